@@ -3,9 +3,13 @@ Sistema de auditoria para rastreamento de mudanças
 """
 import json
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import os
 
+from sqlalchemy import event
+
+import eventos
+
 # Tenta importar módulos de banco de dados
 try:
     import sheets_database as db_module
@@ -24,7 +28,9 @@ def registrar_auditoria(
     registro_id: int,
     valores_antigos: Optional[Dict[str, Any]] = None,
     valores_novos: Optional[Dict[str, Any]] = None,
-    usuario: Optional[str] = None
+    usuario: Optional[str] = None,
+    registrar_alteracao: bool = True,
+    session=None
 ):
     """
     Registra uma ação de auditoria
@@ -36,15 +42,25 @@ def registrar_auditoria(
         valores_antigos: Valores antes da mudança (dict)
         valores_novos: Valores após a mudança (dict)
         usuario: Nome do usuário que fez a ação
+        registrar_alteracao: Também grava no log de alterações do SQLite
+                             (False para o Supabase, cujo log é alimentado por triggers)
+        session: Sessão do SQLite com a alteração ainda sem commit (ver registrar_auditoria_lote)
     """
+    if session is not None:
+        registrar_auditoria_lote([{
+            'acao': acao, 'tabela': tabela, 'registro_id': registro_id,
+            'valores_antigos': valores_antigos, 'valores_novos': valores_novos
+        }], usuario, registrar_alteracao, session=session)
+        return
     try:
         if USE_GOOGLE_SHEETS:
             _registrar_auditoria_sheets(acao, tabela, registro_id, valores_antigos, valores_novos, usuario)
         else:
-            _registrar_auditoria_sqlite(acao, tabela, registro_id, valores_antigos, valores_novos, usuario)
+            _registrar_auditoria_sqlite(acao, tabela, registro_id, valores_antigos, valores_novos, usuario, registrar_alteracao)
     except Exception as e:
         # Não falha a operação principal se a auditoria falhar
         print(f"Erro ao registrar auditoria: {e}")
+    eventos.publicar(TABELAS_ALTERACAO.get(tabela, tabela), acao, registro_id)
 
 
 def _registrar_auditoria_sheets(
@@ -111,56 +127,177 @@ def _registrar_auditoria_sheets(
         print(f"Erro ao registrar auditoria no Google Sheets: {e}")
 
 
+def _modelo_auditoria_sqlite(conexao=None):
+    """Define (uma vez) o modelo de Auditoria e cria a tabela se não existir
+    (conexao: a da transação em andamento, que pode estar com o lock de escrita)"""
+    if not hasattr(db_module, 'Auditoria'):
+        from models import Base, get_engine
+        from sqlalchemy import Column, Integer, String, DateTime
+        
+        class Auditoria(Base):
+            __tablename__ = 'auditoria'
+            __table_args__ = {'extend_existing': True}
+            id = Column(Integer, primary_key=True)
+            usuario = Column(String(100))
+            acao = Column(String(20))
+            tabela = Column(String(50))
+            registro_id = Column(Integer)
+            valores_antigos = Column(String(1000))
+            valores_novos = Column(String(1000))
+            timestamp = Column(DateTime, default=datetime.now)
+        
+        # Cria tabela se não existir
+        Auditoria.__table__.create(conexao if conexao is not None else get_engine(), checkfirst=True)
+        db_module.Auditoria = Auditoria
+    return db_module.Auditoria
+
+
+def _linha_auditoria_sqlite(acao, tabela, registro_id, valores_antigos=None, valores_novos=None, usuario=None, timestamp=None):
+    return {
+        'usuario': usuario or "Sistema",
+        'acao': acao,
+        'tabela': tabela,
+        'registro_id': registro_id,
+        'valores_antigos': json.dumps(valores_antigos, ensure_ascii=False, default=str) if valores_antigos else None,
+        'valores_novos': json.dumps(valores_novos, ensure_ascii=False, default=str) if valores_novos else None,
+        'timestamp': timestamp or datetime.now()
+    }
+
+
 def _registrar_auditoria_sqlite(
     acao: str,
     tabela: str,
     registro_id: int,
     valores_antigos: Optional[Dict[str, Any]] = None,
     valores_novos: Optional[Dict[str, Any]] = None,
-    usuario: Optional[str] = None
+    usuario: Optional[str] = None,
+    registrar_alteracao: bool = True
 ):
     """Registra auditoria no SQLite"""
     try:
-        from models import get_session, Base
-        from sqlalchemy import Column, Integer, String, DateTime
-        from datetime import datetime
-        
-        # Define modelo de Auditoria dinamicamente se não existir
-        if not hasattr(db_module, 'Auditoria'):
-            class Auditoria(Base):
-                __tablename__ = 'auditoria'
-                id = Column(Integer, primary_key=True)
-                usuario = Column(String(100))
-                acao = Column(String(20))
-                tabela = Column(String(50))
-                registro_id = Column(Integer)
-                valores_antigos = Column(String(1000))
-                valores_novos = Column(String(1000))
-                timestamp = Column(DateTime, default=datetime.now)
-            
-            # Cria tabela se não existir
-            Base.metadata.create_all(db_module.get_engine())
-            db_module.Auditoria = Auditoria
-        
-        session = db_module.get_session()
-        try:
-            auditoria = db_module.Auditoria(
-                usuario=usuario or "Sistema",
-                acao=acao,
-                tabela=tabela,
-                registro_id=registro_id,
-                valores_antigos=json.dumps(valores_antigos, ensure_ascii=False, default=str) if valores_antigos else None,
-                valores_novos=json.dumps(valores_novos, ensure_ascii=False, default=str) if valores_novos else None,
-                timestamp=datetime.now()
-            )
-            session.add(auditoria)
-            session.commit()
-        finally:
-            session.close()
+        _registrar_auditoria_lote_sqlite([{
+            'acao': acao, 'tabela': tabela, 'registro_id': registro_id,
+            'valores_antigos': valores_antigos, 'valores_novos': valores_novos
+        }], usuario, registrar_alteracao)
     except Exception as e:
         print(f"Erro ao registrar auditoria no SQLite: {e}")
 
 
+def registrar_auditoria_lote(registros: List[Dict[str, Any]], usuario: Optional[str] = None, registrar_alteracao: bool = True,
+                             session=None):
+    """
+    Registra várias ações de auditoria em uma única escrita
+    
+    Args:
+        registros: Lista de dicts com acao, tabela, registro_id e opcionalmente
+                   valores_antigos / valores_novos
+        usuario: Nome do usuário que fez as ações
+        registrar_alteracao: Também grava no log de alterações do SQLite
+        session: Sessão do SQLite com a alteração de dados ainda sem commit. As
+                 linhas de auditoria e do log de alterações entram nela (mesmo
+                 commit ou rollback), erros sobem para quem chamou e os eventos
+                 só são publicados depois do commit.
+    """
+    if not registros:
+        return
+    if session is not None:
+        _inserir_auditoria_sqlite(session, registros, usuario, registrar_alteracao, criar_tabela=True)
+        event.listen(session, 'after_commit', lambda _session: _publicar_eventos(registros), once=True)
+        return
+    try:
+        if USE_GOOGLE_SHEETS:
+            _registrar_auditoria_lote_sheets(registros, usuario)
+        else:
+            _registrar_auditoria_lote_sqlite(registros, usuario, registrar_alteracao)
+    except Exception as e:
+        # Não falha a operação principal se a auditoria falhar
+        print(f"Erro ao registrar auditoria em lote: {e}")
+    _publicar_eventos(registros)
+
+
+def _publicar_eventos(registros: List[Dict[str, Any]]):
+    for r in registros:
+        eventos.publicar(TABELAS_ALTERACAO.get(r['tabela'], r['tabela']), r['acao'], r['registro_id'])
+
+
+# Nome usado na auditoria -> tabela do banco (log de alterações)
+TABELAS_ALTERACAO = {
+    'Itens': 'itens',
+    'Compromissos': 'compromissos',
+    'Contas a Receber': 'contas_receber',
+    'Contas a Pagar': 'contas_pagar',
+    'Financiamentos': 'financiamentos',
+    'Parcelas Financiamento': 'parcelas_financiamento',
+    'Pecas_Carros': 'pecas_carros',
+}
+
+
+def _registrar_auditoria_lote_sqlite(registros: List[Dict[str, Any]], usuario: Optional[str] = None, registrar_alteracao: bool = True):
+    """Auditoria sem alteração de dados no SQLite (ex.: escritas no Supabase), em sessão própria"""
+    session = db_module.get_session()
+    try:
+        _inserir_auditoria_sqlite(session, registros, usuario, registrar_alteracao)
+        session.commit()
+    finally:
+        session.close()
+
+
+def _inserir_auditoria_sqlite(session, registros: List[Dict[str, Any]], usuario: Optional[str] = None,
+                              registrar_alteracao: bool = True, criar_tabela: bool = False):
+    """Um único INSERT em lote na auditoria e no log de alterações, na transação da sessão"""
+    conexao = session.connection() if criar_tabela else None
+    Auditoria = _modelo_auditoria_sqlite(conexao)
+    if conexao is not None:
+        # Na mesma conexão (outra esperaria pelo lock de escrita desta) e a cada
+        # transação: se a que criou a tabela sofrer rollback, a tabela some junto
+        Auditoria.__table__.create(conexao, checkfirst=True)
+    agora = datetime.now()
+    session.bulk_insert_mappings(Auditoria, [
+        _linha_auditoria_sqlite(
+            r['acao'], r['tabela'], r['registro_id'],
+            r.get('valores_antigos'), r.get('valores_novos'), usuario, agora
+        )
+        for r in registros
+    ])
+    if registrar_alteracao:
+        from models import LogAlteracao
+        session.bulk_insert_mappings(LogAlteracao, [
+            {
+                'tabela': TABELAS_ALTERACAO.get(r['tabela'], r['tabela']),
+                'registro_id': r['registro_id'],
+                'operacao': r['acao'],
+                'timestamp': agora
+            }
+            for r in registros
+        ])
+
+
+def _registrar_auditoria_lote_sheets(registros: List[Dict[str, Any]], usuario: Optional[str] = None):
+    """Um único append_rows na aba Auditoria"""
+    sheets = db_module.get_sheets()
+    sheet_auditoria = sheets['spreadsheet'].worksheet("Auditoria")
+    try:
+        valid_ids = [int(r.get('ID', 0)) for r in sheet_auditoria.get_all_records() if r and r.get('ID')]
+        next_id = max(valid_ids) + 1 if valid_ids else 1
+    except Exception:
+        next_id = 1
+    
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    linhas = []
+    for i, r in enumerate(registros):
+        linhas.append([
+            next_id + i,
+            timestamp,
+            usuario or "Sistema",
+            r['acao'],
+            r['tabela'],
+            r['registro_id'],
+            json.dumps(r['valores_antigos'], ensure_ascii=False, default=str) if r.get('valores_antigos') else "",
+            json.dumps(r['valores_novos'], ensure_ascii=False, default=str) if r.get('valores_novos') else ""
+        ])
+    sheet_auditoria.append_rows(linhas)
+
+
 def obter_historico(tabela: str, registro_id: int) -> list:
     """
     Obtém histórico de mudanças de um registro
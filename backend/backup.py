@@ -1,9 +1,12 @@
 """
-Sistema de backup automático e manual para Google Sheets
+Sistema de backup automático e manual para Google Sheets e SQLite (snapshots locais)
 """
+import base64
 import os
+import uuid
 from datetime import datetime
-from typing import List, Dict, Optional
+from decimal import Decimal
+from typing import List, Dict, Iterator, Optional
 import json
 
 # Tenta importar módulos de banco de dados
@@ -102,7 +105,7 @@ def listar_backups(max_backups: int = 50) -> List[Dict[str, str]]:
         Lista de backups ordenados por data (mais recente primeiro)
     """
     if not USE_GOOGLE_SHEETS:
-        return []
+        return listar_backups_sqlite(max_backups)
     
     try:
         from googleapiclient.discovery import build
@@ -170,7 +173,7 @@ def restaurar_backup(backup_id: str) -> Dict[str, str]:
         Dict com informações da planilha restaurada
     """
     if not USE_GOOGLE_SHEETS:
-        raise ValueError("Restauração de backup só está disponível quando USE_GOOGLE_SHEETS=true")
+        return restaurar_backup_sqlite(backup_id)
     
     try:
         from googleapiclient.discovery import build
@@ -278,6 +281,159 @@ def exportar_backup_json() -> str:
         raise ValueError(f"Erro ao exportar backup JSON: {str(e)}")
 
 
+class _BufferStream:
+    """Destino de escrita sem seek para o zipfile: acumula bytes até serem drenados"""
+    
+    def __init__(self):
+        self._partes = []
+        self._posicao = 0
+    
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self._posicao += len(dados)
+        return len(dados)
+    
+    def tell(self):
+        return self._posicao
+    
+    def flush(self):
+        pass
+    
+    def drenar(self) -> bytes:
+        dados = b''.join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def _valor_exportacao(valor):
+    """Valor de coluna em tipo serializável: datas em ISO, bytes em base64, Decimal em float"""
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(valor)).decode('ascii')
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return valor
+
+
+def _json_padrao(valor):
+    """default= do json.dumps: converte os tipos conhecidos e recusa o resto"""
+    convertido = _valor_exportacao(valor)
+    if convertido is valor:
+        raise TypeError(f"Tipo não exportável: {type(valor).__name__}")
+    return convertido
+
+
+def exportar_ndjson(db_export, tamanho_lote: int = 1000) -> Iterator[bytes]:
+    """
+    Exporta todas as tabelas em NDJSON (uma linha JSON por registro)
+    
+    A primeira linha é um cabeçalho {"tipo": "cabecalho", ...}; as demais têm
+    {"tabela": nome, "dados": {...}}. Os registros são lidos em lotes
+    (db_export.iterar_tabela), então a memória não cresce com o volume.
+    
+    Args:
+        db_export: Módulo de banco (database ou supabase_database)
+        tamanho_lote: Linhas por lote lidas do banco / enviadas ao cliente
+    """
+    tabelas = db_export.listar_tabelas_exportacao()
+    yield (json.dumps({
+        'tipo': 'cabecalho', 'timestamp': datetime.now().isoformat(), 'tabelas': tabelas
+    }, ensure_ascii=False) + '\n').encode('utf-8')
+    
+    for tabela in tabelas:
+        pedaco = []
+        for registro in db_export.iterar_tabela(tabela, tamanho_lote):
+            pedaco.append(json.dumps({'tabela': tabela, 'dados': registro}, ensure_ascii=False, default=_json_padrao))
+            if len(pedaco) >= tamanho_lote:
+                yield ('\n'.join(pedaco) + '\n').encode('utf-8')
+                pedaco = []
+        if pedaco:
+            yield ('\n'.join(pedaco) + '\n').encode('utf-8')
+
+
+def exportar_delta_ndjson(db_export, desde: int, tamanho_lote: int = 1000) -> Iterator[bytes]:
+    """
+    Backup incremental: exporta só os registros alterados depois da versão `desde`
+    
+    Usa o log de alterações (db_export.listar_alteracoes); cada registro aparece
+    uma vez com seu estado atual ({"tabela", "operacao": "UPSERT", "dados"}) ou
+    como {"tabela", "operacao": "DELETE", "registro_id"} se não existe mais.
+    O cabeçalho traz a 'versao' a ser usada como `desde` no próximo backup.
+    """
+    # (tabela, id) -> última operação; proporcional ao número de registros alterados
+    ultimas = {}
+    versao = int(desde or 0)
+    while True:
+        pagina = db_export.listar_alteracoes(versao, tamanho_lote)
+        for alteracao in pagina['alteracoes']:
+            ultimas[(alteracao['tabela'], alteracao['registro_id'])] = alteracao['operacao']
+        versao = pagina['versao']
+        if not pagina['tem_mais']:
+            break
+    
+    yield (json.dumps({
+        'tipo': 'cabecalho_incremental', 'timestamp': datetime.now().isoformat(),
+        'desde': int(desde or 0), 'versao': versao, 'registros': len(ultimas)
+    }, ensure_ascii=False) + '\n').encode('utf-8')
+    
+    por_tabela = {}
+    for (tabela, registro_id), operacao in ultimas.items():
+        por_tabela.setdefault(tabela, []).append(registro_id)
+    
+    for tabela, ids in por_tabela.items():
+        for inicio in range(0, len(ids), tamanho_lote):
+            lote = ids[inicio:inicio + tamanho_lote]
+            encontrados = {r['id']: r for r in db_export.buscar_registros(tabela, lote)}
+            linhas = []
+            for registro_id in lote:
+                if registro_id in encontrados:
+                    linhas.append({'tabela': tabela, 'operacao': 'UPSERT', 'dados': encontrados[registro_id]})
+                else:
+                    linhas.append({'tabela': tabela, 'operacao': 'DELETE', 'registro_id': registro_id})
+            yield ''.join(
+                json.dumps(linha, ensure_ascii=False, default=_json_padrao) + '\n' for linha in linhas
+            ).encode('utf-8')
+
+
+def exportar_csv_zip(db_export, tamanho_lote: int = 1000) -> Iterator[bytes]:
+    """
+    Exporta todas as tabelas como um ZIP com um CSV por tabela, gerado em streaming
+    
+    O ZIP é escrito em um destino sem seek (descritores de dados após cada
+    arquivo), e os bytes são repassados ao cliente a cada lote de linhas.
+    
+    Args:
+        db_export: Módulo de banco (database ou supabase_database)
+        tamanho_lote: Linhas por lote lidas do banco / enviadas ao cliente
+    """
+    import csv
+    import io
+    import zipfile
+    
+    destino = _BufferStream()
+    with zipfile.ZipFile(destino, mode='w', compression=zipfile.ZIP_DEFLATED) as arquivo_zip:
+        for tabela in db_export.listar_tabelas_exportacao():
+            with arquivo_zip.open(f'{tabela}.csv', mode='w', force_zip64=True) as arquivo_csv:
+                texto = io.TextIOWrapper(arquivo_csv, encoding='utf-8', newline='')
+                escritor = None
+                for numero, registro in enumerate(db_export.iterar_tabela(tabela, tamanho_lote), start=1):
+                    if escritor is None:
+                        escritor = csv.DictWriter(texto, fieldnames=list(registro.keys()), extrasaction='ignore')
+                        escritor.writeheader()
+                    escritor.writerow({
+                        chave: json.dumps(valor, ensure_ascii=False) if isinstance(valor, (dict, list)) else _valor_exportacao(valor)
+                        for chave, valor in registro.items()
+                    })
+                    if numero % tamanho_lote == 0:
+                        texto.flush()
+                        yield destino.drenar()
+                texto.flush()
+                texto.detach()
+            yield destino.drenar()
+    yield destino.drenar()
+
+
 def limpar_backups_antigos(dias_manter: int = 30) -> int:
     """
     Remove backups mais antigos que o número de dias especificado
@@ -289,7 +445,7 @@ def limpar_backups_antigos(dias_manter: int = 30) -> int:
         Número de backups removidos
     """
     if not USE_GOOGLE_SHEETS:
-        return 0
+        return limpar_backups_sqlite(dias_manter)
     
     try:
         from googleapiclient.discovery import build
@@ -332,3 +488,253 @@ def limpar_backups_antigos(dias_manter: int = 30) -> int:
     except Exception as e:
         print(f"Erro ao limpar backups antigos: {e}")
         return 0
+
+
+# ============= BACKUP LOCAL (SQLite) =============
+
+DIRETORIO_BACKUPS = os.getenv('BACKUP_DIR', os.path.join('data', 'backups'))
+PREFIXO_BACKUP = 'estoque_'
+FORMATO_TIMESTAMP = "%Y%m%d_%H%M%S"
+# Páginas copiadas por passo da API de backup; entre passos o banco fica livre para escrita
+PAGINAS_POR_PASSO = 256
+TAMANHO_BLOCO = 1024 * 1024
+
+
+def _caminho_banco_sqlite() -> str:
+    from models import get_engine
+    return get_engine().url.database
+
+
+def _compressor():
+    """Retorna (extensão, abrir_escrita): zstd se instalado, senão gzip"""
+    try:
+        import zstandard
+        return '.zst', lambda caminho: zstandard.ZstdCompressor(level=10).stream_writer(open(caminho, 'wb'), closefd=True)
+    except ImportError:
+        import gzip
+        return '.gz', lambda caminho: gzip.open(caminho, 'wb')
+
+
+def _abrir_snapshot(caminho: str):
+    if caminho.endswith('.zst'):
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(caminho, 'rb'), closefd=True)
+    import gzip
+    return gzip.open(caminho, 'rb')
+
+
+def _copiar_banco(origem: str, destino: str):
+    """Cópia consistente via API de backup do SQLite, em passos (não trava escritores)"""
+    import sqlite3
+    conexao_origem = sqlite3.connect(origem)
+    conexao_destino = sqlite3.connect(destino)
+    try:
+        conexao_origem.backup(conexao_destino, pages=PAGINAS_POR_PASSO)
+    finally:
+        conexao_destino.close()
+        conexao_origem.close()
+
+
+def _timestamp_backup(nome: str) -> Optional[datetime]:
+    try:
+        return datetime.strptime(nome[len(PREFIXO_BACKUP):len(PREFIXO_BACKUP) + 15], FORMATO_TIMESTAMP)
+    except ValueError:
+        return None
+
+
+def _versao_log_sqlite(caminho: str) -> int:
+    """Maior versão já emitida pelo log_alteracoes (contador AUTOINCREMENT ou maior linha)"""
+    import sqlite3
+    conexao = sqlite3.connect(caminho)
+    try:
+        if conexao.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'log_alteracoes'").fetchone() is None:
+            return 0
+        versao = conexao.execute("SELECT COALESCE(MAX(versao), 0) FROM log_alteracoes").fetchone()[0]
+        if conexao.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_sequence'").fetchone():
+            seq = conexao.execute("SELECT seq FROM sqlite_sequence WHERE name = 'log_alteracoes'").fetchone()
+            versao = max(versao, seq[0] if seq else 0)
+        return int(versao)
+    finally:
+        conexao.close()
+
+
+def _avancar_versao_log_sqlite(caminho: str, versao: int):
+    """Faz o log_alteracoes continuar depois de `versao` (versões nunca são reutilizadas)"""
+    import sqlite3
+    conexao = sqlite3.connect(caminho)
+    try:
+        with conexao:
+            if conexao.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_sequence'").fetchone() is None:
+                return
+            atualizado = conexao.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'log_alteracoes'", (versao,)
+            ).rowcount
+            if not atualizado:
+                conexao.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('log_alteracoes', ?)", (versao,))
+    finally:
+        conexao.close()
+
+
+def criar_backup_sqlite() -> Dict[str, str]:
+    """
+    Cria um snapshot comprimido do banco SQLite em DIRETORIO_BACKUPS
+    
+    Se o conteúdo for idêntico ao do último snapshot, nenhum arquivo novo é
+    gravado e o último é devolvido com 'inalterado': True.
+    
+    Returns:
+        Dict com informações do backup (id, nome, timestamp, tamanho)
+    """
+    import hashlib
+    import tempfile
+    
+    os.makedirs(DIRETORIO_BACKUPS, exist_ok=True)
+    timestamp = datetime.now().strftime(FORMATO_TIMESTAMP)
+    extensao, abrir_escrita = _compressor()
+    # Sufixo aleatório: dois snapshots no mesmo segundo não se sobrescrevem
+    nome = f"{PREFIXO_BACKUP}{timestamp}_{uuid.uuid4().hex[:8]}.db{extensao}"
+    caminho = os.path.join(DIRETORIO_BACKUPS, nome)
+    
+    fd, temporario = tempfile.mkstemp(suffix='.db', dir=DIRETORIO_BACKUPS)
+    os.close(fd)
+    try:
+        _copiar_banco(_caminho_banco_sqlite(), temporario)
+        
+        resumo = hashlib.sha256()
+        with open(temporario, 'rb') as origem, abrir_escrita(caminho + '.parcial') as destino:
+            for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b''):
+                resumo.update(bloco)
+                destino.write(bloco)
+    finally:
+        os.remove(temporario)
+    
+    hash_snapshot = resumo.hexdigest()
+    anteriores = listar_backups_sqlite(max_backups=1)
+    if anteriores and anteriores[0].get('sha256') == hash_snapshot:
+        os.remove(caminho + '.parcial')
+        return {**anteriores[0], 'inalterado': True}
+    
+    os.replace(caminho + '.parcial', caminho)
+    with open(caminho + '.sha256', 'w') as arquivo_hash:
+        arquivo_hash.write(hash_snapshot)
+    
+    return {
+        'id': nome,
+        'nome': nome,
+        'url': None,
+        'timestamp': timestamp,
+        'data_criacao': datetime.strptime(timestamp, FORMATO_TIMESTAMP).isoformat(),
+        'tamanho': os.path.getsize(caminho),
+        'sha256': hash_snapshot,
+        'inalterado': False
+    }
+
+
+def listar_backups_sqlite(max_backups: int = 50) -> List[Dict[str, str]]:
+    """Lista os snapshots locais, mais recente primeiro"""
+    if not os.path.isdir(DIRETORIO_BACKUPS):
+        return []
+    backups = []
+    for nome in os.listdir(DIRETORIO_BACKUPS):
+        momento = _timestamp_backup(nome)
+        if momento is None or not nome.endswith(('.db.gz', '.db.zst')):
+            continue
+        caminho = os.path.join(DIRETORIO_BACKUPS, nome)
+        estado = os.stat(caminho)
+        sha256 = None
+        if os.path.exists(caminho + '.sha256'):
+            with open(caminho + '.sha256') as arquivo_hash:
+                sha256 = arquivo_hash.read().strip()
+        backups.append(({
+            'id': nome,
+            'nome': nome,
+            'url': None,
+            'timestamp': momento.strftime(FORMATO_TIMESTAMP),
+            'data_criacao': momento.isoformat(),
+            'tamanho': estado.st_size,
+            'sha256': sha256
+        }, estado.st_mtime_ns))
+    # Mesmo segundo no nome: desempata pela hora de gravação do arquivo
+    backups.sort(key=lambda b: (b[0]['timestamp'], b[1]), reverse=True)
+    return [b for b, _ in backups[:max_backups]]
+
+
+def restaurar_backup_sqlite(backup_id: Optional[str] = None, momento: Optional[datetime] = None) -> Dict[str, str]:
+    """
+    Restaura o banco SQLite a partir de um snapshot
+    
+    Antes de restaurar, um snapshot do estado atual é criado (permite desfazer).
+    
+    O log_alteracoes volta junto com o banco, mas o contador de versões não:
+    novas alterações continuam depois da maior versão já emitida. Clientes de
+    /api/changes ou do backup incremental com `desde` acima de
+    versao_log_restaurada têm dados que o restore desfez e precisam ressincronizar
+    do zero.
+    
+    Args:
+        backup_id: Nome do snapshot; se omitido, usa o último snapshot até `momento`
+        momento: Ponto no tempo desejado (padrão: agora)
+        
+    Returns:
+        Dict com o snapshot restaurado, o snapshot de segurança criado antes e
+        as versões do log (versao_log_restaurada, versao_log_anterior)
+    """
+    import tempfile
+    
+    if backup_id is None:
+        limite = momento or datetime.now()
+        candidatos = [b for b in listar_backups_sqlite(max_backups=10 ** 6) if datetime.fromisoformat(b['data_criacao']) <= limite]
+        if not candidatos:
+            raise ValueError(f"Nenhum backup anterior a {limite.isoformat()}")
+        backup_id = candidatos[0]['id']
+    
+    nome = os.path.basename(backup_id)
+    caminho = os.path.join(DIRETORIO_BACKUPS, nome)
+    if _timestamp_backup(nome) is None or not os.path.exists(caminho):
+        raise ValueError(f"Backup {backup_id} não encontrado")
+    
+    seguranca = criar_backup_sqlite()
+    banco = _caminho_banco_sqlite()
+    versao_anterior = _versao_log_sqlite(banco)
+    
+    fd, temporario = tempfile.mkstemp(suffix='.db', dir=DIRETORIO_BACKUPS)
+    os.close(fd)
+    try:
+        with _abrir_snapshot(caminho) as origem, open(temporario, 'wb') as destino:
+            for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b''):
+                destino.write(bloco)
+        # A API de backup grava no arquivo em uso com as travas do SQLite,
+        # sem trocar o arquivo por baixo de conexões abertas
+        _copiar_banco(temporario, banco)
+    finally:
+        os.remove(temporario)
+    versao_restaurada = _versao_log_sqlite(banco)
+    _avancar_versao_log_sqlite(banco, versao_anterior)
+    
+    return {
+        'id': nome,
+        'nome': nome,
+        'timestamp': _timestamp_backup(nome).strftime(FORMATO_TIMESTAMP),
+        'data_restauracao': datetime.now().isoformat(),
+        'backup_original': nome,
+        'backup_seguranca': seguranca['id'],
+        'versao_log_restaurada': versao_restaurada,
+        'versao_log_anterior': versao_anterior,
+        'ressincronizar_acima_de': versao_restaurada if versao_anterior > versao_restaurada else None
+    }
+
+
+def limpar_backups_sqlite(dias_manter: int = 30) -> int:
+    """Remove snapshots locais mais antigos que dias_manter (mantém sempre o mais recente)"""
+    from datetime import timedelta
+    
+    data_limite = datetime.now() - timedelta(days=dias_manter)
+    removidos = 0
+    for backup_info in listar_backups_sqlite(max_backups=10 ** 6)[1:]:
+        if datetime.fromisoformat(backup_info['data_criacao']) < data_limite:
+            caminho = os.path.join(DIRETORIO_BACKUPS, backup_info['id'])
+            os.remove(caminho)
+            if os.path.exists(caminho + '.sha256'):
+                os.remove(caminho + '.sha256')
+            removidos += 1
+    return removidos
@@ -0,0 +1,198 @@
+"""
+Modo sombra: compara SQLite e Supabase com o tráfego real
+
+Uma fração (LEITURA_SOMBRA_TAXA, 0 a 1; 0 desliga) das requisições GET da
+API é repetida em segundo plano no outro backend, trocando o header
+X-Use-Database. O cliente recebe só a resposta do backend primário; a
+repetição roda depois, com o mesmo app ASGI (mesmas rotas, autenticação e
+serialização), e grava em leituras_sombra o tempo de cada backend e a
+primeira diferença entre os JSONs.
+
+Cada worker limita as repetições em andamento a MAX_SOMBRAS_SIMULTANEAS: com
+o limite cheio, a amostra é descartada em vez de acumular carga.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, Callable, Optional
+
+TAXA = float(os.getenv('LEITURA_SOMBRA_TAXA', '0'))
+MAX_SOMBRAS_SIMULTANEAS = 4
+LIMITE_CORPO = 5 * 1024 * 1024  # bytes; respostas maiores não são comparadas
+HEADER_SOMBRA = b'x-leitura-sombra'
+# Canais longos, exportações e a própria telemetria ficam de fora
+PREFIXOS_IGNORADOS = ('/api/eventos', '/api/backup', '/api/debug', '/api/auth')
+TOLERANCIA_NUMERICA = 1e-6
+
+
+def diferenca_json(a: Any, b: Any, caminho: str = '$') -> Optional[str]:
+    """Primeira diferença entre dois valores JSON (ex.: "$[3].nome: 'A' != 'B'"); None se iguais"""
+    if isinstance(a, bool) or isinstance(b, bool):
+        return None if a is b else f'{caminho}: {a!r} != {b!r}'
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return None if abs(a - b) <= TOLERANCIA_NUMERICA else f'{caminho}: {a!r} != {b!r}'
+    if type(a) is not type(b):
+        return f'{caminho}: tipo {type(a).__name__} != {type(b).__name__}'
+    if isinstance(a, dict):
+        for chave in sorted(set(a) | set(b), key=str):
+            if chave not in a or chave not in b:
+                return f'{caminho}.{chave}: ausente em {"primário" if chave not in a else "secundário"}'
+            diferenca = diferenca_json(a[chave], b[chave], f'{caminho}.{chave}')
+            if diferenca:
+                return diferenca
+        return None
+    if isinstance(a, list):
+        if len(a) != len(b):
+            return f'{caminho}: {len(a)} != {len(b)} elementos'
+        for i, (x, y) in enumerate(zip(a, b)):
+            diferenca = diferenca_json(x, y, f'{caminho}[{i}]')
+            if diferenca:
+                return diferenca
+        return None
+    return None if a == b else f'{caminho}: {a!r} != {b!r}'
+
+
+def _comparar(corpo_primario: bytes, corpo_secundario: bytes):
+    """(iguais, diferenca) entre dois corpos; iguais None quando não são JSON"""
+    try:
+        a = json.loads(corpo_primario)
+        b = json.loads(corpo_secundario)
+    except (ValueError, UnicodeDecodeError):
+        return (1, None) if corpo_primario == corpo_secundario else (None, 'resposta não é JSON')
+    diferenca = diferenca_json(a, b)
+    return (0, diferenca[:500]) if diferenca else (1, None)
+
+
+def _rota(scope) -> str:
+    """Template da rota atendida (agrupa /api/itens/1 e /api/itens/2); o path se não achar"""
+    endpoint = scope.get('endpoint')
+    app = scope.get('app')
+    for rota in getattr(app, 'routes', ()):
+        if endpoint is not None and getattr(rota, 'endpoint', None) is endpoint:
+            return rota.path
+    return scope.get('path', '')
+
+
+class LeituraSombraMiddleware:
+    """
+    Middleware ASGI: mede a requisição amostrada, guarda o corpo da resposta e
+    agenda a repetição no outro backend
+
+    backends() devolve (db_module, db_module_supabase) no momento da
+    requisição; registrar(**dados) grava a comparação (bloqueante, roda numa
+    thread).
+    """
+
+    def __init__(self, app, backends: Callable[[], tuple], registrar: Callable[..., None],
+                 taxa: float = TAXA):
+        self.app = app
+        self.backends = backends
+        self.registrar = registrar
+        self.taxa = taxa
+        self._tarefas = set()  # repetições em andamento (referência forte até terminarem)
+
+    def _amostrar(self, scope) -> Optional[str]:
+        """Backend primário ('sqlite' | 'supabase') se a requisição entra na amostra; senão None"""
+        if scope['type'] != 'http' or scope['method'] != 'GET' or self.taxa <= 0:
+            return None
+        caminho = scope['path']
+        if not caminho.startswith('/api/') or caminho.startswith(PREFIXOS_IGNORADOS):
+            return None
+        headers = dict(scope['headers'])
+        if HEADER_SOMBRA in headers or len(self._tarefas) >= MAX_SOMBRAS_SIMULTANEAS:
+            return None
+        local, supabase = self.backends()
+        if supabase is None or not hasattr(local, 'registrar_leitura_sombra'):
+            return None
+        if random.random() >= self.taxa:
+            return None
+        escolhido = headers.get(b'x-use-database', b'').strip().lower()
+        return 'supabase' if escolhido == b'supabase' else 'sqlite'
+
+    async def __call__(self, scope, receive, send):
+        primario = self._amostrar(scope)
+        if primario is None:
+            await self.app(scope, receive, send)
+            return
+
+        resposta = {'status': None, 'corpo': bytearray(), 'completa': False, 'json': False}
+
+        async def send_capturando(mensagem):
+            if mensagem['type'] == 'http.response.start':
+                resposta['status'] = mensagem['status']
+                tipo = dict(mensagem.get('headers', [])).get(b'content-type', b'')
+                resposta['json'] = tipo.startswith(b'application/json')
+            elif mensagem['type'] == 'http.response.body' and resposta['json']:
+                if len(resposta['corpo']) <= LIMITE_CORPO:
+                    resposta['corpo'] += mensagem.get('body', b'')
+                resposta['completa'] = not mensagem.get('more_body', False)
+            await send(mensagem)
+
+        inicio = time.perf_counter()
+        await self.app(scope, receive, send_capturando)
+        ms_primario = (time.perf_counter() - inicio) * 1000
+        if not (resposta['json'] and resposta['completa']):
+            return
+
+        tarefa = asyncio.get_running_loop().create_task(
+            self._repetir(scope, primario, resposta['status'], bytes(resposta['corpo']), ms_primario)
+        )
+        self._tarefas.add(tarefa)
+        tarefa.add_done_callback(self._tarefas.discard)
+
+    async def _repetir(self, scope, primario: str, status_primario: int, corpo_primario: bytes,
+                       ms_primario: float):
+        """Repete a requisição no outro backend e grava a comparação; falhas só vão para o log"""
+        secundario = 'sqlite' if primario == 'supabase' else 'supabase'
+        headers = [(k, v) for k, v in scope['headers'] if k != b'x-use-database']
+        headers += [(b'x-use-database', secundario.encode()), (HEADER_SOMBRA, b'1')]
+        escopo = {k: v for k, v in scope.items() if k not in ('endpoint', 'path_params', 'route', 'router')}
+        escopo['headers'] = headers
+        escopo['state'] = {}
+        dados = {
+            'rota': _rota(scope),
+            'caminho': (scope['path'] + ('?' + scope['query_string'].decode('latin-1') if scope.get('query_string') else ''))[:500],
+            'primario': primario,
+            'secundario': secundario,
+            'status_primario': status_primario,
+            'ms_primario': round(ms_primario, 2),
+        }
+        try:
+            resposta = {'status': None, 'corpo': bytearray(), 'pedido_lido': False}
+            terminou = asyncio.Event()
+
+            async def receive():
+                # Como um servidor ASGI: o corpo (vazio) uma vez; depois, desconexão ao fim da resposta
+                if not resposta['pedido_lido']:
+                    resposta['pedido_lido'] = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await terminou.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(mensagem):
+                if mensagem['type'] == 'http.response.start':
+                    resposta['status'] = mensagem['status']
+                elif mensagem['type'] == 'http.response.body':
+                    if len(resposta['corpo']) <= LIMITE_CORPO:
+                        resposta['corpo'] += mensagem.get('body', b'')
+                    if not mensagem.get('more_body', False):
+                        terminou.set()
+
+            inicio = time.perf_counter()
+            await self.app(escopo, receive, send)
+            dados['ms_secundario'] = round((time.perf_counter() - inicio) * 1000, 2)
+            dados['status_secundario'] = resposta['status']
+            if len(corpo_primario) > LIMITE_CORPO or len(resposta['corpo']) > LIMITE_CORPO:
+                dados['iguais'], dados['diferenca'] = None, 'resposta grande demais para comparar'
+            elif resposta['status'] != status_primario:
+                dados['iguais'], dados['diferenca'] = 0, f'status {status_primario} != {resposta["status"]}'
+            else:
+                dados['iguais'], dados['diferenca'] = _comparar(corpo_primario, bytes(resposta['corpo']))
+        except Exception as e:
+            dados['iguais'], dados['diferenca'] = None, f'erro no secundário: {e}'[:500]
+        try:
+            await asyncio.to_thread(self.registrar, **dados)
+        except Exception as e:
+            print(f"[SOMBRA] Falha ao registrar leitura sombra ({dados['rota']}): {e}")
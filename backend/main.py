@@ -1,17 +1,24 @@
 """
 Backend FastAPI para o CRM de Gestão de Estoque
 """
-from fastapi import FastAPI, HTTPException, Depends, status, Body, Request, Query
+import time
+# Marcado antes dos imports pesados (FastAPI, SQLAlchemy): base do relatório TEMPOS_INICIALIZACAO
+_inicio_processo = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Depends, status, Body, Request, Query, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from types import SimpleNamespace
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import date, datetime, timedelta
-from typing import List, Optional
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Union
 import os
 import sys
-import secrets
+import json
+import asyncio
+from contextlib import contextmanager
 from pydantic import BaseModel
 
 # Adiciona o diretório raiz ao path
@@ -51,6 +58,8 @@ except Exception as e:
 
 from models import Item, Compromisso, Carro
 import auditoria
+import eventos
+import disponibilidade
 # Importa módulo de backup
 backend_dir = os.path.dirname(os.path.abspath(__file__))
 if backend_dir not in sys.path:
@@ -59,17 +68,34 @@ try:
     import backup
 except ImportError:
     backup = None
+import sessoes
+import leitura_sombra
+
+# Tempos (ms) das fases de inicialização, expostos em /api/debug: no Render o
+# cold start acontece antes da primeira requisição ser atendida
+TEMPOS_INICIALIZACAO = {'importar_modulos_ms': round((time.perf_counter() - _inicio_processo) * 1000, 1)}
+
+
+@contextmanager
+def _fase_inicializacao(nome: str):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        TEMPOS_INICIALIZACAO[f'{nome}_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
 
 # Escolhe qual banco de dados usar baseado em variável de ambiente
 # Por padrão, tenta usar Google Sheets (mesmo comportamento do Streamlit)
 USE_GOOGLE_SHEETS = os.getenv('USE_GOOGLE_SHEETS', 'true').lower() == 'true'
 
 # Supabase: carregado opcionalmente; o frontend pode alternar via header X-Use-Database: supabase
+# (o cliente do pacote supabase só é importado/criado no primeiro uso, em get_supabase)
 db_module_supabase = None
 SUPABASE_AVAILABLE = False
 if os.getenv('SUPABASE_URL') and (os.getenv('SUPABASE_SERVICE_KEY') or os.getenv('SUPABASE_KEY')):
     try:
-        import supabase_database as db_module_supabase
+        with _fase_inicializacao('importar_supabase'):
+            import supabase_database as db_module_supabase
         SUPABASE_AVAILABLE = True
         if DEBUG_MODE:
             print("✅ Supabase disponível (use header X-Use-Database: supabase para alternar)")
@@ -82,12 +108,28 @@ if os.getenv('SUPABASE_URL') and (os.getenv('SUPABASE_SERVICE_KEY') or os.getenv
 db_module = None
 sheets_info = None
 
+
+def _usar_sqlite(mensagem: str = "✅ Usando SQLite local"):
+    """SQLite local; init_db só recria o schema quando a versão gravada no arquivo mudou"""
+    with _fase_inicializacao('importar_sqlite'):
+        from models import init_db
+        import database
+    with _fase_inicializacao('init_db'):
+        schema_atualizado = init_db()
+    TEMPOS_INICIALIZACAO['schema_atualizado'] = schema_atualizado
+    if DEBUG_MODE:
+        print(mensagem)
+    return database
+
+
 if USE_GOOGLE_SHEETS:
     try:
-        import sheets_database as db_module
+        with _fase_inicializacao('importar_sheets'):
+            import sheets_database as db_module
         # Tenta inicializar Google Sheets
         try:
-            sheets_info = db_module.get_sheets()
+            with _fase_inicializacao('conectar_sheets'):
+                sheets_info = db_module.get_sheets()
             spreadsheet_url = sheets_info.get('spreadsheet_url', 'N/A')
             if DEBUG_MODE:
                 print(f"✅ Conectado ao Google Sheets: {spreadsheet_url}")
@@ -99,11 +141,7 @@ if USE_GOOGLE_SHEETS:
                 print(f"   Por favor, coloque o arquivo credentials.json na raiz do projeto.")
             print("⚠️ Tentando usar SQLite como fallback...")
             USE_GOOGLE_SHEETS = False
-            from models import init_db
-            import database as db_module
-            init_db()
-            if DEBUG_MODE:
-                print("✅ Usando SQLite local")
+            db_module = _usar_sqlite()
         except Exception as e:
             error_msg = str(e)
             import traceback
@@ -114,35 +152,21 @@ if USE_GOOGLE_SHEETS:
                 traceback.print_exc()
             print("⚠️ Tentando usar SQLite como fallback...")
             USE_GOOGLE_SHEETS = False
-            from models import init_db
-            import database as db_module
-            init_db()
-            if DEBUG_MODE:
-                print("✅ Usando SQLite local")
+            db_module = _usar_sqlite()
     except ImportError as e:
         print(f"❌ Erro ao importar sheets_database: {str(e)}")
         print("⚠️ Usando SQLite como fallback...")
         USE_GOOGLE_SHEETS = False
-        from models import init_db
-        import database as db_module
-        init_db()
-        if DEBUG_MODE:
-            print("✅ Usando SQLite local")
+        db_module = _usar_sqlite()
     except Exception as e:
         print(f"❌ Erro inesperado: {str(e)}")
         print("⚠️ Usando SQLite como fallback...")
         USE_GOOGLE_SHEETS = False
-        from models import init_db
-        import database as db_module
-        init_db()
-        if DEBUG_MODE:
-            print("✅ Usando SQLite local")
+        db_module = _usar_sqlite()
 else:
-    from models import init_db
-    import database as db_module
-    init_db()
-    if DEBUG_MODE:
-        print("✅ Usando SQLite local (USE_GOOGLE_SHEETS=false)")
+    db_module = _usar_sqlite("✅ Usando SQLite local (USE_GOOGLE_SHEETS=false)")
+
+TEMPOS_INICIALIZACAO['total_ms'] = round((time.perf_counter() - _inicio_processo) * 1000, 1)
 
 app = FastAPI(
     title="CRM Gestão de Estoque",
@@ -157,6 +181,41 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Atualização diária do status gravado de contas/parcelas vencidas
+# ATUALIZAR_STATUS_AUTOMATICO=true liga; ATUALIZAR_STATUS_HORA (HH:MM, padrão 03:00) define o horário
+ATUALIZAR_STATUS_AUTOMATICO = os.getenv('ATUALIZAR_STATUS_AUTOMATICO', 'false').lower() == 'true'
+ATUALIZAR_STATUS_HORA = os.getenv('ATUALIZAR_STATUS_HORA', '03:00')
+
+
+def _segundos_ate_proxima_execucao(hora: str) -> float:
+    """Segundos até o próximo HH:MM (hoje ou amanhã)"""
+    h, m = (int(p) for p in hora.split(':'))
+    agora = datetime.now()
+    proxima = agora.replace(hour=h, minute=m, second=0, microsecond=0)
+    if proxima <= agora:
+        proxima += timedelta(days=1)
+    return (proxima - agora).total_seconds()
+
+
+def _executar_atualizacao_status():
+    """Roda atualizar_status_vencidos em cada banco disponível e registra as contagens"""
+    for nome, modulo in (('local', db_module), ('supabase', db_module_supabase)):
+        if modulo is None or not hasattr(modulo, 'atualizar_status_vencidos'):
+            continue
+        try:
+            contagens = modulo.atualizar_status_vencidos()
+            print(f"[STATUS] {nome}: {contagens}")
+        except Exception as e:
+            print(f"[STATUS] Erro ao atualizar status ({nome}): {e}")
+
+
+async def _agendador_atualizacao_status():
+    """Executa a atualização ao subir o servidor e depois diariamente"""
+    while True:
+        await run_in_threadpool(_executar_atualizacao_status)
+        await asyncio.sleep(_segundos_ate_proxima_execucao(ATUALIZAR_STATUS_HORA))
+
+
 # Limpa cache ao iniciar (força recarregamento dos dados)
 @app.on_event("startup")
 async def startup_event():
@@ -168,6 +227,9 @@ async def startup_event():
             print("[STARTUP] Cache limpo com sucesso")
         except Exception as e:
             print(f"[STARTUP] Erro ao limpar cache: {e}")
+    if ATUALIZAR_STATUS_AUTOMATICO:
+        app.state.agendador_status = asyncio.create_task(_agendador_atualizacao_status())
+        print(f"[STARTUP] Atualização diária de status agendada para {ATUALIZAR_STATUS_HORA}")
 
 # Middleware adicional para garantir CORS e seleção de banco (Supabase vs Sheets)
 @app.middleware("http")
@@ -242,6 +304,14 @@ app.add_middleware(
     max_age=3600,  # Cache preflight por 1 hora
 )
 
+# Modo sombra (LEITURA_SOMBRA_TAXA > 0): GETs amostrados são repetidos no outro
+# backend e comparados; precisa do SQLite local (onde ficam as métricas) e do Supabase
+app.add_middleware(
+    leitura_sombra.LeituraSombraMiddleware,
+    backends=lambda: (db_module, db_module_supabase),
+    registrar=lambda **dados: db_module.registrar_leitura_sombra(**dados),
+)
+
 # Security
 security = HTTPBearer()
 
@@ -383,6 +453,28 @@ class DisponibilidadeResponse(BaseModel):
     quantidade_disponivel: int
     compromissos_ativos: List[CompromissoResponse] = []
 
+class DisponibilidadeLoteRequest(BaseModel):
+    data_inicio: date
+    data_fim: date
+    itens: List[ItemAluguel]
+    excluir_compromisso_id: Optional[int] = None  # Contrato em edição
+
+class ReservaTemporariaCreate(BaseModel):
+    data_inicio: date
+    data_fim: date
+    itens: List[ItemAluguel]
+    ttl_segundos: Optional[int] = None  # Padrão: 10 minutos
+    token: Optional[str] = None         # Renova/substitui uma reserva existente
+
+class ReservaConfirmacao(BaseModel):
+    nome_contrato: Optional[str] = None
+    contratante: Optional[str] = None
+    descricao: Optional[str] = None
+    cidade: str
+    uf: str
+    endereco: Optional[str] = None
+    valor_total_contrato: float = 0.0
+
 # ============= MODELOS FINANCEIRO =============
 
 class ContaReceberCreate(BaseModel):
@@ -484,6 +576,17 @@ class ParcelaUpdate(BaseModel):
     valor_original: Optional[float] = None
     data_vencimento: Optional[date] = None
 
+class PagamentoParcelaLote(BaseModel):
+    parcela_id: int
+    valor_pago: float
+    data_pagamento: Optional[date] = None
+    juros: float = 0.0
+    multa: float = 0.0
+    desconto: float = 0.0
+
+class PagamentoParcelasLoteRequest(BaseModel):
+    pagamentos: List[PagamentoParcelaLote]
+
 class FinanciamentoCreate(BaseModel):
     itens_ids: Optional[List[int]] = None  # NOVO: múltiplos itens (apenas IDs)
     item_id: Optional[int] = None  # Compatibilidade reversa (deprecated)
@@ -663,12 +766,19 @@ else:
     APP_USUARIO = app_usuario_raw.strip()
     APP_SENHA = app_senha_raw.strip()
 
-# Cache de tokens válidos (em produção, considere Redis)
-active_tokens = {}
-
-def generate_token():
-    """Gera um token seguro"""
-    return secrets.token_urlsafe(32)
+# Tokens de sessão assinados (JWT) com validade: qualquer worker valida sem
+# estado compartilhado. A lista de revogação (logout) é gravada no Supabase,
+# se configurado, senão no banco padrão (backend/sessoes.py)
+_backend_sessoes = next(
+    (m for m in (db_module_supabase, db_module) if m is not None and hasattr(m, 'listar_tokens_revogados')), None
+)
+sessoes_ativas = sessoes.GerenciadorSessoes(
+    sessoes.carregar_segredo(is_production),
+    revogacao=sessoes.ListaRevogacao(
+        carregar=_backend_sessoes.listar_tokens_revogados if _backend_sessoes else None,
+        gravar=_backend_sessoes.revogar_token if _backend_sessoes else None,
+    ),
+)
 
 class LoginRequest(BaseModel):
     usuario: str
@@ -683,16 +793,13 @@ async def login(credentials: LoginRequest):
     senha_esperada = APP_SENHA.strip() if APP_SENHA else ""
     
     if usuario_recebido == usuario_esperado and senha_recebida == senha_esperada:
-        token = generate_token()
-        active_tokens[token] = {
-            "usuario": credentials.usuario,
-            "created_at": datetime.now()
-        }
+        sessao = sessoes_ativas.emitir(credentials.usuario)
         print(f"[LOGIN] ✅ Login bem-sucedido para usuario: {usuario_recebido}")
         return {
             "success": True,
-            "token": token,
-            "usuario": credentials.usuario
+            "token": sessao["token"],
+            "usuario": credentials.usuario,
+            "expira_em": sessao["expira_em"]
         }
     else:
         print(f"[LOGIN] ❌ Login FALHOU - Credenciais incorretas")
@@ -704,20 +811,18 @@ async def login(credentials: LoginRequest):
 @app.post("/api/auth/logout")
 async def logout(token: str = Depends(HTTPBearer())):
     """Endpoint de logout"""
-    token_value = token.credentials
-    if token_value in active_tokens:
-        del active_tokens[token_value]
+    await run_in_threadpool(sessoes_ativas.revogar, token.credentials)
     return {"success": True}
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())):
-    """Verifica se o token é válido"""
-    token = credentials.credentials
-    if token not in active_tokens:
+    """Verifica se o token é válido (assinatura, validade e revogação)"""
+    sessao = sessoes_ativas.validar(credentials.credentials)
+    if sessao is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token inválido ou expirado"
         )
-    return active_tokens[token]
+    return sessao
 
 # ============= ROTAS =============
 
@@ -753,6 +858,12 @@ async def debug(db_module = Depends(get_db)):
         if USE_GOOGLE_SHEETS and sheets_info:
             info["spreadsheet_url"] = sheets_info.get('spreadsheet_url', 'N/A')
             info["spreadsheet_id"] = sheets_info.get('spreadsheet_id', 'N/A')
+        info["inicializacao"] = TEMPOS_INICIALIZACAO
+        if db_module_supabase is not None and hasattr(db_module_supabase, 'estado_espelho'):
+            try:
+                info["espelho_supabase"] = await run_in_threadpool(db_module_supabase.estado_espelho)
+            except Exception as e:
+                info["espelho_supabase"] = {"erro": str(e)}
         
         # Tentar contar itens e compromissos
         try:
@@ -769,16 +880,68 @@ async def debug(db_module = Depends(get_db)):
     except Exception as e:
         return {"status": "error", "error": str(e)}
 
+@app.get("/api/debug/leituras-sombra")
+async def resumo_leituras_sombra(
+    desde: Optional[datetime] = Query(None, description="Só leituras a partir deste momento (hora local, ou com fuso)"),
+    rota: Optional[str] = Query(None, description="Template da rota, ex.: /api/itens/{item_id}"),
+    token: str = Depends(verify_token),
+):
+    """Comparação SQLite x Supabase do modo sombra: latência (p50/p95) e divergências por rota"""
+    if not hasattr(db_module, 'resumo_leituras_sombra'):
+        raise HTTPException(status_code=400, detail="Modo sombra disponível apenas com SQLite local")
+    try:
+        rotas = await run_in_threadpool(db_module.resumo_leituras_sombra, desde, rota)
+        return {
+            "ativo": leitura_sombra.TAXA > 0 and db_module_supabase is not None,
+            "taxa": leitura_sombra.TAXA,
+            "rotas": rotas,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ============= SINCRONIZAÇÃO INCREMENTAL =============
+
+# Sobreposição entre sincronizações: cobre transações gravadas com updated_at
+# anterior ao 'sincronizado_em' devolvido. Registros repetidos são inofensivos no merge.
+MARGEM_SINCRONIZACAO = timedelta(seconds=5)
+
+def _desde_sincronizacao(db_module, updated_since: datetime) -> datetime:
+    """Valida o backend e aplica a margem de sobreposição ao updated_since do cliente"""
+    if not hasattr(db_module, 'listar_removidos'):
+        raise HTTPException(status_code=400, detail="updated_since disponível apenas para SQLite e Supabase")
+    return updated_since - MARGEM_SINCRONIZACAO
+
+def _resposta_delta(db_module, tabela: str, alterados: list, desde: datetime, sincronizado_em: datetime) -> dict:
+    """
+    Formato das listagens com ?updated_since=: o cliente remove os ids de
+    'removidos', aplica 'alterados' por id e guarda 'sincronizado_em' para a próxima chamada
+    """
+    return {
+        "alterados": alterados,
+        "removidos": db_module.listar_removidos(tabela, desde),
+        "sincronizado_em": sincronizado_em.isoformat()
+    }
+
 # ============= ITENS =============
 
-@app.get("/api/itens", response_model=List[dict])
-async def listar_itens(db_module = Depends(get_db)):
-    """Lista todos os itens"""
+@app.get("/api/itens", response_model=Union[List[dict], dict])
+async def listar_itens(
+    updated_since: Optional[datetime] = Query(None, description="Só o que mudou desde o 'sincronizado_em' anterior"),
+    db_module = Depends(get_db)
+):
+    """Lista todos os itens (ou o delta desde updated_since)"""
     try:
         if db_module is None:
             raise HTTPException(status_code=500, detail="Database module not initialized")
+        if updated_since:
+            desde = _desde_sincronizacao(db_module, updated_since)
+            sincronizado_em = datetime.now(timezone.utc)
+            itens = db_module.listar_itens(updated_since=desde)
+            return _resposta_delta(db_module, 'itens', [item_to_dict(item) for item in itens], desde, sincronizado_em)
         itens = db_module.listar_itens()
         return [item_to_dict(item) for item in itens]
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         error_detail = f"{str(e)}\n\nTraceback:\n{traceback.format_exc()}"
@@ -790,7 +953,7 @@ async def buscar_itens(
     categoria: Optional[str] = None,
     cidade: Optional[str] = None,
     uf: Optional[str] = None,
-    ordenar_por: Optional[str] = "nome",
+    ordenar_por: Optional[str] = None,  # Padrão: relevância com q (SQLite), senão nome
     ordem: Optional[str] = "asc",
     pagina: Optional[int] = 1,
     por_pagina: Optional[int] = 50,
@@ -798,12 +961,15 @@ async def buscar_itens(
 ):
     """Busca avançada de itens com filtros e paginação"""
     try:
-        itens = db_module.listar_itens()
+        # SQLite: q vira consulta ao índice FTS5 (já filtrado e em ordem de relevância)
+        busca_indexada = bool(q) and hasattr(db_module, 'buscar_ids_texto')
+        itens = db_module.listar_itens(q=q) if busca_indexada else db_module.listar_itens()
+        ordenar_por = ordenar_por or ('relevancia' if busca_indexada else 'nome')
         
         # Aplica filtros
         itens_filtrados = itens
         
-        if q:
+        if q and not busca_indexada:
             q_lower = q.lower()
             itens_filtrados = [
                 item for item in itens_filtrados
@@ -930,11 +1096,24 @@ from types import SimpleNamespace
 from typing import List
 
 # Atualize a rota de listar compromissos para ser apenas um repasse
-@app.get("/api/compromissos", response_model=List[dict])
-async def listar_compromissos(db_module = Depends(get_db)):
+@app.get("/api/compromissos", response_model=Union[List[dict], dict])
+async def listar_compromissos(
+    updated_since: Optional[datetime] = Query(None, description="Só o que mudou desde o 'sincronizado_em' anterior"),
+    db_module = Depends(get_db)
+):
     try:
+        if updated_since:
+            desde = _desde_sincronizacao(db_module, updated_since)
+            sincronizado_em = datetime.now(timezone.utc)
+            alterados = [
+                c if isinstance(c, dict) else compromisso_to_dict(c)
+                for c in db_module.listar_compromissos(updated_since=desde)
+            ]
+            return _resposta_delta(db_module, 'compromissos', alterados, desde, sincronizado_em)
         # A view já traz o formato que o front precisa (com compromisso_itens inclusos)
         return db_module.listar_compromissos()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -949,7 +1128,7 @@ async def buscar_compromissos(
     cidade: Optional[str] = None,
     uf: Optional[str] = None,
     contratante: Optional[str] = None,
-    ordenar_por: Optional[str] = "data_inicio",
+    ordenar_por: Optional[str] = None,  # Padrão: relevância com q (SQLite), senão data_inicio
     ordem: Optional[str] = "asc",
     pagina: Optional[int] = 1,
     por_pagina: Optional[int] = 50,
@@ -957,12 +1136,26 @@ async def buscar_compromissos(
 ):
     """Busca avançada de compromissos com filtros e paginação"""
     try:
-        compromissos = db_module.listar_compromissos()
+        # SQLite: q vira consulta ao índice FTS5 (já filtrado e em ordem de relevância)
+        busca_indexada = bool(q) and hasattr(db_module, 'buscar_ids_texto')
+        compromissos = db_module.listar_compromissos(q=q) if busca_indexada else db_module.listar_compromissos()
+        ordenar_por = ordenar_por or ('relevancia' if busca_indexada else 'data_inicio')
+        
+        # Supabase devolve linhas da view (dicts): mesmo acesso por atributo do SQLite
+        compromissos = [
+            SimpleNamespace(**{
+                **comp,
+                'data_inicio': date.fromisoformat(str(comp['data_inicio'])[:10]) if comp.get('data_inicio') else None,
+                'data_fim': date.fromisoformat(str(comp['data_fim'])[:10]) if comp.get('data_fim') else None,
+                'item': None,
+            }) if isinstance(comp, dict) else comp
+            for comp in compromissos
+        ]
         
         # Aplica filtros
         compromissos_filtrados = compromissos
         
-        if q:
+        if q and not busca_indexada:
             q_lower = q.lower()
             compromissos_filtrados = [
                 comp for comp in compromissos_filtrados
@@ -1162,6 +1355,136 @@ async def verificar_disponibilidade(
     except Exception as e:
         print(f"❌ Erro na API de Disponibilidade: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/disponibilidade/timeline", response_model=dict)
+async def linha_do_tempo_disponibilidade(
+    inicio: date,
+    fim: date,
+    item_ids: Optional[str] = Query(None, description="IDs separados por vírgula (padrão: todos os itens)"),
+    db_module = Depends(get_db)
+):
+    """
+    Disponibilidade diária por item na janela [inicio, fim]: para cada item,
+    'disponivel' traz um valor por dia (índice 0 = inicio)
+    """
+    try:
+        ids = [int(i) for i in item_ids.split(',') if i.strip()] if item_ids else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="item_ids deve ser uma lista de números separados por vírgula")
+    if not hasattr(db_module, 'listar_ocupacao_periodo'):
+        raise HTTPException(status_code=400, detail="Linha do tempo disponível apenas para SQLite e Supabase")
+    try:
+        return await run_in_threadpool(disponibilidade.calcular_linha_do_tempo, db_module, inicio, fim, ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/disponibilidade/sugestoes", response_model=dict)
+async def sugerir_janelas_disponibilidade(
+    item_id: int,
+    quantidade: int,
+    dias: int,
+    a_partir: Optional[date] = Query(None, description="Início da busca (padrão: hoje)"),
+    ate: Optional[date] = Query(None, description="Fim da busca (padrão: a_partir + 1 ano)"),
+    limite: int = 3,
+    alternativas: bool = False,
+    db_module = Depends(get_db)
+):
+    """
+    Primeiras janelas de `dias` dias em que o item tem `quantidade` livre; com
+    alternativas=true, também itens da mesma categoria e localização livres no
+    período pedido
+    """
+    if not hasattr(db_module, 'listar_ocupacao_periodo'):
+        raise HTTPException(status_code=400, detail="Sugestões disponíveis apenas para SQLite e Supabase")
+    try:
+        resultado = await run_in_threadpool(
+            disponibilidade.calcular_sugestoes, db_module, item_id, quantidade, dias,
+            a_partir or date.today(), ate, limite, alternativas
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if resultado is None:
+        raise HTTPException(status_code=404, detail="Item não encontrado")
+    return resultado
+
+@app.post("/api/disponibilidade/lote", response_model=dict)
+async def verificar_disponibilidade_lote(pedido: DisponibilidadeLoteRequest, db_module = Depends(get_db)):
+    """
+    Confere todas as linhas do carrinho no período em uma chamada: cada linha
+    volta com disponivel_minimo e falta (0 quando cabe)
+    """
+    if pedido.data_fim < pedido.data_inicio:
+        raise HTTPException(status_code=400, detail="Data de fim deve ser maior ou igual à data de início")
+    if not hasattr(db_module, 'verificar_disponibilidade_lote'):
+        raise HTTPException(status_code=400, detail="Conferência em lote disponível apenas para SQLite e Supabase")
+    try:
+        linhas = await run_in_threadpool(
+            db_module.verificar_disponibilidade_lote,
+            [i.dict() for i in pedido.itens], pedido.data_inicio, pedido.data_fim, pedido.excluir_compromisso_id
+        )
+        return {"disponivel": all(l['falta'] == 0 for l in linhas), "linhas": linhas}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ============= RESERVAS TEMPORÁRIAS =============
+
+@app.post("/api/reservas", status_code=status.HTTP_201_CREATED)
+async def reservar_itens(reserva_in: ReservaTemporariaCreate, db_module = Depends(get_db)):
+    """
+    Bloqueia o estoque do carrinho por ttl_segundos (checkout). Retorna o token
+    usado para confirmar ou cancelar; 409 com as linhas quando falta estoque.
+    """
+    if not hasattr(db_module, 'reservar_itens'):
+        raise HTTPException(status_code=400, detail="Reservas temporárias disponíveis apenas para SQLite e Supabase")
+    try:
+        resultado = await run_in_threadpool(
+            db_module.reservar_itens,
+            [i.dict() for i in reserva_in.itens], reserva_in.data_inicio, reserva_in.data_fim,
+            reserva_in.ttl_segundos, reserva_in.token
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not resultado['reservado']:
+        return JSONResponse(status_code=409, content=jsonable_encoder({
+            "detail": disponibilidade.mensagem_faltas(resultado['linhas']),
+            "linhas": resultado['linhas']
+        }))
+    return resultado
+
+@app.post("/api/reservas/{token}/confirmar", status_code=status.HTTP_201_CREATED)
+async def confirmar_reserva(token: str, confirmacao: ReservaConfirmacao, db_module = Depends(get_db)):
+    """Transforma a reserva em contrato; as datas e os itens vêm da reserva"""
+    if not hasattr(db_module, 'confirmar_reserva'):
+        raise HTTPException(status_code=400, detail="Reservas temporárias disponíveis apenas para SQLite e Supabase")
+    try:
+        return await run_in_threadpool(db_module.confirmar_reserva, token, **confirmacao.dict())
+    except Exception as e:
+        if "Reserva não encontrada" in str(e):
+            raise HTTPException(status_code=404, detail=str(e))
+        if "Estoque insuficiente" in str(e) or "vencida" in str(e):
+            raise HTTPException(status_code=409, detail=str(e))
+        if isinstance(e, ValueError):
+            raise HTTPException(status_code=400, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/api/reservas/{token}")
+async def cancelar_reserva(token: str, db_module = Depends(get_db)):
+    """Libera o estoque bloqueado pelo token"""
+    if not hasattr(db_module, 'cancelar_reserva'):
+        raise HTTPException(status_code=400, detail="Reservas temporárias disponíveis apenas para SQLite e Supabase")
+    try:
+        removidas = await run_in_threadpool(db_module.cancelar_reserva, token)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not removidas:
+        raise HTTPException(status_code=404, detail="Reserva não encontrada")
+    return {"message": "Reserva cancelada", "linhas": removidas}
 # ============= CATEGORIAS E CAMPOS =============
 
 @app.get("/api/categorias", response_model=List[str])
@@ -1330,13 +1653,15 @@ async def obter_historico_auditoria(tabela: str, registro_id: int, db_module = D
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/backup/criar", response_model=dict)
-async def criar_backup(db_module = Depends(get_db)):
-    """Cria backup manual da planilha"""
+async def criar_backup(token: str = Depends(verify_token), db_module = Depends(get_db)):
+    """Cria backup manual da planilha (Google Sheets) ou snapshot do banco (SQLite)"""
     try:
         if backup is None:
             raise HTTPException(status_code=501, detail="Módulo de backup não disponível")
-        resultado = backup.criar_backup_google_sheets()
-        return resultado
+        if backup.USE_GOOGLE_SHEETS:
+            return backup.criar_backup_google_sheets()
+        # SQLite: snapshot local comprimido (API de backup em passos, fora do event loop)
+        return await run_in_threadpool(backup.criar_backup_sqlite)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -1353,19 +1678,58 @@ async def listar_backups(max_backups: Optional[int] = 50, db_module = Depends(ge
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _restaurar_sqlite(backup_id: Optional[str] = None, momento: Optional[datetime] = None) -> dict:
+    """Restaura um snapshot do SQLite e descarta o que este processo derivou do banco
+    antigo: cache de ocupação, resumo do fluxo de caixa e espelho do Supabase.
+    A resposta avisa quando clientes do log de alterações precisam ressincronizar"""
+    import database
+    resultado = backup.restaurar_backup_sqlite(backup_id, momento)
+    if resultado.get('ressincronizar_acima_de') is not None:
+        resultado['aviso'] = (
+            f"Log de alterações restaurado até a versão {resultado['versao_log_restaurada']}; "
+            f"novas alterações seguem depois da {resultado['versao_log_anterior']}. Clientes de "
+            f"/api/changes ou do backup incremental com since acima de "
+            f"{resultado['ressincronizar_acima_de']} devem ressincronizar do zero"
+        )
+    database.cache_ocupacao.invalidar()
+    database.reconstruir_fluxo_caixa()
+    if db_module_supabase is not None and getattr(db_module_supabase, 'espelho', None) is not None:
+        db_module_supabase.espelho.invalidar()
+    return resultado
+
 @app.post("/api/backup/restaurar/{backup_id}", response_model=dict)
-async def restaurar_backup_endpoint(backup_id: str, db_module = Depends(get_db)):
+async def restaurar_backup_endpoint(backup_id: str, token: str = Depends(verify_token), db_module = Depends(get_db)):
     """Restaura um backup específico"""
     try:
         if backup is None:
             raise HTTPException(status_code=501, detail="Módulo de backup não disponível")
-        resultado = backup.restaurar_backup(backup_id)
+        if not backup.USE_GOOGLE_SHEETS:
+            return await run_in_threadpool(_restaurar_sqlite, backup_id)
+        resultado = await run_in_threadpool(backup.restaurar_backup, backup_id)
         return resultado
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/backup/restaurar-ponto", response_model=dict)
+async def restaurar_backup_ponto(
+    momento: datetime = Query(..., description="Restaura o último snapshot até este instante"),
+    token: str = Depends(verify_token),
+    db_module = Depends(get_db)
+):
+    """Restaura o banco SQLite para o último snapshot anterior a `momento`"""
+    try:
+        if backup is None or backup.USE_GOOGLE_SHEETS:
+            raise HTTPException(status_code=501, detail="Restauração por data disponível apenas para o SQLite")
+        return await run_in_threadpool(_restaurar_sqlite, None, momento)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/backup/exportar", response_model=dict)
 async def exportar_backup_json(db_module = Depends(get_db)):
     """Exporta todos os dados em formato JSON"""
@@ -1380,8 +1744,108 @@ async def exportar_backup_json(db_module = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/changes", response_model=dict)
+async def listar_alteracoes(
+    since: int = Query(0, ge=0, description="Última versão conhecida pelo cliente"),
+    limite: int = Query(1000, ge=1, le=10000),
+    compactar: bool = Query(False, description="Só a última alteração de cada registro"),
+    token: str = Depends(verify_token),
+    db_module = Depends(get_db)
+):
+    """Alterações (tabela, registro_id, operação, versão) desde uma versão; use 'versao' como próximo since"""
+    if not hasattr(db_module, 'listar_alteracoes'):
+        raise HTTPException(status_code=400, detail="Log de alterações disponível apenas para SQLite e Supabase")
+    try:
+        return db_module.listar_alteracoes(since, limite, compactar)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ============= EVENTOS (SSE) =============
+
+INTERVALO_PING_SSE = 15  # segundos sem eventos até mandar um comentário de keep-alive
+
+def _evento_sse(tipo: str, dados: dict, evento_id=None) -> str:
+    linhas = [f"id: {evento_id}"] if evento_id is not None else []
+    linhas += [f"event: {tipo}", f"data: {json.dumps(dados, ensure_ascii=False, default=str)}"]
+    return "\n".join(linhas) + "\n\n"
+
+@app.get("/api/eventos")
+async def stream_eventos(
+    request: Request,
+    tabelas: Optional[str] = Query(None, description="Filtro separado por vírgula: itens,compromissos,contas_receber,contas_pagar,..."),
+    token: Optional[str] = Query(None, description="Token de acesso (o EventSource do navegador não envia headers)"),
+):
+    """
+    Canal Server-Sent Events com as alterações de dados (evento 'alteracao')
+    
+    Cada cliente tem um buffer limitado; se ele estourar, ou se a reconexão
+    vier com um Last-Event-ID antigo, o cliente recebe 'resync' e deve buscar
+    o delta pelas listagens com ?updated_since=.
+    """
+    autorizacao = request.headers.get("Authorization", "")
+    if not token and autorizacao.lower().startswith("bearer "):
+        token = autorizacao[7:]
+    if sessoes_ativas.validar(token) is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido ou expirado")
+    
+    assinatura = eventos.barramento.assinar([t.strip() for t in tabelas.split(',') if t.strip()] if tabelas else None)
+    ultimo_recebido = request.headers.get("Last-Event-ID", "")
+    
+    async def gerar():
+        try:
+            yield "retry: 5000\n\n"
+            if ultimo_recebido.isdigit() and int(ultimo_recebido) < eventos.barramento.ultimo_id:
+                yield _evento_sse("resync", {"motivo": "reconexao"})
+            while not await request.is_disconnected():
+                novos, descartados = await assinatura.proximos(INTERVALO_PING_SSE)
+                if descartados:
+                    yield _evento_sse("resync", {"motivo": "buffer_cheio", "descartados": descartados})
+                for evento in novos:
+                    yield _evento_sse("alteracao", evento, evento['id'])
+                if not novos and not descartados:
+                    yield ": ping\n\n"
+        finally:
+            eventos.barramento.cancelar(assinatura)
+    
+    return StreamingResponse(
+        gerar(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/backup/exportar/stream")
+async def exportar_backup_stream(
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    desde: Optional[int] = Query(None, ge=0, description="Backup incremental: só o que mudou depois desta versão (NDJSON)"),
+    token: str = Depends(verify_token),
+    db_module = Depends(get_db)
+):
+    """Exporta todas as tabelas em streaming: NDJSON ou ZIP com um CSV por tabela"""
+    if backup is None:
+        raise HTTPException(status_code=501, detail="Módulo de backup não disponível")
+    if not hasattr(db_module, 'iterar_tabela'):
+        raise HTTPException(status_code=400, detail="Exportação em streaming disponível apenas para SQLite e Supabase")
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if desde is not None:
+        return StreamingResponse(
+            backup.exportar_delta_ndjson(db_module, desde),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": f'attachment; filename="backup_incremental_{desde}_{timestamp}.ndjson"'}
+        )
+    if formato == 'csv':
+        return StreamingResponse(
+            backup.exportar_csv_zip(db_module),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="backup_{timestamp}.zip"'}
+        )
+    return StreamingResponse(
+        backup.exportar_ndjson(db_module),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="backup_{timestamp}.ndjson"'}
+    )
+
 @app.delete("/api/backup/limpar", response_model=dict)
-async def limpar_backups_antigos_endpoint(dias_manter: Optional[int] = 30, db_module = Depends(get_db)):
+async def limpar_backups_antigos_endpoint(dias_manter: Optional[int] = 30, token: str = Depends(verify_token), db_module = Depends(get_db)):
     """Remove backups mais antigos que o número de dias especificado"""
     try:
         if backup is None:
@@ -1485,24 +1949,35 @@ async def criar_conta_receber(conta: ContaReceberCreate, token: str = Depends(ve
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/contas-receber", response_model=List[dict])
+@app.get("/api/contas-receber", response_model=Union[List[dict], dict])
 async def listar_contas_receber(
     status: Optional[str] = None,
     data_inicio: Optional[date] = None,
     data_fim: Optional[date] = None,
     compromisso_id: Optional[int] = None,
+    updated_since: Optional[datetime] = Query(None, description="Só o que mudou desde o 'sincronizado_em' anterior"),
     token: str = Depends(verify_token),
     db_module = Depends(get_db)
 ):
     """Lista contas a receber com filtros opcionais"""
     try:
+        filtro_delta = {}
+        if updated_since:
+            desde = _desde_sincronizacao(db_module, updated_since)
+            sincronizado_em = datetime.now(timezone.utc)
+            filtro_delta['updated_since'] = desde
         contas = db_module.listar_contas_receber(
             status=status,
             data_inicio=data_inicio,
             data_fim=data_fim,
-            compromisso_id=compromisso_id
+            compromisso_id=compromisso_id,
+            **filtro_delta
         )
+        if updated_since:
+            return _resposta_delta(db_module, 'contas_receber', [conta_receber_to_dict(c) for c in contas], desde, sincronizado_em)
         return [conta_receber_to_dict(c) for c in contas]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1579,24 +2054,35 @@ async def criar_conta_pagar(conta: ContaPagarCreate, token: str = Depends(verify
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/contas-pagar", response_model=List[dict])
+@app.get("/api/contas-pagar", response_model=Union[List[dict], dict])
 async def listar_contas_pagar(
     status: Optional[str] = None,
     data_inicio: Optional[date] = None,
     data_fim: Optional[date] = None,
     categoria: Optional[str] = None,
+    updated_since: Optional[datetime] = Query(None, description="Só o que mudou desde o 'sincronizado_em' anterior"),
     token: str = Depends(verify_token),
     db_module = Depends(get_db)
 ):
     """Lista contas a pagar com filtros opcionais"""
     try:
+        filtro_delta = {}
+        if updated_since:
+            desde = _desde_sincronizacao(db_module, updated_since)
+            sincronizado_em = datetime.now(timezone.utc)
+            filtro_delta['updated_since'] = desde
         contas = db_module.listar_contas_pagar(
             status=status,
             data_inicio=data_inicio,
             data_fim=data_fim,
-            categoria=categoria
+            categoria=categoria,
+            **filtro_delta
         )
+        if updated_since:
+            return _resposta_delta(db_module, 'contas_pagar', [conta_pagar_to_dict(c) for c in contas], desde, sincronizado_em)
         return [conta_pagar_to_dict(c) for c in contas]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1869,18 +2355,39 @@ async def listar_financiamentos(
     q: Optional[str] = None, # Parâmetro de busca
     pagina: Optional[int] = Query(None, ge=1), # Página começando em 1
     por_pagina: int = Query(10, ge=1, le=100),
+    after_id: Optional[int] = Query(None, ge=1, description="Cursor: 'proximo_after_id' da página anterior"),
+    count: str = Query("exact", pattern="^(exact|planned|none)$", description="Total exato, estimado ou nenhum"),
+    updated_since: Optional[datetime] = Query(None, description="Só o que mudou desde o 'sincronizado_em' anterior"),
     db_module = Depends(get_db)
 ):
-    """Lista financiamentos com busca e paginação opcional"""
+    """
+    Lista financiamentos com busca e paginação opcional
+
+    Para percorrer muitas páginas, use after_id (paginação por cursor: cada
+    página custa o mesmo que a primeira) no lugar de pagina, e count=planned
+    ou count=none para não contar a view inteira a cada página.
+    """
     try:
+        if updated_since:
+            desde = _desde_sincronizacao(db_module, updated_since)
+            sincronizado_em = datetime.now(timezone.utc)
+            resultado = db_module.listar_financiamentos(status=status, item_id=item_id, q=q, updated_since=desde)
+            alterados = resultado if isinstance(resultado, list) else resultado["data"]
+            return _resposta_delta(
+                db_module, 'financiamentos', [financiamento_to_dict(f) for f in alterados], desde, sincronizado_em
+            )
+        
         # Se for Supabase, ele já retorna o dict formatado. 
         # Se for Sheets/SQLite e não tiver suporte, devolvemos formato compatível.
+        # Cursor/contagem só são repassados quando usados (backends sem suporte seguem funcionando)
+        kwargs_paginacao = {'after_id': after_id, 'count': count} if (after_id or count != 'exact') else {}
         resultado = db_module.listar_financiamentos(
             status=status, 
             item_id=item_id, 
             q=q, 
             pagina=pagina, 
-            por_pagina=por_pagina
+            por_pagina=por_pagina,
+            **kwargs_paginacao
         )
         
         # Se o db_module retornar apenas uma lista (caso do SQLite/Sheets antigo), 
@@ -1891,8 +2398,11 @@ async def listar_financiamentos(
         # Caso do Supabase otimizado: converte os objetos da lista "data" em dicts
         return {
             "data": [financiamento_to_dict(f) for f in resultado["data"]],
-            "total": resultado["total"]
+            "total": resultado["total"],
+            "proximo_after_id": resultado.get("proximo_after_id")
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[ERROR] {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1977,6 +2487,73 @@ async def pagar_parcela_financiamento(
         # Retorna string para o React não tentar renderizar um objeto de erro
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/parcelas/pagar-lote", response_model=dict)
+async def pagar_parcelas_lote(
+    request: PagamentoParcelasLoteRequest,
+    token: str = Depends(verify_token),
+    db_module = Depends(get_db)
+):
+    """Paga várias parcelas em uma única transação (ex.: baixa de extrato bancário)"""
+    try:
+        resultado = db_module.pagar_parcelas_financiamento([p.model_dump() for p in request.pagamentos])
+        return {
+            "parcelas": [parcela_to_dict(p) for p in resultado['parcelas']],
+            "financiamentos_quitados": resultado['financiamentos_quitados']
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/importacao/{tipo}", response_model=dict)
+async def importar_arquivo(
+    tipo: str,
+    arquivo: UploadFile = File(...),
+    token: str = Depends(verify_token),
+    db_module = Depends(get_db)
+):
+    """Importa itens ou compromissos de um CSV/XLSX em lote; devolve os erros por linha"""
+    import importacao
+    funcoes = {'itens': importacao.importar_itens, 'compromissos': importacao.importar_compromissos}
+    if tipo not in funcoes:
+        raise HTTPException(status_code=404, detail="Tipo de importação deve ser 'itens' ou 'compromissos'")
+    try:
+        return await run_in_threadpool(funcoes[tipo], db_module, arquivo.file, arquivo.filename or '')
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/conciliacao/extrato", response_model=dict)
+async def conciliar_extrato(
+    arquivo: UploadFile = File(...),
+    tolerancia_dias: int = Query(3, ge=0, le=30),
+    aplicar: bool = Query(False, description="False = só pré-visualiza os pares encontrados"),
+    token: str = Depends(verify_token),
+    db_module = Depends(get_db)
+):
+    """Concilia um extrato OFX/CSV com contas e parcelas em aberto e aplica as baixas em lote"""
+    import conciliacao
+    try:
+        resultado = await run_in_threadpool(
+            conciliacao.conciliar_extrato, db_module, arquivo.file, arquivo.filename or '', tolerancia_dias, aplicar
+        )
+        return {
+            "conciliadas": [
+                {**c, "data_pagamento": c['data_pagamento'].isoformat(), "data_vencimento": c['data_vencimento'].isoformat()}
+                for c in resultado['conciliadas']
+            ],
+            "nao_conciliadas": [
+                {"data": l.data.isoformat(), "valor": l.valor, "descricao": l.descricao, "identificador": l.identificador}
+                for l in resultado['nao_conciliadas']
+            ],
+            "aplicado": resultado['aplicado']
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.put("/api/financiamentos/{financiamento_id}/parcelas/{parcela_id}", response_model=dict)
 async def atualizar_parcela_financiamento(
     financiamento_id: int,
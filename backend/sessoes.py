@@ -0,0 +1,139 @@
+"""
+Tokens de sessão assinados (JWT HS256) com validade
+
+O login emite um token com usuário (sub), validade (exp) e um id único (jti).
+A validação é só CPU: confere assinatura e exp, sem consultar estado
+compartilhado, então qualquer worker/instância com o mesmo JWT_SECRET aceita
+o token.
+
+Logout revoga o jti até o exp do token (lista de revogação). A lista fica em
+memória em cada worker e, quando há armazenamento (listar_tokens_revogados /
+revogar_token do backend), é gravada nele e recarregada a cada
+INTERVALO_SINCRONIZACAO segundos: um logout feito em um worker vale nos
+outros depois de no máximo esse intervalo. Entradas somem quando o token
+expiraria de qualquer forma, então a lista fica pequena.
+"""
+import os
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from jose import JWTError, jwt
+
+ALGORITMO = 'HS256'
+TTL_TOKEN_HORAS = float(os.getenv('TOKEN_TTL_HORAS', '12'))
+INTERVALO_SINCRONIZACAO = 30  # segundos
+
+
+def carregar_segredo(is_production: bool) -> str:
+    """
+    JWT_SECRET do ambiente; obrigatório em produção
+
+    Em desenvolvimento, sem a variável, gera um segredo por processo (tokens
+    não valem entre workers nem sobrevivem a um restart).
+    """
+    segredo = (os.getenv('JWT_SECRET') or '').strip()
+    if segredo:
+        return segredo
+    if is_production:
+        raise ValueError(
+            "ERRO CRÍTICO: JWT_SECRET deve estar configurada em produção!\n"
+            "Configure em: Settings → Environment → Add Environment Variable"
+        )
+    print("⚠️ JWT_SECRET não configurada: usando segredo temporário (um por processo)")
+    return secrets.token_urlsafe(32)
+
+
+class ListaRevogacao:
+    """jti -> exp (epoch) dos tokens revogados, com limpeza pelo exp"""
+
+    def __init__(self, carregar: Optional[Callable[[], Iterable[Tuple[str, int]]]] = None,
+                 gravar: Optional[Callable[[str, int], None]] = None,
+                 intervalo: float = INTERVALO_SINCRONIZACAO):
+        self._carregar = carregar
+        self._gravar = gravar
+        self._intervalo = intervalo
+        self._revogados: Dict[str, int] = {}
+        self._sincronizado_em = 0.0
+        self._lock = threading.Lock()
+        self._sincronizando = False
+
+    def _limpar(self, agora: int):
+        for jti in [jti for jti, exp in self._revogados.items() if exp <= agora]:
+            del self._revogados[jti]
+
+    def _sincronizar(self):
+        """Recarrega do armazenamento; só uma thread por vez, as outras seguem com a lista atual"""
+        if self._carregar is None or time.monotonic() - self._sincronizado_em < self._intervalo:
+            return
+        with self._lock:
+            if self._sincronizando:
+                return
+            self._sincronizando = True
+        try:
+            linhas = list(self._carregar())
+            with self._lock:
+                for jti, exp in linhas:
+                    self._revogados[jti] = int(exp)
+                self._limpar(int(time.time()))
+        except Exception as e:
+            print(f"⚠️ Falha ao sincronizar tokens revogados: {e}")
+        finally:
+            with self._lock:
+                self._sincronizado_em = time.monotonic()
+                self._sincronizando = False
+
+    def revogar(self, jti: str, exp: int):
+        with self._lock:
+            self._limpar(int(time.time()))
+            self._revogados[jti] = int(exp)
+        if self._gravar is not None:
+            self._gravar(jti, int(exp))
+
+    def revogado(self, jti: str) -> bool:
+        self._sincronizar()
+        return jti in self._revogados
+
+
+class GerenciadorSessoes:
+    def __init__(self, segredo: str, ttl_horas: float = TTL_TOKEN_HORAS,
+                 revogacao: Optional[ListaRevogacao] = None):
+        self._segredo = segredo
+        self._ttl = int(ttl_horas * 3600)
+        self.revogacao = revogacao or ListaRevogacao()
+
+    def emitir(self, usuario: str) -> Dict:
+        """Novo token para o usuário: {'token', 'expira_em'}"""
+        agora = int(time.time())
+        claims = {'sub': usuario, 'iat': agora, 'exp': agora + self._ttl, 'jti': secrets.token_urlsafe(12)}
+        return {
+            'token': jwt.encode(claims, self._segredo, algorithm=ALGORITMO),
+            'expira_em': datetime.fromtimestamp(claims['exp'], timezone.utc),
+        }
+
+    def validar(self, token: Optional[str]) -> Optional[Dict]:
+        """Dados da sessão ({'usuario', 'created_at', 'expira_em', 'jti'}) ou None se inválido/expirado/revogado"""
+        if not token:
+            return None
+        try:
+            claims = jwt.decode(token, self._segredo, algorithms=[ALGORITMO])
+        except JWTError:
+            return None
+        if not claims.get('jti') or self.revogacao.revogado(claims['jti']):
+            return None
+        return {
+            'usuario': claims.get('sub'),
+            'created_at': datetime.fromtimestamp(claims.get('iat', 0), timezone.utc),
+            'expira_em': datetime.fromtimestamp(claims['exp'], timezone.utc),
+            'jti': claims['jti'],
+        }
+
+    def revogar(self, token: Optional[str]) -> bool:
+        """Revoga o token até o exp dele; False se já era inválido"""
+        sessao = self.validar(token)
+        if sessao is None:
+            return False
+        self.revogacao.revogar(sessao['jti'], int(sessao['expira_em'].timestamp()))
+        return True
@@ -0,0 +1,16 @@
+"""
+Suíte de benchmarks reprodutíveis do CRM de Gestão de Estoque
+
+Gera datasets sintéticos de uma locadora (itens, compromissos, contas e
+financiamentos) em SQLite através do database.py, cronometra as funções
+principais e os endpoints da API e grava os resultados em JSON para
+comparar branches.
+
+O supabase_database.py é medido contra um cliente Supabase local apoiado
+em SQLite (supabase_local.py), que conta as idas e voltas de cada função.
+
+Uso:
+    python -m benchmarks.executar --tamanhos 1000 10000 100000 --saida resultados.json
+    python -m benchmarks.comparar base.json resultados.json --limite 1.25
+    python -m benchmarks.supabase_roundtrips --itens 200 --latencia-ms 20
+"""
@@ -0,0 +1,88 @@
+"""
+Compara dois arquivos de resultados de benchmark e aponta regressões
+
+Uso:
+    python -m benchmarks.comparar base.json novo.json --limite 1.25
+
+Sai com código 1 se algum benchmark ficou mais lento que limite x a base
+(pela mediana), para ser usado em CI.
+
+Benchmarks HTTP com status de erro (>= 400) ou com status diferente entre
+base e novo não têm razão calculada: tempo de resposta de erro não é medida.
+Passar a falhar (base ok, novo com erro) conta como regressão.
+"""
+import sys
+import json
+import argparse
+from typing import Dict, List, Optional
+
+
+def comparar(base: Dict, novo: Dict, limite: float) -> List[Dict]:
+    """Retorna uma linha por benchmark presente nos dois relatórios
+
+    Linhas com status HTTP de erro ou divergente têm razao None e 'invalido'
+    com o motivo.
+    """
+    linhas = []
+    for tamanho, resultado_novo in novo.get('resultados', {}).items():
+        resultado_base = base.get('resultados', {}).get(tamanho)
+        if not resultado_base:
+            continue
+        for nome, medida_nova in resultado_novo.get('benchmarks', {}).items():
+            medida_base = resultado_base.get('benchmarks', {}).get(nome)
+            if not medida_base or 'mediana_ms' not in medida_base or 'mediana_ms' not in medida_nova:
+                continue
+            status_base, status_novo = medida_base.get('status_http'), medida_nova.get('status_http')
+            if status_base != status_novo or (status_novo or 0) >= 400:
+                linhas.append({
+                    'tamanho': tamanho,
+                    'benchmark': nome,
+                    'base_ms': medida_base['mediana_ms'],
+                    'novo_ms': medida_nova['mediana_ms'],
+                    'razao': None,
+                    'regressao': (status_base or 0) < 400 <= (status_novo or 0),
+                    'invalido': f"HTTP {status_base} -> {status_novo}",
+                })
+                continue
+            razao = medida_nova['mediana_ms'] / medida_base['mediana_ms'] if medida_base['mediana_ms'] > 0 else 1.0
+            linhas.append({
+                'tamanho': tamanho,
+                'benchmark': nome,
+                'base_ms': medida_base['mediana_ms'],
+                'novo_ms': medida_nova['mediana_ms'],
+                'razao': round(razao, 3),
+                'regressao': razao > limite,
+            })
+    return linhas
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Compara resultados de benchmark')
+    parser.add_argument('base', help='JSON de referência (ex.: branch principal)')
+    parser.add_argument('novo', help='JSON a comparar')
+    parser.add_argument('--limite', type=float, default=1.25, help='Razão novo/base acima da qual há regressão')
+    args = parser.parse_args(argv)
+
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.novo, encoding='utf-8') as f:
+        novo = json.load(f)
+
+    linhas = comparar(base, novo, args.limite)
+    for linha in linhas:
+        if linha['razao'] is None:
+            marca = 'REGRESSAO' if linha['regressao'] else 'ignorado'
+            print(f"{linha['tamanho']:>7} | {linha['benchmark']:<70} | {linha['invalido']:>27} | {marca}")
+            continue
+        marca = 'REGRESSAO' if linha['regressao'] else 'ok'
+        print(f"{linha['tamanho']:>7} | {linha['benchmark']:<70} | {linha['base_ms']:>10.2f} -> {linha['novo_ms']:>10.2f} ms | x{linha['razao']:<6} {marca}")
+
+    regressoes = [l for l in linhas if l['regressao']]
+    if regressoes:
+        print(f"\n{len(regressoes)} regressão(ões) acima de x{args.limite}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+Geração de datasets sintéticos de uma locadora para os benchmarks
+
+Os dados são determinísticos para uma mesma semente e data de referência:
+todas as datas são geradas relativas a data_referencia, então rodar o
+benchmark em dias diferentes produz a mesma distribuição de status
+(pago, pendente, vencido) e de ocupação.
+"""
+import os
+import sys
+import random
+import calendar
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+import database
+from models import Item, Carro, Compromisso, ContaReceber, ContaPagar, Financiamento, ParcelaFinanciamento
+
+# Proporções do dataset em relação ao número de itens
+COMPROMISSOS_POR_ITEM = 3
+CONTAS_PAGAR_POR_ITEM = 0.5
+FINANCIAMENTOS_POR_ITEM = 0.02
+PARCELAS_POR_FINANCIAMENTO = 12
+FRACAO_CARROS = 0.1
+
+CIDADES = [
+    ('São Paulo', 'SP'), ('Rio de Janeiro', 'RJ'), ('Belo Horizonte', 'MG'),
+    ('Curitiba', 'PR'), ('Porto Alegre', 'RS'), ('Salvador', 'BA'),
+    ('Recife', 'PE'), ('Goiânia', 'GO'), ('Brasília', 'DF'), ('Fortaleza', 'CE'),
+]
+TIPOS_ESTRUTURA = ['Tenda', 'Palco', 'Gerador', 'Banheiro Químico', 'Grade', 'Cadeira', 'Mesa', 'Treliça']
+MARCAS = [('Fiat', 'Strada'), ('Volkswagen', 'Saveiro'), ('Chevrolet', 'Montana'), ('Toyota', 'Hilux')]
+CONTRATANTES = ['Prefeitura', 'Produtora Alfa', 'Eventos Beta', 'Festival Gama', 'Buffet Delta', 'Igreja Central']
+CATEGORIAS_PAGAR = ['Fornecedor', 'Manutenção', 'Despesa', 'Outro']
+
+# Tamanho dos lotes enviados ao bulk_insert_mappings
+TAMANHO_LOTE = 5000
+
+
+def _somar_meses(data_base: date, meses: int) -> date:
+    ano = data_base.year + (data_base.month - 1 + meses) // 12
+    mes = (data_base.month - 1 + meses) % 12 + 1
+    dia = min(data_base.day, calendar.monthrange(ano, mes)[1])
+    return date(ano, mes, dia)
+
+
+def _inserir_em_lotes(session, modelo, linhas):
+    for inicio in range(0, len(linhas), TAMANHO_LOTE):
+        session.bulk_insert_mappings(modelo, linhas[inicio:inicio + TAMANHO_LOTE])
+
+
+def gerar_dataset(n_itens: int, seed: int = 42, data_referencia: Optional[date] = None) -> Dict[str, int]:
+    """
+    Popula o banco SQLite atual com um dataset sintético
+
+    Args:
+        n_itens: Número de itens no estoque
+        seed: Semente do gerador aleatório (mesma semente = mesmo dataset)
+        data_referencia: Data em torno da qual os compromissos e vencimentos são gerados
+
+    Returns:
+        Dict com a contagem de linhas inseridas por tabela
+    """
+    rnd = random.Random(seed)
+    hoje = data_referencia or date.today()
+
+    itens = []
+    carros = []
+    for item_id in range(1, n_itens + 1):
+        cidade, uf = rnd.choice(CIDADES)
+        if rnd.random() < FRACAO_CARROS:
+            marca, modelo = rnd.choice(MARCAS)
+            itens.append({
+                'id': item_id, 'nome': f'{marca} {modelo} #{item_id}', 'quantidade_total': 1,
+                'categoria': 'Carros', 'descricao': f'Veículo de apoio {item_id}',
+                'cidade': cidade, 'uf': uf, 'endereco': None
+            })
+            carros.append({
+                'item_id': item_id, 'placa': f'BEN{item_id % 10}{chr(65 + item_id % 26)}{item_id % 100:02d}',
+                'marca': marca, 'modelo': modelo, 'ano': rnd.randint(2015, 2025)
+            })
+        else:
+            tipo = rnd.choice(TIPOS_ESTRUTURA)
+            itens.append({
+                'id': item_id, 'nome': f'{tipo} #{item_id}', 'quantidade_total': rnd.randint(5, 200),
+                'categoria': 'Estrutura de Evento', 'descricao': f'{tipo} para eventos em {cidade}',
+                'cidade': cidade, 'uf': uf, 'endereco': None
+            })
+
+    compromissos = []
+    contas_receber = []
+    compromisso_id = 0
+    for item in itens:
+        for _ in range(COMPROMISSOS_POR_ITEM):
+            compromisso_id += 1
+            inicio = hoje + timedelta(days=rnd.randint(-180, 180))
+            fim = inicio + timedelta(days=rnd.randint(0, 14))
+            cidade, uf = rnd.choice(CIDADES)
+            compromissos.append({
+                'id': compromisso_id, 'item_id': item['id'],
+                'quantidade': max(1, item['quantidade_total'] // rnd.randint(2, 6)),
+                'data_inicio': inicio, 'data_fim': fim,
+                'descricao': f'Evento {compromisso_id}', 'cidade': cidade, 'uf': uf,
+                'endereco': None, 'contratante': rnd.choice(CONTRATANTES)
+            })
+            vencimento = fim + timedelta(days=rnd.randint(0, 30))
+            pago = vencimento < hoje and rnd.random() < 0.7
+            contas_receber.append({
+                'compromisso_id': compromisso_id, 'descricao': f'Locação evento {compromisso_id}',
+                'valor': round(rnd.uniform(500, 20000), 2), 'data_vencimento': vencimento,
+                'data_pagamento': vencimento if pago else None,
+                'status_armazenado': 'Pago' if pago else ('Vencido' if vencimento < hoje else 'Pendente'),
+                'forma_pagamento': rnd.choice(['PIX', 'Boleto', 'Cartão']), 'observacoes': None
+            })
+
+    contas_pagar = []
+    for _ in range(int(n_itens * CONTAS_PAGAR_POR_ITEM)):
+        vencimento = hoje + timedelta(days=rnd.randint(-180, 90))
+        pago = vencimento < hoje and rnd.random() < 0.8
+        contas_pagar.append({
+            'descricao': 'Despesa operacional', 'categoria': rnd.choice(CATEGORIAS_PAGAR),
+            'valor': round(rnd.uniform(100, 8000), 2), 'data_vencimento': vencimento,
+            'data_pagamento': vencimento if pago else None,
+            'status_armazenado': 'Pago' if pago else ('Vencido' if vencimento < hoje else 'Pendente'),
+            'fornecedor': f'Fornecedor {rnd.randint(1, 50)}', 'item_id': rnd.randint(1, n_itens),
+            'forma_pagamento': 'Boleto', 'observacoes': None
+        })
+
+    financiamentos = []
+    parcelas = []
+    carros_ids = [c['item_id'] for c in carros] or [1]
+    for financiamento_id in range(1, max(1, int(n_itens * FINANCIAMENTOS_POR_ITEM)) + 1):
+        valor_total = round(rnd.uniform(40000, 250000), 2)
+        valor_entrada = round(valor_total * 0.2, 2)
+        valor_parcela = round((valor_total - valor_entrada) / PARCELAS_POR_FINANCIAMENTO, 2)
+        inicio = _somar_meses(hoje, -rnd.randint(0, PARCELAS_POR_FINANCIAMENTO))
+        financiamentos.append({
+            'id': financiamento_id, 'item_id': rnd.choice(carros_ids), 'valor_total': valor_total,
+            'valor_entrada': valor_entrada, 'numero_parcelas': PARCELAS_POR_FINANCIAMENTO,
+            'valor_parcela': valor_parcela, 'taxa_juros': 0.0, 'data_inicio': inicio,
+            'status': 'Ativo', 'instituicao_financeira': 'Banco Sintético', 'observacoes': None
+        })
+        for numero in range(1, PARCELAS_POR_FINANCIAMENTO + 1):
+            vencimento = _somar_meses(inicio, numero - 1)
+            paga = vencimento < hoje
+            parcelas.append({
+                'financiamento_id': financiamento_id, 'numero_parcela': numero,
+                'valor_original': valor_parcela, 'valor_pago': valor_parcela if paga else 0.0,
+                'data_vencimento': vencimento, 'data_pagamento': vencimento if paga else None,
+                'status_armazenado': 'Paga' if paga else 'Pendente',
+                'juros': 0.0, 'multa': 0.0, 'desconto': 0.0, 'link_boleto': None
+            })
+
+    session = database.get_session()
+    try:
+        _inserir_em_lotes(session, Item, itens)
+        _inserir_em_lotes(session, Carro, carros)
+        _inserir_em_lotes(session, Compromisso, compromissos)
+        _inserir_em_lotes(session, ContaReceber, contas_receber)
+        _inserir_em_lotes(session, ContaPagar, contas_pagar)
+        _inserir_em_lotes(session, Financiamento, financiamentos)
+        _inserir_em_lotes(session, ParcelaFinanciamento, parcelas)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+    # O bulk insert não passa pelas funções de contas: recalcula o resumo mensal
+    database.reconstruir_fluxo_caixa()
+
+    return {
+        'itens': len(itens),
+        'carros': len(carros),
+        'compromissos': len(compromissos),
+        'contas_receber': len(contas_receber),
+        'contas_pagar': len(contas_pagar),
+        'financiamentos': len(financiamentos),
+        'parcelas_financiamento': len(parcelas),
+    }
@@ -0,0 +1,193 @@
+"""
+Executa os benchmarks sobre datasets sintéticos e grava os resultados em JSON
+
+Cada tamanho de dataset roda em um diretório de trabalho temporário próprio
+(o SQLite fica em data/estoque.db relativo ao diretório atual), então o
+banco de desenvolvimento nunca é tocado.
+
+Uso:
+    python -m benchmarks.executar --tamanhos 1000 10000 --repeticoes 3 --saida resultados.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import importlib
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from benchmarks.dados_sinteticos import gerar_dataset
+
+TAMANHOS_PADRAO = [1000, 10000, 100000]
+
+
+def _cronometrar(funcao: Callable, repeticoes: int) -> Dict:
+    """Executa a função N vezes e devolve estatísticas em milissegundos"""
+    tempos = []
+    resultado = {}
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        try:
+            retorno = funcao()
+        except Exception as e:
+            resultado['erro'] = f"{type(e).__name__}: {e}"
+            break
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        # Respostas HTTP: registra o status para não comparar erro com sucesso
+        status_http = getattr(retorno, 'status_code', None)
+        if status_http is not None:
+            resultado['status_http'] = status_http
+
+    if tempos:
+        resultado.update({
+            'repeticoes': len(tempos),
+            'min_ms': round(min(tempos), 3),
+            'mediana_ms': round(statistics.median(tempos), 3),
+            'media_ms': round(statistics.mean(tempos), 3),
+            'max_ms': round(max(tempos), 3),
+        })
+    return resultado
+
+
+def _benchmarks_database(hoje: date) -> List[Tuple[str, Callable]]:
+    """Funções do database.py cronometradas diretamente"""
+    import database
+
+    inicio_periodo = hoje - timedelta(days=180)
+    return [
+        ('database.listar_itens', lambda: database.listar_itens()),
+        ('database.verificar_disponibilidade_todos_itens', lambda: database.verificar_disponibilidade_todos_itens(hoje)),
+        ('database.verificar_disponibilidade_periodo', lambda: database.verificar_disponibilidade_periodo(1, hoje, hoje + timedelta(days=30))),
+        ('database.obter_fluxo_caixa', lambda: database.obter_fluxo_caixa(inicio_periodo, hoje)),
+        ('database.criar_financiamento', lambda: database.criar_financiamento(
+            item_id=1, valor_total=60000, numero_parcelas=12, taxa_juros=0.015,
+            data_inicio=hoje, valor_entrada=10000, instituicao_financeira='Banco Benchmark'
+        )),
+    ]
+
+
+def _carregar_api():
+    """Importa o backend FastAPI; devolve None se as dependências não estiverem instaladas"""
+    os.environ.setdefault('USE_GOOGLE_SHEETS', 'false')
+    os.environ.setdefault('APP_USUARIO', 'benchmark')
+    os.environ.setdefault('APP_SENHA', 'benchmark')
+    try:
+        from fastapi.testclient import TestClient
+        main = importlib.import_module('backend.main')
+    except ImportError as e:
+        print(f"[BENCH] API ignorada (dependência ausente): {e}")
+        return None, None
+    return main, TestClient(main.app)
+
+
+def _benchmarks_api(main, client, hoje: date) -> List[Tuple[str, Callable]]:
+    """Endpoints da API cronometrados via TestClient"""
+    resposta = client.post('/api/auth/login', json={'usuario': main.APP_USUARIO, 'senha': main.APP_SENHA})
+    token = resposta.json().get('token', '') if resposta.status_code == 200 else ''
+    headers = {'Authorization': f'Bearer {token}'}
+
+    d = hoje.isoformat()
+    d_30 = (hoje + timedelta(days=30)).isoformat()
+    rotas = [
+        '/api/itens',
+        '/api/itens/buscar?q=tenda&por_pagina=50',
+        '/api/compromissos',
+        f'/api/disponibilidade?data_consulta={d}',
+        f'/api/disponibilidade?item_id=1&data_inicio={d}&data_fim={d_30}',
+        '/api/contas-receber',
+        '/api/contas-pagar',
+        '/api/financeiro/dashboard',
+        '/api/financeiro/fluxo-caixa',
+        '/api/financiamentos?pagina=1&por_pagina=10',
+        '/api/stats',
+    ]
+    return [(f'api.GET {rota}', lambda rota=rota: client.get(rota, headers=headers)) for rota in rotas]
+
+
+def executar_tamanho(n_itens: int, repeticoes: int, seed: int, incluir_api: bool = True) -> Dict:
+    """Gera o dataset de um tamanho em diretório temporário e roda todos os benchmarks"""
+    diretorio_original = os.getcwd()
+    diretorio = tempfile.mkdtemp(prefix=f'bench_{n_itens}_')
+    hoje = date.today()
+    try:
+        os.chdir(diretorio)
+        from models import init_db
+        init_db()
+
+        print(f"[BENCH] Gerando dataset com {n_itens} itens...")
+        inicio = time.perf_counter()
+        contagem = gerar_dataset(n_itens, seed=seed, data_referencia=hoje)
+        tempo_geracao = time.perf_counter() - inicio
+
+        benchmarks = _benchmarks_database(hoje)
+        if incluir_api:
+            main, client = _carregar_api()
+            if client is not None:
+                benchmarks += _benchmarks_api(main, client, hoje)
+
+        resultados = {}
+        for nome, funcao in benchmarks:
+            print(f"[BENCH] {n_itens:>7} | {nome}")
+            resultados[nome] = _cronometrar(funcao, repeticoes)
+
+        return {
+            'dataset': contagem,
+            'tempo_geracao_s': round(tempo_geracao, 3),
+            'benchmarks': resultados,
+        }
+    finally:
+        os.chdir(diretorio_original)
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+
+def _metadados(seed: int, repeticoes: int) -> Dict:
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], cwd=root_dir, capture_output=True, text=True, timeout=10).stdout.strip() or None
+        except Exception:
+            return None
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'commit': git('rev-parse', 'HEAD'),
+        'branch': git('rev-parse', '--abbrev-ref', 'HEAD'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'seed': seed,
+        'repeticoes': repeticoes,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks do CRM de Gestão de Estoque')
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=TAMANHOS_PADRAO, help='Números de itens dos datasets')
+    parser.add_argument('--repeticoes', type=int, default=3, help='Execuções por benchmark')
+    parser.add_argument('--seed', type=int, default=42, help='Semente do gerador de dados')
+    parser.add_argument('--sem-api', action='store_true', help='Não cronometra os endpoints FastAPI')
+    parser.add_argument('--saida', default='bench_output.json', help='Arquivo JSON de resultados')
+    args = parser.parse_args(argv)
+
+    relatorio = {'meta': _metadados(args.seed, args.repeticoes), 'resultados': {}}
+    for n_itens in args.tamanhos:
+        relatorio['resultados'][str(n_itens)] = executar_tamanho(
+            n_itens, args.repeticoes, args.seed, incluir_api=not args.sem_api
+        )
+
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    print(f"[BENCH] Resultados gravados em {args.saida}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1049 @@
+"""
+Cliente Supabase local (substituto do PostgREST) apoiado em SQLite
+
+Implementa a parte da API do supabase-py usada pelo supabase_database.py:
+table().select/insert/update/upsert/delete com os filtros eq/neq/gt/gte/lt/lte/
+in_/is_/like/ilike/or_, order/range/limit/single e rpc(). Cada execute() conta
+como uma ida e volta à rede e pode sofrer uma latência artificial, o que
+permite medir quantos round trips cada função pública faz sem um projeto
+Supabase de verdade.
+
+Uso:
+    from benchmarks.supabase_local import ClienteSupabaseLocal, instalar
+    cliente = instalar(ClienteSupabaseLocal(latencia_ms=20))
+    supabase_database.listar_itens()
+    print(cliente.chamadas)
+"""
+import re
+import json
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+# Colunas JSONB do Supabase: gravadas como texto e devolvidas como dict/list
+COLUNAS_JSON = {'dados_categoria', 'itens_json', 'itens'}
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS categorias_itens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nome TEXT UNIQUE NOT NULL,
+    data_criacao TEXT DEFAULT CURRENT_DATE
+);
+CREATE TABLE IF NOT EXISTS itens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nome TEXT NOT NULL,
+    quantidade_total INTEGER NOT NULL DEFAULT 1,
+    categoria TEXT NOT NULL DEFAULT 'Estrutura de Evento',
+    descricao TEXT,
+    cidade TEXT NOT NULL,
+    uf TEXT NOT NULL,
+    endereco TEXT,
+    dados_categoria TEXT DEFAULT '{}',
+    valor_compra REAL DEFAULT 0,
+    data_aquisicao TEXT DEFAULT CURRENT_DATE,
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+CREATE TABLE IF NOT EXISTS carros (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_id INTEGER UNIQUE NOT NULL REFERENCES itens(id) ON DELETE CASCADE,
+    placa TEXT, marca TEXT, modelo TEXT, ano_fabricacao INTEGER,
+    chassi TEXT, renavam TEXT, cor TEXT,
+    dados_categoria TEXT DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS pecas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_id INTEGER UNIQUE NOT NULL REFERENCES itens(id) ON DELETE CASCADE,
+    marca TEXT,
+    dados_categoria TEXT DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS compromissos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_id INTEGER REFERENCES itens(id),
+    quantidade INTEGER,
+    data_inicio TEXT NOT NULL,
+    data_fim TEXT NOT NULL,
+    descricao TEXT,
+    cidade TEXT,
+    uf TEXT,
+    endereco TEXT,
+    contratante TEXT,
+    nome_contrato TEXT,
+    valor_total_contrato REAL DEFAULT 0,
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+CREATE TABLE IF NOT EXISTS compromisso_itens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    compromisso_id INTEGER REFERENCES compromissos(id),
+    item_id INTEGER REFERENCES itens(id),
+    quantidade INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS contas_receber (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    compromisso_id INTEGER NOT NULL REFERENCES compromissos(id),
+    descricao TEXT NOT NULL,
+    valor REAL NOT NULL,
+    data_vencimento TEXT NOT NULL,
+    data_pagamento TEXT,
+    status TEXT NOT NULL DEFAULT 'Pendente',
+    forma_pagamento TEXT,
+    observacoes TEXT,
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+CREATE TABLE IF NOT EXISTS contas_pagar (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    descricao TEXT NOT NULL,
+    categoria TEXT NOT NULL,
+    valor REAL NOT NULL,
+    data_vencimento TEXT NOT NULL,
+    data_pagamento TEXT,
+    status TEXT NOT NULL DEFAULT 'Pendente',
+    fornecedor TEXT,
+    item_id INTEGER REFERENCES itens(id),
+    forma_pagamento TEXT,
+    observacoes TEXT,
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+CREATE TABLE IF NOT EXISTS financiamentos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    codigo_contrato TEXT DEFAULT '',
+    item_id INTEGER REFERENCES itens(id),
+    valor_total REAL NOT NULL,
+    valor_entrada REAL NOT NULL DEFAULT 0,
+    numero_parcelas INTEGER NOT NULL,
+    valor_parcela REAL NOT NULL,
+    taxa_juros REAL NOT NULL DEFAULT 0,
+    data_inicio TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'Ativo',
+    instituicao_financeira TEXT,
+    observacoes TEXT,
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+CREATE TABLE IF NOT EXISTS financiamentos_itens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    financiamento_id INTEGER NOT NULL REFERENCES financiamentos(id),
+    item_id INTEGER NOT NULL REFERENCES itens(id),
+    valor_proporcional REAL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS parcelas_financiamento (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    financiamento_id INTEGER NOT NULL REFERENCES financiamentos(id),
+    numero_parcela INTEGER NOT NULL,
+    valor_original REAL NOT NULL,
+    valor_pago REAL NOT NULL DEFAULT 0,
+    data_vencimento TEXT NOT NULL,
+    data_pagamento TEXT,
+    status TEXT NOT NULL DEFAULT 'Pendente',
+    link_boleto TEXT,
+    link_comprovante TEXT,
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+CREATE TABLE IF NOT EXISTS pecas_carros (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    peca_id INTEGER NOT NULL REFERENCES itens(id),
+    carro_id INTEGER NOT NULL REFERENCES itens(id),
+    quantidade INTEGER NOT NULL DEFAULT 1,
+    data_instalacao TEXT,
+    observacoes TEXT,
+    custo_na_data REAL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS movimentacoes_estoque (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_id INTEGER REFERENCES itens(id),
+    quantidade INTEGER NOT NULL,
+    tipo TEXT NOT NULL,
+    data_movimentacao TEXT DEFAULT CURRENT_TIMESTAMP,
+    referencia_id INTEGER,
+    descricao TEXT
+);
+
+CREATE TABLE IF NOT EXISTS fluxo_caixa_mensal (
+    mes TEXT PRIMARY KEY,
+    receitas REAL NOT NULL DEFAULT 0,
+    despesas REAL NOT NULL DEFAULT 0
+);
+-- Equivalente aos triggers de supabase_migration_fluxo_caixa_mensal.sql
+CREATE TRIGGER IF NOT EXISTS fluxo_contas_receber_ins AFTER INSERT ON contas_receber BEGIN
+    INSERT INTO fluxo_caixa_mensal (mes, receitas, despesas) SELECT substr(NEW.data_pagamento, 1, 7), NEW.valor, 0
+     WHERE NEW.status = 'Pago' AND NEW.data_pagamento IS NOT NULL
+    ON CONFLICT(mes) DO UPDATE SET receitas = receitas + excluded.receitas;
+END;
+CREATE TRIGGER IF NOT EXISTS fluxo_contas_receber_upd AFTER UPDATE ON contas_receber BEGIN
+    INSERT INTO fluxo_caixa_mensal (mes, receitas, despesas) SELECT substr(OLD.data_pagamento, 1, 7), -OLD.valor, 0
+     WHERE OLD.status = 'Pago' AND OLD.data_pagamento IS NOT NULL
+    ON CONFLICT(mes) DO UPDATE SET receitas = receitas + excluded.receitas;
+    INSERT INTO fluxo_caixa_mensal (mes, receitas, despesas) SELECT substr(NEW.data_pagamento, 1, 7), NEW.valor, 0
+     WHERE NEW.status = 'Pago' AND NEW.data_pagamento IS NOT NULL
+    ON CONFLICT(mes) DO UPDATE SET receitas = receitas + excluded.receitas;
+END;
+CREATE TRIGGER IF NOT EXISTS fluxo_contas_receber_del AFTER DELETE ON contas_receber BEGIN
+    INSERT INTO fluxo_caixa_mensal (mes, receitas, despesas) SELECT substr(OLD.data_pagamento, 1, 7), -OLD.valor, 0
+     WHERE OLD.status = 'Pago' AND OLD.data_pagamento IS NOT NULL
+    ON CONFLICT(mes) DO UPDATE SET receitas = receitas + excluded.receitas;
+END;
+CREATE TRIGGER IF NOT EXISTS fluxo_contas_pagar_ins AFTER INSERT ON contas_pagar BEGIN
+    INSERT INTO fluxo_caixa_mensal (mes, despesas, receitas) SELECT substr(NEW.data_pagamento, 1, 7), NEW.valor, 0
+     WHERE NEW.status = 'Pago' AND NEW.data_pagamento IS NOT NULL
+    ON CONFLICT(mes) DO UPDATE SET despesas = despesas + excluded.despesas;
+END;
+CREATE TRIGGER IF NOT EXISTS fluxo_contas_pagar_upd AFTER UPDATE ON contas_pagar BEGIN
+    INSERT INTO fluxo_caixa_mensal (mes, despesas, receitas) SELECT substr(OLD.data_pagamento, 1, 7), -OLD.valor, 0
+     WHERE OLD.status = 'Pago' AND OLD.data_pagamento IS NOT NULL
+    ON CONFLICT(mes) DO UPDATE SET despesas = despesas + excluded.despesas;
+    INSERT INTO fluxo_caixa_mensal (mes, despesas, receitas) SELECT substr(NEW.data_pagamento, 1, 7), NEW.valor, 0
+     WHERE NEW.status = 'Pago' AND NEW.data_pagamento IS NOT NULL
+    ON CONFLICT(mes) DO UPDATE SET despesas = despesas + excluded.despesas;
+END;
+CREATE TRIGGER IF NOT EXISTS fluxo_contas_pagar_del AFTER DELETE ON contas_pagar BEGIN
+    INSERT INTO fluxo_caixa_mensal (mes, despesas, receitas) SELECT substr(OLD.data_pagamento, 1, 7), -OLD.valor, 0
+     WHERE OLD.status = 'Pago' AND OLD.data_pagamento IS NOT NULL
+    ON CONFLICT(mes) DO UPDATE SET despesas = despesas + excluded.despesas;
+END;
+
+CREATE VIEW IF NOT EXISTS view_compromissos_dashboard AS
+SELECT c.*,
+       (SELECT json_group_array(json_object('item_id', ci.item_id, 'quantidade', ci.quantidade, 'nome', i.nome))
+          FROM compromisso_itens ci JOIN itens i ON i.id = ci.item_id
+         WHERE ci.compromisso_id = c.id) AS itens
+  FROM compromissos c;
+
+CREATE VIEW IF NOT EXISTS view_financiamentos_quitacao AS
+SELECT f.*,
+       (SELECT group_concat(i.nome, ' ') FROM financiamentos_itens fi JOIN itens i ON i.id = fi.item_id
+         WHERE fi.financiamento_id = f.id) AS busca_itens,
+       (SELECT json_group_array(json_object('id', i.id, 'nome', i.nome)) FROM financiamentos_itens fi JOIN itens i ON i.id = fi.item_id
+         WHERE fi.financiamento_id = f.id) AS itens_json,
+       (SELECT COUNT(*) FROM parcelas_financiamento p WHERE p.financiamento_id = f.id AND p.status = 'Paga') AS parcelas_pagas,
+       (SELECT COALESCE(SUM(p.valor_original - p.valor_pago), 0) FROM parcelas_financiamento p
+         WHERE p.financiamento_id = f.id AND p.status != 'Paga') AS saldo_devedor_nominal,
+       (SELECT COALESCE(SUM(p.valor_original - p.valor_pago), 0) FROM parcelas_financiamento p
+         WHERE p.financiamento_id = f.id AND p.status != 'Paga') AS valor_quitacao_hoje
+  FROM financiamentos f;
+
+CREATE VIEW IF NOT EXISTS view_manutencao_detalhada AS
+SELECT pc.*, carro.nome AS carro_nome, peca.nome AS peca_nome, cr.placa AS carro_placa
+  FROM pecas_carros pc
+  LEFT JOIN itens carro ON carro.id = pc.carro_id
+  LEFT JOIN itens peca ON peca.id = pc.peca_id
+  LEFT JOIN carros cr ON cr.item_id = pc.carro_id;
+
+CREATE VIEW IF NOT EXISTS view_sistema_stats AS
+SELECT (SELECT COALESCE(SUM(valor_compra * quantidade_total), 0) FROM itens) AS patrimonio_total,
+       (SELECT COALESCE(SUM(valor_total_contrato), 0) FROM compromissos) AS receita_master;
+
+INSERT OR IGNORE INTO categorias_itens (nome) VALUES ('Estrutura de Evento'), ('Carros'), ('Pecas');
+"""
+
+# Equivalente a supabase_migration_log_alteracoes.sql: um trigger por operação e tabela
+TABELAS_LOG_ALTERACOES = (
+    'itens', 'carros', 'compromissos', 'compromisso_itens', 'contas_receber', 'contas_pagar',
+    'financiamentos', 'financiamentos_itens', 'parcelas_financiamento', 'pecas_carros',
+)
+SCHEMA_SQL += """
+CREATE TABLE IF NOT EXISTS log_alteracoes (
+    versao INTEGER PRIMARY KEY AUTOINCREMENT,
+    tabela TEXT NOT NULL,
+    registro_id INTEGER,
+    operacao TEXT NOT NULL,
+    criado_em TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+""" + "".join(
+    f"""
+CREATE TRIGGER IF NOT EXISTS log_{tabela}_{sufixo} AFTER {evento} ON {tabela} BEGIN
+    INSERT INTO log_alteracoes (tabela, registro_id, operacao) VALUES ('{tabela}', {linha}.id, '{operacao}');
+END;"""
+    for tabela in TABELAS_LOG_ALTERACOES
+    for sufixo, evento, linha, operacao in (
+        ('ins', 'INSERT', 'NEW', 'CREATE'), ('upd', 'UPDATE', 'NEW', 'UPDATE'), ('del', 'DELETE', 'OLD', 'DELETE')
+    )
+)
+
+# Equivalente a supabase_migration_reservas_temporarias.sql
+SCHEMA_SQL += """
+CREATE TABLE IF NOT EXISTS reservas_temporarias (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token TEXT NOT NULL,
+    item_id INTEGER NOT NULL REFERENCES itens(id) ON DELETE CASCADE,
+    quantidade INTEGER NOT NULL,
+    data_inicio TEXT NOT NULL,
+    data_fim TEXT NOT NULL,
+    expira_em TEXT NOT NULL,
+    criado_em TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+"""
+
+# Equivalente a supabase_migration_tokens_revogados.sql
+SCHEMA_SQL += """
+CREATE TABLE IF NOT EXISTS tokens_revogados (
+    jti TEXT PRIMARY KEY,
+    expira_em INTEGER NOT NULL
+);
+"""
+
+# Equivalente a supabase_migration_updated_at.sql: carimbo em cada UPDATE e
+# alterações nas tabelas filhas renovam o updated_at do registro pai
+TABELAS_UPDATED_AT = (
+    'itens', 'compromissos', 'contas_receber', 'contas_pagar', 'financiamentos', 'parcelas_financiamento',
+)
+FILHAS_UPDATED_AT = (
+    ('carros', 'itens', 'item_id'),
+    ('compromisso_itens', 'compromissos', 'compromisso_id'),
+    ('financiamentos_itens', 'financiamentos', 'financiamento_id'),
+    ('parcelas_financiamento', 'financiamentos', 'financiamento_id'),
+)
+SCHEMA_SQL += "".join(
+    f"""
+CREATE TRIGGER IF NOT EXISTS updated_at_{tabela} AFTER UPDATE ON {tabela} WHEN NEW.updated_at IS OLD.updated_at BEGIN
+    UPDATE {tabela} SET updated_at = (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')) WHERE id = NEW.id;
+END;"""
+    for tabela in TABELAS_UPDATED_AT
+) + "".join(
+    f"""
+CREATE TRIGGER IF NOT EXISTS tocar_{pai}_{filha}_{sufixo} AFTER {evento} ON {filha} BEGIN
+    UPDATE {pai} SET updated_at = (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')) WHERE id = {linha}.{coluna};
+END;"""
+    for filha, pai, coluna in FILHAS_UPDATED_AT
+    for sufixo, evento, linha in (('ins', 'INSERT', 'NEW'), ('upd', 'UPDATE', 'NEW'), ('del', 'DELETE', 'OLD'))
+)
+
+# Funções RPC disponíveis: nome -> função(cliente, params)
+RPCS: Dict[str, Callable] = {}
+
+
+def registrar_rpc(nome: str):
+    """Decorator que registra uma função Python como RPC do cliente local"""
+    def decorator(funcao):
+        RPCS[nome] = funcao
+        return funcao
+    return decorator
+
+
+class ErroPostgrest(Exception):
+    """Equivalente local do APIError levantado pelo supabase-py"""
+    pass
+
+
+class RespostaLocal:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _dividir_nivel_superior(texto: str) -> List[str]:
+    """Divide por vírgulas que não estejam dentro de parênteses"""
+    partes, nivel, atual = [], 0, ''
+    for ch in texto:
+        if ch == '(':
+            nivel += 1
+        elif ch == ')':
+            nivel -= 1
+        if ch == ',' and nivel == 0:
+            partes.append(atual.strip())
+            atual = ''
+        else:
+            atual += ch
+    if atual.strip():
+        partes.append(atual.strip())
+    return partes
+
+
+def _valor_sql(valor):
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, ensure_ascii=False, default=str)
+    if isinstance(valor, date):
+        return valor.isoformat()
+    if isinstance(valor, bool):
+        return int(valor)
+    return valor
+
+
+def _decodificar_linha(linha: Dict) -> Dict:
+    for coluna in COLUNAS_JSON:
+        valor = linha.get(coluna)
+        if isinstance(valor, str) and valor[:1] in ('{', '['):
+            try:
+                linha[coluna] = json.loads(valor)
+            except ValueError:
+                pass
+    return linha
+
+
+class ConsultaLocal:
+    """Builder encadeável equivalente ao SyncRequestBuilder do supabase-py"""
+
+    OPERADORES = {'eq': '=', 'neq': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<=', 'like': 'LIKE', 'ilike': 'LIKE'}
+
+    def __init__(self, cliente: 'ClienteSupabaseLocal', tabela: str):
+        self.cliente = cliente
+        self.tabela = tabela
+        self._operacao = 'select'
+        self._colunas = '*'
+        self._contar = None
+        self._payload = None
+        self._on_conflict = None
+        self._filtros: List[tuple] = []
+        self._ordem: List[str] = []
+        self._limite = None
+        self._offset = None
+        self._single = False
+
+    # --- operações ---
+    def select(self, colunas: str = '*', count: Optional[str] = None):
+        self._operacao, self._colunas, self._contar = 'select', colunas, count
+        return self
+
+    def insert(self, payload):
+        self._operacao, self._payload = 'insert', payload
+        return self
+
+    def upsert(self, payload, on_conflict: Optional[str] = None):
+        self._operacao, self._payload, self._on_conflict = 'upsert', payload, on_conflict
+        return self
+
+    def update(self, payload: Dict):
+        self._operacao, self._payload = 'update', payload
+        return self
+
+    def delete(self):
+        self._operacao = 'delete'
+        return self
+
+    # --- filtros ---
+    def _filtro(self, coluna: str, operador: str, valor):
+        if '.' in coluna:
+            raise ErroPostgrest(f"Filtro em recurso embutido não suportado pelo cliente local: {coluna}")
+        if operador in ('like', 'ilike'):
+            valor = str(valor).replace('*', '%')
+        self._filtros.append((f'"{coluna}" {self.OPERADORES[operador]} ?', [_valor_sql(valor)]))
+        return self
+
+    def eq(self, coluna, valor): return self._filtro(coluna, 'eq', valor)
+    def neq(self, coluna, valor): return self._filtro(coluna, 'neq', valor)
+    def gt(self, coluna, valor): return self._filtro(coluna, 'gt', valor)
+    def gte(self, coluna, valor): return self._filtro(coluna, 'gte', valor)
+    def lt(self, coluna, valor): return self._filtro(coluna, 'lt', valor)
+    def lte(self, coluna, valor): return self._filtro(coluna, 'lte', valor)
+    def like(self, coluna, valor): return self._filtro(coluna, 'like', valor)
+    def ilike(self, coluna, valor): return self._filtro(coluna, 'ilike', valor)
+
+    def in_(self, coluna, valores):
+        valores = list(valores)
+        if not valores:
+            self._filtros.append(('0', []))
+        else:
+            marcadores = ', '.join('?' for _ in valores)
+            self._filtros.append((f'"{coluna}" IN ({marcadores})', [_valor_sql(v) for v in valores]))
+        return self
+
+    def is_(self, coluna, valor):
+        if valor in (None, 'null'):
+            self._filtros.append((f'"{coluna}" IS NULL', []))
+        else:
+            self._filtros.append((f'"{coluna}" IS ?', [_valor_sql(valor)]))
+        return self
+
+    def not_(self, *args):
+        raise ErroPostgrest("not_ não é suportado pelo cliente local")
+
+    def or_(self, filtros: str):
+        """Interpreta a sintaxe PostgREST 'col.op.valor,col.op.valor'"""
+        condicoes, params = [], []
+        for parte in _dividir_nivel_superior(filtros):
+            coluna, operador, valor = parte.split('.', 2)
+            if operador == 'is':
+                condicoes.append(f'"{coluna}" IS NULL' if valor == 'null' else f'"{coluna}" IS ?')
+                if valor != 'null':
+                    params.append(valor)
+                continue
+            if operador == 'in':
+                valores = [v.strip() for v in valor.strip('()').split(',') if v.strip()]
+                condicoes.append(f'"{coluna}" IN ({", ".join("?" for _ in valores)})' if valores else '0')
+                params.extend(valores)
+                continue
+            if operador in ('like', 'ilike'):
+                valor = valor.replace('*', '%')
+            condicoes.append(f'"{coluna}" {self.OPERADORES[operador]} ?')
+            params.append(valor)
+        self._filtros.append(('(' + ' OR '.join(condicoes) + ')', params))
+        return self
+
+    # --- modificadores ---
+    def order(self, coluna: str, desc: bool = False, **kwargs):
+        self._ordem.append(f'"{coluna}" {"DESC" if desc else "ASC"}')
+        return self
+
+    def range(self, inicio: int, fim: int):
+        self._offset, self._limite = int(inicio), int(fim) - int(inicio) + 1
+        return self
+
+    def limit(self, n: int):
+        self._limite = int(n)
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def maybe_single(self):
+        return self.single()
+
+    # --- execução ---
+    def _where(self):
+        if not self._filtros:
+            return '', []
+        sql = ' WHERE ' + ' AND '.join(f for f, _ in self._filtros)
+        params = [p for _, ps in self._filtros for p in ps]
+        return sql, params
+
+    def execute(self) -> RespostaLocal:
+        self.cliente._registrar_chamada(f'{self.tabela}.{self._operacao}')
+        with self.cliente._lock:
+            try:
+                resposta = getattr(self, f'_executar_{self._operacao}')()
+                self.cliente.conexao.commit()
+            except sqlite3.Error as e:
+                self.cliente.conexao.rollback()
+                raise ErroPostgrest(str(e))
+        if self._single:
+            if not resposta.data or len(resposta.data) != 1:
+                raise ErroPostgrest("JSON object requested, multiple (or no) rows returned")
+            resposta.data = resposta.data[0]
+        return resposta
+
+    def _executar_select(self) -> RespostaLocal:
+        where, params = self._where()
+        sql = f'SELECT * FROM "{self.tabela}"{where}'
+        if self._ordem:
+            sql += ' ORDER BY ' + ', '.join(self._ordem)
+        if self._limite is not None:
+            sql += f' LIMIT {self._limite}'
+            if self._offset:
+                sql += f' OFFSET {self._offset}'
+        linhas = [_decodificar_linha(dict(r)) for r in self.cliente.conexao.execute(sql, params)]
+        linhas = self.cliente._projetar(self.tabela, linhas, self._colunas)
+
+        contagem = None
+        if self._contar:
+            contagem = self.cliente.conexao.execute(f'SELECT COUNT(*) FROM "{self.tabela}"{where}', params).fetchone()[0]
+        return RespostaLocal(linhas, contagem)
+
+    def _inserir(self, linhas: List[Dict], on_conflict: Optional[str]) -> List[Dict]:
+        resultado = []
+        for linha in linhas:
+            colunas = list(linha.keys())
+            marcadores = ', '.join('?' for _ in colunas)
+            lista_colunas = ', '.join(f'"{c}"' for c in colunas)
+            sql = f'INSERT INTO "{self.tabela}" ({lista_colunas}) VALUES ({marcadores})'
+            if on_conflict:
+                atualizacoes = ', '.join(f'"{c}" = excluded."{c}"' for c in colunas if c != on_conflict)
+                sql += f' ON CONFLICT("{on_conflict}") DO ' + (f'UPDATE SET {atualizacoes}' if atualizacoes else 'NOTHING')
+            sql += ' RETURNING *'
+            cursor = self.cliente.conexao.execute(sql, [_valor_sql(linha[c]) for c in colunas])
+            resultado.extend(_decodificar_linha(dict(r)) for r in cursor.fetchall())
+        return resultado
+
+    def _executar_insert(self) -> RespostaLocal:
+        linhas = self._payload if isinstance(self._payload, list) else [self._payload]
+        return RespostaLocal(self._inserir(linhas, None))
+
+    def _executar_upsert(self) -> RespostaLocal:
+        linhas = self._payload if isinstance(self._payload, list) else [self._payload]
+        return RespostaLocal(self._inserir(linhas, self._on_conflict or 'id'))
+
+    def _executar_update(self) -> RespostaLocal:
+        where, params = self._where()
+        colunas = list(self._payload.keys())
+        atribuicoes = ', '.join(f'"{c}" = ?' for c in colunas)
+        sql = f'UPDATE "{self.tabela}" SET {atribuicoes}{where} RETURNING *'
+        cursor = self.cliente.conexao.execute(sql, [_valor_sql(self._payload[c]) for c in colunas] + params)
+        return RespostaLocal([_decodificar_linha(dict(r)) for r in cursor.fetchall()])
+
+    def _executar_delete(self) -> RespostaLocal:
+        where, params = self._where()
+        cursor = self.cliente.conexao.execute(f'DELETE FROM "{self.tabela}"{where} RETURNING *', params)
+        return RespostaLocal([_decodificar_linha(dict(r)) for r in cursor.fetchall()])
+
+
+class ChamadaRpcLocal:
+    def __init__(self, cliente: 'ClienteSupabaseLocal', nome: str, params: Optional[Dict]):
+        self.cliente = cliente
+        self.nome = nome
+        self.params = params or {}
+
+    def execute(self) -> RespostaLocal:
+        self.cliente._registrar_chamada(f'rpc.{self.nome}')
+        if self.nome not in RPCS:
+            raise ErroPostgrest(f"Função {self.nome} não encontrada no cliente local")
+        with self.cliente._lock:
+            try:
+                dados = RPCS[self.nome](self.cliente, self.params)
+                self.cliente.conexao.commit()
+            except sqlite3.Error as e:
+                self.cliente.conexao.rollback()
+                raise ErroPostgrest(str(e))
+        return RespostaLocal(dados)
+
+
+class ClienteSupabaseLocal:
+    """
+    Cliente compatível com supabase.Client para uso offline
+
+    Args:
+        caminho: Arquivo SQLite (padrão: banco em memória)
+        latencia_ms: Latência artificial aplicada a cada execute()
+    """
+
+    def __init__(self, caminho: str = ':memory:', latencia_ms: float = 0.0):
+        self.latencia_ms = latencia_ms
+        self.chamadas: Counter = Counter()
+        self._lock = threading.RLock()
+        self.conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self.conexao.row_factory = sqlite3.Row
+        self.conexao.executescript(SCHEMA_SQL)
+        self._fks: Dict[str, List[tuple]] = {}
+
+    # --- API do supabase-py ---
+    def table(self, nome: str) -> ConsultaLocal:
+        return ConsultaLocal(self, nome)
+
+    def from_(self, nome: str) -> ConsultaLocal:
+        return self.table(nome)
+
+    def rpc(self, nome: str, params: Optional[Dict] = None) -> ChamadaRpcLocal:
+        return ChamadaRpcLocal(self, nome, params)
+
+    # --- instrumentação ---
+    @property
+    def total_chamadas(self) -> int:
+        return sum(self.chamadas.values())
+
+    def resetar_contadores(self):
+        self.chamadas.clear()
+
+    def _registrar_chamada(self, chave: str):
+        self.chamadas[chave] += 1
+        if self.latencia_ms:
+            time.sleep(self.latencia_ms / 1000)
+
+    def semear(self, tabela: str, linhas: List[Dict]):
+        """Insere linhas diretamente, sem contar round trips nem latência"""
+        with self._lock:
+            for linha in linhas:
+                colunas = list(linha.keys())
+                lista_colunas = ', '.join(f'"{c}"' for c in colunas)
+                marcadores = ', '.join('?' for _ in colunas)
+                self.conexao.execute(
+                    f'INSERT INTO "{tabela}" ({lista_colunas}) VALUES ({marcadores})',
+                    [_valor_sql(linha[c]) for c in colunas]
+                )
+            self.conexao.commit()
+
+    # --- recursos embutidos (select='*, tabela(*)') ---
+    def _chaves_estrangeiras(self, tabela: str) -> List[tuple]:
+        if tabela not in self._fks:
+            self._fks[tabela] = [(r['from'], r['table'], r['to'] or 'id')
+                                 for r in self.conexao.execute(f'PRAGMA foreign_key_list("{tabela}")')]
+        return self._fks[tabela]
+
+    def _projetar(self, tabela: str, linhas: List[Dict], colunas: str) -> List[Dict]:
+        partes = _dividir_nivel_superior(colunas or '*')
+        simples = [p for p in partes if '(' not in p]
+        embutidos = [p for p in partes if '(' in p]
+
+        if '*' not in simples:
+            linhas = [{c: linha.get(c) for c in simples} | {'_linha': linha} for linha in linhas]
+        else:
+            linhas = [dict(linha, _linha=linha) for linha in linhas]
+
+        for embutido in embutidos:
+            m = re.match(r'^(?:(\w+):)?(\w+)(!inner)?\((.*)\)$', embutido, re.S)
+            if not m:
+                raise ErroPostgrest(f"Seleção não suportada: {embutido}")
+            alias, relacionada, inner, sub_colunas = m.groups()
+            chave = alias or relacionada
+            linhas = self._embutir(tabela, linhas, relacionada, sub_colunas, chave, bool(inner))
+
+        for linha in linhas:
+            linha.pop('_linha', None)
+        return linhas
+
+    def _embutir(self, tabela, linhas, relacionada, sub_colunas, chave, inner):
+        muitos_para_um = next((fk for fk in self._chaves_estrangeiras(tabela) if fk[1] == relacionada), None)
+        um_para_muitos = next((fk for fk in self._chaves_estrangeiras(relacionada) if fk[1] == tabela), None)
+        resultado = []
+        for linha in linhas:
+            original = linha['_linha']
+            if muitos_para_um:
+                coluna_local, _, coluna_remota = muitos_para_um
+                rows = self.conexao.execute(
+                    f'SELECT * FROM "{relacionada}" WHERE "{coluna_remota}" = ?', [original.get(coluna_local)]
+                ).fetchall()
+                filhos = self._projetar(relacionada, [_decodificar_linha(dict(r)) for r in rows], sub_colunas)
+                valor = filhos[0] if filhos else None
+            elif um_para_muitos:
+                coluna_remota, _, coluna_local = um_para_muitos
+                rows = self.conexao.execute(
+                    f'SELECT * FROM "{relacionada}" WHERE "{coluna_remota}" = ?', [original.get(coluna_local)]
+                ).fetchall()
+                valor = self._projetar(relacionada, [_decodificar_linha(dict(r)) for r in rows], sub_colunas)
+            else:
+                raise ErroPostgrest(f"Sem relacionamento entre {tabela} e {relacionada}")
+            if inner and not valor:
+                continue
+            linha[chave] = valor
+            resultado.append(linha)
+        return resultado
+
+
+def instalar(cliente: Optional[ClienteSupabaseLocal] = None) -> ClienteSupabaseLocal:
+    """Faz o supabase_database usar o cliente local em vez do Supabase real"""
+    import supabase_database
+    cliente = cliente or ClienteSupabaseLocal()
+    supabase_database._supabase_client = cliente
+    return cliente
+
+
+# ============= RPCs =============
+
+def _linhas(cliente, sql, params=()):
+    return [dict(r) for r in cliente.conexao.execute(sql, params)]
+
+
+def _ocupacao_alugada(cliente, item_id, inicio: str, fim: str) -> List[Dict]:
+    """Reservas do item que se sobrepõem ao período (contratos master e legados)"""
+    return _linhas(cliente, """
+        SELECT c.data_inicio, c.data_fim, ci.quantidade
+          FROM compromisso_itens ci JOIN compromissos c ON c.id = ci.compromisso_id
+         WHERE ci.item_id = ? AND c.data_inicio <= ? AND c.data_fim >= ?
+        UNION ALL
+        SELECT data_inicio, data_fim, quantidade FROM compromissos
+         WHERE item_id = ? AND data_inicio <= ? AND data_fim >= ?
+    """, (item_id, fim, inicio, item_id, fim, inicio))
+
+
+def _pico_por_dia(reservas: List[Dict], inicio: date, fim: date) -> int:
+    pico, dia = 0, inicio
+    while dia <= fim:
+        d = dia.isoformat()
+        pico = max(pico, sum(r['quantidade'] or 0 for r in reservas if r['data_inicio'] <= d <= r['data_fim']))
+        dia += timedelta(days=1)
+    return pico
+
+
+@registrar_rpc('get_table_columns')
+def _rpc_get_table_columns(cliente, params):
+    return [{'column_name': r['name']} for r in cliente.conexao.execute(f'PRAGMA table_info("{params["t_name"]}")')]
+
+
+@registrar_rpc('criar_tabela_categoria')
+def _rpc_criar_tabela_categoria(cliente, params):
+    nome = re.sub(r'[^a-z0-9_]', '', params['nome_tabela'])
+    cliente.conexao.execute(
+        f'CREATE TABLE IF NOT EXISTS "{nome}" (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+        f'item_id INTEGER UNIQUE NOT NULL REFERENCES itens(id) ON DELETE CASCADE, dados_categoria TEXT DEFAULT \'{{}}\')'
+    )
+    return None
+
+
+@registrar_rpc('get_disponibilidade_periodo')
+def _rpc_get_disponibilidade_periodo(cliente, params):
+    item_id = int(params['p_item_id'])
+    inicio, fim = str(params['p_start_date'])[:10], str(params['p_end_date'])[:10]
+    item = cliente.conexao.execute('SELECT quantidade_total FROM itens WHERE id = ?', (item_id,)).fetchone()
+    if not item:
+        return []
+    reservas = _ocupacao_alugada(cliente, item_id, inicio, fim)
+    max_alugado = _pico_por_dia(reservas, date.fromisoformat(inicio), date.fromisoformat(fim))
+    max_instalado = cliente.conexao.execute(
+        'SELECT COALESCE(SUM(quantidade), 0) FROM pecas_carros WHERE peca_id = ? AND data_instalacao <= ?', (item_id, fim)
+    ).fetchone()[0]
+    total = item['quantidade_total']
+    return [{
+        'quantidade_total': total,
+        'max_alugado': max_alugado,
+        'max_instalado': max_instalado,
+        'disponivel_minimo': total - max_alugado - max_instalado,
+    }]
+
+
+def _agora_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@registrar_rpc('get_disponibilidade_lote')
+def _rpc_get_disponibilidade_lote(cliente, params):
+    inicio, fim = str(params['p_start_date'])[:10], str(params['p_end_date'])[:10]
+    excluir = params.get('p_excluir_compromisso_id')
+    excluir_token = params.get('p_excluir_token')
+    picos = {}
+    for linha in params['p_itens']:
+        item_id = int(linha['item_id'])
+        if item_id in picos:
+            continue
+        item = cliente.conexao.execute('SELECT nome, quantidade_total FROM itens WHERE id = ?', (item_id,)).fetchone()
+        if not item:
+            picos[item_id] = (None, 0, 0, 0)
+            continue
+        reservas = _linhas(cliente, """
+            SELECT c.data_inicio, c.data_fim, ci.quantidade
+              FROM compromisso_itens ci JOIN compromissos c ON c.id = ci.compromisso_id
+             WHERE ci.item_id = ? AND c.data_inicio <= ? AND c.data_fim >= ? AND c.id IS NOT ?
+            UNION ALL
+            SELECT data_inicio, data_fim, quantidade FROM compromissos
+             WHERE item_id = ? AND data_inicio <= ? AND data_fim >= ? AND id IS NOT ?
+            UNION ALL
+            SELECT data_inicio, data_fim, quantidade FROM reservas_temporarias
+             WHERE item_id = ? AND data_inicio <= ? AND data_fim >= ? AND expira_em > ? AND token IS NOT ?
+        """, (item_id, fim, inicio, excluir, item_id, fim, inicio, excluir, item_id, fim, inicio, _agora_iso(), excluir_token))
+        max_instalado = cliente.conexao.execute(
+            'SELECT COALESCE(SUM(quantidade), 0) FROM pecas_carros WHERE peca_id = ? AND data_instalacao <= ?', (item_id, fim)
+        ).fetchone()[0]
+        picos[item_id] = (item['nome'], item['quantidade_total'],
+                          _pico_por_dia(reservas, date.fromisoformat(inicio), date.fromisoformat(fim)), max_instalado)
+
+    acumulado = Counter()
+    resultado = []
+    for numero, linha in enumerate(params['p_itens'], start=1):
+        item_id, quantidade = int(linha['item_id']), int(linha.get('quantidade') or 0)
+        nome, total, max_alugado, max_instalado = picos[item_id]
+        disponivel = total - max_alugado - max_instalado
+        acumulado[item_id] += quantidade
+        resultado.append({
+            'linha': numero, 'item_id': item_id, 'nome': nome, 'quantidade': quantidade,
+            'quantidade_total': total, 'max_alugado': max_alugado, 'max_instalado': max_instalado,
+            'disponivel_minimo': disponivel,
+            'falta': min(quantidade, max(0, acumulado[item_id] - max(disponivel, 0))),
+        })
+    return resultado
+
+
+@registrar_rpc('reservar_itens')
+def _rpc_reservar_itens(cliente, params):
+    # O lock do cliente serializa as RPCs: equivale às travas por item do Postgres
+    token = params['p_token']
+    ids = sorted({int(l['item_id']) for l in params['p_itens']})
+    marcadores = ', '.join('?' for _ in ids)
+    cliente.conexao.execute(
+        f'DELETE FROM reservas_temporarias WHERE item_id IN ({marcadores}) AND expira_em <= ?', (*ids, _agora_iso())
+    )
+    linhas = _rpc_get_disponibilidade_lote(cliente, {
+        'p_itens': params['p_itens'], 'p_start_date': params['p_start_date'],
+        'p_end_date': params['p_end_date'], 'p_excluir_token': token,
+    })
+    if any(l['falta'] > 0 for l in linhas):
+        return {'reservado': False, 'expira_em': None, 'linhas': linhas}
+    expira_em = (datetime.now(timezone.utc) + timedelta(seconds=int(params.get('p_ttl_segundos') or 600))).isoformat()
+    cliente.conexao.execute('DELETE FROM reservas_temporarias WHERE token = ?', (token,))
+    cliente.conexao.executemany(
+        'INSERT INTO reservas_temporarias (token, item_id, quantidade, data_inicio, data_fim, expira_em) VALUES (?, ?, ?, ?, ?, ?)',
+        [(token, int(l['item_id']), int(l['quantidade']), str(params['p_start_date'])[:10], str(params['p_end_date'])[:10], expira_em)
+         for l in params['p_itens'] if int(l.get('quantidade') or 0) > 0]
+    )
+    return {'reservado': True, 'expira_em': expira_em, 'linhas': linhas}
+
+
+@registrar_rpc('confirmar_reserva')
+def _rpc_confirmar_reserva(cliente, params):
+    token = params['p_token']
+    reservas = _linhas(cliente, 'SELECT * FROM reservas_temporarias WHERE token = ? ORDER BY id', (token,))
+    if not reservas:
+        raise sqlite3.IntegrityError("Reserva não encontrada (vencida, cancelada ou já confirmada)")
+    inicio = min(r['data_inicio'] for r in reservas)
+    fim = max(r['data_fim'] for r in reservas)
+    itens = [{'item_id': r['item_id'], 'quantidade': r['quantidade']} for r in reservas]
+    if any(r['expira_em'] <= _agora_iso() for r in reservas):
+        conferencia = _rpc_get_disponibilidade_lote(cliente, {
+            'p_itens': itens, 'p_start_date': inicio, 'p_end_date': fim, 'p_excluir_token': token,
+        })
+        if any(c['falta'] > 0 for c in conferencia):
+            raise sqlite3.IntegrityError("Reserva vencida. Estoque insuficiente para confirmar o contrato")
+    h = params.get('p_header') or {}
+    compromisso_id = cliente.conexao.execute(
+        'INSERT INTO compromissos (nome_contrato, contratante, data_inicio, data_fim, descricao, cidade, uf, endereco, valor_total_contrato) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id',
+        (h.get('nome_contrato'), h.get('contratante'), inicio, fim, h.get('descricao'), h.get('cidade'),
+         (h.get('uf') or '')[:2].upper(), h.get('endereco'), h.get('valor_total_contrato') or 0)
+    ).fetchone()[0]
+    cliente.conexao.executemany(
+        'INSERT INTO compromisso_itens (compromisso_id, item_id, quantidade) VALUES (?, ?, ?)',
+        [(compromisso_id, i['item_id'], i['quantidade']) for i in itens]
+    )
+    cliente.conexao.execute('DELETE FROM reservas_temporarias WHERE token = ?', (token,))
+    return {'compromisso_id': compromisso_id, 'data_inicio': inicio, 'data_fim': fim, 'itens': itens}
+
+
+@registrar_rpc('get_disponibilidade_estoque')
+def _rpc_get_disponibilidade_estoque(cliente, params):
+    data = str(params['p_data_consulta'])[:10]
+    return _linhas(cliente, """
+        SELECT i.id, i.nome, i.categoria, i.cidade, i.uf, i.quantidade_total,
+               COALESCE(a.qtd, 0) AS quantidade_comprometida,
+               COALESCE(p.qtd, 0) AS quantidade_instalada,
+               MAX(0, i.quantidade_total - COALESCE(a.qtd, 0) - COALESCE(p.qtd, 0)) AS quantidade_disponivel
+          FROM itens i
+          LEFT JOIN (
+                SELECT item_id, SUM(quantidade) AS qtd FROM (
+                    SELECT ci.item_id, ci.quantidade FROM compromisso_itens ci
+                      JOIN compromissos c ON c.id = ci.compromisso_id
+                     WHERE c.data_inicio <= :d AND c.data_fim >= :d
+                    UNION ALL
+                    SELECT item_id, quantidade FROM compromissos
+                     WHERE item_id IS NOT NULL AND data_inicio <= :d AND data_fim >= :d
+                ) GROUP BY item_id
+          ) a ON a.item_id = i.id
+          LEFT JOIN (
+                SELECT peca_id, SUM(quantidade) AS qtd FROM pecas_carros
+                 WHERE data_instalacao <= :d GROUP BY peca_id
+          ) p ON p.peca_id = i.id
+         ORDER BY i.nome
+    """, {'d': data})
+
+
+# Texto das colunas geradas `busca` (supabase_migration_busca_trigram.sql)
+_TEXTO_BUSCA = {
+    'itens': "SELECT id, nome || ' ' || categoria || ' ' || COALESCE(descricao, '') || ' ' || cidade AS texto FROM itens",
+    'compromissos': """
+        SELECT c.id, COALESCE(c.nome_contrato, '') || ' ' || COALESCE(c.contratante, '') || ' ' ||
+               COALESCE(c.descricao, '') || ' ' || COALESCE(c.cidade, '') || ' ' ||
+               COALESCE((SELECT group_concat(i.nome, ' ') FROM itens i
+                          WHERE i.id IN (SELECT ci.item_id FROM compromisso_itens ci WHERE ci.compromisso_id = c.id)
+                             OR i.id = c.item_id), '') AS texto
+          FROM compromissos c
+    """,
+    'financiamentos': """
+        SELECT f.id, COALESCE(f.codigo_contrato, '') || ' ' || COALESCE(f.instituicao_financeira, '') || ' ' ||
+               COALESCE((SELECT group_concat(i.nome, ' ') FROM itens i
+                          WHERE i.id IN (SELECT fi.item_id FROM financiamentos_itens fi WHERE fi.financiamento_id = f.id)
+                             OR i.id = f.item_id), '') AS texto
+          FROM financiamentos f
+    """,
+}
+
+
+def _sem_acento(texto: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFKD', texto.lower()) if not unicodedata.combining(c))
+
+
+def _trigramas(texto: str) -> set:
+    """Trigramas no formato do pg_trgm: cada palavra com dois espaços antes e um depois"""
+    grupos = set()
+    for palavra in re.findall(r'\w+', texto):
+        palavra = f'  {palavra} '
+        grupos.update(palavra[i:i + 3] for i in range(len(palavra) - 2))
+    return grupos
+
+
+@registrar_rpc('buscar_ids_texto')
+def _rpc_buscar_ids_texto(cliente, params):
+    tabela = params['p_tabela']
+    if tabela not in _TEXTO_BUSCA:
+        raise sqlite3.IntegrityError(f'Tabela sem busca textual: {tabela}')
+    termo = _sem_acento((params.get('p_q') or '').strip())
+    if not termo:
+        return []
+    alvo = _trigramas(termo)
+    achados = []
+    for row in _linhas(cliente, _TEXTO_BUSCA[tabela]):
+        texto = _sem_acento(row['texto'])
+        if termo in texto:
+            grupos = _trigramas(texto)
+            achados.append((-len(alvo & grupos) / max(len(alvo | grupos), 1), -row['id']))
+    achados.sort()
+    return [{'id': -id_negativo} for _, id_negativo in achados[:int(params.get('p_limite') or 1000)]]
+
+
+@registrar_rpc('reconstruir_fluxo_caixa')
+def _rpc_reconstruir_fluxo_caixa(cliente, params):
+    cliente.conexao.execute('DELETE FROM fluxo_caixa_mensal')
+    cursor = cliente.conexao.execute("""
+        INSERT INTO fluxo_caixa_mensal (mes, receitas, despesas)
+        SELECT mes, SUM(receitas), SUM(despesas) FROM (
+            SELECT substr(data_pagamento, 1, 7) AS mes, valor AS receitas, 0 AS despesas
+              FROM contas_receber WHERE status = 'Pago' AND data_pagamento IS NOT NULL
+            UNION ALL
+            SELECT substr(data_pagamento, 1, 7), 0, valor
+              FROM contas_pagar WHERE status = 'Pago' AND data_pagamento IS NOT NULL
+        ) GROUP BY mes
+    """)
+    return cursor.rowcount
+
+
+@registrar_rpc('atualizar_status_vencidos')
+def _rpc_atualizar_status_vencidos(cliente, params):
+    data = str(params.get('p_data') or date.today().isoformat())[:10]
+    contagens = {}
+    for tabela, condicao, novo_status in (
+        ('contas_receber', 'data_pagamento IS NULL', 'Vencido'),
+        ('contas_pagar', 'data_pagamento IS NULL', 'Vencido'),
+        ('parcelas_financiamento', 'COALESCE(valor_pago, 0) < valor_original', 'Atrasada'),
+    ):
+        cursor = cliente.conexao.execute(
+            f"UPDATE {tabela} SET status = ? WHERE status = 'Pendente' AND {condicao} AND data_vencimento < ?",
+            (novo_status, data)
+        )
+        contagens[tabela] = cursor.rowcount
+    return [contagens]
+
+
+@registrar_rpc('pagar_parcelas_financiamento')
+def _rpc_pagar_parcelas_financiamento(cliente, params):
+    pagamentos = params['p_pagamentos']
+    ids = [int(p['parcela_id']) for p in pagamentos]
+    marcadores = ', '.join('?' for _ in ids)
+    existentes = {r[0] for r in cliente.conexao.execute(f'SELECT id FROM parcelas_financiamento WHERE id IN ({marcadores})', ids)}
+    faltando = sorted(set(ids) - existentes)
+    if faltando:
+        raise sqlite3.IntegrityError(f"Parcelas não encontradas: {faltando}")
+    for p in pagamentos:
+        cliente.conexao.execute(
+            "UPDATE parcelas_financiamento SET valor_pago = ?, data_pagamento = ?, "
+            "status = CASE WHEN ? >= valor_original THEN 'Paga' ELSE 'Pendente' END WHERE id = ?",
+            (p['valor_pago'], p['data_pagamento'], p['valor_pago'], int(p['parcela_id']))
+        )
+    quitados = [r[0] for r in cliente.conexao.execute(f"""
+        UPDATE financiamentos SET status = 'Quitado'
+         WHERE id IN (SELECT DISTINCT financiamento_id FROM parcelas_financiamento WHERE id IN ({marcadores}))
+           AND status <> 'Quitado'
+           AND NOT EXISTS (SELECT 1 FROM parcelas_financiamento pf WHERE pf.financiamento_id = financiamentos.id AND pf.status <> 'Paga')
+        RETURNING id
+    """, ids).fetchall()]
+    parcelas = _linhas(cliente, f'SELECT * FROM parcelas_financiamento WHERE id IN ({marcadores})', ids)
+    return {'parcelas': parcelas, 'financiamentos_quitados': quitados}
+
+
+@registrar_rpc('aplicar_baixas_lote')
+def _rpc_aplicar_baixas_lote(cliente, params):
+    baixas = params['p_baixas']
+    contagens = {'receber': 0, 'pagar': 0, 'parcela': 0}
+    for tabela, tipo in (('contas_receber', 'receber'), ('contas_pagar', 'pagar')):
+        ids = [int(b['id']) for b in baixas if b['tipo'] == tipo]
+        if not ids:
+            continue
+        marcadores = ', '.join('?' for _ in ids)
+        existentes = {r[0] for r in cliente.conexao.execute(f'SELECT id FROM {tabela} WHERE id IN ({marcadores})', ids)}
+        faltando = sorted(set(ids) - existentes)
+        if faltando:
+            raise sqlite3.IntegrityError(f"Contas não encontradas: {faltando}")
+        for b in baixas:
+            if b['tipo'] == tipo:
+                cliente.conexao.execute(
+                    f"UPDATE {tabela} SET data_pagamento = ?, status = 'Pago', "
+                    f"forma_pagamento = COALESCE(NULLIF(?, ''), forma_pagamento) WHERE id = ?",
+                    (b['data_pagamento'], b.get('forma_pagamento') or '', int(b['id']))
+                )
+        contagens[tipo] = len(ids)
+    # O lançamento casa com o valor em aberto da parcela: soma ao que já foi pago
+    pagos = dict(cliente.conexao.execute('SELECT id, COALESCE(valor_pago, 0) FROM parcelas_financiamento'))
+    parcelas = [
+        {'parcela_id': b['id'], 'valor_pago': pagos.get(int(b['id']), 0) + float(b['valor']), 'data_pagamento': b['data_pagamento']}
+        for b in baixas if b['tipo'] == 'parcela'
+    ]
+    quitados = []
+    if parcelas:
+        quitados = _rpc_pagar_parcelas_financiamento(cliente, {'p_pagamentos': parcelas})['financiamentos_quitados']
+        contagens['parcela'] = len(parcelas)
+    return {**contagens, 'financiamentos_quitados': quitados}
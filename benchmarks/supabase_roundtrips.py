@@ -0,0 +1,252 @@
+"""
+Mede quantas idas e voltas ao Supabase cada função pública do
+supabase_database.py faz, usando o cliente local (benchmarks.supabase_local)
+
+Cada cenário roda com contadores zerados; o relatório traz o número de
+chamadas (total e por tabela/operação) e o tempo com a latência simulada.
+Funções públicas sem cenário aparecem em 'sem_cenario' para não passarem
+despercebidas.
+
+Uso:
+    python -m benchmarks.supabase_roundtrips --itens 200 --latencia-ms 20 --saida roundtrips.json
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+import shutil
+import tempfile
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from benchmarks.supabase_local import ClienteSupabaseLocal, instalar
+
+
+def semear_dataset(cliente: ClienteSupabaseLocal, n_itens: int, hoje: date):
+    """Popula o cliente local sem contar round trips"""
+    itens, carros, compromissos, compromisso_itens, contas_receber, contas_pagar = [], [], [], [], [], []
+    for item_id in range(1, n_itens + 1):
+        carro = item_id % 10 == 0
+        itens.append({
+            'id': item_id, 'nome': f'{"Carro" if carro else "Tenda"} #{item_id}',
+            'quantidade_total': 1 if carro else 20, 'categoria': 'Carros' if carro else 'Estrutura de Evento',
+            'cidade': 'São Paulo', 'uf': 'SP', 'valor_compra': 1000.0, 'dados_categoria': {},
+        })
+        if carro:
+            carros.append({'item_id': item_id, 'placa': f'BEN{item_id:04d}', 'marca': 'Fiat', 'modelo': 'Strada'})
+        inicio = hoje + timedelta(days=(item_id % 60) - 30)
+        compromissos.append({
+            'id': item_id, 'data_inicio': inicio.isoformat(), 'data_fim': (inicio + timedelta(days=5)).isoformat(),
+            'contratante': 'Produtora Alfa', 'nome_contrato': f'Contrato {item_id}', 'cidade': 'São Paulo', 'uf': 'SP',
+            'valor_total_contrato': 5000.0,
+        })
+        compromisso_itens.append({'compromisso_id': item_id, 'item_id': item_id, 'quantidade': 1})
+        contas_receber.append({
+            'compromisso_id': item_id, 'descricao': f'Locação {item_id}', 'valor': 5000.0,
+            'data_vencimento': (inicio + timedelta(days=10)).isoformat(), 'status': 'Pendente',
+        })
+        if item_id % 2 == 0:
+            contas_pagar.append({
+                'descricao': 'Despesa operacional', 'categoria': 'Fornecedor', 'valor': 800.0,
+                'data_vencimento': inicio.isoformat(), 'status': 'Pendente', 'item_id': item_id,
+            })
+    cliente.semear('itens', itens)
+    cliente.semear('carros', carros)
+    cliente.semear('compromissos', compromissos)
+    cliente.semear('compromisso_itens', compromisso_itens)
+    cliente.semear('contas_receber', contas_receber)
+    cliente.semear('contas_pagar', contas_pagar)
+
+
+def _id(registro):
+    """As funções devolvem ora objetos, ora dicts"""
+    return registro['id'] if isinstance(registro, dict) else registro.id
+
+
+def _cenarios(sdb, hoje: date, n_itens: int) -> List[Tuple[str, Callable]]:
+    """
+    Cenários em ordem: os de criação guardam ids em ctx para os seguintes
+    """
+    ctx: Dict = {}
+    d = hoje.isoformat()
+    d_30 = (hoje + timedelta(days=30)).isoformat()
+    carro_id = 10 if n_itens >= 10 else 1
+
+    def criar_financiamento():
+        f = sdb.criar_financiamento(itens_ids=[carro_id], valor_total=60000, numero_parcelas=12, taxa_juros=1.5,
+                                    data_inicio=hoje, valor_entrada=10000, instituicao_financeira='Banco Local')
+        ctx['financiamento_id'] = _id(f)
+        ctx['parcela_id'] = _id(sdb.listar_parcelas_financiamento(ctx['financiamento_id'])[0])
+        return f
+
+    def criar_compromisso_master():
+        c = sdb.criar_compromisso_master(
+            {'data_inicio': d, 'data_fim': d_30, 'contratante': 'Bench', 'nome_contrato': 'Bench', 'cidade': 'São Paulo', 'uf': 'SP'},
+            [{'item_id': 1, 'quantidade': 1}, {'item_id': 2, 'quantidade': 1}]
+        )
+        ctx['compromisso_id'] = _id(c)
+        return c
+
+    def reservar_itens():
+        r = sdb.reservar_itens([{'item_id': 4, 'quantidade': 1}, {'item_id': 5, 'quantidade': 1}], hoje, hoje + timedelta(days=30))
+        ctx['token'] = r['token']
+        return r
+
+    def criar_peca_carro():
+        p = sdb.criar_peca_carro(peca_id=3, carro_id=carro_id, quantidade=1, data_instalacao=hoje)
+        ctx['peca_carro_id'] = _id(p)
+        return p
+
+    def criar_conta_receber():
+        c = sdb.criar_conta_receber(1, 'Bench', 100.0, hoje)
+        ctx['conta_receber_id'] = _id(c)
+        return c
+
+    def criar_conta_pagar():
+        c = sdb.criar_conta_pagar('Bench', 'Fornecedor', 100.0, hoje)
+        ctx['conta_pagar_id'] = _id(c)
+        return c
+
+    def criar_item():
+        i = sdb.criar_item('Carro Bench', 1, categoria='Carros', cidade='São Paulo', uf='SP')
+        ctx['item_id'] = _id(i)
+        return i
+
+    return [
+        ('obter_categorias', lambda: sdb.obter_categorias()),
+        ('obter_campos_categoria', lambda: sdb.obter_campos_categoria('Carros')),
+        ('criar_item', criar_item),
+        ('atualizar_item', lambda: sdb.atualizar_item(ctx['item_id'], 'Carro Bench 2', 1, categoria='Carros', cidade='São Paulo', uf='SP')),
+        ('listar_itens', lambda: sdb.listar_itens()),
+        ('buscar_item_por_id', lambda: sdb.buscar_item_por_id(1)),
+        ('registrar_movimentacao', lambda: sdb.registrar_movimentacao(1, 1, 'COMPRA')),
+        ('criar_compromisso', lambda: sdb.criar_compromisso(1, 1, d, d_30, contratante='Bench')),
+        ('criar_compromisso_master', criar_compromisso_master),
+        ('listar_compromissos', lambda: sdb.listar_compromissos()),
+        ('buscar_compromisso_por_id', lambda: sdb.buscar_compromisso_por_id(ctx['compromisso_id'])),
+        ('atualizar_compromisso', lambda: sdb.atualizar_compromisso(ctx['compromisso_id'], {'contratante': 'Bench 2'}, [{'item_id': 1, 'quantidade': 1}])),
+        ('atualizar_compromisso_master', lambda: sdb.atualizar_compromisso_master(ctx['compromisso_id'], {'data_inicio': d, 'data_fim': d_30}, [{'item_id': 1, 'quantidade': 1}])),
+        ('obter_estatisticas_kpi', lambda: sdb.obter_estatisticas_kpi()),
+        ('criar_peca_carro', criar_peca_carro),
+        ('listar_pecas_carros', lambda: sdb.listar_pecas_carros(carro_id=carro_id)),
+        ('buscar_peca_carro_por_id', lambda: sdb.buscar_peca_carro_por_id(ctx['peca_carro_id'])),
+        ('atualizar_peca_carro', lambda: sdb.atualizar_peca_carro(ctx['peca_carro_id'], quantidade=2)),
+        ('verificar_disponibilidade', lambda: sdb.verificar_disponibilidade(1, hoje)),
+        ('verificar_disponibilidade_periodo', lambda: sdb.verificar_disponibilidade_periodo(1, hoje, hoje + timedelta(days=30))),
+        ('verificar_disponibilidade_lote', lambda: sdb.verificar_disponibilidade_lote(
+            [{'item_id': i, 'quantidade': 1} for i in range(1, 21)], hoje, hoje + timedelta(days=30))),
+        ('listar_itens_alternativos', lambda: sdb.listar_itens_alternativos(1)),
+        ('reservar_itens', reservar_itens),
+        ('confirmar_reserva', lambda: sdb.confirmar_reserva(ctx['token'], contratante='Bench', nome_contrato='Bench', cidade='São Paulo', uf='SP')),
+        ('cancelar_reserva', lambda: sdb.cancelar_reserva(reservar_itens()['token'])),
+        ('verificar_disponibilidade_todos_itens', lambda: sdb.verificar_disponibilidade_todos_itens(hoje)),
+        ('criar_financiamento', criar_financiamento),
+        ('criar_financiamento_item', lambda: sdb.criar_financiamento_item(ctx['financiamento_id'], 1, 0.0)),
+        ('listar_itens_financiamento', lambda: sdb.listar_itens_financiamento(ctx['financiamento_id'])),
+        ('listar_financiamentos', lambda: sdb.listar_financiamentos(pagina=1, por_pagina=10)),
+        ('buscar_ids_texto', lambda: sdb.buscar_ids_texto('financiamentos', 'banco')),
+        ('buscar_financiamento_por_id', lambda: sdb.buscar_financiamento_por_id(ctx['financiamento_id'])),
+        ('atualizar_financiamento', lambda: sdb.atualizar_financiamento(ctx['financiamento_id'], observacoes='Bench')),
+        ('listar_parcelas_financiamento', lambda: sdb.listar_parcelas_financiamento(ctx['financiamento_id'])),
+        ('atualizar_parcela_financiamento', lambda: sdb.atualizar_parcela_financiamento(ctx['parcela_id'], link_boleto='http://boleto')),
+        ('pagar_parcela_financiamento', lambda: sdb.pagar_parcela_financiamento(ctx['parcela_id'], 1000.0, hoje)),
+        ('pagar_parcelas_financiamento', lambda: sdb.pagar_parcelas_financiamento([
+            {'parcela_id': _id(p), 'valor_pago': p.valor_original} for p in sdb.listar_parcelas_financiamento(ctx['financiamento_id'])
+        ])),
+        ('criar_conta_receber', criar_conta_receber),
+        ('listar_contas_receber', lambda: sdb.listar_contas_receber()),
+        ('atualizar_conta_receber', lambda: sdb.atualizar_conta_receber(ctx['conta_receber_id'], valor=150.0)),
+        ('marcar_conta_receber_paga', lambda: sdb.marcar_conta_receber_paga(ctx['conta_receber_id'], hoje)),
+        ('criar_conta_pagar', criar_conta_pagar),
+        ('listar_contas_pagar', lambda: sdb.listar_contas_pagar()),
+        ('atualizar_conta_pagar', lambda: sdb.atualizar_conta_pagar(ctx['conta_pagar_id'], valor=150.0)),
+        ('marcar_conta_pagar_paga', lambda: sdb.marcar_conta_pagar_paga(ctx['conta_pagar_id'], hoje)),
+        ('aplicar_baixas_lote', lambda: sdb.aplicar_baixas_lote([
+            {'tipo': 'receber', 'id': ctx['conta_receber_id'], 'valor': 150.0, 'data_pagamento': hoje},
+            {'tipo': 'pagar', 'id': ctx['conta_pagar_id'], 'valor': 150.0, 'data_pagamento': hoje},
+        ])),
+        ('obter_fluxo_caixa', lambda: sdb.obter_fluxo_caixa(hoje - timedelta(days=180), hoje + timedelta(days=30))),
+        ('reconstruir_fluxo_caixa', lambda: sdb.reconstruir_fluxo_caixa()),
+        ('atualizar_status_vencidos', lambda: sdb.atualizar_status_vencidos()),
+        ('revogar_token', lambda: sdb.revogar_token('bench', 4102444800)),
+        ('listar_tokens_revogados', lambda: sdb.listar_tokens_revogados()),
+        ('estado_espelho', lambda: sdb.estado_espelho()),
+        ('deletar_peca_carro', lambda: sdb.deletar_peca_carro(ctx['peca_carro_id'])),
+        ('deletar_conta_receber', lambda: sdb.deletar_conta_receber(ctx['conta_receber_id'])),
+        ('deletar_conta_pagar', lambda: sdb.deletar_conta_pagar(ctx['conta_pagar_id'])),
+        ('deletar_financiamento', lambda: sdb.deletar_financiamento(ctx['financiamento_id'])),
+        ('deletar_compromisso', lambda: sdb.deletar_compromisso(ctx['compromisso_id'])),
+        ('deletar_item', lambda: sdb.deletar_item(ctx['item_id'])),
+    ]
+
+
+def executar(n_itens: int, latencia_ms: float) -> Dict:
+    import supabase_database as sdb
+
+    cliente = instalar(ClienteSupabaseLocal(latencia_ms=latencia_ms))
+    hoje = date.today()
+    semear_dataset(cliente, n_itens, hoje)
+
+    resultados = {}
+    cenarios = _cenarios(sdb, hoje, n_itens)
+    for nome, funcao in cenarios:
+        cliente.resetar_contadores()
+        inicio = time.perf_counter()
+        resultado = {}
+        try:
+            funcao()
+        except Exception as e:
+            resultado['erro'] = f"{type(e).__name__}: {e}"
+        resultado.update({
+            'round_trips': cliente.total_chamadas,
+            'tempo_ms': round((time.perf_counter() - inicio) * 1000, 3),
+            'chamadas': dict(cliente.chamadas.most_common()),
+        })
+        resultados[nome] = resultado
+        marca = f"  ERRO {resultado['erro']}" if 'erro' in resultado else ''
+        print(f"[RT] {nome:<40} {resultado['round_trips']:>6} round trips {resultado['tempo_ms']:>10.1f} ms{marca}")
+
+    publicas = {n for n, f in inspect.getmembers(sdb, inspect.isfunction)
+                if not n.startswith('_') and f.__module__ == sdb.__name__ and n != 'get_supabase'}
+    return {
+        'itens': n_itens,
+        'latencia_ms': latencia_ms,
+        'resultados': resultados,
+        'sem_cenario': sorted(publicas - set(resultados)),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Round trips do supabase_database contra o cliente local')
+    parser.add_argument('--itens', type=int, default=200, help='Número de itens semeados')
+    parser.add_argument('--latencia-ms', type=float, default=20.0, help='Latência simulada por chamada')
+    parser.add_argument('--saida', default=None, help='Arquivo JSON de resultados (opcional)')
+    args = parser.parse_args(argv)
+
+    # A auditoria grava no SQLite de data/ relativo ao diretório atual
+    diretorio_original = os.getcwd()
+    diretorio = tempfile.mkdtemp(prefix='bench_supabase_')
+    try:
+        os.chdir(diretorio)
+        relatorio = executar(args.itens, args.latencia_ms)
+    finally:
+        os.chdir(diretorio_original)
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    if relatorio['sem_cenario']:
+        print(f"[RT] Funções sem cenário: {', '.join(relatorio['sem_cenario'])}")
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        print(f"[RT] Resultados gravados em {args.saida}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""
+Conciliação de extrato bancário (OFX/CSV) com contas e parcelas em aberto
+
+O extrato é lido linha a linha (o arquivo não é carregado inteiro; só os
+lançamentos já interpretados ficam em memória, para o casamento), cada
+lançamento é casado com uma conta/parcela em aberto de mesmo valor e
+vencimento dentro da tolerância, e todas as baixas são aplicadas de uma
+vez com db_module.aplicar_baixas_lote (uma transação, uma auditoria).
+"""
+import re
+import csv
+import bisect
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+TOLERANCIA_DIAS_PADRAO = 3
+
+# Nomes de coluna aceitos no CSV (comparados em minúsculas, sem espaços nas pontas)
+COLUNAS_DATA = ('data', 'data lancamento', 'data lançamento', 'data_lancamento', 'date', 'dt')
+COLUNAS_VALOR = ('valor', 'valor (r$)', 'amount', 'value')
+COLUNAS_DESCRICAO = ('descricao', 'descrição', 'historico', 'histórico', 'memo', 'description')
+COLUNAS_IDENTIFICADOR = ('id', 'fitid', 'documento', 'nr documento', 'identificador')
+
+_TAG_OFX = re.compile(r'<(\w+)>([^<\r\n]*)')
+
+
+@dataclass
+class Lancamento:
+    """Um lançamento do extrato; valor positivo = crédito, negativo = débito"""
+    data: date
+    valor: float
+    descricao: str = ''
+    identificador: Optional[str] = None
+
+
+def _linhas_texto(arquivo) -> Iterator[str]:
+    """Itera as linhas do arquivo (bytes ou texto), decodificando UTF-8 com fallback para cp1252"""
+    for linha in arquivo:
+        if isinstance(linha, bytes):
+            try:
+                linha = linha.decode('utf-8-sig')
+            except UnicodeDecodeError:
+                linha = linha.decode('cp1252', errors='replace')
+        yield linha
+
+
+def _parse_valor(texto: str) -> float:
+    """Aceita '1234.56', '-1.234,56', 'R$ 1.234,56', '(1.234,56)' e '1,234.56'
+
+    A vírgula só é separador decimal se vier depois do último ponto.
+    """
+    texto = texto.strip().replace('R$', '').replace(' ', '')
+    negativo = texto.startswith('(') and texto.endswith(')')
+    texto = texto.strip('()')
+    if texto.rfind(',') > texto.rfind('.'):
+        texto = texto.replace('.', '').replace(',', '.')
+    else:
+        texto = texto.replace(',', '')
+    valor = float(texto)
+    return -valor if negativo else valor
+
+
+def _parse_data(texto: str) -> date:
+    texto = texto.strip()
+    for formato in ('%d/%m/%Y', '%Y-%m-%d', '%d/%m/%y', '%d-%m-%Y'):
+        try:
+            return datetime.strptime(texto[:10], formato).date()
+        except ValueError:
+            continue
+    # OFX: AAAAMMDD[HHMMSS[.XXX][TZ]]
+    return datetime.strptime(texto[:8], '%Y%m%d').date()
+
+
+def ler_extrato_ofx(arquivo) -> Iterator[Lancamento]:
+    """Lê os blocos <STMTTRN> de um OFX (SGML ou XML), um lançamento por vez"""
+    atual = None
+    for linha in _linhas_texto(arquivo):
+        for tag, valor in _TAG_OFX.findall(linha):
+            tag = tag.upper()
+            valor = valor.strip()
+            if tag == 'STMTTRN':
+                atual = {}
+            elif atual is None:
+                continue
+            elif tag in ('DTPOSTED', 'TRNAMT', 'FITID', 'MEMO', 'NAME'):
+                atual.setdefault(tag, valor)
+        if atual is not None and re.search(r'</STMTTRN>', linha, re.IGNORECASE):
+            if 'DTPOSTED' in atual and 'TRNAMT' in atual:
+                yield Lancamento(
+                    data=_parse_data(atual['DTPOSTED']),
+                    valor=_parse_valor(atual['TRNAMT']),
+                    descricao=atual.get('MEMO') or atual.get('NAME') or '',
+                    identificador=atual.get('FITID')
+                )
+            atual = None
+
+
+def _achar_coluna(cabecalho: List[str], nomes: Tuple[str, ...]) -> Optional[int]:
+    normalizado = [c.strip().lower() for c in cabecalho]
+    for nome in nomes:
+        if nome in normalizado:
+            return normalizado.index(nome)
+    return None
+
+
+def ler_extrato_csv(arquivo) -> Iterator[Lancamento]:
+    """
+    Lê um extrato CSV com cabeçalho (separador ';' ou ',' detectado na primeira linha)
+
+    Colunas obrigatórias: data e valor (veja COLUNAS_DATA / COLUNAS_VALOR).
+    Linhas sem data ou valor válidos (saldo, totais) são ignoradas.
+
+    Raises:
+        ValueError: Se o cabeçalho não tiver as colunas de data e valor
+    """
+    linhas = _linhas_texto(arquivo)
+    primeira = next(linhas, '')
+    separador = ';' if primeira.count(';') >= primeira.count(',') else ','
+    cabecalho = next(csv.reader([primeira], delimiter=separador), [])
+
+    i_data = _achar_coluna(cabecalho, COLUNAS_DATA)
+    i_valor = _achar_coluna(cabecalho, COLUNAS_VALOR)
+    if i_data is None or i_valor is None:
+        raise ValueError("CSV do extrato precisa das colunas de data e valor")
+    i_descricao = _achar_coluna(cabecalho, COLUNAS_DESCRICAO)
+    i_identificador = _achar_coluna(cabecalho, COLUNAS_IDENTIFICADOR)
+
+    for campos in csv.reader(linhas, delimiter=separador):
+        if len(campos) <= max(i_data, i_valor):
+            continue
+        try:
+            lancamento = Lancamento(data=_parse_data(campos[i_data]), valor=_parse_valor(campos[i_valor]))
+        except ValueError:
+            continue
+        if i_descricao is not None and i_descricao < len(campos):
+            lancamento.descricao = campos[i_descricao].strip()
+        if i_identificador is not None and i_identificador < len(campos):
+            lancamento.identificador = campos[i_identificador].strip() or None
+        yield lancamento
+
+
+def ler_extrato(arquivo, nome_arquivo: str = '') -> Iterator[Lancamento]:
+    """Escolhe o leitor pela extensão do arquivo (.ofx ou .csv)"""
+    if nome_arquivo.lower().endswith('.ofx'):
+        return ler_extrato_ofx(arquivo)
+    return ler_extrato_csv(arquivo)
+
+
+class IndiceAberto:
+    """
+    Índice em memória dos títulos em aberto por (valor em centavos, vencimento)
+
+    Para cada valor, os candidatos ficam ordenados por vencimento; a busca é
+    um bisect na janela [data - tolerância, data + tolerância] e escolhe o
+    vencimento mais próximo. Cada título casa com no máximo um lançamento.
+    """
+
+    def __init__(self, tolerancia_dias: int = TOLERANCIA_DIAS_PADRAO):
+        self.tolerancia = timedelta(days=tolerancia_dias)
+        # (sentido, centavos) -> lista ordenada de (vencimento, tipo, id)
+        self._candidatos: Dict[Tuple[int, int], List[Tuple[date, str, int]]] = {}
+
+    def __len__(self):
+        return sum(len(c) for c in self._candidatos.values())
+
+    def adicionar(self, sentido: int, valor: float, vencimento: date, tipo: str, registro_id: int):
+        """sentido: 1 para recebimentos (créditos), -1 para pagamentos (débitos)"""
+        chave = (sentido, round(abs(valor) * 100))
+        bisect.insort(self._candidatos.setdefault(chave, []), (vencimento, tipo, registro_id))
+
+    def casar(self, lancamento: Lancamento) -> Optional[Tuple[str, int, date]]:
+        """Retorna e remove do índice o título (tipo, id, vencimento) que casa com o lançamento"""
+        sentido = 1 if lancamento.valor > 0 else -1
+        candidatos = self._candidatos.get((sentido, round(abs(lancamento.valor) * 100)))
+        if not candidatos:
+            return None
+        inicio = bisect.bisect_left(candidatos, lancamento.data - self.tolerancia, key=lambda c: c[0])
+        fim = bisect.bisect_right(candidatos, lancamento.data + self.tolerancia, key=lambda c: c[0])
+        if inicio >= fim:
+            return None
+        melhor = min(range(inicio, fim), key=lambda i: abs((candidatos[i][0] - lancamento.data).days))
+        vencimento, tipo, registro_id = candidatos.pop(melhor)
+        return tipo, registro_id, vencimento
+
+
+def carregar_indice(db_module, data_inicio: date, data_fim: date, tolerancia_dias: int = TOLERANCIA_DIAS_PADRAO) -> IndiceAberto:
+    """
+    Monta o índice com as contas a receber/pagar e parcelas em aberto com
+    vencimento entre data_inicio - tolerância e data_fim + tolerância
+    """
+    indice = IndiceAberto(tolerancia_dias)
+    inicio = data_inicio - indice.tolerancia
+    fim = data_fim + indice.tolerancia
+
+    for conta in db_module.listar_contas_receber(data_inicio=inicio, data_fim=fim):
+        if not conta.data_pagamento:
+            indice.adicionar(1, conta.valor, conta.data_vencimento, 'receber', conta.id)
+    for conta in db_module.listar_contas_pagar(data_inicio=inicio, data_fim=fim):
+        if not conta.data_pagamento:
+            indice.adicionar(-1, conta.valor, conta.data_vencimento, 'pagar', conta.id)
+    for parcela in db_module.listar_parcelas_financiamento(data_inicio=inicio, data_fim=fim):
+        em_aberto = round((parcela.valor_original or 0.0) - (parcela.valor_pago or 0.0), 2)
+        if em_aberto > 0 and parcela.data_vencimento:
+            indice.adicionar(-1, em_aberto, parcela.data_vencimento, 'parcela', parcela.id)
+    return indice
+
+
+def conciliar(lancamentos: Iterable[Lancamento], indice: IndiceAberto) -> Dict[str, list]:
+    """
+    Casa cada lançamento com um título do índice
+
+    Returns:
+        Dict com 'conciliadas' (baixas prontas para aplicar_baixas_lote, com o
+        lançamento de origem) e 'nao_conciliadas' (lançamentos sem par)
+    """
+    conciliadas = []
+    nao_conciliadas = []
+    for lancamento in lancamentos:
+        par = indice.casar(lancamento)
+        if par is None:
+            nao_conciliadas.append(lancamento)
+            continue
+        tipo, registro_id, vencimento = par
+        conciliadas.append({
+            'tipo': tipo,
+            'id': registro_id,
+            'valor': abs(lancamento.valor),
+            'data_pagamento': lancamento.data,
+            'data_vencimento': vencimento,
+            'descricao': lancamento.descricao,
+            'identificador': lancamento.identificador,
+        })
+    return {'conciliadas': conciliadas, 'nao_conciliadas': nao_conciliadas}
+
+
+def conciliar_extrato(db_module, arquivo, nome_arquivo: str = '', tolerancia_dias: int = TOLERANCIA_DIAS_PADRAO, aplicar: bool = False) -> Dict:
+    """
+    Lê o extrato, concilia com os títulos em aberto e opcionalmente aplica as baixas
+
+    Os lançamentos são lidos em streaming e guardados numa lista, com a faixa
+    de datas calculada na mesma passada; só essa faixa é consultada no banco
+    (uma consulta por tipo de título).
+
+    Args:
+        db_module: database ou supabase_database
+        arquivo: Arquivo binário ou de texto (iterável por linhas)
+        nome_arquivo: Usado para escolher entre OFX e CSV
+        tolerancia_dias: Diferença máxima entre pagamento e vencimento
+        aplicar: Se True, grava todas as baixas em uma única transação
+
+    Returns:
+        Dict com 'conciliadas', 'nao_conciliadas' e, se aplicar=True, 'aplicado'
+    """
+    lancamentos = []
+    inicio = fim = None
+    for lancamento in ler_extrato(arquivo, nome_arquivo):
+        lancamentos.append(lancamento)
+        inicio = lancamento.data if inicio is None else min(inicio, lancamento.data)
+        fim = lancamento.data if fim is None else max(fim, lancamento.data)
+    if not lancamentos:
+        return {'conciliadas': [], 'nao_conciliadas': [], 'aplicado': None}
+
+    indice = carregar_indice(db_module, inicio, fim, tolerancia_dias)
+    resultado = conciliar(lancamentos, indice)
+    resultado['aplicado'] = db_module.aplicar_baixas_lote(resultado['conciliadas']) if aplicar else None
+    return resultado
@@ -1,9 +1,77 @@
-﻿from models import get_session, Item, Compromisso, Carro, ContaReceber, ContaPagar, Financiamento, ParcelaFinanciamento, PecaCarro
-from datetime import date, datetime
-from sqlalchemy import and_, or_
+﻿from models import get_session, Item, Compromisso, Carro, ContaReceber, ContaPagar, Financiamento, ParcelaFinanciamento, PecaCarro, FluxoCaixaMensal, LogAlteracao, ReservaTemporaria, TokenRevogado, LeituraSombra
+from datetime import date, datetime, timedelta
+import re
+import time
+from sqlalchemy import and_, or_, func, text, false, Float, Integer
 from sqlalchemy.orm import joinedload
 import validacoes
 import auditoria
+import disponibilidade
+
+# ============= BUSCA TEXTUAL =============
+
+# Colunas buscadas por LIKE quando o SQLite não tem FTS5 (models.INDICES_BUSCA)
+_COLUNAS_BUSCA_LIKE = {
+    'itens': ('nome', 'categoria', 'descricao', 'cidade'),
+    'compromissos': ('contratante', 'descricao', 'cidade'),
+    'financiamentos': ('instituicao_financeira', 'observacoes'),
+}
+
+
+def _consulta_fts(q):
+    """Texto livre -> expressão FTS5: todos os termos, cada um como prefixo ("cam"* acha "Camisa")"""
+    termos = re.findall(r'\w+', q or '')
+    return ' '.join(f'"{termo}"*' for termo in termos)
+
+
+def _tem_indice_busca(session, tabela):
+    """Se a tabela FTS5 busca_<tabela> existe (SQLite compilado sem FTS5 não a cria)"""
+    return session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :nome"),
+        {'nome': f'busca_{tabela}'}
+    ).first() is not None
+
+
+def _filtrar_busca_texto(session, query, modelo, q):
+    """
+    Restringe query (sobre modelo: Item, Compromisso ou Financiamento) ao que
+    bate com q, com JOIN no índice FTS5 busca_<tabela>: o filtro fica no SQL,
+    sem lista de ids montada em Python
+    
+    Sem FTS5, cai para LIKE nas colunas de texto da própria tabela (sem ranking).
+    
+    Returns:
+        (query, ordem): ordem é a relevância (bm25, menor primeiro) para
+        order_by, ou None sem ranking
+    """
+    tabela = modelo.__tablename__
+    consulta = _consulta_fts(q)
+    if not consulta:
+        return query.filter(false()), None
+    if _tem_indice_busca(session, tabela):
+        busca = text(
+            f'SELECT rowid AS id, rank FROM busca_{tabela} WHERE busca_{tabela} MATCH :consulta'
+        ).bindparams(consulta=consulta).columns(id=Integer, rank=Float).subquery('busca')
+        return query.join(busca, busca.c.id == modelo.id), busca.c.rank
+    padrao = f'%{q.strip()}%'
+    return query.filter(or_(*(getattr(modelo, coluna).like(padrao) for coluna in _COLUNAS_BUSCA_LIKE[tabela]))), None
+
+
+def buscar_ids_texto(tabela, q, limite=1000):
+    """
+    Até limite IDs da tabela ('itens', 'compromissos' ou 'financiamentos') que
+    batem com q, do mais relevante (bm25) ao menos relevante (_filtrar_busca_texto)
+    """
+    modelo = {'itens': Item, 'compromissos': Compromisso, 'financiamentos': Financiamento}[tabela]
+    session = get_session()
+    try:
+        query, ordem = _filtrar_busca_texto(session, session.query(modelo.id), modelo, q)
+        if ordem is not None:
+            query = query.order_by(ordem)
+        return [linha[0] for linha in query.limit(limite)]
+    finally:
+        session.close()
+
 
 def criar_item(nome, quantidade_total, categoria='Estrutura de Evento', descricao=None, cidade=None, uf=None, endereco=None, placa=None, marca=None, modelo=None, ano=None):
     """Cria um novo item no estoque
@@ -80,14 +148,7 @@ def criar_item(nome, quantidade_total, categoria='Estrutura de Evento', descrica
             )
             session.add(carro)
         
-        session.commit()
-        session.refresh(item)
-        if categoria == 'Carros' and item.carro:
-            session.refresh(item.carro)
-            session.expunge(item.carro)
-        session.expunge(item)
-        
-        # Registra auditoria
+        # Registra auditoria (na mesma transação)
         valores_novos = {
             'id': item.id,
             'nome': nome,
@@ -105,7 +166,14 @@ def criar_item(nome, quantidade_total, categoria='Estrutura de Evento', descrica
                 'modelo': modelo,
                 'ano': ano
             })
-        auditoria.registrar_auditoria('CREATE', 'Itens', item.id, valores_novos=valores_novos)
+        auditoria.registrar_auditoria('CREATE', 'Itens', item.id, valores_novos=valores_novos, session=session)
+        
+        session.commit()
+        session.refresh(item)
+        if categoria == 'Carros' and item.carro:
+            session.refresh(item.carro)
+            session.expunge(item.carro)
+        session.expunge(item)
         
         return item
     except Exception as e:
@@ -115,12 +183,22 @@ def criar_item(nome, quantidade_total, categoria='Estrutura de Evento', descrica
         session.close()
 
 
-def listar_itens():
-    """Lista todos os itens do estoque"""
+def listar_itens(updated_since=None, q=None):
+    """Lista todos os itens do estoque (ou só os alterados depois de updated_since)
+    
+    Com q, só os que batem com a busca textual, em ordem de relevância.
+    """
     session = get_session()
     try:
         # Carrega os relacionamentos antes de desanexar
-        itens = session.query(Item).options(joinedload(Item.compromissos), joinedload(Item.carro)).all()
+        query = session.query(Item).options(joinedload(Item.compromissos), joinedload(Item.carro))
+        if updated_since:
+            query = query.filter(Item.updated_at > _data_local(updated_since))
+        if q:
+            query, ordem = _filtrar_busca_texto(session, query, Item, q)
+            if ordem is not None:
+                query = query.order_by(ordem)
+        itens = query.all()
         # Desanexa todos os objetos da sess├úo
         for item in itens:
             if item.carro:
@@ -276,12 +354,9 @@ def atualizar_item(item_id, nome, quantidade_total, categoria=None, descricao=No
                 'ano': item.carro.ano
             })
         
-        session.commit()
-        session.refresh(item)
-        if item.carro:
-            session.refresh(item.carro)
-            session.expunge(item.carro)
-        session.expunge(item)
+        # Carro criado/removido acima: relê o relacionamento já com as mudanças
+        session.flush()
+        session.expire(item, ['carro'])
         
         # Prepara valores novos para auditoria
         valores_novos = {
@@ -302,8 +377,16 @@ def atualizar_item(item_id, nome, quantidade_total, categoria=None, descricao=No
                 'ano': item.carro.ano
             })
         
-        # Registra auditoria
-        auditoria.registrar_auditoria('UPDATE', 'Itens', item.id, valores_antigos, valores_novos)
+        # Registra auditoria (na mesma transação)
+        auditoria.registrar_auditoria('UPDATE', 'Itens', item.id, valores_antigos, valores_novos, session=session)
+        
+        session.commit()
+        session.refresh(item)
+        cache_ocupacao.atualizar_total(item_id, item.quantidade_total)
+        if item.carro:
+            session.refresh(item.carro)
+            session.expunge(item.carro)
+        session.expunge(item)
         
         return item
     except Exception as e:
@@ -332,6 +415,24 @@ def criar_compromisso(item_id, quantidade, data_inicio, data_fim, descricao=None
         if not cidade or not uf:
             raise ValueError("Cidade e UF s├úo obrigat├│rios")
         
+        # Estoque conferido no banco, com o lock de escrita e na mesma transação
+        # da gravação (o cache de ocupação é só para as telas de consulta)
+        _travar_escrita(session)
+        item = session.query(Item).filter(Item.id == item_id).first()
+        if not item:
+            raise ValueError(f"Item com ID {item_id} n├úo encontrado")
+        valido, msg_erro = validacoes.validar_compromisso_completo(
+            item_id=item_id,
+            quantidade=quantidade,
+            data_inicio=data_inicio,
+            data_fim=data_fim,
+            cidade=cidade,
+            uf=uf,
+            quantidade_disponivel=item.quantidade_total - _pico_comprometido(session, item_id, data_inicio, data_fim)
+        )
+        if not valido:
+            raise ValueError(msg_erro)
+        
         compromisso = Compromisso(
             item_id=item_id,
             quantidade=quantidade,
@@ -344,16 +445,9 @@ def criar_compromisso(item_id, quantidade, data_inicio, data_fim, descricao=None
             contratante=contratante
         )
         session.add(compromisso)
-        session.commit()
-        session.refresh(compromisso)
-        # Carrega o relacionamento com Item antes de desanexar
-        compromisso.item  # For├ºa o carregamento do relacionamento
-        # Desanexa o objeto da sess├úo para poder ser usado depois que a sess├úo fechar
-        session.expunge(compromisso)
-        if compromisso.item:
-            session.expunge(compromisso.item)
+        session.flush()  # Para obter o ID do compromisso
         
-        # Registra auditoria
+        # Registra auditoria (na mesma transação)
         valores_novos = {
             'id': compromisso.id,
             'item_id': item_id,
@@ -366,7 +460,17 @@ def criar_compromisso(item_id, quantidade, data_inicio, data_fim, descricao=None
             'endereco': endereco,
             'contratante': contratante
         }
-        auditoria.registrar_auditoria('CREATE', 'Compromissos', compromisso.id, valores_novos=valores_novos)
+        auditoria.registrar_auditoria('CREATE', 'Compromissos', compromisso.id, valores_novos=valores_novos, session=session)
+        
+        session.commit()
+        session.refresh(compromisso)
+        cache_ocupacao.registrar_reserva(item_id, data_inicio, data_fim, quantidade)
+        # Carrega o relacionamento com Item antes de desanexar
+        compromisso.item  # For├ºa o carregamento do relacionamento
+        # Desanexa o objeto da sess├úo para poder ser usado depois que a sess├úo fechar
+        session.expunge(compromisso)
+        if compromisso.item:
+            session.expunge(compromisso.item)
         
         return compromisso
     except Exception as e:
@@ -376,12 +480,23 @@ def criar_compromisso(item_id, quantidade, data_inicio, data_fim, descricao=None
         session.close()
 
 
-def listar_compromissos():
-    """Lista todos os compromissos"""
+def listar_compromissos(updated_since=None, q=None):
+    """Lista todos os compromissos (ou só os alterados depois de updated_since)
+    
+    Com q, só os que batem com a busca textual (contratante, descrição, cidade
+    e nome do item), em ordem de relevância.
+    """
     session = get_session()
     try:
-        # Carrega o relacionamento com Item antes de desanexar
-        compromissos = session.query(Compromisso).options(joinedload(Compromisso.item)).all()
+        # Carrega o relacionamento com Item (e o Carro dele) antes de desanexar
+        query = session.query(Compromisso).options(joinedload(Compromisso.item).joinedload(Item.carro))
+        if updated_since:
+            query = query.filter(Compromisso.updated_at > _data_local(updated_since))
+        if q:
+            query, ordem = _filtrar_busca_texto(session, query, Compromisso, q)
+            if ordem is not None:
+                query = query.order_by(ordem)
+        compromissos = query.all()
         # Desanexa todos os objetos da sess├úo
         for compromisso in compromissos:
             session.expunge(compromisso)
@@ -465,44 +580,71 @@ def verificar_disponibilidade(item_id, data_consulta, filtro_localizacao=None):
         session.close()
 
 
-def verificar_disponibilidade_periodo(item_id, data_inicio, data_fim, excluir_compromisso_id=None):
-    """Verifica se h├í disponibilidade suficiente em todo o per├¡odo para um novo compromisso"""
+def _pico_comprometido(session, item_id, data_inicio, data_fim, excluir_compromisso_id=None):
+    """Maior quantidade comprometida num dia do per├¡odo (compromissos e reservas
+    temporárias ativas), lida no banco pela sessão informada"""
     from datetime import timedelta
     
+    # Busca compromissos que se sobrep├Áem com o per├¡odo solicitado
+    # Dois per├¡odos se sobrep├Áem se: inicio1 <= fim2 AND inicio2 <= fim1
+    compromissos_sobrepostos = session.query(Compromisso).filter(
+        and_(
+            Compromisso.item_id == item_id,
+            Compromisso.data_inicio <= data_fim,
+            Compromisso.data_fim >= data_inicio
+        )
+    ).all()
+    
+    # Exclui o pr├│prio compromisso se estiver editando
+    if excluir_compromisso_id:
+        compromissos_sobrepostos = [c for c in compromissos_sobrepostos if c.id != excluir_compromisso_id]
+    
+    # Reservas temporárias ativas também ocupam o estoque
+    compromissos_sobrepostos += session.query(ReservaTemporaria).filter(
+        ReservaTemporaria.item_id == item_id,
+        ReservaTemporaria.data_inicio <= data_fim,
+        ReservaTemporaria.data_fim >= data_inicio,
+        ReservaTemporaria.expira_em > datetime.now()
+    ).all()
+    
+    # Encontra o dia com maior comprometimento no per├¡odo
+    max_comprometido = 0
+    data_atual = data_inicio
+    
+    while data_atual <= data_fim:
+        compromissos_no_dia = [c for c in compromissos_sobrepostos 
+                              if c.data_inicio <= data_atual <= c.data_fim]
+        comprometido_no_dia = sum(c.quantidade for c in compromissos_no_dia)
+        max_comprometido = max(max_comprometido, comprometido_no_dia)
+        
+        # Incrementa a data
+        if data_atual >= data_fim:
+            break
+        data_atual += timedelta(days=1)
+    return max_comprometido
+
+
+def verificar_disponibilidade_periodo(item_id, data_inicio, data_fim, excluir_compromisso_id=None):
+    """Verifica se h├í disponibilidade suficiente em todo o per├¡odo para um novo compromisso
+    
+    Consulta para as telas: sem edição em andamento, o pico vem do cache de
+    ocupação (que pode estar até o TTL atrasado em relação a outros processos).
+    As gravações conferem no banco com _pico_comprometido, na própria transação.
+    """
     session = get_session()
     try:
         item = session.query(Item).filter(Item.id == item_id).first()
         if not item:
             return None
         
-        # Busca compromissos que se sobrep├Áem com o per├¡odo solicitado
-        # Dois per├¡odos se sobrep├Áem se: inicio1 <= fim2 AND inicio2 <= fim1
-        compromissos_sobrepostos = session.query(Compromisso).filter(
-            and_(
-                Compromisso.item_id == item_id,
-                Compromisso.data_inicio <= data_fim,
-                Compromisso.data_fim >= data_inicio
-            )
-        ).all()
-        
-        # Exclui o pr├│prio compromisso se estiver editando
-        if excluir_compromisso_id:
-            compromissos_sobrepostos = [c for c in compromissos_sobrepostos if c.id != excluir_compromisso_id]
+        pico = None
+        if not excluir_compromisso_id and isinstance(data_inicio, date) and isinstance(data_fim, date):
+            pico = cache_ocupacao.pico(item_id, data_inicio, data_fim)
         
-        # Encontra o dia com maior comprometimento no per├¡odo
-        max_comprometido = 0
-        data_atual = data_inicio
-        
-        while data_atual <= data_fim:
-            compromissos_no_dia = [c for c in compromissos_sobrepostos 
-                                  if c.data_inicio <= data_atual <= c.data_fim]
-            comprometido_no_dia = sum(c.quantidade for c in compromissos_no_dia)
-            max_comprometido = max(max_comprometido, comprometido_no_dia)
-            
-            # Incrementa a data
-            if data_atual >= data_fim:
-                break
-            data_atual += timedelta(days=1)
+        if pico is not None:
+            max_comprometido = pico['max_alugado']
+        else:
+            max_comprometido = _pico_comprometido(session, item_id, data_inicio, data_fim, excluir_compromisso_id)
         
         # Desanexa objeto da sess├úo antes de retornar
         session.expunge(item)
@@ -517,6 +659,57 @@ def verificar_disponibilidade_periodo(item_id, data_inicio, data_fim, excluir_co
         session.close()
 
 
+def _conferir_pedido(session, linhas, data_inicio, data_fim, excluir_compromisso_id=None, excluir_token=None):
+    """disponibilidade.conferir_linhas com os compromissos e as reservas temporárias
+    ativas que se sobrepõem ao período, lidos na sessão informada"""
+    ids = {int(linha['item_id']) for linha in linhas}
+    itens = {
+        item_id: {'nome': nome, 'quantidade_total': quantidade_total}
+        for item_id, nome, quantidade_total in session.query(
+            Item.id, Item.nome, Item.quantidade_total
+        ).filter(Item.id.in_(ids))
+    }
+    query = session.query(
+        Compromisso.item_id, Compromisso.data_inicio, Compromisso.data_fim, Compromisso.quantidade
+    ).filter(
+        Compromisso.item_id.in_(ids),
+        Compromisso.data_inicio <= data_fim,
+        Compromisso.data_fim >= data_inicio
+    )
+    if excluir_compromisso_id:
+        query = query.filter(Compromisso.id != excluir_compromisso_id)
+    query_temporarias = session.query(
+        ReservaTemporaria.item_id, ReservaTemporaria.data_inicio, ReservaTemporaria.data_fim, ReservaTemporaria.quantidade
+    ).filter(
+        ReservaTemporaria.item_id.in_(ids),
+        ReservaTemporaria.data_inicio <= data_fim,
+        ReservaTemporaria.data_fim >= data_inicio,
+        ReservaTemporaria.expira_em > datetime.now()
+    )
+    if excluir_token:
+        query_temporarias = query_temporarias.filter(ReservaTemporaria.token != excluir_token)
+    reservas = [tuple(linha) for linha in query] + [tuple(linha) for linha in query_temporarias]
+    picos = disponibilidade.picos_periodo(itens, reservas, [], data_inicio, data_fim)
+    return disponibilidade.conferir_linhas(linhas, picos)
+
+
+def verificar_disponibilidade_lote(linhas, data_inicio, data_fim, excluir_compromisso_id=None):
+    """Confere todas as linhas de um pedido ({'item_id', 'quantidade'}) no período
+    com uma consulta por tabela (itens, compromissos e reservas temporárias)
+
+    Como verificar_disponibilidade_periodo, não conta peças instaladas. Retorna
+    disponibilidade.conferir_linhas: uma entrada por linha com a falta de estoque.
+    """
+    if not linhas:
+        return []
+    
+    session = get_session()
+    try:
+        return _conferir_pedido(session, linhas, data_inicio, data_fim, excluir_compromisso_id)
+    finally:
+        session.close()
+
+
 def verificar_disponibilidade_todos_itens(data_consulta, filtro_localizacao=None):
     """Verifica a disponibilidade de todos os itens em uma data espec├¡fica
     
@@ -586,6 +779,234 @@ def verificar_disponibilidade_todos_itens(data_consulta, filtro_localizacao=None
         session.close()
 
 
+def listar_ocupacao_periodo(data_inicio, data_fim, item_ids=None):
+    """
+    Dados para a linha do tempo de disponibilidade (disponibilidade.linha_do_tempo)
+    
+    Uma consulta por tabela: itens, compromissos que se sobrepõem ao período
+    e peças instaladas até data_fim.
+    
+    Returns:
+        (itens {id: {'nome', 'quantidade_total'}}, reservas [(item_id, inicio, fim, qtd)],
+         instalacoes [(peca_id, data_instalacao, qtd)])
+    """
+    session = get_session()
+    try:
+        query_itens = session.query(Item.id, Item.nome, Item.quantidade_total).order_by(Item.nome)
+        query_reservas = session.query(
+            Compromisso.item_id, Compromisso.data_inicio, Compromisso.data_fim, Compromisso.quantidade
+        ).filter(Compromisso.data_inicio <= data_fim, Compromisso.data_fim >= data_inicio)
+        query_instalacoes = session.query(
+            PecaCarro.peca_id, PecaCarro.data_instalacao, PecaCarro.quantidade
+        ).filter(or_(PecaCarro.data_instalacao.is_(None), PecaCarro.data_instalacao <= data_fim))
+        if item_ids:
+            query_itens = query_itens.filter(Item.id.in_(item_ids))
+            query_reservas = query_reservas.filter(Compromisso.item_id.in_(item_ids))
+            query_instalacoes = query_instalacoes.filter(PecaCarro.peca_id.in_(item_ids))
+        
+        itens = {linha.id: {'nome': linha.nome, 'quantidade_total': linha.quantidade_total} for linha in query_itens}
+        return itens, [tuple(linha) for linha in query_reservas], [tuple(linha) for linha in query_instalacoes]
+    finally:
+        session.close()
+
+
+def listar_itens_alternativos(item_id):
+    """IDs dos outros itens da mesma categoria e localização (cidade/UF), por nome"""
+    session = get_session()
+    try:
+        item = session.query(Item.categoria, Item.cidade, Item.uf).filter(Item.id == item_id).first()
+        if not item:
+            return []
+        query = session.query(Item.id).filter(
+            Item.categoria == item.categoria,
+            Item.cidade == item.cidade,
+            Item.uf == item.uf,
+            Item.id != item_id
+        ).order_by(Item.nome)
+        return [linha.id for linha in query]
+    finally:
+        session.close()
+
+
+def listar_reservas_temporarias_ativas(data_inicio, data_fim, item_ids=None):
+    """Reservas temporárias não vencidas que se sobrepõem ao período:
+    [(token, item_id, data_inicio, data_fim, quantidade, expira_em)]"""
+    session = get_session()
+    try:
+        query = session.query(
+            ReservaTemporaria.token, ReservaTemporaria.item_id, ReservaTemporaria.data_inicio,
+            ReservaTemporaria.data_fim, ReservaTemporaria.quantidade, ReservaTemporaria.expira_em
+        ).filter(
+            ReservaTemporaria.data_inicio <= data_fim,
+            ReservaTemporaria.data_fim >= data_inicio,
+            ReservaTemporaria.expira_em > datetime.now()
+        )
+        if item_ids:
+            query = query.filter(ReservaTemporaria.item_id.in_(item_ids))
+        return [tuple(linha) for linha in query]
+    finally:
+        session.close()
+
+
+# Ocupação por item em memória (consultas de período em O(log dias)); as
+# escritas de compromissos, reservas temporárias e peças em carros ajustam o
+# cache incrementalmente
+cache_ocupacao = disponibilidade.CacheOcupacao(
+    listar_ocupacao_periodo, carregar_temporarias=listar_reservas_temporarias_ativas
+)
+
+
+# ============= RESERVAS TEMPORÁRIAS =============
+
+def _travar_escrita(session):
+    """BEGIN IMMEDIATE: pega o lock de escrita do banco antes de conferir o estoque,
+    para que conferência e gravação não se intercalem com outro checkout
+    
+    O SQLite só tem lock do banco inteiro (não há lock por linha ou por item):
+    toda outra escrita espera até o commit/rollback (leituras seguem até o commit).
+    Por isso quem chama valida a entrada antes e, depois do lock, só confere
+    o estoque e grava (com a auditoria); cache e eventos ficam para depois do commit.
+    """
+    session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def reservar_itens(linhas, data_inicio, data_fim, ttl_segundos=None, token=None):
+    """Bloqueia o estoque das linhas ({'item_id', 'quantidade'}) no período por ttl_segundos
+    
+    Conferência e gravação acontecem na mesma transação, com o lock de
+    escrita do banco. Com o token de uma reserva existente, ela é substituída
+    (carrinho alterado ou prazo renovado).
+    
+    Returns:
+        Dict com reservado, token, expira_em e linhas (disponibilidade.conferir_linhas);
+        se faltar estoque em alguma linha nada é gravado e reservado=False
+    """
+    ttl_segundos = disponibilidade.validar_ttl_reserva(ttl_segundos)
+    if not linhas:
+        raise ValueError("Informe ao menos um item para reservar")
+    valido, msg_erro = validacoes.validar_datas(data_inicio, data_fim)
+    if not valido:
+        raise ValueError(msg_erro)
+    token = token or disponibilidade.novo_token_reserva()
+    
+    session = get_session()
+    try:
+        _travar_escrita(session)
+        agora = datetime.now()
+        session.query(ReservaTemporaria).filter(ReservaTemporaria.expira_em <= agora).delete(synchronize_session=False)
+        
+        conferencia = _conferir_pedido(session, linhas, data_inicio, data_fim, excluir_token=token)
+        if any(linha['falta'] for linha in conferencia):
+            session.rollback()
+            return {'reservado': False, 'token': None, 'expira_em': None, 'linhas': conferencia}
+        
+        expira_em = agora + timedelta(seconds=ttl_segundos)
+        session.query(ReservaTemporaria).filter(ReservaTemporaria.token == token).delete(synchronize_session=False)
+        session.add_all([
+            ReservaTemporaria(
+                token=token, item_id=linha['item_id'], quantidade=linha['quantidade'],
+                data_inicio=data_inicio, data_fim=data_fim, expira_em=expira_em
+            )
+            for linha in conferencia if linha['quantidade'] > 0
+        ])
+        session.commit()
+        
+        cache_ocupacao.remover_temporarias(token)
+        for linha in conferencia:
+            if linha['quantidade'] > 0:
+                cache_ocupacao.registrar_temporaria(token, linha['item_id'], data_inicio, data_fim, linha['quantidade'], expira_em)
+        return {'reservado': True, 'token': token, 'expira_em': expira_em, 'linhas': conferencia}
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+def confirmar_reserva(token, cidade=None, uf=None, descricao=None, endereco=None, contratante=None, **kwargs):
+    """Transforma as reservas temporárias do token em compromissos (um por linha)
+    
+    Roda com o lock de escrita: dentro do prazo o estoque já está garantido;
+    depois dele, é conferido de novo antes de gravar.
+    
+    Returns:
+        Dict com compromisso_ids
+    
+    Raises:
+        ValueError: Reserva inexistente (cancelada, confirmada ou limpa) ou vencida sem estoque
+    """
+    # kwargs: campos do contrato master (nome_contrato, valor_total_contrato) não existem no SQLite
+    if not cidade or not uf:
+        raise ValueError("Cidade e UF são obrigatórios")
+    
+    session = get_session()
+    try:
+        _travar_escrita(session)
+        reservas = session.query(ReservaTemporaria).filter(
+            ReservaTemporaria.token == token
+        ).order_by(ReservaTemporaria.id).all()
+        if not reservas:
+            raise ValueError("Reserva não encontrada (vencida, cancelada ou já confirmada)")
+        
+        if any(disponibilidade.expirada(reserva.expira_em) for reserva in reservas):
+            linhas = [{'item_id': reserva.item_id, 'quantidade': reserva.quantidade} for reserva in reservas]
+            erro = disponibilidade.mensagem_faltas(_conferir_pedido(
+                session, linhas, reservas[0].data_inicio, reservas[0].data_fim, excluir_token=token
+            ))
+            if erro:
+                raise ValueError(f"Reserva vencida. {erro}")
+        
+        valores = [{
+            'item_id': reserva.item_id,
+            'quantidade': reserva.quantidade,
+            'data_inicio': reserva.data_inicio,
+            'data_fim': reserva.data_fim,
+            'descricao': descricao,
+            'cidade': cidade,
+            'uf': uf.upper()[:2],
+            'endereco': endereco,
+            'contratante': contratante
+        } for reserva in reservas]
+        compromissos = [Compromisso(**dados) for dados in valores]
+        session.add_all(compromissos)
+        for reserva in reservas:
+            session.delete(reserva)
+        session.flush()
+        compromisso_ids = [compromisso.id for compromisso in compromissos]
+        auditoria.registrar_auditoria_lote([
+            {'acao': 'CREATE', 'tabela': 'Compromissos', 'registro_id': compromisso_id, 'valores_novos': dados}
+            for compromisso_id, dados in zip(compromisso_ids, valores)
+        ], session=session)
+        session.commit()
+        
+        cache_ocupacao.remover_temporarias(token)
+        for dados in valores:
+            cache_ocupacao.registrar_reserva(dados['item_id'], dados['data_inicio'], dados['data_fim'], dados['quantidade'])
+        return {'compromisso_ids': compromisso_ids}
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+def cancelar_reserva(token):
+    """Libera as reservas temporárias do token; retorna quantas linhas foram removidas"""
+    session = get_session()
+    try:
+        removidas = session.query(ReservaTemporaria).filter(
+            ReservaTemporaria.token == token
+        ).delete(synchronize_session=False)
+        session.commit()
+        cache_ocupacao.remover_temporarias(token)
+        return removidas
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
 def deletar_item(item_id):
     """Deleta um item e todos os seus compromissos"""
     session = get_session()
@@ -626,11 +1047,29 @@ def deletar_item(item_id):
                 'ano': item.carro.ano
             })
         
+        # As contas a receber dos compromissos saem junto em cascata
+        for compromisso in item.compromissos:
+            for conta in compromisso.contas_receber:
+                _ajustar_fluxo_caixa(session, 'receitas', _contribuicao_fluxo(conta), -1)
+        
+        # Registros removidos em cascata também geram tombstone no log de alterações
+        cascata = [{'acao': 'DELETE', 'tabela': 'Compromissos', 'registro_id': c.id} for c in item.compromissos]
+        cascata += [
+            {'acao': 'DELETE', 'tabela': 'Contas a Receber', 'registro_id': conta.id}
+            for c in item.compromissos for conta in c.contas_receber
+        ]
+        
+        session.query(ReservaTemporaria).filter(ReservaTemporaria.item_id == item_id).delete(synchronize_session=False)
         session.delete(item)
-        session.commit()
         
-        # Registra auditoria
-        auditoria.registrar_auditoria('DELETE', 'Itens', item_id, valores_antigos=valores_antigos)
+        # Registra auditoria (na mesma transação)
+        auditoria.registrar_auditoria_lote(
+            [{'acao': 'DELETE', 'tabela': 'Itens', 'registro_id': item_id, 'valores_antigos': valores_antigos}] + cascata,
+            session=session
+        )
+        session.commit()
+        # Um carro removido leva junto as peças instaladas nele (outros itens)
+        cache_ocupacao.invalidar()
         
         return True
     except Exception as e:
@@ -657,6 +1096,8 @@ def atualizar_compromisso(compromisso_id, item_id, quantidade, data_inicio, data
     """
     session = get_session()
     try:
+        # Conferência e gravação sob o mesmo lock de escrita
+        _travar_escrita(session)
         compromisso = session.query(Compromisso).filter(Compromisso.id == compromisso_id).first()
         if not compromisso:
             raise ValueError(f"Compromisso com ID {compromisso_id} n├úo encontrado")
@@ -666,12 +1107,10 @@ def atualizar_compromisso(compromisso_id, item_id, quantidade, data_inicio, data
         if not item:
             raise ValueError(f"Item com ID {item_id} n├úo encontrado")
         
-        # Verifica disponibilidade (excluindo o compromisso atual)
-        disponibilidade = verificar_disponibilidade_periodo(item_id, data_inicio, data_fim, excluir_compromisso_id=compromisso_id)
-        if not disponibilidade:
-            raise ValueError(f"Erro ao verificar disponibilidade do item {item_id}")
-        
-        quantidade_disponivel = disponibilidade.get('disponivel_minimo', 0)
+        # Verifica disponibilidade no banco, na mesma transação (excluindo o compromisso atual)
+        quantidade_disponivel = item.quantidade_total - _pico_comprometido(
+            session, item_id, data_inicio, data_fim, excluir_compromisso_id=compromisso_id
+        )
         
         # Valida├º├Áes robustas
         valido, msg_erro = validacoes.validar_compromisso_completo(
@@ -688,6 +1127,7 @@ def atualizar_compromisso(compromisso_id, item_id, quantidade, data_inicio, data
             raise ValueError(msg_erro)
         
         if compromisso:
+            reserva_antiga = (compromisso.item_id, compromisso.data_inicio, compromisso.data_fim, compromisso.quantidade)
             
             compromisso.item_id = item_id
             compromisso.quantidade = quantidade
@@ -713,13 +1153,6 @@ def atualizar_compromisso(compromisso_id, item_id, quantidade, data_inicio, data
                 'contratante': compromisso.contratante
             }
             
-            session.commit()
-            session.refresh(compromisso)
-            compromisso.item  # For├ºa o carregamento do relacionamento
-            session.expunge(compromisso)
-            if compromisso.item:
-                session.expunge(compromisso.item)
-            
             # Prepara valores novos para auditoria
             valores_novos = {
                 'id': compromisso.id,
@@ -734,8 +1167,17 @@ def atualizar_compromisso(compromisso_id, item_id, quantidade, data_inicio, data
                 'contratante': contratante
             }
             
-            # Registra auditoria
-            auditoria.registrar_auditoria('UPDATE', 'Compromissos', compromisso_id, valores_antigos, valores_novos)
+            # Registra auditoria (na mesma transação)
+            auditoria.registrar_auditoria('UPDATE', 'Compromissos', compromisso_id, valores_antigos, valores_novos, session=session)
+            
+            session.commit()
+            session.refresh(compromisso)
+            cache_ocupacao.registrar_reserva(reserva_antiga[0], reserva_antiga[1], reserva_antiga[2], -reserva_antiga[3])
+            cache_ocupacao.registrar_reserva(item_id, data_inicio, data_fim, quantidade)
+            compromisso.item  # For├ºa o carregamento do relacionamento
+            session.expunge(compromisso)
+            if compromisso.item:
+                session.expunge(compromisso.item)
             
             return compromisso
         return None
@@ -766,16 +1208,282 @@ def deletar_compromisso(compromisso_id):
                 'contratante': compromisso.contratante
             }
             
+            cascata = []
+            for conta in compromisso.contas_receber:
+                _ajustar_fluxo_caixa(session, 'receitas', _contribuicao_fluxo(conta), -1)
+                cascata.append({'acao': 'DELETE', 'tabela': 'Contas a Receber', 'registro_id': conta.id})
+            
+            reserva = (compromisso.item_id, compromisso.data_inicio, compromisso.data_fim, compromisso.quantidade)
             session.delete(compromisso)
-            session.commit()
             
-            # Registra auditoria
-            auditoria.registrar_auditoria('DELETE', 'Compromissos', compromisso_id, valores_antigos=valores_antigos)
+            # Registra auditoria (na mesma transação)
+            auditoria.registrar_auditoria_lote(
+                [{'acao': 'DELETE', 'tabela': 'Compromissos', 'registro_id': compromisso_id, 'valores_antigos': valores_antigos}] + cascata,
+                session=session
+            )
+            session.commit()
+            cache_ocupacao.registrar_reserva(reserva[0], reserva[1], reserva[2], -reserva[3])
             
             return True
         return False
     except Exception as e:
-        session.rollback()
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+# ============= IMPORTAÇÃO EM LOTE =============
+
+def importar_itens_lote(linhas):
+    """
+    Grava um lote de itens já validados (importacao.importar_itens)
+    
+    Uma consulta de duplicatas por tabela (nome+categoria e placa), um
+    INSERT em lote para itens e outro para carros, e uma auditoria em lote.
+    
+    Args:
+        linhas: Lista de (numero_linha, dados) com os campos de criar_item
+    
+    Returns:
+        Dict com 'inseridos' e 'erros' [{'linha', 'erro'}] das duplicatas no banco
+    """
+    session = get_session()
+    try:
+        nomes = {dados['nome'] for _, dados in linhas}
+        existentes = set(session.query(Item.nome, Item.categoria).filter(Item.nome.in_(nomes)).all())
+        placas = {dados['placa'] for _, dados in linhas if dados.get('placa')}
+        placas_existentes = {placa for (placa,) in session.query(Carro.placa).filter(Carro.placa.in_(placas)).all()} if placas else set()
+        
+        erros = []
+        aceitos = []
+        for numero, dados in linhas:
+            if (dados['nome'], dados['categoria']) in existentes:
+                erros.append({'linha': numero, 'erro': f"Item '{dados['nome']}' já existe na categoria '{dados['categoria']}'"})
+            elif dados.get('placa') in placas_existentes:
+                erros.append({'linha': numero, 'erro': f"Placa {dados['placa']} já cadastrada"})
+            else:
+                aceitos.append(dados)
+        
+        mapeamentos = [
+            {campo: dados.get(campo) for campo in ('nome', 'quantidade_total', 'categoria', 'descricao', 'cidade', 'uf', 'endereco')}
+            for dados in aceitos
+        ]
+        # return_defaults preenche o id de cada mapeamento (necessário para carros e auditoria)
+        session.bulk_insert_mappings(Item, mapeamentos, return_defaults=True)
+        session.bulk_insert_mappings(Carro, [
+            {'item_id': mapeamento['id'], 'placa': dados['placa'], 'marca': dados['marca'], 'modelo': dados['modelo'], 'ano': dados['ano']}
+            for mapeamento, dados in zip(mapeamentos, aceitos) if dados['categoria'] == 'Carros'
+        ])
+        auditoria.registrar_auditoria_lote([
+            {'acao': 'CREATE', 'tabela': 'Itens', 'registro_id': mapeamento['id'], 'valores_novos': dados}
+            for mapeamento, dados in zip(mapeamentos, aceitos)
+        ], session=session)
+        session.commit()
+        return {'inseridos': len(aceitos), 'erros': erros}
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+def importar_compromissos_lote(linhas):
+    """
+    Grava um lote de compromissos já validados (importacao.importar_compromissos)
+    
+    Uma consulta para os itens do lote e outra para os compromissos desses
+    itens no período do lote; estoque e duplicatas são conferidos em memória.
+    
+    Args:
+        linhas: Lista de (numero_linha, dados) com os campos de criar_compromisso
+    
+    Returns:
+        Dict com 'inseridos' e 'erros' [{'linha', 'erro'}]
+    """
+    session = get_session()
+    try:
+        item_ids = {dados['item_id'] for _, dados in linhas}
+        estoque = dict(session.query(Item.id, Item.quantidade_total).filter(Item.id.in_(item_ids)).all())
+        inicio = min(dados['data_inicio'] for _, dados in linhas)
+        fim = max(dados['data_fim'] for _, dados in linhas)
+        
+        ocupacao = {}
+        existentes = set()
+        for compromisso in session.query(Compromisso).filter(
+            Compromisso.item_id.in_(item_ids),
+            Compromisso.data_inicio <= fim,
+            Compromisso.data_fim >= inicio
+        ).all():
+            ocupacao.setdefault(compromisso.item_id, []).append((compromisso.item_id, compromisso.data_inicio, compromisso.data_fim, compromisso.quantidade))
+            existentes.add((compromisso.item_id, compromisso.data_inicio, compromisso.data_fim, compromisso.contratante or None))
+        for item_id, r_inicio, r_fim, quantidade in session.query(
+            ReservaTemporaria.item_id, ReservaTemporaria.data_inicio, ReservaTemporaria.data_fim, ReservaTemporaria.quantidade
+        ).filter(
+            ReservaTemporaria.item_id.in_(item_ids),
+            ReservaTemporaria.data_inicio <= fim,
+            ReservaTemporaria.data_fim >= inicio,
+            ReservaTemporaria.expira_em > datetime.now()
+        ):
+            ocupacao.setdefault(item_id, []).append((item_id, r_inicio, r_fim, quantidade))
+        
+        erros = []
+        aceitos = []
+        for numero, dados in linhas:
+            item_id = dados['item_id']
+            if item_id not in estoque:
+                erros.append({'linha': numero, 'erro': f"Item {item_id} não encontrado"})
+                continue
+            if (item_id, dados['data_inicio'], dados['data_fim'], dados['contratante']) in existentes:
+                erros.append({'linha': numero, 'erro': "Compromisso já cadastrado"})
+                continue
+            intervalos = ocupacao.setdefault(item_id, [])
+            disponivel = disponibilidade.picos_periodo(
+                {item_id: {'quantidade_total': estoque[item_id]}}, intervalos, [], dados['data_inicio'], dados['data_fim']
+            )[item_id]['disponivel_minimo']
+            if dados['quantidade'] > disponivel:
+                erros.append({'linha': numero, 'erro': f"Quantidade solicitada ({dados['quantidade']}) excede a disponível ({disponivel})"})
+                continue
+            # Linhas seguintes do lote enxergam esta reserva
+            intervalos.append((item_id, dados['data_inicio'], dados['data_fim'], dados['quantidade']))
+            aceitos.append(dados)
+        
+        mapeamentos = [dict(dados) for dados in aceitos]
+        session.bulk_insert_mappings(Compromisso, mapeamentos, return_defaults=True)
+        auditoria.registrar_auditoria_lote([
+            {'acao': 'CREATE', 'tabela': 'Compromissos', 'registro_id': mapeamento['id'], 'valores_novos': dados}
+            for mapeamento, dados in zip(mapeamentos, aceitos)
+        ], session=session)
+        session.commit()
+        for dados in aceitos:
+            cache_ocupacao.registrar_reserva(dados['item_id'], dados['data_inicio'], dados['data_fim'], dados['quantidade'])
+        return {'inseridos': len(aceitos), 'erros': erros}
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+# ============= EXPORTAÇÃO =============
+
+def listar_tabelas_exportacao():
+    """
+    Tabelas de dados do arquivo SQLite (inclusive auditoria); ficam de fora as
+    internas do SQLite (sqlite_*) e os índices FTS5 de busca com suas tabelas
+    de apoio (busca_itens_data, _idx...), que são derivados e guardam blobs
+    """
+    from models import get_engine
+    from sqlalchemy import inspect
+    engine = get_engine()
+    with engine.connect() as conexao:
+        virtuais = [nome for (nome,) in conexao.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'"
+        )]
+    return [
+        nome for nome in inspect(engine).get_table_names()
+        if not nome.startswith('sqlite_')
+        and not any(nome == v or nome.startswith(f'{v}_') for v in virtuais)
+    ]
+
+
+def iterar_tabela(tabela, tamanho_lote=1000):
+    """
+    Itera as linhas de uma tabela como dicts, com cursor no servidor
+    (yield_per): só tamanho_lote linhas ficam em memória por vez
+    """
+    from models import get_engine
+    from sqlalchemy import MetaData, Table, select
+    engine = get_engine()
+    tabela_sa = Table(tabela, MetaData(), autoload_with=engine)
+    consulta = select(tabela_sa).order_by(*(list(tabela_sa.primary_key.columns) or list(tabela_sa.columns)))
+    with engine.connect() as conexao:
+        resultado = conexao.execution_options(yield_per=tamanho_lote).execute(consulta)
+        for linha in resultado.mappings():
+            yield dict(linha)
+
+
+def buscar_registros(tabela, ids):
+    """Linhas (dicts) da tabela com os ids informados, em uma consulta"""
+    from models import get_engine
+    from sqlalchemy import MetaData, Table, select
+    engine = get_engine()
+    tabela_sa = Table(tabela, MetaData(), autoload_with=engine)
+    with engine.connect() as conexao:
+        return [dict(linha) for linha in conexao.execute(select(tabela_sa).where(tabela_sa.c.id.in_(list(ids)))).mappings()]
+
+
+# ============= LOG DE ALTERAÇÕES =============
+
+def _data_local(momento):
+    """updated_at é gravado em hora local sem fuso: converte datetimes com fuso"""
+    if isinstance(momento, str):
+        momento = datetime.fromisoformat(momento)
+    if momento.tzinfo is not None:
+        momento = momento.astimezone().replace(tzinfo=None)
+    return momento
+
+
+def listar_removidos(tabela, updated_since):
+    """
+    IDs apagados da tabela depois de updated_since (tombstones do log de alterações)
+    
+    Args:
+        tabela: Nome da tabela no banco (ex.: 'itens', 'contas_receber')
+        updated_since: datetime (com ou sem fuso) da última sincronização
+    """
+    session = get_session()
+    try:
+        linhas = session.query(LogAlteracao.registro_id).filter(
+            LogAlteracao.tabela == tabela,
+            LogAlteracao.operacao == 'DELETE',
+            LogAlteracao.timestamp > _data_local(updated_since)
+        ).distinct().all()
+        return [linha.registro_id for linha in linhas]
+    except Exception as e:
+        raise e
+    finally:
+        session.close()
+
+
+def listar_alteracoes(desde=0, limite=1000, compactar=False):
+    """
+    Lista as alterações com versão maior que `desde`, em ordem de versão
+    
+    Args:
+        desde: Última versão já conhecida pelo cliente (0 = desde o início)
+        limite: Máximo de alterações por página
+        compactar: Mantém só a última alteração de cada registro na página
+    
+    Returns:
+        Dict com 'alteracoes', 'versao' (use como `desde` na próxima chamada)
+        e 'tem_mais'
+    """
+    session = get_session()
+    try:
+        linhas = session.query(LogAlteracao).filter(
+            LogAlteracao.versao > int(desde or 0)
+        ).order_by(LogAlteracao.versao).limit(limite + 1).all()
+        
+        tem_mais = len(linhas) > limite
+        linhas = linhas[:limite]
+        alteracoes = [{
+            'versao': linha.versao,
+            'tabela': linha.tabela,
+            'registro_id': linha.registro_id,
+            'operacao': linha.operacao,
+            'timestamp': linha.timestamp.isoformat() if linha.timestamp else None
+        } for linha in linhas]
+        if compactar:
+            ultimas = {(a['tabela'], a['registro_id']): a for a in alteracoes}
+            alteracoes = sorted(ultimas.values(), key=lambda a: a['versao'])
+        
+        return {
+            'alteracoes': alteracoes,
+            'versao': linhas[-1].versao if linhas else int(desde or 0),
+            'tem_mais': tem_mais
+        }
+    except Exception as e:
         raise e
     finally:
         session.close()
@@ -808,15 +1516,16 @@ def criar_conta_receber(compromisso_id, descricao, valor, data_vencimento, forma
         )
         
         session.add(nova_conta)
-        session.commit()
-        session.refresh(nova_conta)
+        session.flush()
         
         auditoria.registrar_auditoria('CREATE', 'Contas a Receber', nova_conta.id, valores_novos={
             'compromisso_id': compromisso_id,
             'descricao': descricao,
             'valor': valor,
             'data_vencimento': str(data_vencimento)
-        })
+        }, session=session)
+        session.commit()
+        session.refresh(nova_conta)
         
         return nova_conta
     except Exception as e:
@@ -826,34 +1535,25 @@ def criar_conta_receber(compromisso_id, descricao, valor, data_vencimento, forma
         session.close()
 
 
-def listar_contas_receber(status=None, data_inicio=None, data_fim=None, compromisso_id=None):
+def listar_contas_receber(status=None, data_inicio=None, data_fim=None, compromisso_id=None, updated_since=None):
     """Lista contas a receber com filtros opcionais"""
     session = get_session()
     try:
         query = session.query(ContaReceber)
         
         if status:
-            query = query.filter(ContaReceber.status == status)
+            query = query.filter(ContaReceber.filtro_status(status))
         if compromisso_id:
             query = query.filter(ContaReceber.compromisso_id == compromisso_id)
         if data_inicio:
             query = query.filter(ContaReceber.data_vencimento >= data_inicio)
         if data_fim:
             query = query.filter(ContaReceber.data_vencimento <= data_fim)
+        if updated_since:
+            query = query.filter(ContaReceber.updated_at > _data_local(updated_since))
         
-        contas = query.all()
-        
-        # Recalcula status para garantir consist├¬ncia
-        hoje = date.today()
-        for conta in contas:
-            if conta.data_pagamento:
-                conta.status = 'Pago'
-            elif conta.data_vencimento < hoje:
-                conta.status = 'Vencido'
-            else:
-                conta.status = 'Pendente'
-        
-        return contas
+        # status é calculado na leitura (StatusCalculadoMixin)
+        return query.all()
     except Exception as e:
         raise e
     finally:
@@ -868,6 +1568,7 @@ def atualizar_conta_receber(conta_id, descricao=None, valor=None, data_venciment
         if not conta:
             return None
         
+        contribuicao_antiga = _contribuicao_fluxo(conta)
         valores_antigos = {
             'descricao': conta.descricao,
             'valor': conta.valor,
@@ -902,8 +1603,8 @@ def atualizar_conta_receber(conta_id, descricao=None, valor=None, data_venciment
         else:
             conta.status = 'Pendente'
         
-        session.commit()
-        session.refresh(conta)
+        _ajustar_fluxo_caixa(session, 'receitas', contribuicao_antiga, -1)
+        _ajustar_fluxo_caixa(session, 'receitas', _contribuicao_fluxo(conta), 1)
         
         auditoria.registrar_auditoria('UPDATE', 'Contas a Receber', conta_id, valores_antigos=valores_antigos, valores_novos={
             'descricao': conta.descricao,
@@ -911,7 +1612,9 @@ def atualizar_conta_receber(conta_id, descricao=None, valor=None, data_venciment
             'data_vencimento': str(conta.data_vencimento),
             'data_pagamento': str(conta.data_pagamento) if conta.data_pagamento else None,
             'status': conta.status
-        })
+        }, session=session)
+        session.commit()
+        session.refresh(conta)
         
         return conta
     except Exception as e:
@@ -942,11 +1645,11 @@ def deletar_conta_receber(conta_id):
             'valor': conta.valor
         }
         
+        _ajustar_fluxo_caixa(session, 'receitas', _contribuicao_fluxo(conta), -1)
         session.delete(conta)
+        auditoria.registrar_auditoria('DELETE', 'Contas a Receber', conta_id, valores_antigos=valores_antigos, session=session)
         session.commit()
         
-        auditoria.registrar_auditoria('DELETE', 'Contas a Receber', conta_id, valores_antigos=valores_antigos)
-        
         return True
     except Exception as e:
         session.rollback()
@@ -985,15 +1688,16 @@ def criar_conta_pagar(descricao, categoria, valor, data_vencimento, fornecedor=N
         )
         
         session.add(nova_conta)
-        session.commit()
-        session.refresh(nova_conta)
+        session.flush()
         
         auditoria.registrar_auditoria('CREATE', 'Contas a Pagar', nova_conta.id, valores_novos={
             'descricao': descricao,
             'categoria': categoria,
             'valor': valor,
             'data_vencimento': str(data_vencimento)
-        })
+        }, session=session)
+        session.commit()
+        session.refresh(nova_conta)
         
         return nova_conta
     except Exception as e:
@@ -1003,34 +1707,25 @@ def criar_conta_pagar(descricao, categoria, valor, data_vencimento, fornecedor=N
         session.close()
 
 
-def listar_contas_pagar(status=None, data_inicio=None, data_fim=None, categoria=None):
+def listar_contas_pagar(status=None, data_inicio=None, data_fim=None, categoria=None, updated_since=None):
     """Lista contas a pagar com filtros opcionais"""
     session = get_session()
     try:
         query = session.query(ContaPagar)
         
         if status:
-            query = query.filter(ContaPagar.status == status)
+            query = query.filter(ContaPagar.filtro_status(status))
         if categoria:
             query = query.filter(ContaPagar.categoria == categoria)
         if data_inicio:
             query = query.filter(ContaPagar.data_vencimento >= data_inicio)
         if data_fim:
             query = query.filter(ContaPagar.data_vencimento <= data_fim)
+        if updated_since:
+            query = query.filter(ContaPagar.updated_at > _data_local(updated_since))
         
-        contas = query.all()
-        
-        # Recalcula status para garantir consist├¬ncia
-        hoje = date.today()
-        for conta in contas:
-            if conta.data_pagamento:
-                conta.status = 'Pago'
-            elif conta.data_vencimento < hoje:
-                conta.status = 'Vencido'
-            else:
-                conta.status = 'Pendente'
-        
-        return contas
+        # status é calculado na leitura (StatusCalculadoMixin)
+        return query.all()
     except Exception as e:
         raise e
     finally:
@@ -1045,6 +1740,7 @@ def atualizar_conta_pagar(conta_id, descricao=None, categoria=None, valor=None,
         if not conta:
             return None
         
+        contribuicao_antiga = _contribuicao_fluxo(conta)
         valores_antigos = {
             'descricao': conta.descricao,
             'categoria': conta.categoria,
@@ -1086,8 +1782,8 @@ def atualizar_conta_pagar(conta_id, descricao=None, categoria=None, valor=None,
         else:
             conta.status = 'Pendente'
         
-        session.commit()
-        session.refresh(conta)
+        _ajustar_fluxo_caixa(session, 'despesas', contribuicao_antiga, -1)
+        _ajustar_fluxo_caixa(session, 'despesas', _contribuicao_fluxo(conta), 1)
         
         auditoria.registrar_auditoria('UPDATE', 'Contas a Pagar', conta_id, valores_antigos=valores_antigos, valores_novos={
             'descricao': conta.descricao,
@@ -1096,7 +1792,9 @@ def atualizar_conta_pagar(conta_id, descricao=None, categoria=None, valor=None,
             'data_vencimento': str(conta.data_vencimento),
             'data_pagamento': str(conta.data_pagamento) if conta.data_pagamento else None,
             'status': conta.status
-        })
+        }, session=session)
+        session.commit()
+        session.refresh(conta)
         
         return conta
     except Exception as e:
@@ -1127,11 +1825,11 @@ def deletar_conta_pagar(conta_id):
             'valor': conta.valor
         }
         
+        _ajustar_fluxo_caixa(session, 'despesas', _contribuicao_fluxo(conta), -1)
         session.delete(conta)
+        auditoria.registrar_auditoria('DELETE', 'Contas a Pagar', conta_id, valores_antigos=valores_antigos, session=session)
         session.commit()
         
-        auditoria.registrar_auditoria('DELETE', 'Contas a Pagar', conta_id, valores_antigos=valores_antigos)
-        
         return True
     except Exception as e:
         session.rollback()
@@ -1140,6 +1838,98 @@ def deletar_conta_pagar(conta_id):
         session.close()
 
 
+# ============= ATUALIZAÇÃO DE STATUS =============
+
+def atualizar_status_vencidos(data_referencia=None):
+    """
+    Grava 'Vencido'/'Atrasada' nas contas e parcelas pendentes que venceram
+    
+    Um UPDATE por tabela; o status calculado na leitura já considera a data,
+    isto mantém a coluna gravada em dia para relatórios e filtros indexados.
+    
+    Args:
+        data_referencia: Data usada como "hoje" (padrão: date.today())
+    
+    Returns:
+        Dict com o número de linhas atualizadas por tabela
+    """
+    hoje = data_referencia or date.today()
+    session = get_session()
+    try:
+        contagens = {}
+        for modelo, novo_status in ((ContaReceber, 'Vencido'), (ContaPagar, 'Vencido'), (ParcelaFinanciamento, 'Atrasada')):
+            contagens[modelo.__tablename__] = session.query(modelo).filter(
+                modelo.status_armazenado == 'Pendente',
+                ~modelo._condicao_quitada(),
+                modelo.data_vencimento < hoje
+            ).update({modelo.status_armazenado: novo_status}, synchronize_session=False)
+        session.commit()
+        return contagens
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+# ============= FLUXO DE CAIXA MENSAL =============
+
+def _contribuicao_fluxo(conta):
+    """Retorna (mes, valor) que a conta soma ao fluxo de caixa, ou None se ainda não foi paga"""
+    if not conta.data_pagamento:
+        return None
+    return conta.data_pagamento.strftime('%Y-%m'), float(conta.valor or 0.0)
+
+
+def _ajustar_fluxo_caixa(session, coluna, contribuicao, sinal):
+    """
+    Soma (sinal=1) ou subtrai (sinal=-1) uma contribuição no resumo mensal,
+    dentro da mesma sessão/transação da alteração da conta
+    
+    Args:
+        coluna: 'receitas' (contas a receber) ou 'despesas' (contas a pagar)
+        contribuicao: Retorno de _contribuicao_fluxo
+    """
+    if not contribuicao:
+        return
+    mes, valor = contribuicao
+    linha = session.get(FluxoCaixaMensal, mes)
+    if linha is None:
+        linha = FluxoCaixaMensal(mes=mes, receitas=0.0, despesas=0.0)
+        session.add(linha)
+    setattr(linha, coluna, round((getattr(linha, coluna) or 0.0) + sinal * valor, 2))
+
+
+def reconstruir_fluxo_caixa():
+    """
+    Recalcula o resumo mensal do fluxo de caixa a partir das contas pagas
+    
+    Returns:
+        Número de meses gravados
+    """
+    session = get_session()
+    try:
+        fluxo = {}
+        for modelo, coluna in ((ContaReceber, 'receitas'), (ContaPagar, 'despesas')):
+            mes = func.strftime('%Y-%m', modelo.data_pagamento)
+            linhas = session.query(mes, func.sum(modelo.valor)).filter(
+                modelo.data_pagamento.isnot(None)
+            ).group_by(mes).all()
+            for mes_valor, total in linhas:
+                fluxo.setdefault(mes_valor, {'mes': mes_valor, 'receitas': 0.0, 'despesas': 0.0})
+                fluxo[mes_valor][coluna] = round(total or 0.0, 2)
+        
+        session.query(FluxoCaixaMensal).delete()
+        session.bulk_insert_mappings(FluxoCaixaMensal, list(fluxo.values()))
+        session.commit()
+        return len(fluxo)
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
 # ============= FUN├ç├òES DE C├üLCULO FINANCEIRO =============
 
 def calcular_saldo_periodo(data_inicio, data_fim):
@@ -1160,37 +1950,33 @@ def calcular_saldo_periodo(data_inicio, data_fim):
 
 
 def obter_fluxo_caixa(data_inicio, data_fim):
-    """Retorna fluxo de caixa por per├¡odo (agrupado por m├¬s)"""
-    receitas = listar_contas_receber(data_inicio=data_inicio, data_fim=data_fim)
-    despesas = listar_contas_pagar(data_inicio=data_inicio, data_fim=data_fim)
-    
-    fluxo = {}
-    
-    for conta in receitas:
-        if conta.status == 'Pago':
-            mes = conta.data_pagamento.strftime('%Y-%m') if conta.data_pagamento else conta.data_vencimento.strftime('%Y-%m')
-            if mes not in fluxo:
-                fluxo[mes] = {'receitas': 0, 'despesas': 0}
-            fluxo[mes]['receitas'] += conta.valor
-    
-    for conta in despesas:
-        if conta.status == 'Pago':
-            mes = conta.data_pagamento.strftime('%Y-%m') if conta.data_pagamento else conta.data_vencimento.strftime('%Y-%m')
-            if mes not in fluxo:
-                fluxo[mes] = {'receitas': 0, 'despesas': 0}
-            fluxo[mes]['despesas'] += conta.valor
-    
-    # Converte para lista ordenada
-    resultado = []
-    for mes in sorted(fluxo.keys()):
-        resultado.append({
-            'mes': mes,
-            'receitas': fluxo[mes]['receitas'],
-            'despesas': fluxo[mes]['despesas'],
-            'saldo': fluxo[mes]['receitas'] - fluxo[mes]['despesas']
-        })
+    """
+    Retorna fluxo de caixa por período (agrupado por mês)
     
-    return resultado
+    Lê o resumo mensal mantido incrementalmente pelas funções de contas; o
+    período filtra pelo mês do pagamento.
+    """
+    session = get_session()
+    try:
+        linhas = session.query(FluxoCaixaMensal).filter(
+            FluxoCaixaMensal.mes >= data_inicio.strftime('%Y-%m'),
+            FluxoCaixaMensal.mes <= data_fim.strftime('%Y-%m')
+        ).order_by(FluxoCaixaMensal.mes).all()
+        
+        return [
+            {
+                'mes': linha.mes,
+                'receitas': linha.receitas,
+                'despesas': linha.despesas,
+                'saldo': linha.receitas - linha.despesas
+            }
+            for linha in linhas
+            if linha.receitas or linha.despesas
+        ]
+    except Exception as e:
+        raise e
+    finally:
+        session.close()
 
 
 # ============= FINANCIAMENTOS =============
@@ -1304,15 +2090,16 @@ def criar_financiamento(item_id, valor_total, numero_parcelas, taxa_juros, data_
                 )
                 session.add(parcela)
         
-        session.commit()
-        session.refresh(financiamento)
+        session.flush()
         
         auditoria.registrar_auditoria('CREATE', 'Financiamentos', financiamento.id, valores_novos={
             'item_id': item_id,
             'valor_total': valor_total,
             'valor_entrada': valor_entrada,
             'numero_parcelas': numero_parcelas
-        })
+        }, session=session)
+        session.commit()
+        session.refresh(financiamento)
         
         return financiamento
     except Exception as e:
@@ -1322,17 +2109,57 @@ def criar_financiamento(item_id, valor_total, numero_parcelas, taxa_juros, data_
         session.close()
 
 
-def listar_financiamentos(status=None, item_id=None):
-    """Lista financiamentos com filtros opcionais"""
+def listar_financiamentos(status=None, item_id=None, updated_since=None, q=None, pagina=None, por_pagina=10,
+                          after_id=None, count='exact'):
+    """Lista financiamentos com filtros opcionais
+    
+    Com q, busca textual (instituição, observações e nome do item) em ordem de relevância.
+    
+    Com pagina ou after_id, devolve uma página (do mais novo ao mais antigo) no
+    formato do Supabase: {'data', 'total', 'proximo_after_id'}. after_id é o cursor
+    (id < after_id), com custo igual em qualquer página; com cursor, total conta
+    só o que vem a partir dele. count='none' pula o COUNT ('planned' conta
+    normalmente: o SQLite não tem estimativa do planejador).
+    """
+    if count not in ('exact', 'planned', 'none'):
+        raise ValueError("count deve ser um de: exact, planned, none")
     session = get_session()
     try:
         query = session.query(Financiamento)
+        ordem = None
+        if q:
+            query, ordem = _filtrar_busca_texto(session, query, Financiamento, q)
         
         if status:
             query = query.filter(Financiamento.status == status)
         if item_id:
             query = query.filter(Financiamento.item_id == item_id)
+        if updated_since:
+            # Pagar uma parcela também muda o financiamento na listagem
+            parcelas_alteradas = session.query(ParcelaFinanciamento.financiamento_id).filter(
+                ParcelaFinanciamento.updated_at > _data_local(updated_since)
+            )
+            query = query.filter(or_(
+                Financiamento.updated_at > _data_local(updated_since),
+                Financiamento.id.in_(parcelas_alteradas)
+            ))
+        
+        if pagina is not None or after_id is not None:
+            if after_id is not None:
+                query = query.filter(Financiamento.id < after_id)
+            total = None if count == 'none' else query.count()
+            query = query.order_by(Financiamento.id.desc())
+            if after_id is None:
+                query = query.offset((pagina - 1) * por_pagina)
+            dados = query.limit(por_pagina).all()
+            return {
+                'data': dados,
+                'total': total,
+                'proximo_after_id': dados[-1].id if len(dados) == por_pagina else None
+            }
         
+        if ordem is not None:
+            query = query.order_by(ordem)
         return query.all()
     except Exception as e:
         raise e
@@ -1376,14 +2203,13 @@ def atualizar_financiamento(financiamento_id, valor_total=None, taxa_juros=None,
         if observacoes is not None:
             financiamento.observacoes = observacoes
         
-        session.commit()
-        session.refresh(financiamento)
-        
         auditoria.registrar_auditoria('UPDATE', 'Financiamentos', financiamento_id, valores_antigos=valores_antigos, valores_novos={
             'valor_total': financiamento.valor_total,
             'taxa_juros': financiamento.taxa_juros,
             'status': financiamento.status
-        })
+        }, session=session)
+        session.commit()
+        session.refresh(financiamento)
         
         return financiamento
     except Exception as e:
@@ -1406,11 +2232,18 @@ def deletar_financiamento(financiamento_id):
             'valor_total': financiamento.valor_total
         }
         
+        cascata = [
+            {'acao': 'DELETE', 'tabela': 'Parcelas Financiamento', 'registro_id': parcela.id}
+            for parcela in financiamento.parcelas
+        ]
+        
         session.delete(financiamento)  # Cascade deleta parcelas automaticamente
+        auditoria.registrar_auditoria_lote(
+            [{'acao': 'DELETE', 'tabela': 'Financiamentos', 'registro_id': financiamento_id, 'valores_antigos': valores_antigos}] + cascata,
+            session=session
+        )
         session.commit()
         
-        auditoria.registrar_auditoria('DELETE', 'Financiamentos', financiamento_id, valores_antigos=valores_antigos)
-        
         return True
     except Exception as e:
         session.rollback()
@@ -1419,8 +2252,8 @@ def deletar_financiamento(financiamento_id):
         session.close()
 
 
-def listar_parcelas_financiamento(financiamento_id=None, status=None):
-    """Lista parcelas de financiamento com filtros opcionais"""
+def listar_parcelas_financiamento(financiamento_id=None, status=None, data_inicio=None, data_fim=None):
+    """Lista parcelas de financiamento com filtros opcionais (data_inicio/data_fim: vencimento)"""
     session = get_session()
     try:
         query = session.query(ParcelaFinanciamento)
@@ -1428,29 +2261,83 @@ def listar_parcelas_financiamento(financiamento_id=None, status=None):
         if financiamento_id:
             query = query.filter(ParcelaFinanciamento.financiamento_id == financiamento_id)
         if status:
-            query = query.filter(ParcelaFinanciamento.status == status)
-        
-        parcelas = query.all()
-        
-        # Recalcula status para garantir consist├¬ncia
-        hoje = date.today()
-        for parcela in parcelas:
-            if parcela.valor_pago >= parcela.valor_original:
-                parcela.status = 'Paga'
-            elif parcela.data_vencimento < hoje:
-                parcela.status = 'Atrasada'
-            else:
-                parcela.status = 'Pendente'
+            query = query.filter(ParcelaFinanciamento.filtro_status(status))
+        if data_inicio:
+            query = query.filter(ParcelaFinanciamento.data_vencimento >= data_inicio)
+        if data_fim:
+            query = query.filter(ParcelaFinanciamento.data_vencimento <= data_fim)
         
-        return parcelas
+        # status é calculado na leitura (StatusCalculadoMixin)
+        return query.all()
     except Exception as e:
         raise e
     finally:
         session.close()
 
 
-def pagar_parcela_financiamento(parcela_id, valor_pago, data_pagamento=None, juros=0.0, multa=0.0, desconto=0.0):
-    """Registra pagamento de uma parcela"""
+def _aplicar_pagamento_parcela(parcela, valor_pago, data_pagamento, juros=0.0, multa=0.0, desconto=0.0):
+    """Aplica o pagamento no objeto da sessão e devolve (valores_antigos, valores_novos) para auditoria"""
+    if isinstance(data_pagamento, str):
+        data_pagamento = datetime.strptime(data_pagamento[:10], '%Y-%m-%d').date()
+    
+    valores_antigos = {
+        'valor_pago': parcela.valor_pago,
+        'data_pagamento': str(parcela.data_pagamento) if parcela.data_pagamento else None
+    }
+    
+    valor_pago_total = float(valor_pago) + float(juros or 0.0) + float(multa or 0.0) - float(desconto or 0.0)
+    parcela.valor_pago = valor_pago_total
+    parcela.data_pagamento = data_pagamento
+    parcela.juros = float(juros or 0.0)
+    parcela.multa = float(multa or 0.0)
+    parcela.desconto = float(desconto or 0.0)
+    parcela.status = 'Paga' if valor_pago_total >= parcela.valor_original else 'Pendente'
+    
+    return valores_antigos, {'valor_pago': valor_pago_total, 'data_pagamento': str(data_pagamento)}
+
+
+def _quitar_financiamentos(session, financiamento_ids):
+    """
+    Marca como Quitado os financiamentos sem parcelas em aberto, na mesma transação
+    
+    Uma consulta COUNT agrupada para todos os financiamentos informados.
+    
+    Returns:
+        Lista de ids de financiamentos quitados agora
+    """
+    financiamento_ids = set(financiamento_ids)
+    if not financiamento_ids:
+        return []
+    session.flush()
+    
+    em_aberto = {
+        financiamento_id for financiamento_id, _ in session.query(
+            ParcelaFinanciamento.financiamento_id, func.count(ParcelaFinanciamento.id)
+        ).filter(
+            ParcelaFinanciamento.financiamento_id.in_(financiamento_ids),
+            ~ParcelaFinanciamento._condicao_quitada()
+        ).group_by(ParcelaFinanciamento.financiamento_id).all()
+    }
+    quitados = [
+        financiamento_id for (financiamento_id,) in session.query(Financiamento.id).filter(
+            Financiamento.id.in_(financiamento_ids - em_aberto),
+            Financiamento.status != 'Quitado'
+        ).all()
+    ]
+    if quitados:
+        session.query(Financiamento).filter(Financiamento.id.in_(quitados)).update(
+            {Financiamento.status: 'Quitado'}, synchronize_session=False
+        )
+    return quitados
+
+
+def pagar_parcela_financiamento(parcela_id, valor_pago, data_pagamento=None, juros=0.0, multa=0.0, desconto=0.0, link_comprovante=None):
+    """
+    Registra pagamento de uma parcela
+    
+    A verificação de quitação do financiamento roda na mesma sessão/transação.
+    link_comprovante é aceito por compatibilidade com o Supabase (o SQLite não tem a coluna).
+    """
     if data_pagamento is None:
         data_pagamento = date.today()
     
@@ -1460,39 +2347,180 @@ def pagar_parcela_financiamento(parcela_id, valor_pago, data_pagamento=None, jur
         if not parcela:
             return None
         
-        valores_antigos = {
-            'valor_pago': parcela.valor_pago,
-            'data_pagamento': str(parcela.data_pagamento) if parcela.data_pagamento else None
-        }
-        
-        valor_pago_total = float(valor_pago) + float(juros) + float(multa) - float(desconto)
-        parcela.valor_pago = valor_pago_total
-        parcela.data_pagamento = data_pagamento
-        parcela.juros = float(juros)
-        parcela.multa = float(multa)
-        parcela.desconto = float(desconto)
-        
-        # Atualiza status
-        if valor_pago_total >= parcela.valor_original:
-            parcela.status = 'Paga'
-        else:
-            parcela.status = 'Pendente'
+        valores_antigos, valores_novos = _aplicar_pagamento_parcela(parcela, valor_pago, data_pagamento, juros, multa, desconto)
+        quitados = _quitar_financiamentos(session, [parcela.financiamento_id])
         
+        auditoria.registrar_auditoria_lote(
+            [{'acao': 'UPDATE', 'tabela': 'Parcelas Financiamento', 'registro_id': parcela_id,
+              'valores_antigos': valores_antigos, 'valores_novos': valores_novos}]
+            + [{'acao': 'UPDATE', 'tabela': 'Financiamentos', 'registro_id': financiamento_id, 'valores_novos': {'status': 'Quitado'}}
+               for financiamento_id in quitados],
+            session=session
+        )
         session.commit()
         session.refresh(parcela)
+        session.expunge(parcela)
         
-        # Verifica se financiamento foi quitado
-        parcelas = listar_parcelas_financiamento(financiamento_id=parcela.financiamento_id)
-        todas_pagas = all(p.status == 'Paga' for p in parcelas)
-        if todas_pagas:
-            atualizar_financiamento(parcela.financiamento_id, status='Quitado')
+        return parcela
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+def pagar_parcelas_financiamento(pagamentos):
+    """
+    Registra o pagamento de várias parcelas em uma única transação
+    (ex.: baixa a partir de um extrato bancário)
+    
+    Args:
+        pagamentos: Lista de dicts com parcela_id, valor_pago e opcionalmente
+                    data_pagamento, juros, multa, desconto
+    
+    Returns:
+        Dict com 'parcelas' (objetos atualizados) e 'financiamentos_quitados' (ids)
+    
+    Raises:
+        ValueError: Se alguma parcela não existir (nada é gravado)
+    """
+    if not pagamentos:
+        return {'parcelas': [], 'financiamentos_quitados': []}
+    
+    session = get_session()
+    try:
+        ids = [int(p['parcela_id']) for p in pagamentos]
+        parcelas = {
+            parcela.id: parcela
+            for parcela in session.query(ParcelaFinanciamento).filter(ParcelaFinanciamento.id.in_(ids)).all()
+        }
+        faltando = sorted(set(ids) - set(parcelas))
+        if faltando:
+            raise ValueError(f"Parcelas não encontradas: {faltando}")
+        
+        auditorias = []
+        for pagamento in pagamentos:
+            parcela = parcelas[int(pagamento['parcela_id'])]
+            valores_antigos, valores_novos = _aplicar_pagamento_parcela(
+                parcela,
+                pagamento['valor_pago'],
+                pagamento.get('data_pagamento') or date.today(),
+                pagamento.get('juros', 0.0),
+                pagamento.get('multa', 0.0),
+                pagamento.get('desconto', 0.0)
+            )
+            auditorias.append((parcela.id, valores_antigos, valores_novos))
+        
+        quitados = _quitar_financiamentos(session, {p.financiamento_id for p in parcelas.values()})
+        auditoria.registrar_auditoria_lote(
+            [{'acao': 'UPDATE', 'tabela': 'Parcelas Financiamento', 'registro_id': parcela_id,
+              'valores_antigos': valores_antigos, 'valores_novos': valores_novos}
+             for parcela_id, valores_antigos, valores_novos in auditorias]
+            + [{'acao': 'UPDATE', 'tabela': 'Financiamentos', 'registro_id': financiamento_id, 'valores_novos': {'status': 'Quitado'}}
+               for financiamento_id in quitados],
+            session=session
+        )
+        session.commit()
         
-        auditoria.registrar_auditoria('UPDATE', 'Parcelas Financiamento', parcela_id, valores_antigos=valores_antigos, valores_novos={
-            'valor_pago': valor_pago_total,
-            'data_pagamento': str(data_pagamento)
-        })
+        for parcela in parcelas.values():
+            session.refresh(parcela)
+            session.expunge(parcela)
         
-        return parcela
+        return {'parcelas': list(parcelas.values()), 'financiamentos_quitados': quitados}
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+def aplicar_baixas_lote(baixas):
+    """
+    Baixa várias contas e parcelas em uma única transação, com uma única
+    escrita de auditoria (usado pela conciliação de extrato bancário)
+    
+    Args:
+        baixas: Lista de dicts com tipo ('receber', 'pagar' ou 'parcela'), id,
+                valor, data_pagamento e opcionalmente forma_pagamento
+    
+    Returns:
+        Dict com o número de baixas por tipo e 'financiamentos_quitados' (ids)
+    
+    Raises:
+        ValueError: Se algum registro não existir ou o tipo for inválido (nada é gravado)
+    """
+    resultado = {'receber': 0, 'pagar': 0, 'parcela': 0, 'financiamentos_quitados': []}
+    if not baixas:
+        return resultado
+    
+    modelos = {
+        'receber': (ContaReceber, 'receitas', 'Contas a Receber'),
+        'pagar': (ContaPagar, 'despesas', 'Contas a Pagar'),
+        'parcela': (ParcelaFinanciamento, None, 'Parcelas Financiamento'),
+    }
+    tipos_invalidos = sorted({b['tipo'] for b in baixas} - set(modelos))
+    if tipos_invalidos:
+        raise ValueError(f"Tipos de baixa inválidos: {tipos_invalidos}")
+    
+    session = get_session()
+    try:
+        # Um SELECT ... IN por tabela
+        registros = {}
+        for tipo, (modelo, _, _) in modelos.items():
+            ids = {int(b['id']) for b in baixas if b['tipo'] == tipo}
+            if not ids:
+                continue
+            encontrados = {r.id: r for r in session.query(modelo).filter(modelo.id.in_(ids)).all()}
+            faltando = sorted(ids - set(encontrados))
+            if faltando:
+                raise ValueError(f"{modelos[tipo][2]} não encontradas: {faltando}")
+            registros[tipo] = encontrados
+        
+        auditorias = []
+        financiamento_ids = set()
+        for baixa in baixas:
+            tipo = baixa['tipo']
+            modelo, coluna_fluxo, tabela = modelos[tipo]
+            registro = registros[tipo][int(baixa['id'])]
+            data_pagamento = baixa.get('data_pagamento') or date.today()
+            if isinstance(data_pagamento, str):
+                data_pagamento = datetime.strptime(data_pagamento[:10], '%Y-%m-%d').date()
+            
+            if tipo == 'parcela':
+                # O lançamento casa com o valor em aberto: soma ao que já foi pago
+                valor_pago = float(registro.valor_pago or 0.0) + float(baixa['valor'])
+                valores_antigos, valores_novos = _aplicar_pagamento_parcela(registro, valor_pago, data_pagamento)
+                financiamento_ids.add(registro.financiamento_id)
+            else:
+                contribuicao_antiga = _contribuicao_fluxo(registro)
+                valores_antigos = {
+                    'data_pagamento': str(registro.data_pagamento) if registro.data_pagamento else None,
+                    'status': registro.status
+                }
+                registro.data_pagamento = data_pagamento
+                registro.status = 'Pago'
+                if baixa.get('forma_pagamento'):
+                    registro.forma_pagamento = baixa['forma_pagamento']
+                _ajustar_fluxo_caixa(session, coluna_fluxo, contribuicao_antiga, -1)
+                _ajustar_fluxo_caixa(session, coluna_fluxo, _contribuicao_fluxo(registro), 1)
+                valores_novos = {'data_pagamento': str(data_pagamento), 'status': 'Pago'}
+            
+            resultado[tipo] += 1
+            auditorias.append({
+                'acao': 'UPDATE', 'tabela': tabela, 'registro_id': registro.id,
+                'valores_antigos': valores_antigos, 'valores_novos': valores_novos
+            })
+        
+        quitados = _quitar_financiamentos(session, financiamento_ids)
+        auditorias.extend(
+            {'acao': 'UPDATE', 'tabela': 'Financiamentos', 'registro_id': financiamento_id, 'valores_novos': {'status': 'Quitado'}}
+            for financiamento_id in quitados
+        )
+        auditoria.registrar_auditoria_lote(auditorias, session=session)
+        session.commit()
+        
+        resultado['financiamentos_quitados'] = quitados
+        return resultado
     except Exception as e:
         session.rollback()
         raise e
@@ -1524,15 +2552,14 @@ def atualizar_parcela_financiamento(parcela_id, status=None, link_boleto=None, v
         if data_vencimento is not None:
             parcela.data_vencimento = data_vencimento
         
-        session.commit()
-        session.refresh(parcela)
-        
         auditoria.registrar_auditoria('UPDATE', 'Parcelas Financiamento', parcela_id, valores_antigos=valores_antigos, valores_novos={
             'status': parcela.status,
             'link_boleto': parcela.link_boleto if hasattr(parcela, 'link_boleto') else None,
             'valor_original': parcela.valor_original,
             'data_vencimento': str(parcela.data_vencimento)
-        })
+        }, session=session)
+        session.commit()
+        session.refresh(parcela)
         
         return parcela
     except Exception as e:
@@ -1572,8 +2599,16 @@ def criar_peca_carro(peca_id, carro_id, quantidade=1, data_instalacao=None, obse
         )
         
         session.add(associacao)
+        session.flush()
+        
+        auditoria.registrar_auditoria('CREATE', 'Pecas_Carros', associacao.id, valores_novos={
+            'peca_id': peca_id,
+            'carro_id': carro_id,
+            'quantidade': quantidade
+        }, session=session)
         session.commit()
         session.refresh(associacao)
+        cache_ocupacao.registrar_instalacao(peca_id, associacao.data_instalacao, quantidade)
         
         # Carrega relacionamentos
         if associacao.peca:
@@ -1582,12 +2617,6 @@ def criar_peca_carro(peca_id, carro_id, quantidade=1, data_instalacao=None, obse
             session.expunge(associacao.carro)
         session.expunge(associacao)
         
-        auditoria.registrar_auditoria('CREATE', 'Pecas_Carros', associacao.id, valores_novos={
-            'peca_id': peca_id,
-            'carro_id': carro_id,
-            'quantidade': quantidade
-        })
-        
         return associacao
     except Exception as e:
         session.rollback()
@@ -1662,6 +2691,8 @@ def atualizar_peca_carro(associacao_id, quantidade=None, data_instalacao=None, o
             'observacoes': associacao.observacoes
         }
         
+        instalacao_antiga = (associacao.data_instalacao, associacao.quantidade)
+        
         if quantidade is not None:
             associacao.quantidade = quantidade
         if data_instalacao is not None:
@@ -1669,8 +2700,15 @@ def atualizar_peca_carro(associacao_id, quantidade=None, data_instalacao=None, o
         if observacoes is not None:
             associacao.observacoes = observacoes
         
+        auditoria.registrar_auditoria('UPDATE', 'Pecas_Carros', associacao_id, valores_antigos=valores_antigos, valores_novos={
+            'quantidade': associacao.quantidade,
+            'data_instalacao': str(associacao.data_instalacao) if associacao.data_instalacao else None,
+            'observacoes': associacao.observacoes
+        }, session=session)
         session.commit()
         session.refresh(associacao)
+        cache_ocupacao.registrar_instalacao(associacao.peca_id, instalacao_antiga[0], -instalacao_antiga[1])
+        cache_ocupacao.registrar_instalacao(associacao.peca_id, associacao.data_instalacao, associacao.quantidade)
         
         if associacao.peca:
             session.expunge(associacao.peca)
@@ -1678,12 +2716,6 @@ def atualizar_peca_carro(associacao_id, quantidade=None, data_instalacao=None, o
             session.expunge(associacao.carro)
         session.expunge(associacao)
         
-        auditoria.registrar_auditoria('UPDATE', 'Pecas_Carros', associacao_id, valores_antigos=valores_antigos, valores_novos={
-            'quantidade': associacao.quantidade,
-            'data_instalacao': str(associacao.data_instalacao) if associacao.data_instalacao else None,
-            'observacoes': associacao.observacoes
-        })
-        
         return associacao
     except Exception as e:
         session.rollback()
@@ -1706,10 +2738,11 @@ def deletar_peca_carro(associacao_id):
             'quantidade': associacao.quantidade
         }
         
+        instalacao = (associacao.peca_id, associacao.data_instalacao, associacao.quantidade)
         session.delete(associacao)
+        auditoria.registrar_auditoria('DELETE', 'Pecas_Carros', associacao_id, valores_antigos=valores_antigos, session=session)
         session.commit()
-        
-        auditoria.registrar_auditoria('DELETE', 'Pecas_Carros', associacao_id, valores_antigos=valores_antigos)
+        cache_ocupacao.registrar_instalacao(instalacao[0], instalacao[1], -instalacao[2])
         
         return True
     except Exception as e:
@@ -1717,3 +2750,99 @@ def deletar_peca_carro(associacao_id):
         raise e
     finally:
         session.close()
+
+
+# ============= SESSÕES =============
+
+def revogar_token(jti, expira_em):
+    """Grava o jti de um token encerrado (logout) até expira_em (epoch) e limpa os já vencidos"""
+    session = get_session()
+    try:
+        session.query(TokenRevogado).filter(TokenRevogado.expira_em <= int(time.time())).delete(synchronize_session=False)
+        session.merge(TokenRevogado(jti=jti, expira_em=int(expira_em)))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+def listar_tokens_revogados():
+    """[(jti, expira_em)] dos tokens revogados que ainda não venceriam"""
+    session = get_session()
+    try:
+        linhas = session.query(TokenRevogado.jti, TokenRevogado.expira_em).filter(
+            TokenRevogado.expira_em > int(time.time())
+        )
+        return [tuple(linha) for linha in linhas]
+    finally:
+        session.close()
+
+
+# ============= LEITURAS SOMBRA =============
+
+DIAS_RETENCAO_LEITURAS_SOMBRA = 30
+
+
+def registrar_leitura_sombra(**dados):
+    """Grava uma comparação do modo sombra (colunas de LeituraSombra) e descarta as mais antigas que a retenção"""
+    session = get_session()
+    try:
+        limite = datetime.now() - timedelta(days=DIAS_RETENCAO_LEITURAS_SOMBRA)
+        session.query(LeituraSombra).filter(LeituraSombra.criado_em < limite).delete(synchronize_session=False)
+        session.add(LeituraSombra(**dados))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+def _percentil(valores, p):
+    """Percentil por posição (valores já ordenados); None se vazio"""
+    if not valores:
+        return None
+    return round(valores[min(len(valores) - 1, int(len(valores) * p))], 1)
+
+
+def resumo_leituras_sombra(desde=None, rota=None):
+    """
+    Por rota: leituras, divergências e latência (p50/p95 em ms) de cada backend,
+    com o mais rápido pela mediana. Cada leitura conta para os dois backends,
+    seja qual for o que atendeu o cliente.
+    """
+    session = get_session()
+    try:
+        query = session.query(LeituraSombra)
+        if desde is not None:
+            query = query.filter(LeituraSombra.criado_em >= _data_local(desde))
+        if rota:
+            query = query.filter(LeituraSombra.rota == rota)
+        grupos = {}
+        for leitura in query.order_by(LeituraSombra.id):
+            g = grupos.setdefault(leitura.rota, {
+                'leituras': 0, 'divergentes': 0, 'sem_comparacao': 0, 'ultima_diferenca': None, 'ms': {},
+            })
+            g['leituras'] += 1
+            if leitura.iguais is None:
+                g['sem_comparacao'] += 1
+            elif not leitura.iguais:
+                g['divergentes'] += 1
+                g['ultima_diferenca'] = leitura.diferenca
+            g['ms'].setdefault(leitura.primario, []).append(leitura.ms_primario)
+            if leitura.ms_secundario is not None:
+                g['ms'].setdefault(leitura.secundario, []).append(leitura.ms_secundario)
+    finally:
+        session.close()
+
+    resumo = []
+    for nome_rota, g in sorted(grupos.items()):
+        latencias = {}
+        for backend, valores in g.pop('ms').items():
+            valores.sort()
+            latencias[backend] = {'p50_ms': _percentil(valores, 0.5), 'p95_ms': _percentil(valores, 0.95)}
+        mais_rapido = min(latencias, key=lambda b: latencias[b]['p50_ms']) if len(latencias) > 1 else None
+        resumo.append({'rota': nome_rota, **g, 'latencia': latencias, 'mais_rapido': mais_rapido})
+    return resumo
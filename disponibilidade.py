@@ -0,0 +1,589 @@
+"""
+Linha do tempo de disponibilidade por item (capacidade livre dia a dia)
+
+Os dados vêm de uma única leitura por tabela (db_module.listar_ocupacao_periodo):
+reservas que se sobrepõem à janela e peças instaladas até o fim dela. Cada
+reserva soma +quantidade no dia de início e -quantidade no dia seguinte ao
+fim de um vetor de diferenças; a soma de prefixos dá a ocupação de cada dia
+em O(reservas + dias) por item, em vez de uma consulta por dia.
+
+picos_periodo / conferir_linhas conferem todas as linhas de um pedido no
+período de uma vez (falta por linha); janelas_livres acha as primeiras
+janelas com a quantidade livre numa varredura dos eventos do item.
+
+Reservas temporárias (bloqueios com prazo, criados no checkout) contam como
+reservas até expira_em: entram na linha do tempo, na conferência em lote e
+no cache.
+
+CacheOcupacao guarda, por item, a ocupação em árvores de segmentos para
+responder picos de período em O(log dias) sem ir ao banco.
+"""
+import secrets
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+MAX_DIAS_LINHA_DO_TEMPO = 366
+
+
+def linha_do_tempo(itens: Dict[int, Dict], reservas: Iterable[Tuple[int, date, date, int]],
+                   instalacoes: Iterable[Tuple[int, date, int]], inicio: date, fim: date) -> List[Dict]:
+    """
+    Calcula a disponibilidade diária de cada item em [inicio, fim]
+
+    Args:
+        itens: item_id -> {'nome', 'quantidade_total'}
+        reservas: (item_id, data_inicio, data_fim, quantidade) de compromissos
+        instalacoes: (peca_id, data_instalacao, quantidade) de peças em carros;
+                     a peça fica indisponível a partir da data de instalação
+        inicio, fim: Janela consultada (inclusive)
+
+    Returns:
+        Lista (na ordem de `itens`) de dicts com item_id, nome, quantidade_total,
+        disponivel (um valor por dia, podendo ser negativo em overbooking)
+        e disponivel_minimo
+    """
+    dias = (fim - inicio).days + 1
+    base = inicio.toordinal()
+    diferencas = {item_id: [0] * (dias + 1) for item_id in itens}
+
+    for item_id, r_inicio, r_fim, quantidade in reservas:
+        vetor = diferencas.get(item_id)
+        if vetor is None or r_inicio > fim or r_fim < inicio:
+            continue
+        vetor[max(r_inicio.toordinal() - base, 0)] += quantidade
+        vetor[min(r_fim.toordinal() - base, dias - 1) + 1] -= quantidade
+
+    for item_id, instalada_em, quantidade in instalacoes:
+        vetor = diferencas.get(item_id)
+        if vetor is None or (instalada_em and instalada_em > fim):
+            continue
+        vetor[max((instalada_em or inicio).toordinal() - base, 0)] += quantidade
+
+    resultado = []
+    for item_id, dados in itens.items():
+        total = dados['quantidade_total'] or 0
+        ocupado = 0
+        disponivel = []
+        for delta in diferencas[item_id][:dias]:
+            ocupado += delta
+            disponivel.append(total - ocupado)
+        resultado.append({
+            'item_id': item_id,
+            'nome': dados.get('nome'),
+            'quantidade_total': total,
+            'disponivel': disponivel,
+            'disponivel_minimo': min(disponivel) if disponivel else total,
+        })
+    return resultado
+
+
+def carregar_ocupacao(db_module, inicio: date, fim: date, item_ids: Optional[List[int]] = None):
+    """listar_ocupacao_periodo do backend com as reservas temporárias ativas somadas às reservas"""
+    itens, reservas, instalacoes = db_module.listar_ocupacao_periodo(inicio, fim, item_ids)
+    if hasattr(db_module, 'listar_reservas_temporarias_ativas'):
+        reservas = list(reservas) + [
+            (item_id, r_inicio, r_fim, quantidade)
+            for _, item_id, r_inicio, r_fim, quantidade, _ in db_module.listar_reservas_temporarias_ativas(inicio, fim, item_ids)
+        ]
+    return itens, reservas, instalacoes
+
+
+def calcular_linha_do_tempo(db_module, inicio: date, fim: date, item_ids: Optional[List[int]] = None) -> Dict:
+    """
+    Linha do tempo de disponibilidade para a janela, a partir do banco
+
+    Raises:
+        ValueError: Se a janela for inválida ou maior que MAX_DIAS_LINHA_DO_TEMPO
+    """
+    if fim < inicio:
+        raise ValueError("Data de fim deve ser maior ou igual à data de início")
+    if (fim - inicio).days + 1 > MAX_DIAS_LINHA_DO_TEMPO:
+        raise ValueError(f"Janela máxima de {MAX_DIAS_LINHA_DO_TEMPO} dias")
+
+    itens, reservas, instalacoes = carregar_ocupacao(db_module, inicio, fim, item_ids)
+    return {
+        'inicio': inicio.isoformat(),
+        'fim': fim.isoformat(),
+        'dias': (fim - inicio).days + 1,
+        'itens': linha_do_tempo(itens, reservas, instalacoes, inicio, fim),
+    }
+
+
+# ============= CONFERÊNCIA DE PEDIDOS =============
+
+def picos_periodo(itens: Dict[int, Dict], reservas: Iterable[Tuple[int, date, date, int]],
+                  instalacoes: Iterable[Tuple[int, date, int]], inicio: date, fim: date) -> Dict[int, Dict]:
+    """
+    Pico de ocupação de cada item em [inicio, fim] (mesmo formato da RPC
+    get_disponibilidade_periodo), por varredura de eventos em O(reservas log reservas)
+
+    Returns:
+        item_id -> {'nome', 'quantidade_total', 'max_alugado', 'max_instalado', 'disponivel_minimo'}
+    """
+    eventos = {item_id: [] for item_id in itens}
+    for item_id, r_inicio, r_fim, quantidade in reservas:
+        if item_id not in eventos or r_inicio > fim or r_fim < inicio:
+            continue
+        eventos[item_id].append((max(r_inicio, inicio).toordinal(), quantidade))
+        eventos[item_id].append((min(r_fim, fim).toordinal() + 1, -quantidade))
+
+    instalado = dict.fromkeys(itens, 0)
+    for peca_id, instalada_em, quantidade in instalacoes:
+        if peca_id in instalado and (instalada_em is None or instalada_em <= fim):
+            instalado[peca_id] += quantidade
+
+    picos = {}
+    for item_id, dados in itens.items():
+        max_alugado = atual = 0
+        # No mesmo dia, saídas (negativas) antes das entradas
+        for _, delta in sorted(eventos[item_id]):
+            atual += delta
+            max_alugado = max(max_alugado, atual)
+        total = dados['quantidade_total'] or 0
+        picos[item_id] = {
+            'nome': dados.get('nome'),
+            'quantidade_total': total,
+            'max_alugado': max_alugado,
+            'max_instalado': instalado[item_id],
+            'disponivel_minimo': total - max_alugado - instalado[item_id],
+        }
+    return picos
+
+
+def conferir_linhas(linhas: Iterable[Dict], picos: Dict[int, Dict]) -> List[Dict]:
+    """
+    Falta de estoque por linha de um pedido ({'item_id', 'quantidade'})
+
+    Linhas repetidas do mesmo item consomem a mesma disponibilidade, na ordem
+    do pedido. Item inexistente conta como disponibilidade zero.
+
+    Returns:
+        Uma entrada por linha: linha (1..n), item_id, nome, quantidade,
+        quantidade_total, max_alugado, max_instalado, disponivel_minimo e
+        falta (0 quando a linha cabe)
+    """
+    restante: Dict[int, int] = {}
+    resultado = []
+    for numero, linha in enumerate(linhas, start=1):
+        item_id = int(linha['item_id'])
+        quantidade = int(linha.get('quantidade') or 0)
+        pico = picos.get(item_id) or {'nome': None, 'quantidade_total': 0, 'max_alugado': 0,
+                                      'max_instalado': 0, 'disponivel_minimo': 0}
+        if item_id not in restante:
+            restante[item_id] = max(0, pico['disponivel_minimo'])
+        atendido = min(quantidade, restante[item_id])
+        restante[item_id] -= atendido
+        resultado.append({
+            'linha': numero,
+            'item_id': item_id,
+            'nome': pico['nome'],
+            'quantidade': quantidade,
+            'quantidade_total': pico['quantidade_total'],
+            'max_alugado': pico['max_alugado'],
+            'max_instalado': pico['max_instalado'],
+            'disponivel_minimo': pico['disponivel_minimo'],
+            'falta': quantidade - atendido,
+        })
+    return resultado
+
+
+def mensagem_faltas(conferencia: List[Dict]) -> Optional[str]:
+    """Texto de erro com todas as linhas sem estoque (None se o pedido cabe)"""
+    faltas = [c for c in conferencia if c['falta'] > 0]
+    if not faltas:
+        return None
+    partes = [
+        f"{c['nome'] or 'Item ID %s' % c['item_id']} (disponível: {max(0, c['disponivel_minimo'])}, faltam {c['falta']})"
+        for c in faltas
+    ]
+    return "Estoque insuficiente para " + "; ".join(partes)
+
+
+# ============= SUGESTÃO DE JANELAS =============
+
+MAX_SUGESTOES = 20
+
+
+def janelas_livres(quantidade_total: int, reservas: Iterable[Tuple[date, date, int]],
+                   instalacoes: Iterable[Tuple[Optional[date], int]], quantidade: int, dias: int,
+                   inicio: date, fim: date, limite: int) -> List[Dict]:
+    """
+    Primeiras janelas de `dias` dias em [inicio, fim] com `quantidade` livre em todos os dias
+
+    Uma única varredura ordenada pelos dias em que a ocupação muda: entre dois
+    eventos a capacidade livre é constante, então cada trecho livre contínuo é
+    achado sem olhar dia a dia. Cada trecho rende uma sugestão (o início mais
+    cedo); livre_ate é o último dia do trecho (qualquer início até
+    livre_ate - dias + 1 também serve). Trecho que chega a `fim` pode continuar
+    livre depois dele.
+
+    Args:
+        reservas: (data_inicio, data_fim, quantidade) do item
+        instalacoes: (data_instalacao, quantidade); a peça sai do estoque a partir da data
+
+    Returns:
+        Até `limite` dicts com data_inicio, data_fim e livre_ate, em ordem de data
+    """
+    base, ultimo = inicio.toordinal(), fim.toordinal()
+    deltas: Dict[int, int] = {base: 0}
+    for r_inicio, r_fim, qtd in reservas:
+        if r_inicio > fim or r_fim < inicio:
+            continue
+        dia = max(r_inicio.toordinal(), base)
+        deltas[dia] = deltas.get(dia, 0) + qtd
+        if r_fim < fim:
+            deltas[r_fim.toordinal() + 1] = deltas.get(r_fim.toordinal() + 1, 0) - qtd
+    for instalada_em, qtd in instalacoes:
+        if instalada_em is not None and instalada_em > fim:
+            continue
+        dia = max((instalada_em or inicio).toordinal(), base)
+        deltas[dia] = deltas.get(dia, 0) + qtd
+
+    janelas = []
+
+    def fechar(trecho_inicio: int, trecho_fim: int):
+        if trecho_fim - trecho_inicio + 1 >= dias:
+            janelas.append({
+                'data_inicio': date.fromordinal(trecho_inicio).isoformat(),
+                'data_fim': date.fromordinal(trecho_inicio + dias - 1).isoformat(),
+                'livre_ate': date.fromordinal(trecho_fim).isoformat(),
+            })
+
+    ocupado = 0
+    trecho_inicio = None
+    for dia in sorted(deltas):
+        ocupado += deltas[dia]
+        livre = (quantidade_total or 0) - ocupado >= quantidade
+        if livre and trecho_inicio is None:
+            trecho_inicio = dia
+        elif not livre and trecho_inicio is not None:
+            fechar(trecho_inicio, dia - 1)
+            trecho_inicio = None
+            if len(janelas) >= limite:
+                return janelas
+    if trecho_inicio is not None:
+        fechar(trecho_inicio, ultimo)
+    return janelas[:limite]
+
+
+def calcular_sugestoes(db_module, item_id: int, quantidade: int, dias: int, a_partir: date,
+                       ate: Optional[date] = None, limite: int = 3, alternativas: bool = False) -> Optional[Dict]:
+    """
+    Janelas mais cedo em que o item tem `quantidade` livre por `dias` dias, a partir
+    de a_partir (busca até `ate`, no máximo MAX_DIAS_LINHA_DO_TEMPO dias)
+
+    Com alternativas=True, lista também os itens da mesma categoria e localização
+    com a quantidade livre em [a_partir, a_partir + dias - 1].
+
+    Returns:
+        Dict com o item, janelas e alternativas; None se o item não existe
+
+    Raises:
+        ValueError: Parâmetros fora dos limites
+    """
+    if quantidade < 1 or dias < 1:
+        raise ValueError("Quantidade e dias devem ser maiores que zero")
+    if not 1 <= limite <= MAX_SUGESTOES:
+        raise ValueError(f"Limite deve estar entre 1 e {MAX_SUGESTOES}")
+    ate = ate or a_partir + timedelta(days=MAX_DIAS_LINHA_DO_TEMPO - 1)
+    if (ate - a_partir).days + 1 > MAX_DIAS_LINHA_DO_TEMPO:
+        raise ValueError(f"Busca máxima de {MAX_DIAS_LINHA_DO_TEMPO} dias")
+    if (ate - a_partir).days + 1 < dias:
+        raise ValueError("O intervalo de busca é menor que a duração pedida")
+
+    itens, reservas, instalacoes = carregar_ocupacao(db_module, a_partir, ate, [item_id])
+    dados = itens.get(item_id)
+    if dados is None:
+        return None
+    janelas = janelas_livres(
+        dados['quantidade_total'],
+        [(r_inicio, r_fim, qtd) for i, r_inicio, r_fim, qtd in reservas if i == item_id],
+        [(instalada_em, qtd) for i, instalada_em, qtd in instalacoes if i == item_id],
+        quantidade, dias, a_partir, ate, limite
+    )
+
+    sugestoes_itens = []
+    if alternativas and hasattr(db_module, 'listar_itens_alternativos'):
+        ids = db_module.listar_itens_alternativos(item_id)
+        if ids:
+            fim_pedido = a_partir + timedelta(days=dias - 1)
+            picos = picos_periodo(*carregar_ocupacao(db_module, a_partir, fim_pedido, ids), a_partir, fim_pedido)
+            sugestoes_itens = sorted(
+                ({'item_id': alt_id, 'nome': p['nome'], 'quantidade_total': p['quantidade_total'],
+                  'disponivel_minimo': p['disponivel_minimo']}
+                 for alt_id, p in picos.items() if p['disponivel_minimo'] >= quantidade),
+                key=lambda alt: -alt['disponivel_minimo']
+            )[:limite]
+
+    return {
+        'item_id': item_id,
+        'nome': dados.get('nome'),
+        'quantidade_total': dados['quantidade_total'] or 0,
+        'quantidade': quantidade,
+        'dias': dias,
+        'busca_inicio': a_partir.isoformat(),
+        'busca_fim': ate.isoformat(),
+        'janelas': janelas,
+        'alternativas': sugestoes_itens,
+    }
+
+
+# ============= RESERVAS TEMPORÁRIAS =============
+
+TTL_RESERVA_PADRAO = 600  # segundos
+TTL_RESERVA_MAXIMO = 3600
+
+
+def novo_token_reserva() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def validar_ttl_reserva(ttl_segundos: Optional[int]) -> int:
+    """TTL da reserva em segundos (padrão TTL_RESERVA_PADRAO); ValueError fora de 1..TTL_RESERVA_MAXIMO"""
+    if ttl_segundos is None:
+        return TTL_RESERVA_PADRAO
+    ttl_segundos = int(ttl_segundos)
+    if not 1 <= ttl_segundos <= TTL_RESERVA_MAXIMO:
+        raise ValueError(f"Prazo da reserva deve estar entre 1 e {TTL_RESERVA_MAXIMO} segundos")
+    return ttl_segundos
+
+
+def expirada(expira_em: datetime) -> bool:
+    """Compara com o relógio no mesmo fuso de expira_em (aware no Supabase, local no SQLite)"""
+    return expira_em <= datetime.now(expira_em.tzinfo)
+
+
+# ============= CACHE DE OCUPAÇÃO =============
+
+JANELA_PASSADO_DIAS = 366
+JANELA_FUTURO_DIAS = 3 * 365
+TTL_CACHE_OCUPACAO = 300  # segundos; cobre escritas feitas por outros processos
+
+
+class ArvoreOcupacao:
+    """
+    Árvore de segmentos esparsa sobre dias (deslocamentos 0..tamanho-1)
+
+    Soma em intervalo e máximo em intervalo em O(log dias), sem propagação:
+    cada nó guarda o acréscimo aplicado ao segmento inteiro e o máximo da
+    subárvore já incluindo esse acréscimo. Só os nós tocados existem.
+    """
+
+    def __init__(self, tamanho: int):
+        self.tamanho = 1
+        while self.tamanho < tamanho:
+            self.tamanho *= 2
+        self._acrescimo: Dict[int, int] = {}
+        self._maximo: Dict[int, int] = {}
+
+    def somar(self, inicio: int, fim: int, valor: int, no: int = 1, esq: int = 0, dir: Optional[int] = None):
+        if dir is None:
+            dir = self.tamanho - 1
+        if fim < esq or dir < inicio:
+            return
+        if inicio <= esq and dir <= fim:
+            self._acrescimo[no] = self._acrescimo.get(no, 0) + valor
+            self._maximo[no] = self._maximo.get(no, 0) + valor
+            return
+        meio = (esq + dir) // 2
+        self.somar(inicio, fim, valor, 2 * no, esq, meio)
+        self.somar(inicio, fim, valor, 2 * no + 1, meio + 1, dir)
+        self._maximo[no] = self._acrescimo.get(no, 0) + max(self._maximo.get(2 * no, 0), self._maximo.get(2 * no + 1, 0))
+
+    def maximo(self, inicio: int, fim: int, no: int = 1, esq: int = 0, dir: Optional[int] = None) -> int:
+        if dir is None:
+            dir = self.tamanho - 1
+        if inicio <= esq and dir <= fim:
+            return self._maximo.get(no, 0)
+        meio = (esq + dir) // 2
+        filhos = []
+        if inicio <= meio:
+            filhos.append(self.maximo(inicio, fim, 2 * no, esq, meio))
+        if fim > meio:
+            filhos.append(self.maximo(inicio, fim, 2 * no + 1, meio + 1, dir))
+        return self._acrescimo.get(no, 0) + max(filhos)
+
+
+class OcupacaoItem:
+    """Ocupação de um item na janela do cache: reservas e peças instaladas em árvores separadas"""
+
+    def __init__(self, quantidade_total: int, inicio: date, fim: date, criado_em: float):
+        self.quantidade_total = quantidade_total or 0
+        self.inicio = inicio
+        self.fim = fim
+        self.criado_em = criado_em
+        dias = (fim - inicio).days + 1
+        self.alugado = ArvoreOcupacao(dias)
+        self.instalado = ArvoreOcupacao(dias)
+        # Reservas temporárias somadas em `alugado`: (expira_em, token, inicio, fim, quantidade)
+        self.temporarias: List[Tuple[datetime, str, date, date, int]] = []
+
+    def _recorte(self, inicio: date, fim: date) -> Optional[Tuple[int, int]]:
+        inicio, fim = max(inicio, self.inicio), min(fim, self.fim)
+        if inicio > fim:
+            return None
+        return (inicio - self.inicio).days, (fim - self.inicio).days
+
+    def cobre(self, inicio: date, fim: date) -> bool:
+        return self.inicio <= inicio and fim <= self.fim
+
+    def somar_reserva(self, inicio: date, fim: date, quantidade: int):
+        recorte = self._recorte(inicio, fim)
+        if recorte:
+            self.alugado.somar(recorte[0], recorte[1], quantidade)
+
+    def somar_instalacao(self, instalada_em: Optional[date], quantidade: int):
+        recorte = self._recorte(instalada_em or self.inicio, self.fim)
+        if recorte:
+            self.instalado.somar(recorte[0], recorte[1], quantidade)
+
+    def somar_temporaria(self, token: str, inicio: date, fim: date, quantidade: int, expira_em: datetime):
+        if expirada(expira_em):
+            return
+        self.somar_reserva(inicio, fim, quantidade)
+        self.temporarias.append((expira_em, token, inicio, fim, quantidade))
+
+    def _retirar(self, manter: Callable[[Tuple], bool]) -> int:
+        restantes = []
+        for temporaria in self.temporarias:
+            if manter(temporaria):
+                restantes.append(temporaria)
+            else:
+                self.somar_reserva(temporaria[2], temporaria[3], -temporaria[4])
+        retiradas = len(self.temporarias) - len(restantes)
+        self.temporarias = restantes
+        return retiradas
+
+    def expirar(self):
+        """Tira da ocupação as reservas temporárias vencidas"""
+        if self.temporarias:
+            self._retirar(lambda t: not expirada(t[0]))
+
+    def retirar_temporarias(self, token: str) -> int:
+        return self._retirar(lambda t: t[1] != token)
+
+    def pico(self, inicio: date, fim: date) -> Dict:
+        a, b = self._recorte(inicio, fim)
+        max_alugado = self.alugado.maximo(a, b)
+        max_instalado = self.instalado.maximo(a, b)
+        return {
+            'quantidade_total': self.quantidade_total,
+            'max_alugado': max_alugado,
+            'max_instalado': max_instalado,
+            'disponivel_minimo': self.quantidade_total - max_alugado - max_instalado,
+        }
+
+
+class CacheOcupacao:
+    """
+    Cache em memória da ocupação por item_id, montado sob demanda
+
+    `carregar` é o listar_ocupacao_periodo do backend e `carregar_temporarias`
+    o listar_reservas_temporarias_ativas. As escritas chamam registrar_reserva /
+    registrar_instalacao / registrar_temporaria (ajuste incremental das árvores
+    já montadas) ou invalidar quando não conhecem o intervalo alterado.
+    Consultas fora da janela (hoje - JANELA_PASSADO_DIAS .. hoje +
+    JANELA_FUTURO_DIAS) devolvem None e o chamador consulta o banco.
+    """
+
+    def __init__(self, carregar: Callable, ttl: float = TTL_CACHE_OCUPACAO,
+                 carregar_temporarias: Optional[Callable] = None):
+        self._carregar = carregar
+        self._carregar_temporarias = carregar_temporarias
+        self.ttl = ttl
+        self._itens: Dict[int, OcupacaoItem] = {}
+        # Incrementada a cada escrita: montagens concorrentes com uma escrita são descartadas
+        self._geracao: Dict[int, int] = {}
+        self._geracao_global = 0
+        self._lock = threading.RLock()
+
+    def _montar(self, item_id: int) -> Optional[OcupacaoItem]:
+        with self._lock:
+            geracao = (self._geracao_global, self._geracao.get(item_id, 0))
+        hoje = date.today()
+        inicio, fim = hoje - timedelta(days=JANELA_PASSADO_DIAS), hoje + timedelta(days=JANELA_FUTURO_DIAS)
+        itens, reservas, instalacoes = self._carregar(inicio, fim, [item_id])
+        if item_id not in itens:
+            return None
+        ocupacao = OcupacaoItem(itens[item_id]['quantidade_total'], inicio, fim, time.monotonic())
+        for _, r_inicio, r_fim, quantidade in reservas:
+            ocupacao.somar_reserva(r_inicio, r_fim, quantidade)
+        for _, instalada_em, quantidade in instalacoes:
+            ocupacao.somar_instalacao(instalada_em, quantidade)
+        if self._carregar_temporarias:
+            for token, _, r_inicio, r_fim, quantidade, expira_em in self._carregar_temporarias(inicio, fim, [item_id]):
+                ocupacao.somar_temporaria(token, r_inicio, r_fim, quantidade, expira_em)
+        with self._lock:
+            if geracao == (self._geracao_global, self._geracao.get(item_id, 0)):
+                self._itens[item_id] = ocupacao
+        return ocupacao
+
+    def _obter(self, item_id: int) -> Optional[OcupacaoItem]:
+        with self._lock:
+            ocupacao = self._itens.get(item_id)
+        if ocupacao is None or time.monotonic() - ocupacao.criado_em > self.ttl:
+            ocupacao = self._montar(item_id)
+        return ocupacao
+
+    def pico(self, item_id: int, inicio: date, fim: date) -> Optional[Dict]:
+        """Maior ocupação (alugado e instalado) em [inicio, fim]; None se item inexistente ou fora da janela"""
+        ocupacao = self._obter(int(item_id))
+        if ocupacao is None or not ocupacao.cobre(inicio, fim):
+            return None
+        with self._lock:
+            ocupacao.expirar()
+            return ocupacao.pico(inicio, fim)
+
+    def no_dia(self, item_id: int, dia: date) -> Optional[Dict]:
+        """Ocupação em um único dia (mesmo formato de pico)"""
+        return self.pico(item_id, dia, dia)
+
+    def _ajustar(self, item_id, ajuste: Callable[[OcupacaoItem], None]):
+        with self._lock:
+            self._geracao[item_id] = self._geracao.get(item_id, 0) + 1
+            ocupacao = self._itens.get(item_id)
+            if ocupacao is not None:
+                ajuste(ocupacao)
+
+    def registrar_reserva(self, item_id, inicio: date, fim: date, quantidade: int):
+        """Soma (quantidade > 0) ou remove (quantidade < 0) uma reserva do item"""
+        if item_id is None:
+            return
+        if not (isinstance(inicio, date) and isinstance(fim, date)):
+            return self.invalidar(item_id)
+        self._ajustar(int(item_id), lambda o: o.somar_reserva(inicio, fim, int(quantidade or 0)))
+
+    def registrar_instalacao(self, peca_id, instalada_em: Optional[date], quantidade: int):
+        """Soma ou remove peças instaladas a partir da data"""
+        if peca_id is None:
+            return
+        if instalada_em is not None and not isinstance(instalada_em, date):
+            return self.invalidar(peca_id)
+        self._ajustar(int(peca_id), lambda o: o.somar_instalacao(instalada_em, int(quantidade or 0)))
+
+    def registrar_temporaria(self, token: str, item_id, inicio: date, fim: date, quantidade: int, expira_em: datetime):
+        """Soma uma reserva temporária, que sai sozinha da ocupação em expira_em"""
+        self._ajustar(int(item_id), lambda o: o.somar_temporaria(token, inicio, fim, int(quantidade or 0), expira_em))
+
+    def remover_temporarias(self, token: str):
+        """Tira da ocupação as reservas temporárias do token (cancelada ou confirmada)"""
+        with self._lock:
+            # Montagens em andamento podem ter lido as reservas do token: descartadas
+            self._geracao_global += 1
+            for ocupacao in self._itens.values():
+                ocupacao.retirar_temporarias(token)
+
+    def atualizar_total(self, item_id, quantidade_total: int):
+        self._ajustar(int(item_id), lambda o: setattr(o, 'quantidade_total', quantidade_total or 0))
+
+    def invalidar(self, item_id=None):
+        """Descarta um item (ou todos, se item_id for None); será remontado na próxima consulta"""
+        with self._lock:
+            if item_id is None:
+                self._geracao_global += 1
+                self._itens.clear()
+            else:
+                self._geracao[int(item_id)] = self._geracao.get(int(item_id), 0) + 1
+                self._itens.pop(int(item_id), None)
@@ -0,0 +1,279 @@
+"""
+Espelho local (SQLite) de tabelas do Supabase para leituras sem ida à rede
+
+Cada tabela espelhada guarda suas linhas como JSON num arquivo SQLite local
+(ESPELHO_SUPABASE_ARQUIVO), compartilhado pelos workers da instância. As
+leituras saem do arquivo; as escritas continuam indo direto ao Supabase.
+
+Sincronização incremental pela marca d'água do log_alteracoes (versao, que
+só cresce): a cada INTERVALO_SINCRONIZACAO segundos, no máximo, as
+alterações novas viram uma lista de ids por tabela, que são rebuscados (id
+que não volta foi apagado). Tabelas sem log (categorias_itens) são
+recarregadas inteiras a cada `ttl` segundos; tabelas com colunas calculadas
+pela data (view de financiamentos) são recarregadas inteiras quando o dia muda.
+
+Escrita local chama invalidar(): a próxima leitura sincroniza antes de
+responder, então quem gravou lê o que gravou. Nos outros workers a alteração
+aparece em até INTERVALO_SINCRONIZACAO segundos.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+ATIVO = os.getenv('ESPELHO_SUPABASE', 'false').lower() == 'true'
+ARQUIVO = os.getenv('ESPELHO_SUPABASE_ARQUIVO', os.path.join('data', 'espelho_supabase.db'))
+INTERVALO_SINCRONIZACAO = float(os.getenv('ESPELHO_SUPABASE_INTERVALO', '5'))  # segundos
+MARCA_LOG = '_log_alteracoes'
+MARCA_ORIGEM = '_origem'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS linhas (
+    tabela TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    dados TEXT NOT NULL,
+    PRIMARY KEY (tabela, id)
+);
+CREATE TABLE IF NOT EXISTS marcas (
+    tabela TEXT PRIMARY KEY,
+    versao INTEGER,
+    carregado_em REAL,
+    dia TEXT
+);
+"""
+
+
+class TabelaEspelhada:
+    """
+    Como carregar uma tabela: carregar_todos() -> linhas (dicts com 'id');
+    carregar_ids(ids) -> as linhas desses ids que ainda existem.
+    ttl: recarga completa periódica (tabelas fora do log_alteracoes).
+    diaria: recarga completa quando o dia muda (colunas calculadas pela data).
+    """
+
+    def __init__(self, nome: str, carregar_todos: Callable[[], Iterable[Dict]],
+                 carregar_ids: Optional[Callable[[List[int]], Iterable[Dict]]] = None,
+                 ttl: Optional[float] = None, diaria: bool = False):
+        self.nome = nome
+        self.carregar_todos = carregar_todos
+        self.carregar_ids = carregar_ids
+        self.ttl = ttl
+        self.diaria = diaria
+
+
+class Espelho:
+    """
+    tabelas: as TabelaEspelhada. versao_atual() -> maior versao do log agora;
+    listar_alteracoes(desde, limite) -> mesmo formato de
+    supabase_database.listar_alteracoes; ids_afetados(alteracoes) ->
+    {tabela espelhada: ids a rebuscar} (inclui dependências, ex.: parcela paga
+    -> financiamento). origem identifica o projeto (SUPABASE_URL): arquivo de
+    outro projeto é descartado.
+    """
+
+    def __init__(self, caminho: str, tabelas: Iterable[TabelaEspelhada],
+                 versao_atual: Callable[[], int],
+                 listar_alteracoes: Callable[..., Dict],
+                 ids_afetados: Callable[[List[Dict]], Dict[str, Set[int]]],
+                 origem: str = '', intervalo: float = INTERVALO_SINCRONIZACAO):
+        self.caminho = caminho
+        self.origem = origem
+        self.tabelas = {t.nome: t for t in tabelas}
+        self._versao_atual = versao_atual
+        self._listar_alteracoes = listar_alteracoes
+        self._ids_afetados = ids_afetados
+        self._intervalo = intervalo
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sincronizado_em = 0.0
+        self._pendente = True  # primeira leitura do processo confere o arquivo
+
+    # ---------- Arquivo ----------
+    def _conexao(self) -> sqlite3.Connection:
+        """Uma conexão por thread (sqlite3 não compartilha conexões entre threads)"""
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            pasta = os.path.dirname(self.caminho)
+            if pasta:
+                os.makedirs(pasta, exist_ok=True)
+            conexao = sqlite3.connect(self.caminho, timeout=30)
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute('PRAGMA synchronous=NORMAL')
+            conexao.executescript(SCHEMA)
+            self._local.conexao = conexao
+        return conexao
+
+    def _marca(self, tabela: str) -> Optional[tuple]:
+        return self._conexao().execute(
+            'SELECT versao, carregado_em, dia FROM marcas WHERE tabela = ?', (tabela,)
+        ).fetchone()
+
+    def _gravar_marca(self, conexao, tabela: str, versao=None, carregado_em=None, dia=None):
+        conexao.execute(
+            'INSERT INTO marcas (tabela, versao, carregado_em, dia) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(tabela) DO UPDATE SET '
+            'versao = COALESCE(excluded.versao, versao), '
+            'carregado_em = COALESCE(excluded.carregado_em, carregado_em), '
+            'dia = COALESCE(excluded.dia, dia)',
+            (tabela, versao, carregado_em, dia),
+        )
+
+    def _gravar_linhas(self, conexao, tabela: str, linhas: Iterable[Dict]):
+        conexao.executemany(
+            'INSERT OR REPLACE INTO linhas (tabela, id, dados) VALUES (?, ?, ?)',
+            ((tabela, int(linha['id']), json.dumps(linha, default=str)) for linha in linhas),
+        )
+
+    # ---------- Sincronização ----------
+    def _recarregar(self, tabela: TabelaEspelhada):
+        """Troca todas as linhas da tabela numa transação (leitores veem a versão antiga até o commit)"""
+        linhas = list(tabela.carregar_todos())
+        conexao = self._conexao()
+        with conexao:
+            conexao.execute('DELETE FROM linhas WHERE tabela = ?', (tabela.nome,))
+            self._gravar_linhas(conexao, tabela.nome, linhas)
+            self._gravar_marca(conexao, tabela.nome, carregado_em=time.time(), dia=date.today().isoformat())
+
+    def _atualizar_ids(self, tabela: TabelaEspelhada, ids: Set[int]):
+        """Rebusca os ids; os que não voltam foram apagados no Supabase"""
+        if tabela.carregar_ids is None:
+            self._recarregar(tabela)
+            return
+        linhas = list(tabela.carregar_ids(sorted(ids)))
+        apagados = ids - {int(linha['id']) for linha in linhas}
+        conexao = self._conexao()
+        with conexao:
+            self._gravar_linhas(conexao, tabela.nome, linhas)
+            conexao.executemany('DELETE FROM linhas WHERE tabela = ? AND id = ?',
+                                ((tabela.nome, i) for i in apagados))
+
+    def _descartar_arquivo_invalido(self):
+        """
+        Primeira sincronização do processo: o arquivo sobrevive a restarts, mas
+        não vale se é de outro projeto ou se o log recomeçou (versão gravada
+        maior que a atual); nesses casos tudo é recarregado
+        """
+        marca_origem = self._marca(MARCA_ORIGEM)
+        marca_log = self._marca(MARCA_LOG)
+        if marca_log is None:
+            valido = True
+        elif marca_origem is None or marca_origem[2] != self.origem:
+            valido = False
+        else:
+            valido = (marca_log[0] or 0) <= self._versao_atual()
+        conexao = self._conexao()
+        with conexao:
+            if not valido:
+                conexao.execute('DELETE FROM linhas')
+                conexao.execute('DELETE FROM marcas')
+            self._gravar_marca(conexao, MARCA_ORIGEM, dia=self.origem)
+
+    def _sincronizar(self):
+        if not self._sincronizado_em:
+            self._descartar_arquivo_invalido()
+        marca_log = self._marca(MARCA_LOG)
+        hoje = date.today().isoformat()
+        agora = time.time()
+
+        # Recargas completas: tabela nunca carregada, dia novo (diaria) ou ttl vencido.
+        # A versão do log é lida antes: o que mudar durante a carga é reaplicado depois.
+        versao_inicial = self._versao_atual() if marca_log is None else None
+        for tabela in self.tabelas.values():
+            marca = self._marca(tabela.nome)
+            if (marca is None or marca_log is None
+                    or (tabela.diaria and marca[2] != hoje)
+                    or (tabela.ttl is not None and agora - (marca[1] or 0) >= tabela.ttl)):
+                self._recarregar(tabela)
+        if versao_inicial is not None:
+            conexao = self._conexao()
+            with conexao:
+                self._gravar_marca(conexao, MARCA_LOG, versao=versao_inicial, carregado_em=agora)
+            return
+
+        # Incremental: alterações depois da marca d'água, em páginas
+        desde = marca_log[0] or 0
+        while True:
+            pagina = self._listar_alteracoes(desde=desde, limite=1000, compactar=True)
+            if pagina['alteracoes']:
+                for nome, ids in self._ids_afetados(pagina['alteracoes']).items():
+                    if ids and nome in self.tabelas:
+                        self._atualizar_ids(self.tabelas[nome], {int(i) for i in ids})
+            desde = pagina['versao']
+            conexao = self._conexao()
+            with conexao:
+                self._gravar_marca(conexao, MARCA_LOG, versao=desde, carregado_em=time.time())
+            if not pagina.get('tem_mais'):
+                return
+
+    def sincronizar(self, forcar: bool = False):
+        """
+        Sincroniza se o intervalo passou, se houve escrita local (invalidar) ou
+        com forcar. Com sincronização em andamento em outra thread, leitores
+        comuns seguem com o arquivo atual; depois de uma escrita, esperam por ela.
+        """
+        obrigatoria = forcar or self._pendente
+        if not obrigatoria and time.monotonic() - self._sincronizado_em < self._intervalo:
+            return
+        if not self._lock.acquire(blocking=obrigatoria):
+            return
+        try:
+            self._pendente = False
+            try:
+                self._sincronizar()
+            except Exception:
+                self._pendente = True
+                raise
+            self._sincronizado_em = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def invalidar(self):
+        """Escrita local nas tabelas espelhadas: a próxima leitura sincroniza antes"""
+        self._pendente = True
+
+    # ---------- Leitura ----------
+    def disponivel(self, tabela: str) -> bool:
+        """
+        Sincroniza (se for a hora) e diz se a tabela pode ser lida do espelho:
+        False só se ela nunca foi carregada e o Supabase não respondeu (o
+        chamador lê direto da rede). Já carregada, falha de sincronização só
+        deixa a leitura desatualizada.
+        """
+        try:
+            self.sincronizar()
+        except Exception as e:
+            print(f"⚠️ Espelho Supabase: falha ao sincronizar ({e})")
+        return self._marca(tabela) is not None
+
+    def linhas(self, tabela: str) -> Optional[List[Dict]]:
+        """Linhas da tabela em ordem de id; None se indisponível (ver disponivel)"""
+        if not self.disponivel(tabela):
+            return None
+        cursor = self._conexao().execute('SELECT dados FROM linhas WHERE tabela = ? ORDER BY id', (tabela,))
+        return [json.loads(dados) for (dados,) in cursor]
+
+    def linha(self, tabela: str, registro_id: int):
+        """Uma linha pelo id: dict, None se não existe, ou False se o espelho está indisponível"""
+        if not self.disponivel(tabela):
+            return False
+        r = self._conexao().execute('SELECT dados FROM linhas WHERE tabela = ? AND id = ?',
+                                    (tabela, int(registro_id))).fetchone()
+        return json.loads(r[0]) if r else None
+
+    def estado(self) -> Dict:
+        """Resumo para /api/debug: marca d'água e linhas por tabela"""
+        conexao = self._conexao()
+        contagens = dict(conexao.execute('SELECT tabela, COUNT(*) FROM linhas GROUP BY tabela').fetchall())
+        marca_log = self._marca(MARCA_LOG)
+        return {
+            'arquivo': self.caminho,
+            'versao': marca_log[0] if marca_log else None,
+            'tabelas': {
+                nome: {'linhas': contagens.get(nome, 0),
+                       'carregado_em': (self._marca(nome) or (None, None))[1]}
+                for nome in self.tabelas
+            },
+        }
@@ -0,0 +1,120 @@
+"""
+Pub/sub em processo para eventos de alteração de dados (canal SSE /api/eventos)
+
+As escritas publicam um evento {tabela, operacao, registro_id} depois de
+gravar (a auditoria publica por todas as operações auditadas). Cada cliente
+SSE tem uma assinatura com buffer limitado: se o cliente não consome a
+tempo, os eventos mais antigos são descartados e o cliente recebe um aviso
+para ressincronizar pelas listagens com ?updated_since=.
+
+O barramento vive no processo: com vários workers, cada um só vê as
+escritas que ele mesmo atendeu.
+"""
+import asyncio
+import itertools
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TAMANHO_BUFFER = 256
+
+
+class Assinatura:
+    """Fila de um cliente: deque com maxlen e um asyncio.Event para acordar o leitor"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, tabelas: Optional[Iterable[str]] = None,
+                 tamanho_buffer: int = TAMANHO_BUFFER):
+        self.tabelas = set(tabelas) if tabelas else None
+        self.descartados = 0
+        self._fila = deque(maxlen=tamanho_buffer)
+        self._loop = loop
+        self._sinal = asyncio.Event()
+        self._lock = threading.Lock()
+
+    def entregar(self, evento: Dict):
+        """Enfileira o evento (chamado pela thread que fez a escrita)"""
+        if self.tabelas and evento['tabela'] not in self.tabelas:
+            return
+        with self._lock:
+            if len(self._fila) == self._fila.maxlen:
+                self.descartados += 1
+            self._fila.append(evento)
+        try:
+            self._loop.call_soon_threadsafe(self._sinal.set)
+        except RuntimeError:
+            # Loop do cliente já encerrado; a assinatura será cancelada pelo endpoint
+            pass
+
+    async def proximos(self, timeout: float) -> Tuple[List[Dict], int]:
+        """
+        Espera até `timeout` segundos por eventos
+
+        Returns:
+            (eventos pendentes, quantos foram descartados por estouro do buffer)
+        """
+        if not self._fila:
+            try:
+                await asyncio.wait_for(self._sinal.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._sinal.clear()
+        with self._lock:
+            eventos = list(self._fila)
+            self._fila.clear()
+            descartados, self.descartados = self.descartados, 0
+        return eventos, descartados
+
+
+class Barramento:
+    def __init__(self):
+        self._assinaturas: List[Assinatura] = []
+        self._lock = threading.Lock()
+        self._sequencia = itertools.count(1)
+        self.ultimo_id = 0
+
+    def assinar(self, tabelas: Optional[Iterable[str]] = None, tamanho_buffer: int = TAMANHO_BUFFER) -> Assinatura:
+        """Cria uma assinatura ligada ao event loop corrente (chamar de dentro de uma corrotina)"""
+        assinatura = Assinatura(asyncio.get_running_loop(), tabelas, tamanho_buffer)
+        with self._lock:
+            self._assinaturas.append(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura: Assinatura):
+        with self._lock:
+            if assinatura in self._assinaturas:
+                self._assinaturas.remove(assinatura)
+
+    @property
+    def assinantes(self) -> int:
+        return len(self._assinaturas)
+
+    def publicar(self, tabela: str, operacao: str, registro_id=None):
+        """Publica um evento para todas as assinaturas; nunca levanta exceção para quem escreveu"""
+        with self._lock:
+            # A sequência avança mesmo sem assinantes: quem reconecta com
+            # Last-Event-ID percebe que perdeu eventos
+            self.ultimo_id = next(self._sequencia)
+            if not self._assinaturas:
+                return
+            evento = {
+                'id': self.ultimo_id,
+                'tabela': tabela,
+                'operacao': operacao,
+                'registro_id': registro_id,
+                'timestamp': datetime.now().isoformat()
+            }
+            assinaturas = list(self._assinaturas)
+        for assinatura in assinaturas:
+            try:
+                assinatura.entregar(evento)
+            except Exception as e:
+                print(f"Erro ao entregar evento: {e}")
+
+
+barramento = Barramento()
+
+
+def publicar(tabela: str, operacao: str, registro_id=None):
+    """Atalho para barramento.publicar"""
+    barramento.publicar(tabela, operacao, registro_id)
@@ -0,0 +1,261 @@
+"""
+Importação em lote de itens e compromissos a partir de CSV/XLSX
+
+As linhas são lidas em streaming, validadas com o módulo validacoes e
+enviadas ao banco em lotes de TAMANHO_LOTE: cada lote faz uma consulta de
+duplicatas por tabela e um único INSERT em lote (db_module.importar_itens_lote
+/ importar_compromissos_lote). Linhas com erro não interrompem a importação;
+elas voltam no relatório com o número da linha no arquivo.
+"""
+import csv
+import unicodedata
+from datetime import date, datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import validacoes
+
+TAMANHO_LOTE = 500
+
+# Nome normalizado da coluna no arquivo -> campo
+ALIASES_ITENS = {
+    'nome': 'nome', 'item': 'nome',
+    'quantidade_total': 'quantidade_total', 'quantidade': 'quantidade_total', 'qtd': 'quantidade_total',
+    'categoria': 'categoria', 'descricao': 'descricao', 'cidade': 'cidade', 'uf': 'uf', 'estado': 'uf',
+    'endereco': 'endereco', 'placa': 'placa', 'marca': 'marca', 'modelo': 'modelo', 'ano': 'ano',
+}
+ALIASES_COMPROMISSOS = {
+    'item_id': 'item_id', 'id_item': 'item_id', 'item': 'item_id',
+    'quantidade': 'quantidade', 'qtd': 'quantidade',
+    'data_inicio': 'data_inicio', 'inicio': 'data_inicio', 'data_fim': 'data_fim', 'fim': 'data_fim',
+    'descricao': 'descricao', 'cidade': 'cidade', 'uf': 'uf', 'estado': 'uf',
+    'endereco': 'endereco', 'contratante': 'contratante', 'cliente': 'contratante',
+}
+
+
+def _normalizar_cabecalho(texto) -> str:
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode()
+    return texto.strip().lower().replace(' ', '_')
+
+
+def _texto(valor) -> Optional[str]:
+    if valor is None:
+        return None
+    texto = str(valor).strip()
+    return texto or None
+
+
+def _inteiro(valor, campo: str) -> Optional[int]:
+    if valor is None or str(valor).strip() == '':
+        return None
+    try:
+        return int(float(str(valor).replace(',', '.')))
+    except (ValueError, OverflowError):  # OverflowError: inf, 1e400
+        raise ValueError(f"{campo} inválido: {valor}")
+
+
+def _data(valor, campo: str) -> date:
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    texto = _texto(valor)
+    if not texto:
+        raise ValueError(f"{campo} é obrigatório")
+    for formato in ('%Y-%m-%d', '%d/%m/%Y', '%d/%m/%y'):
+        try:
+            return datetime.strptime(texto[:10], formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f"{campo} inválido: {texto}")
+
+
+def _linhas_csv(arquivo) -> Iterator[list]:
+    def texto():
+        for linha in arquivo:
+            if isinstance(linha, bytes):
+                try:
+                    linha = linha.decode('utf-8-sig')
+                except UnicodeDecodeError:
+                    linha = linha.decode('cp1252', errors='replace')
+            yield linha
+
+    linhas = texto()
+    primeira = next(linhas, '')
+    separador = ';' if primeira.count(';') >= primeira.count(',') else ','
+    yield next(csv.reader([primeira], delimiter=separador), [])
+    yield from csv.reader(linhas, delimiter=separador)
+
+
+def _linhas_xlsx(arquivo) -> Iterator[list]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Importação de XLSX requer o pacote openpyxl (pip install openpyxl)")
+    # read_only: as linhas são lidas sob demanda, sem montar a planilha inteira em memória
+    planilha = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        for linha in planilha.worksheets[0].iter_rows(values_only=True):
+            yield list(linha)
+    finally:
+        planilha.close()
+
+
+def ler_linhas(arquivo, nome_arquivo: str, aliases: Dict[str, str]) -> Iterator[Tuple[int, Dict]]:
+    """
+    Itera (numero_linha, dict campo -> valor) do arquivo, ignorando linhas vazias
+
+    Colunas desconhecidas são ignoradas; numero_linha conta o cabeçalho como linha 1.
+    """
+    linhas = _linhas_xlsx(arquivo) if nome_arquivo.lower().endswith(('.xlsx', '.xlsm')) else _linhas_csv(arquivo)
+    cabecalho = [aliases.get(_normalizar_cabecalho(c)) for c in next(linhas, [])]
+    if not any(cabecalho):
+        raise ValueError("Cabeçalho do arquivo sem nenhuma coluna reconhecida")
+    for numero, valores in enumerate(linhas, start=2):
+        if not any(_texto(v) for v in valores):
+            continue
+        yield numero, {campo: valor for campo, valor in zip(cabecalho, valores) if campo}
+
+
+def validar_item(campos: Dict) -> Dict:
+    """Normaliza e valida uma linha de item; lança ValueError com todos os problemas da linha"""
+    dados = {
+        'nome': _texto(campos.get('nome')),
+        'quantidade_total': _inteiro(campos.get('quantidade_total'), 'Quantidade'),
+        'categoria': _texto(campos.get('categoria')) or 'Estrutura de Evento',
+        'descricao': _texto(campos.get('descricao')),
+        'cidade': _texto(campos.get('cidade')),
+        'uf': (_texto(campos.get('uf')) or '').upper()[:2],
+        'endereco': _texto(campos.get('endereco')),
+    }
+    if dados['categoria'] == 'Carros':
+        dados.update({
+            'placa': (_texto(campos.get('placa')) or '').upper(),
+            'marca': _texto(campos.get('marca')),
+            'modelo': _texto(campos.get('modelo')),
+            'ano': _inteiro(campos.get('ano'), 'Ano'),
+        })
+        if dados['quantidade_total'] is None:
+            dados['quantidade_total'] = 1
+    valido, msg_erro = validacoes.validar_item_completo(
+        nome=dados['nome'] or '',
+        categoria=dados['categoria'],
+        cidade=dados['cidade'] or '',
+        uf=dados['uf'],
+        quantidade_total=dados['quantidade_total'] or 0,
+        placa=dados.get('placa'),
+        marca=dados.get('marca'),
+        modelo=dados.get('modelo'),
+        ano=dados.get('ano')
+    )
+    if not valido:
+        raise ValueError(msg_erro)
+    return dados
+
+
+def validar_compromisso(campos: Dict) -> Dict:
+    """Normaliza e valida uma linha de compromisso (sem checar estoque, feito no lote)"""
+    dados = {
+        'item_id': _inteiro(campos.get('item_id'), 'Item'),
+        'quantidade': _inteiro(campos.get('quantidade'), 'Quantidade'),
+        'data_inicio': _data(campos.get('data_inicio'), 'Data de início'),
+        'data_fim': _data(campos.get('data_fim'), 'Data de fim'),
+        'descricao': _texto(campos.get('descricao')),
+        'cidade': _texto(campos.get('cidade')),
+        'uf': (_texto(campos.get('uf')) or '').upper()[:2],
+        'endereco': _texto(campos.get('endereco')),
+        'contratante': _texto(campos.get('contratante')),
+    }
+    if dados['item_id'] is None:
+        raise ValueError("Item é obrigatório")
+    erros = []
+    for valido, msg in (
+        validacoes.validar_quantidade(dados['quantidade'] or 0),
+        validacoes.validar_datas(dados['data_inicio'], dados['data_fim']),
+        validacoes.validar_uf(dados['uf']),
+    ):
+        if not valido:
+            erros.append(msg)
+    if not dados['cidade']:
+        erros.append("Cidade é obrigatória")
+    if erros:
+        raise ValueError("; ".join(erros))
+    return dados
+
+
+def _chave_item(dados: Dict):
+    return dados['nome'], dados['categoria']
+
+
+def _chave_compromisso(dados: Dict):
+    return dados['item_id'], dados['data_inicio'], dados['data_fim'], dados['contratante']
+
+
+def _importar(linhas: Iterator[Tuple[int, Dict]], validar: Callable, chave: Callable,
+              inserir_lote: Callable, tamanho_lote: int) -> Dict:
+    relatorio = {'total': 0, 'importados': 0, 'erros': []}
+    vistos = set()
+    placas = set()
+    lote: List[Tuple[int, Dict]] = []
+
+    def enviar():
+        if lote:
+            resultado = inserir_lote(lote)
+            relatorio['importados'] += resultado['inseridos']
+            relatorio['erros'].extend(resultado['erros'])
+            lote.clear()
+
+    for numero, campos in linhas:
+        relatorio['total'] += 1
+        try:
+            dados = validar(campos)
+            # Duplicatas dentro do próprio arquivo (as do banco são checadas no lote)
+            if chave(dados) in vistos:
+                raise ValueError("Linha duplicada no arquivo")
+            if dados.get('placa'):
+                if dados['placa'] in placas:
+                    raise ValueError(f"Placa {dados['placa']} repetida no arquivo")
+                placas.add(dados['placa'])
+            vistos.add(chave(dados))
+        except ValueError as e:
+            relatorio['erros'].append({'linha': numero, 'erro': str(e)})
+            continue
+        lote.append((numero, dados))
+        if len(lote) >= tamanho_lote:
+            enviar()
+    enviar()
+
+    relatorio['erros'].sort(key=lambda e: e['linha'])
+    return relatorio
+
+
+def importar_itens(db_module, arquivo, nome_arquivo: str = '', tamanho_lote: int = TAMANHO_LOTE) -> Dict:
+    """
+    Importa itens de um CSV/XLSX
+
+    Colunas: nome, quantidade_total (ou quantidade), categoria, descricao,
+    cidade, uf, endereco e, para Carros, placa, marca, modelo, ano.
+
+    Returns:
+        Dict com total de linhas, importados e erros [{'linha', 'erro'}]
+    """
+    return _importar(
+        ler_linhas(arquivo, nome_arquivo, ALIASES_ITENS),
+        validar_item, _chave_item, db_module.importar_itens_lote, tamanho_lote
+    )
+
+
+def importar_compromissos(db_module, arquivo, nome_arquivo: str = '', tamanho_lote: int = TAMANHO_LOTE) -> Dict:
+    """
+    Importa compromissos de um CSV/XLSX
+
+    Colunas: item_id, quantidade, data_inicio, data_fim, descricao, cidade,
+    uf, endereco, contratante. O estoque é conferido por lote, contando os
+    compromissos já gravados e os aceitos antes no mesmo arquivo.
+
+    Returns:
+        Dict com total de linhas, importados e erros [{'linha', 'erro'}]
+    """
+    return _importar(
+        ler_linhas(arquivo, nome_arquivo, ALIASES_COMPROMISSOS),
+        validar_compromisso, _chave_compromisso, db_module.importar_compromissos_lote, tamanho_lote
+    )
@@ -0,0 +1,58 @@
+"""
+Comandos de manutenção do banco de dados
+
+Uso:
+    python manutencao.py reconstruir-fluxo-caixa
+    python manutencao.py --supabase reconstruir-fluxo-caixa
+    python manutencao.py atualizar-status [--data AAAA-MM-DD]
+"""
+import sys
+import argparse
+from datetime import date
+from typing import List, Optional
+
+
+def _carregar_db(usar_supabase: bool):
+    """Retorna o módulo de banco escolhido (SQLite por padrão)"""
+    if usar_supabase:
+        from dotenv import load_dotenv
+        load_dotenv()
+        import supabase_database
+        return supabase_database
+    import database
+    from models import init_db
+    init_db()
+    return database
+
+
+def cmd_reconstruir_fluxo_caixa(db_module, args) -> int:
+    meses = db_module.reconstruir_fluxo_caixa()
+    print(f"Fluxo de caixa reconstruído: {meses} mês(es)")
+    return 0
+
+
+def cmd_atualizar_status(db_module, args) -> int:
+    contagens = db_module.atualizar_status_vencidos(args.data)
+    for tabela, total in contagens.items():
+        print(f"{tabela}: {total} registro(s) marcados como vencidos")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Manutenção do banco de dados do CRM')
+    parser.add_argument('--supabase', action='store_true', help='Usa o Supabase (SUPABASE_URL/SUPABASE_KEY) em vez do SQLite')
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p = sub.add_parser('reconstruir-fluxo-caixa', help='Recalcula o resumo mensal do fluxo de caixa')
+    p.set_defaults(func=cmd_reconstruir_fluxo_caixa)
+
+    p = sub.add_parser('atualizar-status', help='Marca contas e parcelas pendentes vencidas como Vencido/Atrasada')
+    p.add_argument('--data', type=date.fromisoformat, default=None, help='Data de referência (padrão: hoje)')
+    p.set_defaults(func=cmd_atualizar_status)
+
+    args = parser.parse_args(argv)
+    return args.func(_carregar_db(args.supabase), args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,73 @@
-from sqlalchemy import create_engine, Column, Integer, String, Date, ForeignKey, Float
+from sqlalchemy import create_engine, inspect, Column, Integer, String, Date, DateTime, ForeignKey, Float, and_, not_, case
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from datetime import date
+from datetime import date, datetime
 import os
+import zlib
 
 Base = declarative_base()
 
-class Item(Base):
+
+class StatusCalculadoMixin:
+    """
+    Status derivado das datas (e valores), calculado na leitura
+    
+    Em Python, .status chama calcular_status(); em consultas, Modelo.status vira
+    um CASE com a data de hoje. A coluna gravada (status_armazenado) continua
+    existindo para o Supabase e relatórios, e é o que o setter escreve.
+    Para filtrar use Modelo.filtro_status(status), que gera predicados
+    indexáveis em vez de comparar o CASE.
+    
+    Subclasses definem STATUS_QUITADO, STATUS_VENCIDO e _condicao_quitada().
+    """
+    STATUS_QUITADO = 'Pago'
+    STATUS_VENCIDO = 'Vencido'
+    
+    @classmethod
+    def _condicao_quitada(cls):
+        return cls.data_pagamento.isnot(None)
+    
+    @hybrid_property
+    def status(self):
+        return self.calcular_status()
+    
+    @status.setter
+    def status(self, valor):
+        self.status_armazenado = valor
+    
+    @status.expression
+    def status(cls):
+        return case(
+            (cls._condicao_quitada(), cls.STATUS_QUITADO),
+            (cls.data_vencimento < date.today(), cls.STATUS_VENCIDO),
+            else_='Pendente'
+        )
+    
+    @classmethod
+    def filtro_status(cls, status):
+        """Predicado SQL equivalente a status == valor, usando os índices de data"""
+        quitada = cls._condicao_quitada()
+        if status == cls.STATUS_QUITADO:
+            return quitada
+        if status == cls.STATUS_VENCIDO:
+            return and_(not_(quitada), cls.data_vencimento < date.today())
+        if status == 'Pendente':
+            return and_(not_(quitada), cls.data_vencimento >= date.today())
+        return cls.status == status
+
+
+class AtualizadoEmMixin:
+    """
+    Carimbo updated_at, renovado a cada UPDATE feito pelo ORM
+    
+    Usado pelo ?updated_since= das listagens: o cliente guarda o
+    'sincronizado_em' da última resposta e só recebe o que mudou depois.
+    """
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, index=True)
+
+
+class Item(AtualizadoEmMixin, Base):
     __tablename__ = 'itens'
     
     id = Column(Integer, primary_key=True)
@@ -42,7 +103,7 @@ class Carro(Base):
         return f"<Carro(item_id={self.item_id}, placa='{self.placa}', marca='{self.marca}', modelo='{self.modelo}', ano={self.ano})>"
 
 
-class Compromisso(Base):
+class Compromisso(AtualizadoEmMixin, Base):
     __tablename__ = 'compromissos'
     
     id = Column(Integer, primary_key=True)
@@ -63,16 +124,16 @@ class Compromisso(Base):
         return f"<Compromisso(item_id={self.item_id}, quantidade={self.quantidade}, data_inicio={self.data_inicio}, data_fim={self.data_fim})>"
 
 
-class ContaReceber(Base):
+class ContaReceber(StatusCalculadoMixin, AtualizadoEmMixin, Base):
     __tablename__ = 'contas_receber'
     
     id = Column(Integer, primary_key=True)
     compromisso_id = Column(Integer, ForeignKey('compromissos.id'), nullable=False)
     descricao = Column(String(500), nullable=False)
     valor = Column(Float, nullable=False)
-    data_vencimento = Column(Date, nullable=False)
-    data_pagamento = Column(Date)
-    status = Column(String(20), nullable=False, default='Pendente')  # Pendente, Pago, Vencido
+    data_vencimento = Column(Date, nullable=False, index=True)
+    data_pagamento = Column(Date, index=True)
+    status_armazenado = Column('status', String(20), nullable=False, default='Pendente')  # Pendente, Pago, Vencido (leia .status)
     forma_pagamento = Column(String(50))  # Dinheiro, PIX, Cartão, Boleto, etc.
     observacoes = Column(String(1000))
     
@@ -92,16 +153,16 @@ class ContaReceber(Base):
         return f"<ContaReceber(id={self.id}, compromisso_id={self.compromisso_id}, valor={self.valor}, status='{self.status}')>"
 
 
-class ContaPagar(Base):
+class ContaPagar(StatusCalculadoMixin, AtualizadoEmMixin, Base):
     __tablename__ = 'contas_pagar'
     
     id = Column(Integer, primary_key=True)
     descricao = Column(String(500), nullable=False)
     categoria = Column(String(50), nullable=False)  # Fornecedor, Manutenção, Despesa, Outro
     valor = Column(Float, nullable=False)
-    data_vencimento = Column(Date, nullable=False)
-    data_pagamento = Column(Date)
-    status = Column(String(20), nullable=False, default='Pendente')  # Pendente, Pago, Vencido
+    data_vencimento = Column(Date, nullable=False, index=True)
+    data_pagamento = Column(Date, index=True)
+    status_armazenado = Column('status', String(20), nullable=False, default='Pendente')  # Pendente, Pago, Vencido (leia .status)
     fornecedor = Column(String(200))
     item_id = Column(Integer, ForeignKey('itens.id'))  # Opcional - para manutenção de itens específicos
     forma_pagamento = Column(String(50))  # Dinheiro, PIX, Cartão, Boleto, etc.
@@ -123,7 +184,7 @@ class ContaPagar(Base):
         return f"<ContaPagar(id={self.id}, descricao='{self.descricao}', valor={self.valor}, status='{self.status}')>"
 
 
-class Financiamento(Base):
+class Financiamento(AtualizadoEmMixin, Base):
     __tablename__ = 'financiamentos'
     
     id = Column(Integer, primary_key=True)
@@ -145,17 +206,17 @@ class Financiamento(Base):
         return f"<Financiamento(id={self.id}, item_id={self.item_id}, valor_total={self.valor_total}, status='{self.status}')>"
 
 
-class ParcelaFinanciamento(Base):
+class ParcelaFinanciamento(StatusCalculadoMixin, AtualizadoEmMixin, Base):
     __tablename__ = 'parcelas_financiamento'
     
     id = Column(Integer, primary_key=True)
-    financiamento_id = Column(Integer, ForeignKey('financiamentos.id'), nullable=False)
+    financiamento_id = Column(Integer, ForeignKey('financiamentos.id'), nullable=False, index=True)
     numero_parcela = Column(Integer, nullable=False)
     valor_original = Column(Float, nullable=False)
     valor_pago = Column(Float, nullable=False, default=0.0)
-    data_vencimento = Column(Date, nullable=False)
+    data_vencimento = Column(Date, nullable=False, index=True)
     data_pagamento = Column(Date)
-    status = Column(String(20), nullable=False, default='Pendente')  # Pendente, Paga, Atrasada
+    status_armazenado = Column('status', String(20), nullable=False, default='Pendente')  # Pendente, Paga, Atrasada (leia .status)
     juros = Column(Float, nullable=False, default=0.0)
     multa = Column(Float, nullable=False, default=0.0)
     desconto = Column(Float, nullable=False, default=0.0)
@@ -163,6 +224,13 @@ class ParcelaFinanciamento(Base):
     
     financiamento = relationship("Financiamento", back_populates="parcelas")
     
+    STATUS_QUITADO = 'Paga'
+    STATUS_VENCIDO = 'Atrasada'
+    
+    @classmethod
+    def _condicao_quitada(cls):
+        return cls.valor_pago >= cls.valor_original
+    
     def calcular_status(self):
         """Calcula o status baseado nas datas"""
         hoje = date.today()
@@ -200,6 +268,90 @@ class PecaCarro(Base):
         return f"<PecaCarro(id={self.id}, peca_id={self.peca_id}, carro_id={self.carro_id}, qtd={self.quantidade})>"
 
 
+class ReservaTemporaria(Base):
+    """Bloqueio de estoque com prazo (checkout em andamento): conta na disponibilidade até expira_em"""
+    __tablename__ = 'reservas_temporarias'
+
+    id = Column(Integer, primary_key=True)
+    token = Column(String(64), nullable=False, index=True)
+    item_id = Column(Integer, ForeignKey('itens.id'), nullable=False, index=True)
+    quantidade = Column(Integer, nullable=False)
+    data_inicio = Column(Date, nullable=False)
+    data_fim = Column(Date, nullable=False)
+    expira_em = Column(DateTime, nullable=False, index=True)
+    criado_em = Column(DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        return f"<ReservaTemporaria(token='{self.token}', item_id={self.item_id}, quantidade={self.quantidade}, expira_em={self.expira_em})>"
+
+
+class TokenRevogado(Base):
+    """Sessão encerrada (logout) antes do prazo: jti do token até o exp dele (epoch)"""
+    __tablename__ = 'tokens_revogados'
+
+    jti = Column(String(64), primary_key=True)
+    expira_em = Column(Integer, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<TokenRevogado(jti='{self.jti}', expira_em={self.expira_em})>"
+
+
+class LeituraSombra(Base):
+    """
+    Uma leitura GET amostrada e repetida no outro backend (modo sombra): tempo
+    de cada backend e se as respostas bateram
+    """
+    __tablename__ = 'leituras_sombra'
+
+    id = Column(Integer, primary_key=True, index=True)
+    criado_em = Column(DateTime, nullable=False, default=datetime.now, index=True)
+    rota = Column(String(200), nullable=False, index=True)  # template da rota (ex.: /api/itens/{item_id})
+    caminho = Column(String(500), nullable=True)  # path + query da requisição original
+    primario = Column(String(20), nullable=False)  # 'sqlite' | 'supabase' (atendeu o cliente)
+    secundario = Column(String(20), nullable=False)
+    status_primario = Column(Integer, nullable=False)
+    status_secundario = Column(Integer, nullable=True)
+    ms_primario = Column(Float, nullable=False)
+    ms_secundario = Column(Float, nullable=True)
+    iguais = Column(Integer, nullable=True)  # 1/0; None quando não deu para comparar
+    diferenca = Column(String(500), nullable=True)  # primeira diferença encontrada
+
+    def __repr__(self):
+        return f"<LeituraSombra(rota='{self.rota}', primario='{self.primario}', iguais={self.iguais})>"
+
+
+class FluxoCaixaMensal(Base):
+    """Resumo mensal do fluxo de caixa - valores pagos somados pelo mês do pagamento"""
+    __tablename__ = 'fluxo_caixa_mensal'
+    
+    mes = Column(String(7), primary_key=True)  # AAAA-MM
+    receitas = Column(Float, nullable=False, default=0.0)
+    despesas = Column(Float, nullable=False, default=0.0)
+    
+    def __repr__(self):
+        return f"<FluxoCaixaMensal(mes='{self.mes}', receitas={self.receitas}, despesas={self.despesas})>"
+
+
+class LogAlteracao(Base):
+    """
+    Log de alterações (change data capture): cada CREATE/UPDATE/DELETE
+    auditado ganha uma versão crescente, usada por /api/changes e pelo
+    backup incremental
+    """
+    __tablename__ = 'log_alteracoes'
+    # AUTOINCREMENT: versões nunca são reutilizadas, mesmo após apagar o log
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    versao = Column(Integer, primary_key=True)
+    tabela = Column(String(50), nullable=False)
+    registro_id = Column(Integer)
+    operacao = Column(String(10), nullable=False)
+    timestamp = Column(DateTime, nullable=False, default=datetime.now)
+    
+    def __repr__(self):
+        return f"<LogAlteracao(versao={self.versao}, tabela='{self.tabela}', registro_id={self.registro_id}, operacao='{self.operacao}')>"
+
+
 def get_engine():
     """Cria e retorna a engine do banco de dados"""
     os.makedirs('data', exist_ok=True)
@@ -208,10 +360,134 @@ def get_engine():
     return engine
 
 
-def init_db():
-    """Inicializa o banco de dados criando as tabelas"""
+def _adicionar_colunas_novas(engine):
+    """
+    create_all não altera tabelas existentes: adiciona (ALTER TABLE ADD COLUMN)
+    as colunas anuláveis do modelo que ainda faltam no arquivo SQLite
+    """
+    inspetor = inspect(engine)
+    with engine.begin() as conexao:
+        for tabela in Base.metadata.sorted_tables:
+            existentes = {c['name'] for c in inspetor.get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name in existentes or not coluna.nullable:
+                    continue
+                tipo = coluna.type.compile(dialect=engine.dialect)
+                conexao.exec_driver_sql(f'ALTER TABLE {tabela.name} ADD COLUMN {coluna.name} {tipo}')
+
+
+# Índices de texto (FTS5) mantidos por triggers: tabela -> (colunas indexadas, SELECT das
+# colunas para uma linha da tabela base, com o nome do item para compromissos/financiamentos)
+# unicode61 com remove_diacritics: "sao paulo" encontra "São Paulo"
+INDICES_BUSCA = {
+    'itens': (
+        ('nome', 'categoria', 'descricao', 'cidade'),
+        "SELECT t.id, t.nome, t.categoria, t.descricao, t.cidade FROM itens t",
+    ),
+    'compromissos': (
+        ('contratante', 'descricao', 'cidade', 'item_nome'),
+        "SELECT t.id, t.contratante, t.descricao, t.cidade, i.nome FROM compromissos t LEFT JOIN itens i ON i.id = t.item_id",
+    ),
+    'financiamentos': (
+        ('instituicao_financeira', 'observacoes', 'item_nome'),
+        "SELECT t.id, t.instituicao_financeira, t.observacoes, i.nome FROM financiamentos t LEFT JOIN itens i ON i.id = t.item_id",
+    ),
+}
+
+
+def _criar_busca_textual(engine):
+    """
+    Cria as tabelas FTS5 busca_<tabela> e os triggers que as mantêm em dia;
+    índices novos são populados a partir das tabelas base. Sem FTS5 no SQLite
+    (compilação sem a extensão), a busca continua por LIKE (database._filtrar_busca_texto).
+    """
+    with engine.begin() as conexao:
+        for tabela, (colunas, selecao) in INDICES_BUSCA.items():
+            fts = f'busca_{tabela}'
+            existia = conexao.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+            ).first() is not None
+            try:
+                conexao.exec_driver_sql(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                    f"{', '.join(colunas)}, tokenize = 'unicode61 remove_diacritics 2')"
+                )
+            except Exception:
+                return
+            lista = ', '.join(colunas)
+            inserir = f"INSERT INTO {fts} (rowid, {lista}) {selecao} WHERE t.id = new.id;"
+            apagar = f"DELETE FROM {fts} WHERE rowid = old.id;"
+            conexao.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabela} BEGIN {inserir} END")
+            conexao.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabela} BEGIN {apagar} END")
+            conexao.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {tabela} BEGIN {apagar} {inserir} END")
+            if not existia:
+                conexao.exec_driver_sql(f"INSERT INTO {fts} (rowid, {lista}) {selecao}")
+
+        # Renomear um item reindexa os compromissos e financiamentos dele
+        reindexar = []
+        for tabela in ('compromissos', 'financiamentos'):
+            colunas, selecao = INDICES_BUSCA[tabela]
+            reindexar.append(
+                f"DELETE FROM busca_{tabela} WHERE rowid IN (SELECT id FROM {tabela} WHERE item_id = new.id); "
+                f"INSERT INTO busca_{tabela} (rowid, {', '.join(colunas)}) {selecao} WHERE t.item_id = new.id;"
+            )
+        conexao.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS busca_itens_nome_au AFTER UPDATE OF nome ON itens "
+            f"BEGIN {' '.join(reindexar)} END"
+        )
+
+
+def versao_schema() -> int:
+    """
+    Impressão digital do schema (tabelas, colunas, índices e busca textual),
+    gravada em PRAGMA user_version. Muda sozinha quando o modelo muda, sem
+    número de versão para lembrar de incrementar.
+    """
+    partes = []
+    for tabela in Base.metadata.sorted_tables:
+        colunas = ','.join(f'{c.name}:{c.type}:{int(bool(c.nullable))}' for c in tabela.columns)
+        indices = ','.join(sorted(
+            f"{i.name}:{'/'.join(c.name for c in i.columns)}:{int(bool(i.unique))}" for i in tabela.indexes
+        ))
+        partes.append(f'{tabela.name}({colunas})[{indices}]')
+    partes.append(repr(sorted(INDICES_BUSCA.items())))
+    # user_version é um inteiro de 32 bits com sinal; 0 é o valor de bancos novos
+    return zlib.crc32('|'.join(partes).encode('utf-8')) & 0x7fffffff or 1
+
+
+def init_db(forcar: bool = False):
+    """
+    Inicializa o banco de dados criando as tabelas
+
+    Só refaz create_all / colunas / índices / busca textual quando a versão
+    do schema gravada no arquivo difere da do modelo (ou com forcar=True):
+    nos cold starts seguintes o custo é um PRAGMA.
+    """
     engine = get_engine()
+    versao = versao_schema()
+    with engine.connect() as conexao:
+        gravada = conexao.exec_driver_sql('PRAGMA user_version').scalar()
+    if gravada == versao and not forcar:
+        return False
+    fluxo_existia = inspect(engine).has_table(FluxoCaixaMensal.__tablename__)
     Base.metadata.create_all(engine)
+    _adicionar_colunas_novas(engine)
+    
+    # create_all não cria índices novos em tabelas que já existiam
+    for tabela in Base.metadata.sorted_tables:
+        for indice in tabela.indexes:
+            indice.create(engine, checkfirst=True)
+    
+    _criar_busca_textual(engine)
+    
+    # Bancos criados antes do resumo mensal: popula a tabela a partir das contas
+    if not fluxo_existia:
+        import database
+        database.reconstruir_fluxo_caixa()
+
+    with engine.begin() as conexao:
+        conexao.exec_driver_sql(f'PRAGMA user_version = {versao}')
+    return True
 
 
 def get_session():
@@ -1,9 +1,15 @@
+import functools
 import os
 import re
-from datetime import date, datetime, timedelta
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
 import calendar
 import validacoes
 import auditoria
+import eventos
+import disponibilidade
+import espelho_supabase
 from types import SimpleNamespace
 
 _supabase_client = None
@@ -39,6 +45,31 @@ def _slugify_label(text):
 def _labelify_column(text):
     return text.replace('_', ' ').title()
 
+_escrita_em_andamento = threading.local()
+
+def _altera_espelho(funcao):
+    """
+    Escrita em tabela espelhada: leituras feitas durante ela vão direto ao
+    Supabase (ex.: o buscar_item_por_id do retorno) e a próxima leitura do
+    espelho local sincroniza antes, para ler o que foi gravado
+    """
+    @functools.wraps(funcao)
+    def envoltorio(*args, **kwargs):
+        _escrita_em_andamento.nivel = getattr(_escrita_em_andamento, 'nivel', 0) + 1
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            _escrita_em_andamento.nivel -= 1
+            if espelho is not None:
+                espelho.invalidar()
+    return envoltorio
+
+def _espelho_leitura():
+    """O espelho local, se ativo e fora de uma escrita; None para ler do Supabase"""
+    if espelho is None or getattr(_escrita_em_andamento, 'nivel', 0):
+        return None
+    return espelho
+
 def registrar_movimentacao(item_id, quantidade, tipo, ref_id=None, desc=""):
     """Registra histórico: COMPRA, ALUGUEL_SAIDA, ALUGUEL_RETORNO, INSTALACAO, REMOCAO_PECA."""
     try:
@@ -90,9 +121,12 @@ def _row_to_compromisso(record, item=None):
 # --- GESTÃO DE CATEGORIAS ---
 
 def obter_categorias():
-    sb = get_supabase()
-    r = sb.table('categorias_itens').select('nome').order('nome').execute()
-    return sorted([row['nome'] for row in (r.data or []) if row.get('nome')])
+    espelho_local = _espelho_leitura()
+    linhas = espelho_local.linhas('categorias_itens') if espelho_local else None
+    if linhas is None:
+        sb = get_supabase()
+        linhas = sb.table('categorias_itens').select('nome').order('nome').execute().data or []
+    return sorted([row['nome'] for row in linhas if row.get('nome')])
 
 def obter_campos_categoria(categoria):
     """Lê as colunas reais da tabela no Supabase via RPC."""
@@ -107,6 +141,7 @@ def obter_campos_categoria(categoria):
 
 # --- CRUD DE ITENS (ESTOQUE) ---
 
+@_altera_espelho
 def criar_item(nome, quantidade_total, categoria=None, valor_compra=0.0, data_aquisicao=None, **kwargs):
     sb = get_supabase()
     cat = categoria or 'Estrutura de Evento'
@@ -145,9 +180,11 @@ def criar_item(nome, quantidade_total, categoria=None, valor_compra=0.0, data_aq
         for k, v in campos_extra.items(): p_spec[_slugify_label(k)] = v
         try: sb.table(slug).insert(p_spec).execute()
         except: pass
-        
+    
+    eventos.publicar('itens', 'CREATE', item_id)
     return buscar_item_por_id(item_id)
 
+@_altera_espelho
 def atualizar_item(item_id, nome, quantidade_total, categoria=None, **kwargs):
     sb = get_supabase()
     
@@ -173,23 +210,32 @@ def atualizar_item(item_id, nome, quantidade_total, categoria=None, **kwargs):
         for label, valor in kwargs['campos_categoria'].items(): p_spec[_slugify_label(label)] = valor
         try: sb.table(slug).upsert(p_spec, on_conflict='item_id').execute()
         except: pass
-        
+    
+    cache_ocupacao.atualizar_total(item_id, int(quantidade_total))
+    eventos.publicar('itens', 'UPDATE', int(item_id))
     return buscar_item_por_id(item_id)
 
-def listar_itens():
+def buscar_ids_texto(tabela, q, limite=1000):
+    """IDs de 'itens', 'compromissos' ou 'financiamentos' que contêm q (sem acento),
+    do mais parecido ao menos parecido: RPC buscar_ids_texto sobre a coluna gerada
+    `busca` com índice de trigramas (supabase_migration_busca_trigram.sql)"""
+    if not (q or '').strip():
+        return []
+    r = get_supabase().rpc('buscar_ids_texto', {'p_tabela': tabela, 'p_q': str(q), 'p_limite': int(limite)}).execute()
+    return [row['id'] for row in (r.data or [])]
+
+def _ordenar_por_ids(linhas, ids):
+    """Reordena as linhas (dicts com 'id') na ordem de ids (ranking da busca textual)"""
+    posicao = {registro_id: indice for indice, registro_id in enumerate(ids)}
+    return sorted(linhas, key=lambda row: posicao.get(row['id'], len(posicao)))
+
+def _mesclar_dados_categoria(sb, linhas):
     """
-    Busca todos os itens e seus dados extras de categoria em LOTE (Batch).
-    Reduz centenas de queries para apenas 1 query por categoria.
+    Junta em dados_categoria de cada linha de `itens` os campos da tabela da
+    categoria, buscados em LOTE: 1 query por categoria em vez de 1 por item.
     """
-    sb = get_supabase()
-    # 1. Busca todos os itens base
-    r = sb.table('itens').select('*').execute()
-    if not r.data: return []
-    
-    itens_raw = r.data
-    # 2. Agrupamos os IDs por categoria para buscar extras de uma vez só
     categorias_map = {}
-    for row in itens_raw:
+    for row in linhas:
         cat = row.get('categoria')
         if cat:
             slug = _slug_categoria(cat)
@@ -197,7 +243,6 @@ def listar_itens():
                 if slug not in categorias_map: categorias_map[slug] = []
                 categorias_map[slug].append(row['id'])
 
-    # 3. Busca dados extras de cada categoria em UMA única query por tabela
     extras_por_item = {}
     for slug, ids in categorias_map.items():
         try:
@@ -213,17 +258,50 @@ def listar_itens():
                     }
         except: continue
 
-    # 4. Monta a lista final mesclando os dados na memória
-    resultado = []
-    for row in itens_raw:
-        iid = row['id']
-        meus_extras = extras_por_item.get(iid, {})
-        dados_finais = {**row.get('dados_categoria', {}), **meus_extras}
-        resultado.append(_row_to_item(row, dados_categoria=dados_finais))
-        
-    return resultado
+    return [
+        {**row, 'dados_categoria': {**(row.get('dados_categoria') or {}), **extras_por_item.get(row['id'], {})}}
+        for row in linhas
+    ]
+
+def listar_itens(updated_since=None, q=None):
+    """
+    Busca todos os itens e seus dados extras de categoria em LOTE (Batch).
+    Reduz centenas de queries para apenas 1 query por categoria.
+    Com updated_since, só os itens alterados depois desse momento.
+    Com q, só os que batem com a busca textual, em ordem de relevância.
+    Com o espelho local ativo (e sem updated_since), lê do espelho.
+    """
+    ids_busca = buscar_ids_texto('itens', q) if q else None
+    if q and not ids_busca: return []
+
+    espelho_local = _espelho_leitura() if not updated_since else None
+    linhas = espelho_local.linhas('itens') if espelho_local else None
+    if linhas is not None:
+        if q:
+            encontrados = set(ids_busca)
+            linhas = _ordenar_por_ids([row for row in linhas if row['id'] in encontrados], ids_busca)
+        return [_row_to_item(row) for row in linhas]
+
+    sb = get_supabase()
+    # 1. Busca todos os itens base
+    query = sb.table('itens').select('*')
+    if updated_since:
+        query = query.gt('updated_at', _momento_iso(updated_since))
+    if q:
+        query = query.in_('id', ids_busca)
+    r = query.execute()
+    if not r.data: return []
+    
+    itens_raw = _ordenar_por_ids(r.data, ids_busca) if q else r.data
+    # 2. Dados extras de cada categoria, mesclados na memória
+    return [_row_to_item(row) for row in _mesclar_dados_categoria(sb, itens_raw)]
 
 def buscar_item_por_id(item_id):
+    espelho_local = _espelho_leitura()
+    if espelho_local:
+        row = espelho_local.linha('itens', item_id)
+        if row is not False:
+            return _row_to_item(row) if row else None
     sb = get_supabase(); r = sb.table('itens').select('*').eq('id', int(item_id)).execute()
     if not r.data: return None
     row = r.data[0]; slug = _slug_categoria(row['categoria']); d_spec = {}
@@ -234,6 +312,7 @@ def buscar_item_por_id(item_id):
         except: pass
     return _row_to_item(row, dados_categoria={**row.get('dados_categoria', {}), **d_spec})
 
+@_altera_espelho
 def deletar_item(item_id):
     sb = get_supabase(); item = buscar_item_por_id(item_id)
     if item:
@@ -241,6 +320,8 @@ def deletar_item(item_id):
         if slug: sb.table(slug).delete().eq('item_id', int(item_id)).execute()
         sb.table('pecas_carros').delete().or_(f"carro_id.eq.{item_id},peca_id.eq.{item_id}").execute()
     r = sb.table('itens').delete().eq('id', int(item_id)).execute()
+    cache_ocupacao.invalidar()  # peças instaladas no carro removido também saem
+    eventos.publicar('itens', 'DELETE', int(item_id))
     return r.data is not None
 
 # --- CRUD DE COMPROMISSOS (ALUGUÉIS) ---
@@ -258,15 +339,30 @@ def criar_compromisso(item_id, quantidade, data_inicio, data_fim, **kwargs):
     ins = sb.table('compromissos').insert(payload).execute()
     if ins.data:
         registrar_movimentacao(item_id, -quantidade, 'ALUGUEL_SAIDA', ref_id=ins.data[0]['id'])
+        cache_ocupacao.registrar_reserva(item_id, _date_parse(data_inicio), _date_parse(data_fim), int(quantidade))
+        eventos.publicar('compromissos', 'CREATE', ins.data[0]['id'])
         return _row_to_compromisso(ins.data[0])
     raise Exception("Erro ao criar compromisso")
 
-def listar_compromissos():
-    """Lista compromissos usando a view que já traz os itens agregados em JSON"""
+def listar_compromissos(updated_since=None, q=None):
+    """Lista compromissos usando a view que já traz os itens agregados em JSON
+    (com q, só os que batem com a busca textual, em ordem de relevância)"""
     sb = get_supabase()
     # Aponta para a view que criamos no SQL Editor
-    r = sb.table('view_compromissos_dashboard').select('*').order('data_inicio', desc=True).execute()
-    return r.data or []
+    query = sb.table('view_compromissos_dashboard').select('*').order('data_inicio', desc=True)
+    if updated_since:
+        # A view não expõe updated_at: filtra pelos ids alterados na tabela base
+        ids = _ids_alterados('compromissos', updated_since)
+        if not ids:
+            return []
+        query = query.in_('id', ids)
+    if q:
+        ids_busca = buscar_ids_texto('compromissos', q)
+        if not ids_busca:
+            return []
+        query = query.in_('id', ids_busca)
+    r = query.execute()
+    return _ordenar_por_ids(r.data or [], ids_busca) if q else (r.data or [])
 
 def obter_estatisticas_kpi():
     """Busca os números do topo da página de uma vez só"""
@@ -297,21 +393,10 @@ def atualizar_compromisso_master(compromisso_id, dados_header, lista_itens=None)
         r_itens = sb.table('compromisso_itens').select('item_id, quantidade').eq('compromisso_id', cid).execute()
         itens_para_validar = r_itens.data or []
 
-    for item in itens_para_validar:
-        # Passamos excluir_compromisso_id para o motor ignorar a reserva atual deste contrato
-        disp = verificar_disponibilidade_periodo(
-            item_id=item['item_id'],
-            data_inicio=d_inicio,
-            data_fim=d_fim,
-            excluir_compromisso_id=cid 
-        )
-        
-        # item['quantidade'] ou item.get('quantidade') dependendo da origem
-        qtd_solicitada = item.get('quantidade') if isinstance(item, dict) else item.quantidade
-        
-        if disp['disponivel_minimo'] < qtd_solicitada:
-            nome = disp['item'].nome if hasattr(disp['item'], 'nome') else f"Item ID {item['item_id']}"
-            raise Exception(f"Conflito de estoque para '{nome}' no novo período/quantidade.")
+    # excluir_compromisso_id: a reserva atual deste contrato não conta contra ele mesmo
+    erro = disponibilidade.mensagem_faltas(verificar_disponibilidade_lote(itens_para_validar, d_inicio, d_fim, excluir_compromisso_id=cid))
+    if erro:
+        raise Exception(f"Conflito de estoque no novo período/quantidade. {erro}")
 
     # 3. Atualizar o Cabeçalho (Tabela compromissos)
     payload_h = dados_header.copy()
@@ -341,6 +426,8 @@ def atualizar_compromisso_master(compromisso_id, dados_header, lista_itens=None)
             ]
             sb.table('compromisso_itens').insert(payload_i).execute()
 
+    cache_ocupacao.invalidar()
+    eventos.publicar('compromissos', 'UPDATE', cid)
     res_final = buscar_compromisso_por_id(cid)
     
     patch_data = {
@@ -380,17 +467,10 @@ def atualizar_compromisso(compromisso_id, data_header, lista_itens=None):
             d_inicio = d_inicio or comp_atual.data['data_inicio']
             d_fim = d_fim or comp_atual.data['data_fim']
 
-        # Loop de validação para cada item
-        for item in itens_para_validar:
-            # Importante: passar o compromisso_id para EXCLUIR este contrato da conta de estoque
-            disp = verificar_disponibilidade_periodo(
-                item_id=item['item_id'],
-                data_inicio=d_inicio,
-                data_fim=d_fim,
-                excluir_compromisso_id=compromisso_id 
-            )
-            if disp['disponivel_minimo'] < item['quantidade']:
-                raise Exception(f"Estoque insuficiente para o item ID {item['item_id']}. Disponível: {disp['disponivel_minimo']}")
+        # Validação de todos os itens em uma chamada, EXCLUINDO este contrato da conta de estoque
+        erro = disponibilidade.mensagem_faltas(verificar_disponibilidade_lote(itens_para_validar or [], d_inicio, d_fim, excluir_compromisso_id=compromisso_id))
+        if erro:
+            raise Exception(erro)
 
     # 2. Atualizar o cabeçalho (compromissos)
     if data_header:
@@ -417,61 +497,30 @@ def atualizar_compromisso(compromisso_id, data_header, lista_itens=None):
             ]
             sb.table('compromisso_itens').insert(payload_itens).execute()
 
+    # Datas e linhas antigas não são conhecidas aqui: o cache remonta sob demanda
+    cache_ocupacao.invalidar()
+    eventos.publicar('compromissos', 'UPDATE', int(compromisso_id))
     return buscar_compromisso_por_id(compromisso_id)
 def criar_compromisso_master(dados_header, lista_itens):
     """
     Cria um contrato master com múltiplos itens. 
     Blindado contra erros de atributo e dicionário.
     """
-    sb = get_supabase()
-    
     # Acesso seguro via .get() para evitar o erro 'dict object has no attribute'
     d_inicio = dados_header.get('data_inicio')
     d_fim = dados_header.get('data_fim')
 
-    # 1. Validação de Estoque antes de qualquer inserção
-    for item in lista_itens:
-        disp = verificar_disponibilidade_periodo(
-            item_id=item['item_id'],
-            data_inicio=d_inicio,
-            data_fim=d_fim
-        )
-        
-        # disp['disponivel_minimo'] vem do motor de cálculo que já ajustamos
-        if disp['disponivel_minimo'] < item.get('quantidade', 0):
-            nome_item = disp['item'].nome if hasattr(disp['item'], 'nome') else "Item"
-            raise Exception(f"Estoque insuficiente para {nome_item}. Disponível: {disp['disponivel_minimo']}")
-
-    # 2. Preparar Payload do Cabeçalho
-    # Fazemos uma cópia para não alterar o dicionário original
-    payload = dados_header.copy()
-    
-    # Garantimos que as datas sejam strings ISO para o Supabase
-    for campo in ['data_inicio', 'data_fim']:
-        if campo in payload and payload[campo]:
-            val = payload[campo]
-            payload[campo] = val.isoformat() if hasattr(val, 'isoformat') else str(val)
-
-    # 3. Inserir o Contrato (Compromisso Master)
-    # Se o erro de constraint NULL persistir, certifique-se de que rodou o SQL: 
-    # ALTER TABLE compromissos ALTER COLUMN item_id DROP NOT NULL;
-    res_h = sb.table('compromissos').insert(payload).execute()
-    if not res_h.data:
-        raise Exception("Erro ao criar cabeçalho do contrato")
-    
-    contrato_id = res_h.data[0]['id']
-
-    # 4. Inserir Itens do Contrato
-    payload_itens = [
-        {
-            "compromisso_id": contrato_id,
-            "item_id": i['item_id'],
-            "quantidade": i['quantidade']
-        } for i in lista_itens
-    ]
-    
-    sb.table('compromisso_itens').insert(payload_itens).execute()
-    
+    # 1. Reserva curta das linhas (conferência e bloqueio numa transação) e
+    # 2. confirmação: cabeçalho + itens gravados atomicamente a partir da reserva
+    reserva = reservar_itens(lista_itens, d_inicio, d_fim, ttl_segundos=60)
+    if not reserva['reservado']:
+        raise Exception(disponibilidade.mensagem_faltas(reserva['linhas']))
+    try:
+        contrato_id = confirmar_reserva(reserva['token'], **dados_header)['compromisso_ids'][0]
+    except Exception:
+        cancelar_reserva(reserva['token'])
+        raise
+
     res_final = buscar_compromisso_por_id(contrato_id)
     
     patch_data = {
@@ -497,6 +546,8 @@ def deletar_compromisso(compromisso_id: int):
     
     # 3. Finalmente, remove o contrato
     r = sb.table('compromissos').delete().eq('id', compromisso_id).execute()
+    cache_ocupacao.invalidar()
+    eventos.publicar('compromissos', 'DELETE', int(compromisso_id))
     
     return len(r.data) > 0
 
@@ -527,6 +578,7 @@ def criar_peca_carro(peca_id, carro_id, quantidade=1, data_instalacao=None, obse
     if not ins.data: raise Exception("Erro ao inserir associação de peça")
     
     registrar_movimentacao(peca_id, -quantidade, 'INSTALACAO', ref_id=carro_id)
+    cache_ocupacao.registrar_instalacao(peca_id, _date_parse(dt_fix), int(quantidade))
     return ins.data[0] # Retorna o dicionário criado
 
 def listar_pecas_carros(carro_id=None, peca_id=None):
@@ -572,6 +624,7 @@ def atualizar_peca_carro(associacao_id, quantidade=None, data_instalacao=None, o
             registrar_movimentacao(dados_antigos['peca_id'], diff, 'AJUSTE_INSTALACAO', ref_id=dados_antigos['carro_id'])
     
     r = sb.table('pecas_carros').update(payload).eq('id', int(associacao_id)).execute()
+    cache_ocupacao.invalidar(dados_antigos['peca_id'])
     return r.data[0] if r.data else None
 
 def deletar_peca_carro(associacao_id):
@@ -581,6 +634,8 @@ def deletar_peca_carro(associacao_id):
         # Quando removemos a peça do carro, ela volta para o estoque disponível (+)
         registrar_movimentacao(r_assoc.data['peca_id'], r_assoc.data['quantidade'], 'REMOCAO_PECA', ref_id=r_assoc.data['carro_id'])
     r = sb.table('pecas_carros').delete().eq('id', int(associacao_id)).execute()
+    if r_assoc.data:
+        cache_ocupacao.invalidar(r_assoc.data['peca_id'])
     return len(r.data) > 0
 
 # --- MOTOR DE DISPONIBILIDADE (TOTAL - ALUGADO - INSTALADO) ---
@@ -623,22 +678,30 @@ def verificar_disponibilidade(item_id, data_consulta, filtro_loc=None):
         'compromissos_ativos': comps_objetos 
     }
 
-def verificar_disponibilidade_periodo(item_id, data_inicio, data_fim):
+def verificar_disponibilidade_periodo(item_id, data_inicio, data_fim, excluir_compromisso_id=None):
+    """Consulta para as telas (pode vir do cache de ocupação). As gravações conferem
+    no banco, na transação da RPC: reservar_itens / get_disponibilidade_lote."""
     sb = get_supabase()
     
     # 1. Busca os dados do item para o cabeçalho
     item = buscar_item_por_id(item_id)
     if not item: return None
 
-    # 2. Chama a RPC que calcula o pico de ocupação no período
-    res = sb.rpc('get_disponibilidade_periodo', {
-        'p_item_id': int(item_id),
-        'p_start_date': str(data_inicio),
-        'p_end_date': str(data_fim)
-    }).execute()
+    # 2. Pico de ocupação no período: cache em memória; fora da janela, a RPC.
+    # Editando um contrato, a reserva dele sai da conta (RPC em lote)
+    if excluir_compromisso_id:
+        dados = verificar_disponibilidade_lote([{'item_id': item_id, 'quantidade': 0}], data_inicio, data_fim, excluir_compromisso_id)[0]
+    else:
+        dados = cache_ocupacao.pico(item_id, _date_parse(data_inicio), _date_parse(data_fim))
+    if dados is None:
+        res = sb.rpc('get_disponibilidade_periodo', {
+            'p_item_id': int(item_id),
+            'p_start_date': str(data_inicio),
+            'p_end_date': str(data_fim)
+        }).execute()
 
-    if not res.data: return None
-    dados = res.data[0]
+        if not res.data: return None
+        dados = res.data[0]
 
     # 3. Formata exatamente como o seu componente React espera
     return {
@@ -650,6 +713,23 @@ def verificar_disponibilidade_periodo(item_id, data_inicio, data_fim):
         "disponivel_minimo": max(0, dados['disponivel_minimo'])
     }
 
+def verificar_disponibilidade_lote(linhas, data_inicio, data_fim, excluir_compromisso_id=None):
+    """Confere todas as linhas de um pedido ({'item_id', 'quantidade'}) no período em
+    uma única chamada (RPC get_disponibilidade_lote, supabase_migration_disponibilidade_lote.sql).
+
+    Linhas do mesmo item consomem a mesma disponibilidade, na ordem. Retorna uma
+    entrada por linha (formato de disponibilidade.conferir_linhas) com a falta de estoque."""
+    linhas = [{'item_id': int(l['item_id']), 'quantidade': int(l.get('quantidade') or 0)} for l in linhas]
+    if not linhas:
+        return []
+    res = get_supabase().rpc('get_disponibilidade_lote', {
+        'p_itens': linhas,
+        'p_start_date': _date_parse(data_inicio).isoformat(),
+        'p_end_date': _date_parse(data_fim).isoformat(),
+        'p_excluir_compromisso_id': int(excluir_compromisso_id) if excluir_compromisso_id else None
+    }).execute()
+    return sorted(res.data or [], key=lambda r: r['linha'])
+
 def verificar_disponibilidade_todos_itens(data_consulta, filtro_localizacao=None, filtro_categoria=None):
     sb = get_supabase()
     
@@ -677,7 +757,302 @@ def verificar_disponibilidade_todos_itens(data_consulta, filtro_localizacao=None
         "quantidade_disponivel": r['quantidade_disponivel']
     } for r in dados]
 
+def _paginas(consulta, tamanho_pagina=1000):
+    """Todas as linhas de consulta() em páginas de .range() (o PostgREST corta cada
+    resposta em 1000 linhas); consulta monta a query do zero e com ordem estável."""
+    inicio = 0
+    while True:
+        linhas = consulta().range(inicio, inicio + tamanho_pagina - 1).execute().data or []
+        yield from linhas
+        if len(linhas) < tamanho_pagina:
+            return
+        inicio += tamanho_pagina
+
+def listar_ocupacao_periodo(data_inicio, data_fim, item_ids=None, tamanho_lote=500):
+    """Dados para a linha do tempo de disponibilidade (disponibilidade.linha_do_tempo):
+    itens, reservas que se sobrepõem ao período (legadas e linhas de contratos master)
+    e peças instaladas até data_fim, com um número fixo de consultas."""
+    sb = get_supabase()
+    inicio, fim = _date_parse(data_inicio), _date_parse(data_fim)
+    filtro = [int(i) for i in item_ids] if item_ids else None
+
+    q = sb.table('itens').select('id, nome, quantidade_total').order('nome')
+    if filtro: q = q.in_('id', filtro)
+    itens = {row['id']: {'nome': row['nome'], 'quantidade_total': row['quantidade_total']} for row in (q.execute().data or [])}
+
+    def consulta_contratos():
+        q = sb.table('compromissos').select('id, item_id, quantidade, data_inicio, data_fim') \
+            .lte('data_inicio', fim.isoformat()).gte('data_fim', inicio.isoformat()).order('id')
+        # Com filtro: legados dos itens pedidos e contratos master (item_id nulo; itens nas linhas)
+        if filtro: q = q.or_(f"item_id.in.({','.join(str(i) for i in filtro)}),item_id.is.null")
+        return q
+    contratos = {row['id']: row for row in _paginas(consulta_contratos)}
+    reservas = [
+        (row['item_id'], _date_parse(row['data_inicio']), _date_parse(row['data_fim']), int(row['quantidade'] or 0))
+        for row in contratos.values() if row.get('item_id')
+    ]
+    ids_contratos = list(contratos)
+    for i in range(0, len(ids_contratos), tamanho_lote):
+        def consulta_linhas(lote=ids_contratos[i:i + tamanho_lote]):
+            q = sb.table('compromisso_itens').select('compromisso_id, item_id, quantidade') \
+                .in_('compromisso_id', lote).order('id')
+            if filtro: q = q.in_('item_id', filtro)
+            return q
+        for row in _paginas(consulta_linhas):
+            contrato = contratos[row['compromisso_id']]
+            reservas.append((row['item_id'], _date_parse(contrato['data_inicio']), _date_parse(contrato['data_fim']), int(row['quantidade'] or 0)))
+
+    q = sb.table('pecas_carros').select('peca_id, data_instalacao, quantidade').lte('data_instalacao', fim.isoformat())
+    if filtro: q = q.in_('peca_id', filtro)
+    instalacoes = [(row['peca_id'], _date_parse(row['data_instalacao']), int(row['quantidade'] or 0)) for row in (q.execute().data or [])]
+    return itens, reservas, instalacoes
+
+def listar_itens_alternativos(item_id):
+    """IDs dos outros itens da mesma categoria e localização (cidade/UF), por nome"""
+    sb = get_supabase()
+    r = sb.table('itens').select('categoria, cidade, uf').eq('id', int(item_id)).execute()
+    if not r.data:
+        return []
+    item = r.data[0]
+    r = sb.table('itens').select('id').eq('categoria', item['categoria']).eq('cidade', item['cidade']) \
+        .eq('uf', item['uf']).neq('id', int(item_id)).order('nome').execute()
+    return [row['id'] for row in (r.data or [])]
+
+def _momento_parse(texto):
+    """timestamptz do PostgREST -> datetime com fuso (sem fuso é tratado como UTC)"""
+    if isinstance(texto, datetime):
+        momento = texto
+    else:
+        momento = datetime.fromisoformat(str(texto).replace('Z', '+00:00'))
+    if momento.tzinfo is None:
+        momento = momento.replace(tzinfo=timezone.utc)
+    return momento
+
+def listar_reservas_temporarias_ativas(data_inicio, data_fim, item_ids=None):
+    """Reservas temporárias não vencidas que se sobrepõem ao período:
+    [(token, item_id, data_inicio, data_fim, quantidade, expira_em)]"""
+    q = get_supabase().table('reservas_temporarias').select('token, item_id, data_inicio, data_fim, quantidade, expira_em') \
+        .lte('data_inicio', _date_parse(data_fim).isoformat()).gte('data_fim', _date_parse(data_inicio).isoformat()) \
+        .gt('expira_em', datetime.now(timezone.utc).isoformat())
+    if item_ids: q = q.in_('item_id', [int(i) for i in item_ids])
+    return [
+        (row['token'], row['item_id'], _date_parse(row['data_inicio']), _date_parse(row['data_fim']),
+         int(row['quantidade'] or 0), _momento_parse(row['expira_em']))
+        for row in (q.execute().data or [])
+    ]
+
+# Pico de ocupação por item em memória (verificar_disponibilidade_periodo);
+# as escritas acima ajustam ou invalidam o item afetado
+cache_ocupacao = disponibilidade.CacheOcupacao(listar_ocupacao_periodo, carregar_temporarias=listar_reservas_temporarias_ativas)
+
+# ---------- Reservas temporárias ----------
+def reservar_itens(linhas, data_inicio, data_fim, ttl_segundos=None, token=None):
+    """Bloqueia o estoque das linhas ({'item_id', 'quantidade'}) no período por ttl_segundos.
+
+    RPC reservar_itens (supabase_migration_reservas_temporarias.sql): trava só as
+    linhas de itens do pedido, confere e grava numa transação. Com o token de uma
+    reserva existente, ela é substituída. Retorna {'reservado', 'token', 'expira_em',
+    'linhas'}; se faltar estoque nada é gravado e reservado=False."""
+    ttl_segundos = disponibilidade.validar_ttl_reserva(ttl_segundos)
+    if not linhas:
+        raise ValueError("Informe ao menos um item para reservar")
+    inicio, fim = _date_parse(data_inicio), _date_parse(data_fim)
+    valido, msg_erro = validacoes.validar_datas(inicio, fim)
+    if not valido:
+        raise ValueError(msg_erro)
+    token = token or disponibilidade.novo_token_reserva()
+    linhas = [{'item_id': int(l['item_id']), 'quantidade': int(l.get('quantidade') or 0)} for l in linhas]
+
+    r = get_supabase().rpc('reservar_itens', {
+        'p_token': token,
+        'p_itens': linhas,
+        'p_start_date': inicio.isoformat(),
+        'p_end_date': fim.isoformat(),
+        'p_ttl_segundos': ttl_segundos
+    }).execute()
+    resultado = r.data[0] if isinstance(r.data, list) else (r.data or {})
+    conferencia = sorted(resultado.get('linhas') or [], key=lambda c: c['linha'])
+    if not resultado.get('reservado'):
+        return {'reservado': False, 'token': None, 'expira_em': None, 'linhas': conferencia}
+
+    expira_em = _momento_parse(resultado['expira_em'])
+    cache_ocupacao.remover_temporarias(token)
+    for linha in linhas:
+        if linha['quantidade'] > 0:
+            cache_ocupacao.registrar_temporaria(token, linha['item_id'], inicio, fim, linha['quantidade'], expira_em)
+    return {'reservado': True, 'token': token, 'expira_em': expira_em, 'linhas': conferencia}
+
+def confirmar_reserva(token, **dados_header):
+    """Transforma as reservas do token em um contrato master (RPC confirmar_reserva):
+    cabeçalho, linhas e remoção das reservas na mesma transação. As datas e os itens
+    vêm da reserva. Retorna {'compromisso_ids': [id]}."""
+    payload = {k: v for k, v in dados_header.items() if k not in ('itens', 'data_inicio', 'data_fim') and v is not None}
+
+    r = get_supabase().rpc('confirmar_reserva', {'p_token': token, 'p_header': payload}).execute()
+    resultado = r.data[0] if isinstance(r.data, list) else (r.data or {})
+    contrato_id = resultado['compromisso_id']
+
+    cache_ocupacao.remover_temporarias(token)
+    inicio, fim = _date_parse(resultado['data_inicio']), _date_parse(resultado['data_fim'])
+    for i in resultado.get('itens') or []:
+        cache_ocupacao.registrar_reserva(i['item_id'], inicio, fim, i['quantidade'])
+    eventos.publicar('compromissos', 'CREATE', contrato_id)
+    return {'compromisso_ids': [contrato_id]}
+
+def cancelar_reserva(token):
+    """Libera as reservas temporárias do token; retorna quantas linhas foram removidas"""
+    r = get_supabase().table('reservas_temporarias').delete().eq('token', token).execute()
+    cache_ocupacao.remover_temporarias(token)
+    return len(r.data or [])
+
+# ---------- Importação em lote ----------
+@_altera_espelho
+def importar_itens_lote(linhas):
+    """Grava um lote de itens já validados (importacao.importar_itens).
+
+    Uma consulta de duplicatas por nome e outra por placa, e um INSERT em array
+    para itens, movimentações e cada tabela de categoria.
+    linhas: lista de (numero_linha, dados). Retorna {'inseridos', 'erros'}."""
+    sb = get_supabase()
+    nomes = sorted({d['nome'] for _, d in linhas})
+    r = sb.table('itens').select('nome, categoria').in_('nome', nomes).execute()
+    existentes = {(row['nome'], row['categoria']) for row in (r.data or [])}
+    placas = sorted({d['placa'] for _, d in linhas if d.get('placa')})
+    placas_existentes = set()
+    if placas:
+        try:
+            r = sb.table('carros').select('placa').in_('placa', placas).execute()
+            placas_existentes = {row['placa'] for row in (r.data or [])}
+        except Exception:
+            pass
+
+    erros, aceitos = [], []
+    for numero, d in linhas:
+        if (d['nome'], d['categoria']) in existentes:
+            erros.append({'linha': numero, 'erro': f"Item '{d['nome']}' já existe na categoria '{d['categoria']}'"})
+        elif d.get('placa') in placas_existentes:
+            erros.append({'linha': numero, 'erro': f"Placa {d['placa']} já cadastrada"})
+        else:
+            aceitos.append(d)
+    if not aceitos:
+        return {'inseridos': 0, 'erros': erros}
+
+    extras = [{k: d[k] for k in ('placa', 'marca', 'modelo', 'ano') if d.get(k) is not None} for d in aceitos]
+    payload = [{
+        'nome': d['nome'], 'quantidade_total': int(d['quantidade_total']), 'categoria': d['categoria'],
+        'descricao': d.get('descricao') or '', 'cidade': d['cidade'], 'uf': d['uf'],
+        'endereco': d.get('endereco') or '', 'dados_categoria': extra
+    } for d, extra in zip(aceitos, extras)]
+    ins = sb.table('itens').insert(payload).execute()
+    if not ins.data or len(ins.data) != len(payload):
+        raise Exception("Falha ao inserir itens no banco")
+
+    agora = datetime.now().isoformat()
+    try:
+        sb.table('movimentacoes_estoque').insert([{
+            'item_id': row['id'], 'quantidade': int(row['quantidade_total']), 'tipo': 'COMPRA',
+            'referencia_id': None, 'descricao': 'Importação', 'data_movimentacao': agora
+        } for row in ins.data]).execute()
+    except: pass
+
+    por_tabela = {}
+    for row, extra in zip(ins.data, extras):
+        slug = _slug_categoria(row['categoria'])
+        if slug and slug != 'itens' and extra:
+            por_tabela.setdefault(slug, []).append({'item_id': row['id'], **{_slugify_label(k): v for k, v in extra.items()}})
+    for slug, linhas_categoria in por_tabela.items():
+        try: sb.table(slug).insert(linhas_categoria).execute()
+        except: pass
+
+    auditoria.registrar_auditoria_lote([
+        {'acao': 'CREATE', 'tabela': 'Itens', 'registro_id': row['id'], 'valores_novos': d}
+        for row, d in zip(ins.data, aceitos)
+    ], registrar_alteracao=False)
+    return {'inseridos': len(ins.data), 'erros': erros}
+
+
+def importar_compromissos_lote(linhas):
+    """Grava um lote de compromissos já validados (importacao.importar_compromissos).
+
+    Uma consulta para os itens, uma para os compromissos legados e uma para os
+    itens de contratos master no período; estoque e duplicatas são conferidos em memória.
+    linhas: lista de (numero_linha, dados). Retorna {'inseridos', 'erros'}."""
+    sb = get_supabase()
+    item_ids = sorted({d['item_id'] for _, d in linhas})
+    inicio = min(d['data_inicio'] for _, d in linhas).isoformat()
+    fim = max(d['data_fim'] for _, d in linhas).isoformat()
+
+    r = sb.table('itens').select('id, quantidade_total').in_('id', item_ids).execute()
+    estoque = {row['id']: int(row['quantidade_total'] or 0) for row in (r.data or [])}
+
+    ocupacao, existentes = {}, set()
+    r = sb.table('compromissos').select('item_id, quantidade, data_inicio, data_fim, contratante') \
+        .in_('item_id', item_ids).lte('data_inicio', fim).gte('data_fim', inicio).execute()
+    for row in (r.data or []):
+        di, df = _date_parse(row['data_inicio']), _date_parse(row['data_fim'])
+        ocupacao.setdefault(row['item_id'], []).append((row['item_id'], di, df, int(row['quantidade'] or 0)))
+        existentes.add((row['item_id'], di, df, row.get('contratante') or None))
+    try:
+        r = sb.table('compromisso_itens').select('item_id, quantidade, compromissos!inner(data_inicio, data_fim)') \
+            .in_('item_id', item_ids).execute()
+        for row in (r.data or []):
+            c = row.get('compromissos') or {}
+            di, df = _date_parse(c.get('data_inicio')), _date_parse(c.get('data_fim'))
+            if di and df and di.isoformat() <= fim and df.isoformat() >= inicio:
+                ocupacao.setdefault(row['item_id'], []).append((row['item_id'], di, df, int(row['quantidade'] or 0)))
+    except Exception:
+        pass
+
+    erros, aceitos = [], []
+    for numero, d in linhas:
+        item_id = d['item_id']
+        if item_id not in estoque:
+            erros.append({'linha': numero, 'erro': f"Item {item_id} não encontrado"})
+            continue
+        if (item_id, d['data_inicio'], d['data_fim'], d['contratante']) in existentes:
+            erros.append({'linha': numero, 'erro': "Compromisso já cadastrado"})
+            continue
+        intervalos = ocupacao.setdefault(item_id, [])
+        disponivel = disponibilidade.picos_periodo(
+            {item_id: {'quantidade_total': estoque[item_id]}}, intervalos, [], d['data_inicio'], d['data_fim']
+        )[item_id]['disponivel_minimo']
+        if d['quantidade'] > disponivel:
+            erros.append({'linha': numero, 'erro': f"Quantidade solicitada ({d['quantidade']}) excede a disponível ({disponivel})"})
+            continue
+        intervalos.append((item_id, d['data_inicio'], d['data_fim'], d['quantidade']))
+        aceitos.append(d)
+    if not aceitos:
+        return {'inseridos': 0, 'erros': erros}
+
+    payload = [{
+        'item_id': d['item_id'], 'quantidade': int(d['quantidade']),
+        'data_inicio': d['data_inicio'].isoformat(), 'data_fim': d['data_fim'].isoformat(),
+        'descricao': d.get('descricao') or '', 'cidade': d['cidade'], 'uf': d['uf'],
+        'endereco': d.get('endereco') or '', 'contratante': d.get('contratante') or ''
+    } for d in aceitos]
+    ins = sb.table('compromissos').insert(payload).execute()
+    if not ins.data or len(ins.data) != len(payload):
+        raise Exception("Erro ao criar compromissos")
+
+    agora = datetime.now().isoformat()
+    try:
+        sb.table('movimentacoes_estoque').insert([{
+            'item_id': row['item_id'], 'quantidade': -int(row['quantidade']), 'tipo': 'ALUGUEL_SAIDA',
+            'referencia_id': row['id'], 'descricao': '', 'data_movimentacao': agora
+        } for row in ins.data]).execute()
+    except: pass
+    for d in aceitos:
+        cache_ocupacao.registrar_reserva(d['item_id'], d['data_inicio'], d['data_fim'], d['quantidade'])
+
+    auditoria.registrar_auditoria_lote([
+        {'acao': 'CREATE', 'tabela': 'Compromissos', 'registro_id': row['id'], 'valores_novos': p}
+        for row, p in zip(ins.data, payload)
+    ], registrar_alteracao=False)
+    return {'inseridos': len(ins.data), 'erros': erros}
+
+
 # ---------- Financiamentos ----------
+@_altera_espelho
 def criar_financiamento_item(financiamento_id, item_id, valor_proporcional=0.0):
     sb = get_supabase()
     sb.table('financiamentos_itens').insert({
@@ -691,6 +1066,7 @@ def listar_itens_financiamento(financiamento_id):
     r = sb.table('financiamentos_itens').select('*').eq('financiamento_id', int(financiamento_id)).execute()
     return [{'item_id': x['item_id'], 'valor_proporcional': float(x.get('valor_proporcional') or 0)} for x in (r.data or [])]
 
+@_altera_espelho
 def criar_financiamento(item_id=None, valor_total=None, numero_parcelas=None, taxa_juros=None, data_inicio=None, valor_entrada=0.0, instituicao_financeira=None, observacoes=None, parcelas_customizadas=None, itens_ids=None, codigo_contrato=None):
     if item_id and not itens_ids:
         itens_ids = [item_id]
@@ -764,14 +1140,36 @@ def criar_financiamento(item_id=None, valor_total=None, numero_parcelas=None, ta
                 'data_vencimento': data_venc.isoformat(),
                 'status': 'Pendente'
             }).execute()
-    auditoria.registrar_auditoria('CREATE', 'Financiamentos', fin_id, valores_novos={'itens_ids': itens_ids})
+    auditoria.registrar_auditoria('CREATE', 'Financiamentos', fin_id, valores_novos={'itens_ids': itens_ids}, registrar_alteracao=False)
     return buscar_financiamento_por_id(fin_id)
 
-def listar_financiamentos(status=None, item_id=None, q=None, pagina=None, por_pagina=10):
+MODOS_CONTAGEM = ('exact', 'planned', 'none')
+
+def listar_financiamentos(status=None, item_id=None, q=None, pagina=None, por_pagina=10, updated_since=None,
+                          after_id=None, count='exact'):
+    """Financiamentos da view_financiamentos_quitacao, do mais novo ao mais antigo.
+
+    Paginação por cursor: after_id = proximo_after_id da página anterior (id < after_id,
+    custo igual ao da primeira página); pagina usa offset e fica cara em páginas fundas.
+    count: 'exact' (COUNT na view), 'planned' (estimativa do planejador) ou 'none' (total None);
+    com after_id, o total é o do que vem a partir do cursor.
+    """
+    if count not in MODOS_CONTAGEM:
+        raise ValueError(f"count deve ser um de: {', '.join(MODOS_CONTAGEM)}")
+    espelho_local = _espelho_leitura() if not (updated_since or item_id) else None
+    linhas = espelho_local.linhas('financiamentos') if espelho_local else None
+    if linhas is not None:
+        return _listar_financiamentos_espelho(linhas, status, q, pagina, por_pagina, after_id, count)
     sb = get_supabase()
     
     # Agora apontamos para a view_financiamentos_quitacao
-    query = sb.table('view_financiamentos_quitacao').select('*', count='exact').order('id', desc=True)
+    query = sb.table('view_financiamentos_quitacao').select('*', count=None if count == 'none' else count).order('id', desc=True)
+    
+    if updated_since:
+        # Parcelas pagas renovam o updated_at do financiamento (trigger trg_tocar_pai)
+        ids = _ids_alterados('financiamentos', updated_since)
+        if not ids: return {"data": [], "total": 0}
+        query = query.in_('id', ids)
     
     if status and status != 'Todos':
         query = query.eq('status', status)
@@ -782,27 +1180,54 @@ def listar_financiamentos(status=None, item_id=None, q=None, pagina=None, por_pa
         if not fin_ids: return {"data": [], "total": 0}
         query = query.in_('id', fin_ids)
 
-    if q:
-        qe = str(q).strip()
-        # Contrato, nomes dos itens (view) e instituição financeira
-        filtro = (
-            f"codigo_contrato.ilike.%{qe}%,"
-            f"busca_itens.ilike.%{qe}%,"
-            f"instituicao_financeira.ilike.%{qe}%"
-        )
-        query = query.or_(filtro)
-
-    if pagina is not None:
+    if q and str(q).strip():
+        # Contrato, nomes dos itens e instituição financeira: índice de trigramas
+        # na coluna gerada financiamentos.busca, em vez de ilike '%q%' na view
+        ids_busca = buscar_ids_texto('financiamentos', q)
+        if not ids_busca: return {"data": [], "total": 0}
+        query = query.in_('id', ids_busca)
+
+    paginado = after_id is not None or pagina is not None
+    if after_id is not None:
+        query = query.lt('id', int(after_id)).limit(int(por_pagina))
+    elif pagina is not None:
         inicio = (int(pagina) - 1) * int(por_pagina)
         fim = inicio + int(por_pagina) - 1
         query = query.range(inicio, fim)
     
     res = query.execute()
+    dados = res.data or []
     
     # Retorno limpo: a View já fez todo o trabalho de nomes e cálculos
     return {
-        "data": res.data or [], 
-        "total": res.count or 0
+        "data": dados, 
+        "total": None if count == 'none' else (res.count or 0),
+        # Cursor da próxima página (None quando esta não veio cheia)
+        "proximo_after_id": dados[-1]['id'] if paginado and len(dados) == int(por_pagina) else None
+    }
+
+def _listar_financiamentos_espelho(linhas, status, q, pagina, por_pagina, after_id, count):
+    """listar_financiamentos sobre as linhas da view no espelho local (mesmos filtros, cursor e formato)"""
+    linhas = linhas[::-1]  # do mais novo ao mais antigo, como order('id', desc=True)
+    if status and status != 'Todos':
+        linhas = [row for row in linhas if row.get('status') == status]
+    if q and str(q).strip():
+        ids_busca = set(buscar_ids_texto('financiamentos', q))
+        linhas = [row for row in linhas if row['id'] in ids_busca]
+
+    paginado = after_id is not None or pagina is not None
+    if after_id is not None:
+        linhas = [row for row in linhas if row['id'] < int(after_id)]
+        dados = linhas[:int(por_pagina)]
+    elif pagina is not None:
+        inicio = (int(pagina) - 1) * int(por_pagina)
+        dados = linhas[inicio:inicio + int(por_pagina)]
+    else:
+        dados = linhas
+    return {
+        "data": dados,
+        "total": None if count == 'none' else len(linhas),
+        "proximo_after_id": dados[-1]['id'] if paginado and len(dados) == int(por_pagina) else None
     }
 
 def _row_to_financiamento_otimizado(row, itens_pre_carregados):
@@ -883,6 +1308,7 @@ def _financiamento_itens_ids_only(financiamento_id):
     r = sb.table('financiamentos_itens').select('item_id, valor_proporcional').eq('financiamento_id', int(financiamento_id)).execute()
     return r.data or []
 
+@_altera_espelho
 def atualizar_financiamento(financiamento_id, **kwargs):
     sb = get_supabase()
     fid = int(financiamento_id)
@@ -946,10 +1372,11 @@ def atualizar_financiamento(financiamento_id, **kwargs):
             sb.table('financiamentos').update({'item_id': int(kwargs['itens_ids'][0])}).eq('id', fid).execute()
 
     # 5. Auditoria
-    auditoria.registrar_auditoria('UPDATE', 'Financiamentos', fid, valores_novos=kwargs)
+    auditoria.registrar_auditoria('UPDATE', 'Financiamentos', fid, valores_novos=kwargs, registrar_alteracao=False)
     
     return buscar_financiamento_por_id(fid)
 
+@_altera_espelho
 def deletar_financiamento(financiamento_id):
     sb = get_supabase()
     sb.table('parcelas_financiamento').delete().eq('financiamento_id', int(financiamento_id)).execute()
@@ -959,7 +1386,8 @@ def deletar_financiamento(financiamento_id):
 
 # No seu supabase.py, substitua a função listar_parcelas_financiamento
 
-def listar_parcelas_financiamento(financiamento_id=None, status=None, mes=None, ano=None, data_vencimento=None):
+def listar_parcelas_financiamento(financiamento_id=None, status=None, mes=None, ano=None, data_vencimento=None,
+                                  data_inicio=None, data_fim=None):
     sb = get_supabase()
     
     # JOIN para trazer o código do contrato
@@ -983,6 +1411,12 @@ def listar_parcelas_financiamento(financiamento_id=None, status=None, mes=None,
         p_dia = f"{ano}-{str(mes).zfill(2)}-01"
         u_dia = f"{ano}-{str(mes).zfill(2)}-{calendar.monthrange(int(ano), int(mes))[1]}"
         q = q.gte('data_vencimento', p_dia).lte('data_vencimento', u_dia)
+
+    # Intervalo de vencimento (conciliação de extrato)
+    if data_inicio:
+        q = q.gte('data_vencimento', _date_parse(data_inicio).isoformat())
+    if data_fim:
+        q = q.lte('data_vencimento', _date_parse(data_fim).isoformat())
     
     r = q.order('data_vencimento').execute()
     data_rows = r.data or []
@@ -1016,6 +1450,7 @@ def listar_parcelas_financiamento(financiamento_id=None, status=None, mes=None,
 
     return [Parcela(x) for x in data_rows]
 
+@_altera_espelho
 def atualizar_parcela_financiamento(parcela_id, status=None, link_boleto=None, link_comprovante=None, valor_original=None, data_vencimento=None):
     sb = get_supabase()
     payload = {}
@@ -1048,6 +1483,7 @@ def atualizar_parcela_financiamento(parcela_id, status=None, link_boleto=None, l
             self.link_comprovante = row.get('link_comprovante')
     return Parcela(r.data[0])
 
+@_altera_espelho
 def pagar_parcela_financiamento(parcela_id, valor_pago, data_pagamento=None, link_comprovante=None):
     if data_pagamento is None:
         data_pagamento = date.today()
@@ -1085,6 +1521,97 @@ def pagar_parcela_financiamento(parcela_id, valor_pago, data_pagamento=None, lin
     return Parcela()
 
 
+@_altera_espelho
+def pagar_parcelas_financiamento(pagamentos):
+    """Paga várias parcelas em uma única transação (RPC pagar_parcelas_financiamento,
+    supabase_migration_pagamento_lote.sql) e quita os financiamentos sem parcelas em aberto.
+
+    pagamentos: lista de dicts com parcela_id, valor_pago e opcionalmente data_pagamento.
+    Retorna {'parcelas': [...], 'financiamentos_quitados': [...]}."""
+    if not pagamentos:
+        return {'parcelas': [], 'financiamentos_quitados': []}
+    payload = []
+    for p in pagamentos:
+        dp = _date_parse(p.get('data_pagamento')) or date.today()
+        payload.append({
+            'parcela_id': int(p['parcela_id']),
+            'valor_pago': round(float(p['valor_pago']) + float(p.get('juros') or 0) + float(p.get('multa') or 0) - float(p.get('desconto') or 0), 2),
+            'data_pagamento': dp.isoformat(),
+        })
+    r = get_supabase().rpc('pagar_parcelas_financiamento', {'p_pagamentos': payload}).execute()
+    dados = r.data[0] if isinstance(r.data, list) else (r.data or {})
+    parcelas = []
+    for row in (dados.get('parcelas') or []):
+        row = dict(row)
+        row['data_vencimento'] = _date_parse(row.get('data_vencimento'))
+        row['data_pagamento'] = _date_parse(row.get('data_pagamento'))
+        parcelas.append(SimpleNamespace(**row))
+    for p in payload:
+        auditoria.registrar_auditoria('UPDATE', 'Parcelas Financiamento', p['parcela_id'], valores_novos=p, registrar_alteracao=False)
+    return {'parcelas': parcelas, 'financiamentos_quitados': list(dados.get('financiamentos_quitados') or [])}
+
+
+@_altera_espelho
+def aplicar_baixas_lote(baixas):
+    """Baixa várias contas e parcelas em uma única transação (RPC aplicar_baixas_lote,
+    supabase_migration_conciliacao.sql), com uma única escrita de auditoria.
+
+    baixas: lista de dicts com tipo ('receber', 'pagar' ou 'parcela'), id, valor,
+    data_pagamento e opcionalmente forma_pagamento.
+    Retorna o número de baixas por tipo e 'financiamentos_quitados'."""
+    resultado = {'receber': 0, 'pagar': 0, 'parcela': 0, 'financiamentos_quitados': []}
+    if not baixas:
+        return resultado
+    tipos_invalidos = sorted({b['tipo'] for b in baixas} - {'receber', 'pagar', 'parcela'})
+    if tipos_invalidos:
+        raise ValueError(f"Tipos de baixa inválidos: {tipos_invalidos}")
+    payload = [{
+        'tipo': b['tipo'],
+        'id': int(b['id']),
+        'valor': round(float(b['valor']), 2),
+        'data_pagamento': (_date_parse(b.get('data_pagamento')) or date.today()).isoformat(),
+        'forma_pagamento': b.get('forma_pagamento') or '',
+    } for b in baixas]
+    r = get_supabase().rpc('aplicar_baixas_lote', {'p_baixas': payload}).execute()
+    dados = r.data[0] if isinstance(r.data, list) else (r.data or {})
+    for chave in ('receber', 'pagar', 'parcela'):
+        resultado[chave] = int(dados.get(chave) or 0)
+    resultado['financiamentos_quitados'] = list(dados.get('financiamentos_quitados') or [])
+    tabelas = {'receber': 'Contas a Receber', 'pagar': 'Contas a Pagar', 'parcela': 'Parcelas Financiamento'}
+    auditoria.registrar_auditoria_lote(
+        [{'acao': 'UPDATE', 'tabela': tabelas[p['tipo']], 'registro_id': p['id'], 'valores_novos': p} for p in payload]
+        + [{'acao': 'UPDATE', 'tabela': 'Financiamentos', 'registro_id': f, 'valores_novos': {'status': 'Quitado'}}
+           for f in resultado['financiamentos_quitados']],
+        registrar_alteracao=False
+    )
+    return resultado
+
+
+# ---------- Atualização de status ----------
+@_altera_espelho
+def atualizar_status_vencidos(data_referencia=None):
+    """Grava 'Vencido'/'Atrasada' nas contas e parcelas pendentes que venceram.
+
+    Usa a RPC atualizar_status_vencidos (supabase_migration_status_vencidos.sql): um
+    UPDATE por tabela no banco. Sem a migração, faz os mesmos UPDATEs via PostgREST.
+    Retorna o número de linhas atualizadas por tabela."""
+    hoje = (_date_parse(data_referencia) or date.today()).isoformat()
+    sb = get_supabase()
+    try:
+        r = sb.rpc('atualizar_status_vencidos', {'p_data': hoje}).execute()
+        linha = r.data[0] if isinstance(r.data, list) else r.data
+        return {k: int(v or 0) for k, v in (linha or {}).items()}
+    except Exception:
+        pass
+    contagens = {}
+    for tabela, novo_status in (('contas_receber', 'Vencido'), ('contas_pagar', 'Vencido'), ('parcelas_financiamento', 'Atrasada')):
+        q = sb.table(tabela).update({'status': novo_status}).eq('status', 'Pendente').lt('data_vencimento', hoje)
+        if tabela != 'parcelas_financiamento':
+            q = q.is_('data_pagamento', 'null')
+        contagens[tabela] = len(q.execute().data or [])
+    return contagens
+
+
 # ---------- Contas a receber ----------
 def criar_conta_receber(compromisso_id, descricao, valor, data_vencimento, forma_pagamento=None, observacoes=None):
     sb = get_supabase()
@@ -1104,11 +1631,14 @@ def criar_conta_receber(compromisso_id, descricao, valor, data_vencimento, forma
     }).execute()
     if not ins.data or len(ins.data) == 0:
         raise Exception("Erro ao criar conta a receber")
+    eventos.publicar('contas_receber', 'CREATE', ins.data[0]['id'])
     return ins.data[0]
 
-def listar_contas_receber(status=None, data_inicio=None, data_fim=None, compromisso_id=None):
+def listar_contas_receber(status=None, data_inicio=None, data_fim=None, compromisso_id=None, updated_since=None):
     sb = get_supabase()
     q = sb.table('contas_receber').select('*')
+    if updated_since:
+        q = q.gt('updated_at', _momento_iso(updated_since))
     if status:
         q = q.eq('status', status)
     if compromisso_id is not None:
@@ -1174,6 +1704,7 @@ def atualizar_conta_receber(conta_id, descricao=None, valor=None, data_venciment
         payload['observacoes'] = observacoes
     if payload:
         sb.table('contas_receber').update(payload).eq('id', int(conta_id)).execute()
+    eventos.publicar('contas_receber', 'UPDATE', int(conta_id))
     r = sb.table('contas_receber').select('*').eq('id', int(conta_id)).execute()
     if not r.data or len(r.data) == 0:
         return None
@@ -1182,6 +1713,7 @@ def atualizar_conta_receber(conta_id, descricao=None, valor=None, data_venciment
 def deletar_conta_receber(conta_id):
     sb = get_supabase()
     r = sb.table('contas_receber').delete().eq('id', int(conta_id)).execute()
+    eventos.publicar('contas_receber', 'DELETE', int(conta_id))
     return r.data is not None and len(r.data) > 0
 
 def marcar_conta_receber_paga(conta_id, data_pagamento=None, forma_pagamento=None):
@@ -1194,6 +1726,7 @@ def marcar_conta_receber_paga(conta_id, data_pagamento=None, forma_pagamento=Non
     if forma_pagamento is not None:
         payload['forma_pagamento'] = forma_pagamento
     sb.table('contas_receber').update(payload).eq('id', int(conta_id)).execute()
+    eventos.publicar('contas_receber', 'UPDATE', int(conta_id))
     r = sb.table('contas_receber').select('*').eq('id', int(conta_id)).execute()
     if not r.data or len(r.data) == 0:
         return None
@@ -1220,6 +1753,7 @@ def criar_conta_pagar(descricao, categoria, valor, data_vencimento, fornecedor=N
     ins = sb.table('contas_pagar').insert(payload).execute()
     if not ins.data or len(ins.data) == 0:
         raise Exception("Erro ao criar conta a pagar")
+    eventos.publicar('contas_pagar', 'CREATE', ins.data[0]['id'])
     return _row_to_conta_pagar(ins.data[0])
 
 def _row_to_conta_pagar(row):
@@ -1239,9 +1773,11 @@ def _row_to_conta_pagar(row):
     c.observacoes = row.get('observacoes') or ''
     return c
 
-def listar_contas_pagar(status=None, data_inicio=None, data_fim=None, categoria=None):
+def listar_contas_pagar(status=None, data_inicio=None, data_fim=None, categoria=None, updated_since=None):
     sb = get_supabase()
     q = sb.table('contas_pagar').select('*')
+    if updated_since:
+        q = q.gt('updated_at', _momento_iso(updated_since))
     if status:
         q = q.eq('status', status)
     if data_inicio:
@@ -1291,6 +1827,7 @@ def atualizar_conta_pagar(conta_id, descricao=None, categoria=None, valor=None,
         payload['item_id'] = int(item_id)
     if payload:
         sb.table('contas_pagar').update(payload).eq('id', int(conta_id)).execute()
+    eventos.publicar('contas_pagar', 'UPDATE', int(conta_id))
     r = sb.table('contas_pagar').select('*').eq('id', int(conta_id)).execute()
     if not r.data or len(r.data) == 0:
         return None
@@ -1299,27 +1836,44 @@ def atualizar_conta_pagar(conta_id, descricao=None, categoria=None, valor=None,
 def deletar_conta_pagar(conta_id):
     sb = get_supabase()
     r = sb.table('contas_pagar').delete().eq('id', int(conta_id)).execute()
+    eventos.publicar('contas_pagar', 'DELETE', int(conta_id))
     return r.data is not None and len(r.data) > 0
 
 def obter_fluxo_caixa(data_inicio, data_fim):
-    """Retorna fluxo de caixa por período (agrupado por mês)."""
+    """Retorna fluxo de caixa por período (agrupado por mês do pagamento).
+
+    Lê fluxo_caixa_mensal, mantida por triggers (supabase_migration_fluxo_caixa_mensal.sql).
+    Sem a migração aplicada, soma as contas como antes."""
     data_inicio = _date_parse(data_inicio)
     data_fim = _date_parse(data_fim)
-    receitas = listar_contas_receber(data_inicio=data_inicio, data_fim=data_fim)
-    despesas = listar_contas_pagar(data_inicio=data_inicio, data_fim=data_fim)
+    try:
+        r = get_supabase().table('fluxo_caixa_mensal').select('*') \
+            .gte('mes', data_inicio.strftime('%Y-%m')).lte('mes', data_fim.strftime('%Y-%m')) \
+            .order('mes').execute()
+    except Exception:
+        return _obter_fluxo_caixa_das_contas(data_inicio, data_fim)
+    out = []
+    for row in (r.data or []):
+        receitas, despesas = float(row.get('receitas') or 0), float(row.get('despesas') or 0)
+        if receitas or despesas:
+            out.append({'mes': row['mes'], 'receitas': receitas, 'despesas': despesas, 'saldo': receitas - despesas})
+    return out
+
+def reconstruir_fluxo_caixa():
+    """Recalcula fluxo_caixa_mensal no banco; retorna o número de meses gravados."""
+    r = get_supabase().rpc('reconstruir_fluxo_caixa', {}).execute()
+    return r.data or 0
+
+def _obter_fluxo_caixa_das_contas(data_inicio, data_fim):
+    mes_inicio, mes_fim = data_inicio.strftime('%Y-%m'), data_fim.strftime('%Y-%m')
     fluxo = {}
-    for conta in receitas:
-        if conta.status == 'Pago' and conta.data_pagamento:
-            mes = conta.data_pagamento.strftime('%Y-%m')
-            if mes not in fluxo:
-                fluxo[mes] = {'receitas': 0, 'despesas': 0}
-            fluxo[mes]['receitas'] += conta.valor
-    for conta in despesas:
-        if conta.status == 'Pago' and conta.data_pagamento:
+    for contas, chave in ((listar_contas_receber(), 'receitas'), (listar_contas_pagar(), 'despesas')):
+        for conta in contas:
+            if conta.status != 'Pago' or not conta.data_pagamento:
+                continue
             mes = conta.data_pagamento.strftime('%Y-%m')
-            if mes not in fluxo:
-                fluxo[mes] = {'receitas': 0, 'despesas': 0}
-            fluxo[mes]['despesas'] += conta.valor
+            if mes_inicio <= mes <= mes_fim:
+                fluxo.setdefault(mes, {'receitas': 0, 'despesas': 0})[chave] += conta.valor
     return [
         {'mes': mes, 'receitas': fluxo[mes]['receitas'], 'despesas': fluxo[mes]['despesas'],
          'saldo': fluxo[mes]['receitas'] - fluxo[mes]['despesas']}
@@ -1337,7 +1891,168 @@ def marcar_conta_pagar_paga(conta_id, data_pagamento=None, forma_pagamento=None)
     if forma_pagamento is not None:
         payload['forma_pagamento'] = forma_pagamento
     sb.table('contas_pagar').update(payload).eq('id', int(conta_id)).execute()
+    eventos.publicar('contas_pagar', 'UPDATE', int(conta_id))
     r = sb.table('contas_pagar').select('*').eq('id', int(conta_id)).execute()
     if not r.data or len(r.data) == 0:
         return None
     return _row_to_conta_pagar(r.data[0])
+
+
+# ---------- Exportação ----------
+TABELAS_EXPORTACAO = [
+    'categorias_itens', 'itens', 'carros', 'compromissos', 'compromisso_itens',
+    'contas_receber', 'contas_pagar', 'financiamentos', 'financiamentos_itens',
+    'parcelas_financiamento', 'pecas_carros', 'movimentacoes_estoque', 'fluxo_caixa_mensal',
+]
+# Tabelas sem coluna id: paginadas pela chave primária própria
+CHAVES_EXPORTACAO = {'fluxo_caixa_mensal': 'mes'}
+
+
+def listar_tabelas_exportacao():
+    """Tabelas fixas + tabelas de categoria (uma por categoria cadastrada)."""
+    tabelas = list(TABELAS_EXPORTACAO)
+    try:
+        r = get_supabase().table('categorias_itens').select('nome').execute()
+        for row in (r.data or []):
+            slug = _slug_categoria(row.get('nome'))
+            if slug and slug != 'itens' and slug not in tabelas:
+                try:
+                    # Categorias sem tabela própria (nunca criada) ficam de fora
+                    get_supabase().table(slug).select('item_id').limit(1).execute()
+                    tabelas.append(slug)
+                except Exception:
+                    pass
+    except Exception:
+        pass
+    return tabelas
+
+
+def iterar_tabela(tabela, tamanho_lote=1000):
+    """Itera as linhas de uma tabela em páginas de tamanho_lote (keyset pela chave,
+    sem OFFSET), mantendo no máximo uma página em memória."""
+    sb = get_supabase()
+    chave = CHAVES_EXPORTACAO.get(tabela, 'id')
+    ultimo = None
+    while True:
+        q = sb.table(tabela).select('*').order(chave)
+        if ultimo is not None:
+            q = q.gt(chave, ultimo)
+        linhas = q.limit(tamanho_lote).execute().data or []
+        yield from linhas
+        if len(linhas) < tamanho_lote:
+            return
+        ultimo = linhas[-1][chave]
+
+
+def buscar_registros(tabela, ids, tamanho_lote=500):
+    """Linhas da tabela com os ids informados (uma consulta .in_() por lote de ids)."""
+    sb = get_supabase()
+    ids = list(ids)
+    out = []
+    for i in range(0, len(ids), tamanho_lote):
+        out.extend(sb.table(tabela).select('*').in_('id', ids[i:i + tamanho_lote]).execute().data or [])
+    return out
+
+
+# ---------- Log de alterações ----------
+def _momento_iso(momento):
+    """updated_at é timestamptz: datetimes sem fuso são tratados como UTC"""
+    if isinstance(momento, str):
+        return momento
+    if momento.tzinfo is None:
+        momento = momento.replace(tzinfo=timezone.utc)
+    return momento.isoformat()
+
+def _ids_alterados(tabela, updated_since):
+    r = get_supabase().table(tabela).select('id').gt('updated_at', _momento_iso(updated_since)).execute()
+    return [row['id'] for row in (r.data or [])]
+
+def listar_removidos(tabela, updated_since):
+    """IDs apagados da tabela depois de updated_since (tombstones do log_alteracoes,
+    que também registra as exclusões em cascata)."""
+    r = get_supabase().table('log_alteracoes').select('registro_id').eq('tabela', tabela) \
+        .eq('operacao', 'DELETE').gt('criado_em', _momento_iso(updated_since)).execute()
+    return list(dict.fromkeys(row['registro_id'] for row in (r.data or [])))
+
+def listar_alteracoes(desde=0, limite=1000, compactar=False):
+    """Alterações com versão maior que `desde` (tabela log_alteracoes, alimentada por
+    triggers: supabase_migration_log_alteracoes.sql).
+    Retorna {'alteracoes', 'versao', 'tem_mais'}; 'versao' é o próximo `desde`."""
+    desde = int(desde or 0)
+    r = get_supabase().table('log_alteracoes').select('versao, tabela, registro_id, operacao, criado_em') \
+        .gt('versao', desde).order('versao').limit(limite + 1).execute()
+    linhas = r.data or []
+    tem_mais = len(linhas) > limite
+    linhas = linhas[:limite]
+    alteracoes = [{
+        'versao': row['versao'], 'tabela': row['tabela'], 'registro_id': row['registro_id'],
+        'operacao': row['operacao'], 'timestamp': row.get('criado_em')
+    } for row in linhas]
+    if compactar:
+        ultimas = {(a['tabela'], a['registro_id']): a for a in alteracoes}
+        alteracoes = sorted(ultimas.values(), key=lambda a: a['versao'])
+    return {'alteracoes': alteracoes, 'versao': linhas[-1]['versao'] if linhas else desde, 'tem_mais': tem_mais}
+
+# ---------- Sessões ----------
+def revogar_token(jti, expira_em):
+    """Grava o jti de um token encerrado (logout) até expira_em (epoch) e limpa os já vencidos"""
+    sb = get_supabase()
+    sb.table('tokens_revogados').delete().lte('expira_em', int(time.time())).execute()
+    sb.table('tokens_revogados').upsert({'jti': jti, 'expira_em': int(expira_em)}, on_conflict='jti').execute()
+
+def listar_tokens_revogados():
+    """[(jti, expira_em)] dos tokens revogados que ainda não venceriam"""
+    r = get_supabase().table('tokens_revogados').select('jti, expira_em').gt('expira_em', int(time.time())).execute()
+    return [(row['jti'], int(row['expira_em'])) for row in (r.data or [])]
+
+# ---------- Espelho local ----------
+def _versao_log_alteracoes():
+    r = get_supabase().table('log_alteracoes').select('versao').order('versao', desc=True).limit(1).execute()
+    return r.data[0]['versao'] if r.data else 0
+
+def _ids_espelho_afetados(alteracoes):
+    """Ids de itens e financiamentos a rebuscar no espelho para as alterações do log"""
+    por_tabela = {}
+    for a in alteracoes:
+        por_tabela.setdefault(a['tabela'], set()).add(a['registro_id'])
+    itens = por_tabela.get('itens', set())
+    financiamentos = set(por_tabela.get('financiamentos', ()))
+    # Vínculos e parcelas mudam os nomes e saldos da view: rebusca o financiamento deles
+    for tabela in ('financiamentos_itens', 'parcelas_financiamento'):
+        if por_tabela.get(tabela):
+            financiamentos |= {row['financiamento_id'] for row in buscar_registros(tabela, por_tabela[tabela])}
+    # Item renomeado ou apagado aparece na view dos financiamentos dele
+    if itens:
+        r = get_supabase().table('financiamentos_itens').select('financiamento_id').in_('item_id', list(itens)).execute()
+        financiamentos |= {row['financiamento_id'] for row in (r.data or [])}
+    return {'itens': itens, 'financiamentos': financiamentos}
+
+# ESPELHO_SUPABASE=true: itens, categorias e financiamentos lidos de um SQLite local
+# (espelho_supabase.py); escritas continuam indo ao Supabase
+espelho = espelho_supabase.Espelho(
+    espelho_supabase.ARQUIVO,
+    [
+        espelho_supabase.TabelaEspelhada(
+            'itens',
+            lambda: _mesclar_dados_categoria(get_supabase(), list(iterar_tabela('itens'))),
+            lambda ids: _mesclar_dados_categoria(get_supabase(), buscar_registros('itens', ids)),
+        ),
+        # Fora do log_alteracoes: recarregada a cada minuto
+        espelho_supabase.TabelaEspelhada('categorias_itens', lambda: iterar_tabela('categorias_itens'), ttl=60),
+        # valor_quitacao_hoje depende da data: recarga completa a cada dia
+        espelho_supabase.TabelaEspelhada(
+            'financiamentos',
+            lambda: iterar_tabela('view_financiamentos_quitacao'),
+            lambda ids: buscar_registros('view_financiamentos_quitacao', ids),
+            diaria=True,
+        ),
+    ],
+    versao_atual=_versao_log_alteracoes,
+    listar_alteracoes=listar_alteracoes,
+    ids_afetados=_ids_espelho_afetados,
+    origem=os.getenv('SUPABASE_URL', ''),
+) if espelho_supabase.ATIVO else None
+
+def estado_espelho():
+    """Resumo do espelho local para /api/debug (None se desativado)"""
+    return espelho.estado() if espelho is not None else None
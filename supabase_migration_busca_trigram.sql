@@ -0,0 +1,194 @@
+-- ============================================================
+-- Migração: busca textual por trigramas (pg_trgm + unaccent)
+-- Execute no Supabase: SQL Editor → New query → Cole e Run
+-- Usada por supabase_database.buscar_ids_texto (listar_itens,
+-- listar_compromissos e listar_financiamentos com q)
+-- ============================================================
+
+-- ilike '%q%' não usa índice B-tree: cada tecla na busca virava um seq scan.
+-- Cada tabela ganha uma coluna gerada `busca` (texto sem acento, minúsculo)
+-- com índice GIN de trigramas, que atende LIKE '%q%' e ordena por similaridade.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() é STABLE; colunas geradas e índices exigem IMMUTABLE
+CREATE OR REPLACE FUNCTION f_unaccent(texto text)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE PARALLEL SAFE STRICT
+AS $$
+  SELECT public.unaccent('public.unaccent'::regdictionary, texto)
+$$;
+
+-- ---------- Nomes dos itens (compromissos e financiamentos) ----------
+-- Coluna gerada não enxerga outras tabelas: os nomes dos itens ficam numa
+-- coluna comum, mantida pelos triggers abaixo, que entra na coluna gerada
+
+ALTER TABLE compromissos ADD COLUMN IF NOT EXISTS busca_itens_nomes text NOT NULL DEFAULT '';
+ALTER TABLE financiamentos ADD COLUMN IF NOT EXISTS busca_itens_nomes text NOT NULL DEFAULT '';
+
+CREATE OR REPLACE FUNCTION nomes_itens_compromisso(p_compromisso_id bigint)
+RETURNS text
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT COALESCE(string_agg(i.nome, ' ' ORDER BY i.nome), '')
+    FROM itens i
+   WHERE i.id IN (
+     SELECT ci.item_id FROM compromisso_itens ci WHERE ci.compromisso_id = p_compromisso_id
+     UNION
+     SELECT c.item_id FROM compromissos c WHERE c.id = p_compromisso_id
+   )
+$$;
+
+CREATE OR REPLACE FUNCTION nomes_itens_financiamento(p_financiamento_id bigint)
+RETURNS text
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT COALESCE(string_agg(i.nome, ' ' ORDER BY i.nome), '')
+    FROM itens i
+   WHERE i.id IN (
+     SELECT fi.item_id FROM financiamentos_itens fi WHERE fi.financiamento_id = p_financiamento_id
+     UNION
+     SELECT f.item_id FROM financiamentos f WHERE f.id = p_financiamento_id
+   )
+$$;
+
+CREATE OR REPLACE FUNCTION trg_busca_itens_compromisso()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_id bigint;
+BEGIN
+  IF TG_TABLE_NAME = 'compromissos' THEN
+    v_id := NEW.id;
+  ELSIF TG_OP = 'DELETE' THEN
+    v_id := OLD.compromisso_id;
+  ELSE
+    v_id := NEW.compromisso_id;
+  END IF;
+  UPDATE compromissos SET busca_itens_nomes = nomes_itens_compromisso(v_id)
+   WHERE id = v_id AND busca_itens_nomes IS DISTINCT FROM nomes_itens_compromisso(v_id);
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION trg_busca_itens_financiamento()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_id bigint;
+BEGIN
+  IF TG_TABLE_NAME = 'financiamentos' THEN
+    v_id := NEW.id;
+  ELSIF TG_OP = 'DELETE' THEN
+    v_id := OLD.financiamento_id;
+  ELSE
+    v_id := NEW.financiamento_id;
+  END IF;
+  UPDATE financiamentos SET busca_itens_nomes = nomes_itens_financiamento(v_id)
+   WHERE id = v_id AND busca_itens_nomes IS DISTINCT FROM nomes_itens_financiamento(v_id);
+  RETURN NULL;
+END;
+$$;
+
+-- Renomear um item atualiza os compromissos e financiamentos dele
+CREATE OR REPLACE FUNCTION trg_busca_itens_renomeado()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  UPDATE compromissos c SET busca_itens_nomes = nomes_itens_compromisso(c.id)
+   WHERE c.item_id = NEW.id OR c.id IN (SELECT ci.compromisso_id FROM compromisso_itens ci WHERE ci.item_id = NEW.id);
+  UPDATE financiamentos f SET busca_itens_nomes = nomes_itens_financiamento(f.id)
+   WHERE f.item_id = NEW.id OR f.id IN (SELECT fi.financiamento_id FROM financiamentos_itens fi WHERE fi.item_id = NEW.id);
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_busca_itens_compromisso ON compromissos;
+CREATE TRIGGER trg_busca_itens_compromisso
+  AFTER INSERT OR UPDATE OF item_id ON compromissos
+  FOR EACH ROW EXECUTE FUNCTION trg_busca_itens_compromisso();
+
+DROP TRIGGER IF EXISTS trg_busca_itens_compromisso ON compromisso_itens;
+CREATE TRIGGER trg_busca_itens_compromisso
+  AFTER INSERT OR UPDATE OR DELETE ON compromisso_itens
+  FOR EACH ROW EXECUTE FUNCTION trg_busca_itens_compromisso();
+
+DROP TRIGGER IF EXISTS trg_busca_itens_financiamento ON financiamentos;
+CREATE TRIGGER trg_busca_itens_financiamento
+  AFTER INSERT OR UPDATE OF item_id ON financiamentos
+  FOR EACH ROW EXECUTE FUNCTION trg_busca_itens_financiamento();
+
+DROP TRIGGER IF EXISTS trg_busca_itens_financiamento ON financiamentos_itens;
+CREATE TRIGGER trg_busca_itens_financiamento
+  AFTER INSERT OR UPDATE OR DELETE ON financiamentos_itens
+  FOR EACH ROW EXECUTE FUNCTION trg_busca_itens_financiamento();
+
+DROP TRIGGER IF EXISTS trg_busca_itens_renomeado ON itens;
+CREATE TRIGGER trg_busca_itens_renomeado
+  AFTER UPDATE OF nome ON itens
+  FOR EACH ROW WHEN (OLD.nome IS DISTINCT FROM NEW.nome)
+  EXECUTE FUNCTION trg_busca_itens_renomeado();
+
+-- Carga inicial
+UPDATE compromissos SET busca_itens_nomes = nomes_itens_compromisso(id);
+UPDATE financiamentos SET busca_itens_nomes = nomes_itens_financiamento(id);
+
+-- ---------- Colunas geradas + índices GIN ----------
+
+ALTER TABLE itens ADD COLUMN IF NOT EXISTS busca text GENERATED ALWAYS AS (
+  f_unaccent(lower(
+    COALESCE(nome, '') || ' ' || COALESCE(categoria, '') || ' ' ||
+    COALESCE(descricao, '') || ' ' || COALESCE(cidade, '')
+  ))
+) STORED;
+
+ALTER TABLE compromissos ADD COLUMN IF NOT EXISTS busca text GENERATED ALWAYS AS (
+  f_unaccent(lower(
+    COALESCE(nome_contrato, '') || ' ' || COALESCE(contratante, '') || ' ' ||
+    COALESCE(descricao, '') || ' ' || COALESCE(cidade, '') || ' ' || busca_itens_nomes
+  ))
+) STORED;
+
+ALTER TABLE financiamentos ADD COLUMN IF NOT EXISTS busca text GENERATED ALWAYS AS (
+  f_unaccent(lower(
+    COALESCE(codigo_contrato, '') || ' ' || COALESCE(instituicao_financeira, '') || ' ' ||
+    busca_itens_nomes
+  ))
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_itens_busca_trgm ON itens USING gin (busca gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_compromissos_busca_trgm ON compromissos USING gin (busca gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_financiamentos_busca_trgm ON financiamentos USING gin (busca gin_trgm_ops);
+
+-- ---------- Consulta ----------
+-- IDs que contêm q (sem acento, sem diferenciar maiúsculas), do mais parecido
+-- ao menos parecido. p_tabela: 'itens', 'compromissos' ou 'financiamentos'
+CREATE OR REPLACE FUNCTION buscar_ids_texto(p_tabela text, p_q text, p_limite integer DEFAULT 1000)
+RETURNS TABLE (id bigint)
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+  v_q text := f_unaccent(lower(btrim(COALESCE(p_q, ''))));
+  v_padrao text;
+BEGIN
+  IF p_tabela NOT IN ('itens', 'compromissos', 'financiamentos') THEN
+    RAISE EXCEPTION 'Tabela sem busca textual: %', p_tabela;
+  END IF;
+  IF v_q = '' THEN
+    RETURN;
+  END IF;
+  v_padrao := '%' || replace(replace(replace(v_q, '\', '\\'), '%', '\%'), '_', '\_') || '%';
+  RETURN QUERY EXECUTE format(
+    'SELECT t.id::bigint FROM %I t WHERE t.busca LIKE $1 ORDER BY similarity(t.busca, $2) DESC, t.id DESC LIMIT $3',
+    p_tabela
+  ) USING v_padrao, v_q, p_limite;
+END;
+$$;
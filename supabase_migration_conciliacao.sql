@@ -0,0 +1,71 @@
+-- ============================================================
+-- Migração: baixa em lote de contas e parcelas (conciliação bancária)
+-- Execute no Supabase: SQL Editor → New query → Cole e Run
+-- Requer supabase_migration_pagamento_lote.sql (pagar_parcelas_financiamento)
+-- Usada por supabase_database.aplicar_baixas_lote()
+-- ============================================================
+
+-- p_baixas: [{"tipo": "receber", "id": 1, "valor": 100.0, "data_pagamento": "2025-01-10", "forma_pagamento": "PIX"}, ...]
+-- tipo: 'receber' | 'pagar' | 'parcela'
+CREATE OR REPLACE FUNCTION aplicar_baixas_lote(p_baixas jsonb)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  v_faltando integer[];
+  v_receber integer := 0;
+  v_pagar integer := 0;
+  v_parcelas jsonb;
+  v_resultado jsonb := '{}'::jsonb;
+BEGIN
+  IF EXISTS (SELECT 1 FROM jsonb_array_elements(p_baixas) b WHERE b->>'tipo' NOT IN ('receber', 'pagar', 'parcela')) THEN
+    RAISE EXCEPTION 'Tipos de baixa inválidos';
+  END IF;
+
+  SELECT array_agg((b->>'id')::integer) INTO v_faltando
+    FROM jsonb_array_elements(p_baixas) b
+   WHERE (b->>'tipo' = 'receber' AND NOT EXISTS (SELECT 1 FROM contas_receber c WHERE c.id = (b->>'id')::integer))
+      OR (b->>'tipo' = 'pagar' AND NOT EXISTS (SELECT 1 FROM contas_pagar c WHERE c.id = (b->>'id')::integer));
+  IF v_faltando IS NOT NULL THEN
+    RAISE EXCEPTION 'Contas não encontradas: %', v_faltando;
+  END IF;
+
+  -- Os triggers de fluxo_caixa_mensal acompanham estes UPDATEs
+  UPDATE contas_receber c
+     SET data_pagamento = (b->>'data_pagamento')::date,
+         status = 'Pago',
+         forma_pagamento = COALESCE(NULLIF(b->>'forma_pagamento', ''), c.forma_pagamento)
+    FROM jsonb_array_elements(p_baixas) b
+   WHERE b->>'tipo' = 'receber' AND c.id = (b->>'id')::integer;
+  GET DIAGNOSTICS v_receber = ROW_COUNT;
+
+  UPDATE contas_pagar c
+     SET data_pagamento = (b->>'data_pagamento')::date,
+         status = 'Pago',
+         forma_pagamento = COALESCE(NULLIF(b->>'forma_pagamento', ''), c.forma_pagamento)
+    FROM jsonb_array_elements(p_baixas) b
+   WHERE b->>'tipo' = 'pagar' AND c.id = (b->>'id')::integer;
+  GET DIAGNOSTICS v_pagar = ROW_COUNT;
+
+  -- O lançamento casa com o valor em aberto da parcela: soma ao que já foi pago
+  SELECT jsonb_agg(jsonb_build_object(
+           'parcela_id', (b->>'id')::integer,
+           'valor_pago', COALESCE(p.valor_pago, 0) + (b->>'valor')::numeric,
+           'data_pagamento', b->>'data_pagamento'))
+    INTO v_parcelas
+    FROM jsonb_array_elements(p_baixas) b
+    LEFT JOIN parcelas_financiamento p ON p.id = (b->>'id')::integer
+   WHERE b->>'tipo' = 'parcela';
+  IF v_parcelas IS NOT NULL THEN
+    v_resultado := pagar_parcelas_financiamento(v_parcelas);
+  END IF;
+
+  RETURN jsonb_build_object(
+    'receber', v_receber,
+    'pagar', v_pagar,
+    'parcela', COALESCE(jsonb_array_length(v_parcelas), 0),
+    'financiamentos_quitados', COALESCE(v_resultado->'financiamentos_quitados', '[]'::jsonb)
+  );
+END;
+$$;
@@ -0,0 +1,97 @@
+-- ============================================================
+-- Migração: conferência de disponibilidade de um pedido inteiro
+-- Execute no Supabase: SQL Editor → New query → Cole e Run
+-- Usada por supabase_database.verificar_disponibilidade_lote()
+-- (criar_compromisso_master / atualizar_compromisso_master)
+-- ============================================================
+
+-- p_itens: [{"item_id": 1, "quantidade": 10}, ...]
+-- Uma linha de retorno por linha do pedido, na ordem. Linhas repetidas do
+-- mesmo item consomem a mesma disponibilidade; falta = 0 quando a linha cabe.
+-- p_excluir_compromisso_id: contrato em edição (sua reserva atual não conta)
+CREATE OR REPLACE FUNCTION get_disponibilidade_lote(
+  p_itens jsonb,
+  p_start_date date,
+  p_end_date date,
+  p_excluir_compromisso_id bigint DEFAULT NULL
+)
+RETURNS TABLE (
+  linha integer,
+  item_id bigint,
+  nome text,
+  quantidade integer,
+  quantidade_total integer,
+  max_alugado integer,
+  max_instalado integer,
+  disponivel_minimo integer,
+  falta integer
+)
+LANGUAGE sql
+STABLE
+AS $$
+  WITH linhas AS (
+    SELECT l.ord::integer AS linha,
+           (l.valor->>'item_id')::bigint AS item_id,
+           COALESCE((l.valor->>'quantidade')::integer, 0) AS quantidade
+      FROM jsonb_array_elements(p_itens) WITH ORDINALITY AS l(valor, ord)
+  ),
+  reservas AS (
+    -- Linhas de contratos master
+    SELECT ci.item_id, c.data_inicio, c.data_fim, ci.quantidade
+      FROM compromisso_itens ci
+      JOIN compromissos c ON c.id = ci.compromisso_id
+     WHERE ci.item_id IN (SELECT l.item_id FROM linhas l)
+       AND c.data_inicio <= p_end_date AND c.data_fim >= p_start_date
+       AND c.id IS DISTINCT FROM p_excluir_compromisso_id
+    UNION ALL
+    -- Compromissos legados (um item por compromisso)
+    SELECT c.item_id, c.data_inicio, c.data_fim, c.quantidade
+      FROM compromissos c
+     WHERE c.item_id IN (SELECT l.item_id FROM linhas l)
+       AND c.data_inicio <= p_end_date AND c.data_fim >= p_start_date
+       AND c.id IS DISTINCT FROM p_excluir_compromisso_id
+  ),
+  -- A ocupação só sobe no início de uma reserva: o pico está em um desses dias
+  alugado AS (
+    SELECT p.item_id, MAX(o.total)::integer AS max_alugado
+      FROM (SELECT DISTINCT r.item_id, GREATEST(r.data_inicio, p_start_date) AS dia FROM reservas r) p
+      CROSS JOIN LATERAL (
+        SELECT SUM(r.quantidade) AS total
+          FROM reservas r
+         WHERE r.item_id = p.item_id AND r.data_inicio <= p.dia AND r.data_fim >= p.dia
+      ) o
+     GROUP BY p.item_id
+  ),
+  instalado AS (
+    SELECT pc.peca_id AS item_id, SUM(pc.quantidade)::integer AS max_instalado
+      FROM pecas_carros pc
+     WHERE pc.peca_id IN (SELECT l.item_id FROM linhas l)
+       AND pc.data_instalacao <= p_end_date
+     GROUP BY pc.peca_id
+  ),
+  picos AS (
+    SELECT i.id AS item_id, i.nome,
+           COALESCE(i.quantidade_total, 0) AS quantidade_total,
+           COALESCE(a.max_alugado, 0) AS max_alugado,
+           COALESCE(n.max_instalado, 0) AS max_instalado
+      FROM itens i
+      LEFT JOIN alugado a ON a.item_id = i.id
+      LEFT JOIN instalado n ON n.item_id = i.id
+     WHERE i.id IN (SELECT l.item_id FROM linhas l)
+  ),
+  conferencia AS (
+    SELECT l.linha, l.item_id, p.nome, l.quantidade,
+           COALESCE(p.quantidade_total, 0) AS quantidade_total,
+           COALESCE(p.max_alugado, 0) AS max_alugado,
+           COALESCE(p.max_instalado, 0) AS max_instalado,
+           COALESCE(p.quantidade_total - p.max_alugado - p.max_instalado, 0) AS disponivel_minimo,
+           SUM(l.quantidade) OVER (PARTITION BY l.item_id ORDER BY l.linha) AS acumulado
+      FROM linhas l
+      LEFT JOIN picos p ON p.item_id = l.item_id
+  )
+  SELECT c.linha, c.item_id, c.nome::text, c.quantidade, c.quantidade_total,
+         c.max_alugado, c.max_instalado, c.disponivel_minimo,
+         LEAST(c.quantidade, GREATEST(0, c.acumulado - GREATEST(c.disponivel_minimo, 0)))::integer AS falta
+    FROM conferencia c
+   ORDER BY c.linha;
+$$;
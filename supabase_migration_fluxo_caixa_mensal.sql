@@ -0,0 +1,90 @@
+-- ============================================================
+-- Migração: resumo mensal do fluxo de caixa mantido por triggers
+-- Execute no Supabase: SQL Editor → New query → Cole e Run
+-- Depois de rodar, /api/financeiro/fluxo-caixa lê fluxo_caixa_mensal
+-- em vez de somar todas as contas a cada requisição.
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS fluxo_caixa_mensal (
+  mes CHAR(7) PRIMARY KEY,              -- AAAA-MM do pagamento
+  receitas NUMERIC(14, 2) NOT NULL DEFAULT 0,
+  despesas NUMERIC(14, 2) NOT NULL DEFAULT 0
+);
+
+-- Soma/subtrai a contribuição de uma conta paga no mês do pagamento
+CREATE OR REPLACE FUNCTION ajustar_fluxo_caixa(p_coluna text, p_status text, p_data_pagamento date, p_valor numeric, p_sinal integer)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF p_status IS DISTINCT FROM 'Pago' OR p_data_pagamento IS NULL OR p_valor IS NULL THEN
+    RETURN;
+  END IF;
+
+  INSERT INTO fluxo_caixa_mensal (mes, receitas, despesas)
+  VALUES (
+    to_char(p_data_pagamento, 'YYYY-MM'),
+    CASE WHEN p_coluna = 'receitas' THEN p_sinal * p_valor ELSE 0 END,
+    CASE WHEN p_coluna = 'despesas' THEN p_sinal * p_valor ELSE 0 END
+  )
+  ON CONFLICT (mes) DO UPDATE SET
+    receitas = fluxo_caixa_mensal.receitas + EXCLUDED.receitas,
+    despesas = fluxo_caixa_mensal.despesas + EXCLUDED.despesas;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION trg_fluxo_caixa()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_coluna text := CASE WHEN TG_TABLE_NAME = 'contas_receber' THEN 'receitas' ELSE 'despesas' END;
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM ajustar_fluxo_caixa(v_coluna, OLD.status, OLD.data_pagamento, OLD.valor, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM ajustar_fluxo_caixa(v_coluna, NEW.status, NEW.data_pagamento, NEW.valor, 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS fluxo_caixa_contas_receber ON contas_receber;
+CREATE TRIGGER fluxo_caixa_contas_receber
+  AFTER INSERT OR UPDATE OF status, data_pagamento, valor OR DELETE ON contas_receber
+  FOR EACH ROW EXECUTE FUNCTION trg_fluxo_caixa();
+
+DROP TRIGGER IF EXISTS fluxo_caixa_contas_pagar ON contas_pagar;
+CREATE TRIGGER fluxo_caixa_contas_pagar
+  AFTER INSERT OR UPDATE OF status, data_pagamento, valor OR DELETE ON contas_pagar
+  FOR EACH ROW EXECUTE FUNCTION trg_fluxo_caixa();
+
+-- Reconstrução completa (também usada para popular a tabela pela primeira vez)
+CREATE OR REPLACE FUNCTION reconstruir_fluxo_caixa()
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  v_meses integer;
+BEGIN
+  DELETE FROM fluxo_caixa_mensal;
+
+  INSERT INTO fluxo_caixa_mensal (mes, receitas, despesas)
+  SELECT mes, SUM(receitas), SUM(despesas)
+  FROM (
+    SELECT to_char(data_pagamento, 'YYYY-MM') AS mes, valor AS receitas, 0 AS despesas
+      FROM contas_receber WHERE status = 'Pago' AND data_pagamento IS NOT NULL
+    UNION ALL
+    SELECT to_char(data_pagamento, 'YYYY-MM'), 0, valor
+      FROM contas_pagar WHERE status = 'Pago' AND data_pagamento IS NOT NULL
+  ) t
+  GROUP BY mes;
+
+  GET DIAGNOSTICS v_meses = ROW_COUNT;
+  RETURN v_meses;
+END;
+$$;
+
+SELECT reconstruir_fluxo_caixa();
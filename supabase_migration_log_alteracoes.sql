@@ -0,0 +1,48 @@
+-- ============================================================
+-- Migração: log de alterações (change data capture)
+-- Execute no Supabase: SQL Editor → New query → Cole e Run
+-- Usada por /api/changes?since=<versao> e pelo backup incremental
+-- (supabase_database.listar_alteracoes)
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS log_alteracoes (
+  versao BIGSERIAL PRIMARY KEY,         -- cresce a cada alteração; nunca reutilizada
+  tabela TEXT NOT NULL,
+  registro_id BIGINT,
+  operacao TEXT NOT NULL,               -- CREATE | UPDATE | DELETE
+  criado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION trg_log_alteracoes()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  INSERT INTO log_alteracoes (tabela, registro_id, operacao)
+  VALUES (
+    TG_TABLE_NAME,
+    CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END,
+    CASE TG_OP WHEN 'INSERT' THEN 'CREATE' ELSE TG_OP END
+  );
+  RETURN NULL;
+END;
+$$;
+
+DO $$
+DECLARE
+  t text;
+BEGIN
+  FOREACH t IN ARRAY ARRAY[
+    'itens', 'carros', 'compromissos', 'compromisso_itens', 'contas_receber', 'contas_pagar',
+    'financiamentos', 'financiamentos_itens', 'parcelas_financiamento', 'pecas_carros'
+  ] LOOP
+    EXECUTE format('DROP TRIGGER IF EXISTS log_alteracoes_%1$s ON %1$I', t);
+    EXECUTE format(
+      'CREATE TRIGGER log_alteracoes_%1$s AFTER INSERT OR UPDATE OR DELETE ON %1$I '
+      'FOR EACH ROW EXECUTE FUNCTION trg_log_alteracoes()', t);
+  END LOOP;
+END;
+$$;
+
+-- Opcional: descartar o histórico antigo (as versões continuam crescendo)
+-- DELETE FROM log_alteracoes WHERE criado_em < now() - interval '90 days';
@@ -0,0 +1,59 @@
+-- ============================================================
+-- Migração: pagamento de parcelas em lote (uma transação)
+-- Execute no Supabase: SQL Editor → New query → Cole e Run
+-- Usada por supabase_database.pagar_parcelas_financiamento()
+-- ============================================================
+
+-- p_pagamentos: [{"parcela_id": 1, "valor_pago": 100.0, "data_pagamento": "2025-01-10"}, ...]
+CREATE OR REPLACE FUNCTION pagar_parcelas_financiamento(p_pagamentos jsonb)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  v_ids integer[];
+  v_faltando integer[];
+  v_parcelas jsonb;
+  v_quitados integer[];
+BEGIN
+  SELECT array_agg((p->>'parcela_id')::integer) INTO v_ids
+    FROM jsonb_array_elements(p_pagamentos) p;
+
+  SELECT array_agg(u.parcela_id) INTO v_faltando
+    FROM unnest(v_ids) AS u(parcela_id)
+   WHERE NOT EXISTS (SELECT 1 FROM parcelas_financiamento pf WHERE pf.id = u.parcela_id);
+  IF v_faltando IS NOT NULL THEN
+    RAISE EXCEPTION 'Parcelas não encontradas: %', v_faltando;
+  END IF;
+
+  WITH pagos AS (
+    UPDATE parcelas_financiamento pf
+       SET valor_pago = (p->>'valor_pago')::numeric,
+           data_pagamento = (p->>'data_pagamento')::date,
+           status = CASE WHEN (p->>'valor_pago')::numeric >= pf.valor_original THEN 'Paga' ELSE 'Pendente' END
+      FROM jsonb_array_elements(p_pagamentos) p
+     WHERE pf.id = (p->>'parcela_id')::integer
+    RETURNING pf.*
+  )
+  SELECT jsonb_agg(to_jsonb(pagos)) INTO v_parcelas FROM pagos;
+
+  -- Quitação: financiamentos tocados sem nenhuma parcela em aberto
+  WITH quitados AS (
+    UPDATE financiamentos f
+       SET status = 'Quitado'
+     WHERE f.id IN (SELECT DISTINCT financiamento_id FROM parcelas_financiamento WHERE id = ANY (v_ids))
+       AND f.status <> 'Quitado'
+       AND NOT EXISTS (
+         SELECT 1 FROM parcelas_financiamento pf
+          WHERE pf.financiamento_id = f.id AND pf.status <> 'Paga'
+       )
+    RETURNING f.id
+  )
+  SELECT array_agg(id) INTO v_quitados FROM quitados;
+
+  RETURN jsonb_build_object(
+    'parcelas', COALESCE(v_parcelas, '[]'::jsonb),
+    'financiamentos_quitados', COALESCE(to_jsonb(v_quitados), '[]'::jsonb)
+  );
+END;
+$$;
@@ -0,0 +1,216 @@
+-- ============================================================
+-- Migração: reservas temporárias (bloqueio de estoque no checkout)
+-- Execute no Supabase: SQL Editor → New query → Cole e Run
+-- Execute depois de supabase_migration_disponibilidade_lote.sql
+-- Usada por supabase_database.reservar_itens / confirmar_reserva /
+-- cancelar_reserva / listar_reservas_temporarias_ativas
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS reservas_temporarias (
+  id bigserial PRIMARY KEY,
+  token text NOT NULL,
+  item_id bigint NOT NULL REFERENCES itens(id) ON DELETE CASCADE,
+  quantidade integer NOT NULL CHECK (quantidade > 0),
+  data_inicio date NOT NULL,
+  data_fim date NOT NULL,
+  expira_em timestamptz NOT NULL,
+  criado_em timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_reservas_temporarias_token ON reservas_temporarias (token);
+CREATE INDEX IF NOT EXISTS idx_reservas_temporarias_item ON reservas_temporarias (item_id, expira_em);
+
+-- Conferência em lote passa a contar as reservas temporárias ativas
+-- (p_excluir_token: as do próprio carrinho não contam contra ele)
+DROP FUNCTION IF EXISTS get_disponibilidade_lote(jsonb, date, date, bigint);
+CREATE OR REPLACE FUNCTION get_disponibilidade_lote(
+  p_itens jsonb,
+  p_start_date date,
+  p_end_date date,
+  p_excluir_compromisso_id bigint DEFAULT NULL,
+  p_excluir_token text DEFAULT NULL
+)
+RETURNS TABLE (
+  linha integer,
+  item_id bigint,
+  nome text,
+  quantidade integer,
+  quantidade_total integer,
+  max_alugado integer,
+  max_instalado integer,
+  disponivel_minimo integer,
+  falta integer
+)
+LANGUAGE sql
+STABLE
+AS $$
+  WITH linhas AS (
+    SELECT l.ord::integer AS linha,
+           (l.valor->>'item_id')::bigint AS item_id,
+           COALESCE((l.valor->>'quantidade')::integer, 0) AS quantidade
+      FROM jsonb_array_elements(p_itens) WITH ORDINALITY AS l(valor, ord)
+  ),
+  reservas AS (
+    SELECT ci.item_id, c.data_inicio, c.data_fim, ci.quantidade
+      FROM compromisso_itens ci
+      JOIN compromissos c ON c.id = ci.compromisso_id
+     WHERE ci.item_id IN (SELECT l.item_id FROM linhas l)
+       AND c.data_inicio <= p_end_date AND c.data_fim >= p_start_date
+       AND c.id IS DISTINCT FROM p_excluir_compromisso_id
+    UNION ALL
+    SELECT c.item_id, c.data_inicio, c.data_fim, c.quantidade
+      FROM compromissos c
+     WHERE c.item_id IN (SELECT l.item_id FROM linhas l)
+       AND c.data_inicio <= p_end_date AND c.data_fim >= p_start_date
+       AND c.id IS DISTINCT FROM p_excluir_compromisso_id
+    UNION ALL
+    SELECT rt.item_id, rt.data_inicio, rt.data_fim, rt.quantidade
+      FROM reservas_temporarias rt
+     WHERE rt.item_id IN (SELECT l.item_id FROM linhas l)
+       AND rt.data_inicio <= p_end_date AND rt.data_fim >= p_start_date
+       AND rt.expira_em > now()
+       AND rt.token IS DISTINCT FROM p_excluir_token
+  ),
+  alugado AS (
+    SELECT p.item_id, MAX(o.total)::integer AS max_alugado
+      FROM (SELECT DISTINCT r.item_id, GREATEST(r.data_inicio, p_start_date) AS dia FROM reservas r) p
+      CROSS JOIN LATERAL (
+        SELECT SUM(r.quantidade) AS total
+          FROM reservas r
+         WHERE r.item_id = p.item_id AND r.data_inicio <= p.dia AND r.data_fim >= p.dia
+      ) o
+     GROUP BY p.item_id
+  ),
+  instalado AS (
+    SELECT pc.peca_id AS item_id, SUM(pc.quantidade)::integer AS max_instalado
+      FROM pecas_carros pc
+     WHERE pc.peca_id IN (SELECT l.item_id FROM linhas l)
+       AND pc.data_instalacao <= p_end_date
+     GROUP BY pc.peca_id
+  ),
+  picos AS (
+    SELECT i.id AS item_id, i.nome,
+           COALESCE(i.quantidade_total, 0) AS quantidade_total,
+           COALESCE(a.max_alugado, 0) AS max_alugado,
+           COALESCE(n.max_instalado, 0) AS max_instalado
+      FROM itens i
+      LEFT JOIN alugado a ON a.item_id = i.id
+      LEFT JOIN instalado n ON n.item_id = i.id
+     WHERE i.id IN (SELECT l.item_id FROM linhas l)
+  ),
+  conferencia AS (
+    SELECT l.linha, l.item_id, p.nome, l.quantidade,
+           COALESCE(p.quantidade_total, 0) AS quantidade_total,
+           COALESCE(p.max_alugado, 0) AS max_alugado,
+           COALESCE(p.max_instalado, 0) AS max_instalado,
+           COALESCE(p.quantidade_total - p.max_alugado - p.max_instalado, 0) AS disponivel_minimo,
+           SUM(l.quantidade) OVER (PARTITION BY l.item_id ORDER BY l.linha) AS acumulado
+      FROM linhas l
+      LEFT JOIN picos p ON p.item_id = l.item_id
+  )
+  SELECT c.linha, c.item_id, c.nome::text, c.quantidade, c.quantidade_total,
+         c.max_alugado, c.max_instalado, c.disponivel_minimo,
+         LEAST(c.quantidade, GREATEST(0, c.acumulado - GREATEST(c.disponivel_minimo, 0)))::integer AS falta
+    FROM conferencia c
+   ORDER BY c.linha;
+$$;
+
+-- Bloqueia o estoque das linhas por p_ttl_segundos. Trava (FOR UPDATE) só as
+-- linhas de `itens` do pedido, em ordem de id: checkouts de itens diferentes
+-- não esperam um pelo outro, e dois checkouts do mesmo item conferem em fila.
+-- Se faltar estoque, nada é gravado (reservado = false). Reenviar o mesmo
+-- token substitui a reserva anterior.
+CREATE OR REPLACE FUNCTION reservar_itens(
+  p_token text,
+  p_itens jsonb,
+  p_start_date date,
+  p_end_date date,
+  p_ttl_segundos integer DEFAULT 600
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  v_ids bigint[];
+  v_conferencia jsonb;
+  v_expira_em timestamptz := now() + make_interval(secs => p_ttl_segundos);
+BEGIN
+  SELECT array_agg(DISTINCT (l->>'item_id')::bigint) INTO v_ids
+    FROM jsonb_array_elements(p_itens) l;
+
+  PERFORM 1 FROM itens WHERE id = ANY (v_ids) ORDER BY id FOR UPDATE;
+
+  DELETE FROM reservas_temporarias WHERE item_id = ANY (v_ids) AND expira_em <= now();
+
+  -- Consulta nova depois das travas: enxerga as reservas de quem travou antes
+  SELECT jsonb_agg(to_jsonb(c) ORDER BY c.linha) INTO v_conferencia
+    FROM get_disponibilidade_lote(p_itens, p_start_date, p_end_date, NULL, p_token) c;
+
+  IF EXISTS (SELECT 1 FROM jsonb_array_elements(v_conferencia) c WHERE (c->>'falta')::integer > 0) THEN
+    RETURN jsonb_build_object('reservado', false, 'expira_em', NULL, 'linhas', v_conferencia);
+  END IF;
+
+  DELETE FROM reservas_temporarias WHERE token = p_token;
+  INSERT INTO reservas_temporarias (token, item_id, quantidade, data_inicio, data_fim, expira_em)
+  SELECT p_token, (l->>'item_id')::bigint, (l->>'quantidade')::integer, p_start_date, p_end_date, v_expira_em
+    FROM jsonb_array_elements(p_itens) l
+   WHERE COALESCE((l->>'quantidade')::integer, 0) > 0;
+
+  RETURN jsonb_build_object('reservado', true, 'expira_em', v_expira_em, 'linhas', v_conferencia);
+END;
+$$;
+
+-- Cria o contrato master (compromissos + compromisso_itens) a partir das
+-- reservas do token e apaga as reservas, numa transação. Dentro do prazo o
+-- estoque já está garantido; vencido, é conferido de novo com as travas.
+-- p_header: nome_contrato, contratante, descricao, cidade, uf, endereco,
+-- valor_total_contrato (as datas vêm da reserva)
+CREATE OR REPLACE FUNCTION confirmar_reserva(p_token text, p_header jsonb)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  v_inicio date;
+  v_fim date;
+  v_vencida boolean;
+  v_itens jsonb;
+  v_id bigint;
+BEGIN
+  PERFORM 1 FROM itens
+   WHERE id IN (SELECT rt.item_id FROM reservas_temporarias rt WHERE rt.token = p_token)
+   ORDER BY id FOR UPDATE;
+
+  SELECT min(rt.data_inicio), max(rt.data_fim), bool_or(rt.expira_em <= now()),
+         jsonb_agg(jsonb_build_object('item_id', rt.item_id, 'quantidade', rt.quantidade) ORDER BY rt.id)
+    INTO v_inicio, v_fim, v_vencida, v_itens
+    FROM reservas_temporarias rt
+   WHERE rt.token = p_token;
+
+  IF v_itens IS NULL THEN
+    RAISE EXCEPTION 'Reserva não encontrada (vencida, cancelada ou já confirmada)';
+  END IF;
+
+  IF v_vencida AND EXISTS (
+    SELECT 1 FROM get_disponibilidade_lote(v_itens, v_inicio, v_fim, NULL, p_token) c WHERE c.falta > 0
+  ) THEN
+    RAISE EXCEPTION 'Reserva vencida. Estoque insuficiente para confirmar o contrato';
+  END IF;
+
+  INSERT INTO compromissos (nome_contrato, contratante, data_inicio, data_fim, descricao, cidade, uf, endereco, valor_total_contrato)
+  SELECT h.nome_contrato, h.contratante, v_inicio, v_fim, h.descricao, h.cidade, upper(left(h.uf, 2)), h.endereco,
+         COALESCE(h.valor_total_contrato, 0)
+    FROM jsonb_populate_record(NULL::compromissos, COALESCE(p_header, '{}'::jsonb)) h
+  RETURNING id INTO v_id;
+
+  INSERT INTO compromisso_itens (compromisso_id, item_id, quantidade)
+  SELECT v_id, rt.item_id, rt.quantidade
+    FROM reservas_temporarias rt
+   WHERE rt.token = p_token
+   ORDER BY rt.id;
+
+  DELETE FROM reservas_temporarias WHERE token = p_token;
+
+  RETURN jsonb_build_object('compromisso_id', v_id, 'data_inicio', v_inicio, 'data_fim', v_fim, 'itens', v_itens);
+END;
+$$;
@@ -0,0 +1,39 @@
+-- ============================================================
+-- Migração: atualização em lote do status de contas e parcelas vencidas
+-- Execute no Supabase: SQL Editor → New query → Cole e Run
+-- Um UPDATE por tabela; chamada por supabase_database.atualizar_status_vencidos()
+-- (agendador do backend ou: python manutencao.py --supabase atualizar-status)
+-- ============================================================
+
+CREATE INDEX IF NOT EXISTS idx_contas_receber_pendentes ON contas_receber (data_vencimento) WHERE status = 'Pendente';
+CREATE INDEX IF NOT EXISTS idx_contas_pagar_pendentes ON contas_pagar (data_vencimento) WHERE status = 'Pendente';
+CREATE INDEX IF NOT EXISTS idx_parcelas_pendentes ON parcelas_financiamento (data_vencimento) WHERE status = 'Pendente';
+
+CREATE OR REPLACE FUNCTION atualizar_status_vencidos(p_data date DEFAULT CURRENT_DATE)
+RETURNS TABLE (contas_receber integer, contas_pagar integer, parcelas_financiamento integer)
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  v_receber integer;
+  v_pagar integer;
+  v_parcelas integer;
+BEGIN
+  UPDATE contas_receber c SET status = 'Vencido'
+   WHERE c.status = 'Pendente' AND c.data_pagamento IS NULL AND c.data_vencimento < p_data;
+  GET DIAGNOSTICS v_receber = ROW_COUNT;
+
+  UPDATE contas_pagar c SET status = 'Vencido'
+   WHERE c.status = 'Pendente' AND c.data_pagamento IS NULL AND c.data_vencimento < p_data;
+  GET DIAGNOSTICS v_pagar = ROW_COUNT;
+
+  UPDATE parcelas_financiamento p SET status = 'Atrasada'
+   WHERE p.status = 'Pendente' AND COALESCE(p.valor_pago, 0) < p.valor_original AND p.data_vencimento < p_data;
+  GET DIAGNOSTICS v_parcelas = ROW_COUNT;
+
+  RETURN QUERY SELECT v_receber, v_pagar, v_parcelas;
+END;
+$$;
+
+-- Opcional: agendar no próprio banco com pg_cron (Database → Extensions → pg_cron)
+-- SELECT cron.schedule('atualizar-status-vencidos', '5 3 * * *', $$SELECT atualizar_status_vencidos()$$);
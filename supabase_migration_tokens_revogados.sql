@@ -0,0 +1,14 @@
+-- ============================================================
+-- Migração: lista de revogação dos tokens de sessão (logout)
+-- Execute no Supabase: SQL Editor → New query → Cole e Run
+-- Usada por supabase_database.revogar_token / listar_tokens_revogados
+-- (backend/sessoes.py): cada worker recarrega a lista periodicamente
+-- ============================================================
+
+-- jti do token e o exp dele (epoch em segundos): depois do exp o token já
+-- é recusado pela assinatura, e a linha pode ser apagada
+CREATE TABLE IF NOT EXISTS tokens_revogados (
+  jti text PRIMARY KEY,
+  expira_em bigint NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tokens_revogados_expira_em ON tokens_revogados (expira_em);
@@ -0,0 +1,67 @@
+-- ============================================================
+-- Migração: coluna updated_at para sincronização incremental
+-- Execute no Supabase: SQL Editor → New query → Cole e Run
+-- Usada pelo ?updated_since= das listagens (itens, compromissos,
+-- contas a receber/pagar e financiamentos). As exclusões vêm do
+-- log_alteracoes (rode antes supabase_migration_log_alteracoes.sql).
+-- ============================================================
+
+-- Carimbo em cada UPDATE
+CREATE OR REPLACE FUNCTION trg_updated_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  NEW.updated_at := now();
+  RETURN NEW;
+END;
+$$;
+
+DO $$
+DECLARE
+  t text;
+BEGIN
+  FOREACH t IN ARRAY ARRAY[
+    'itens', 'compromissos', 'contas_receber', 'contas_pagar', 'financiamentos', 'parcelas_financiamento'
+  ] LOOP
+    EXECUTE format('ALTER TABLE %1$I ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()', t);
+    EXECUTE format('CREATE INDEX IF NOT EXISTS idx_%1$s_updated_at ON %1$I (updated_at)', t);
+    EXECUTE format('DROP TRIGGER IF EXISTS updated_at_%1$s ON %1$I', t);
+    EXECUTE format(
+      'CREATE TRIGGER updated_at_%1$s BEFORE UPDATE ON %1$I '
+      'FOR EACH ROW EXECUTE FUNCTION trg_updated_at()', t);
+  END LOOP;
+END;
+$$;
+
+-- Alterações nas tabelas filhas renovam o updated_at do registro pai
+-- (a listagem de compromissos mostra os itens; a de financiamentos, as parcelas pagas)
+-- Argumentos: tabela pai, coluna da chave estrangeira na filha
+CREATE OR REPLACE FUNCTION trg_tocar_pai()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  linha jsonb := to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END);
+BEGIN
+  EXECUTE format('UPDATE %I SET updated_at = now() WHERE id = $1', TG_ARGV[0])
+    USING (linha ->> TG_ARGV[1])::bigint;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS tocar_itens_carros ON carros;
+CREATE TRIGGER tocar_itens_carros AFTER INSERT OR UPDATE OR DELETE ON carros
+  FOR EACH ROW EXECUTE FUNCTION trg_tocar_pai('itens', 'item_id');
+
+DROP TRIGGER IF EXISTS tocar_compromissos_compromisso_itens ON compromisso_itens;
+CREATE TRIGGER tocar_compromissos_compromisso_itens AFTER INSERT OR UPDATE OR DELETE ON compromisso_itens
+  FOR EACH ROW EXECUTE FUNCTION trg_tocar_pai('compromissos', 'compromisso_id');
+
+DROP TRIGGER IF EXISTS tocar_financiamentos_financiamentos_itens ON financiamentos_itens;
+CREATE TRIGGER tocar_financiamentos_financiamentos_itens AFTER INSERT OR UPDATE OR DELETE ON financiamentos_itens
+  FOR EACH ROW EXECUTE FUNCTION trg_tocar_pai('financiamentos', 'financiamento_id');
+
+DROP TRIGGER IF EXISTS tocar_financiamentos_parcelas ON parcelas_financiamento;
+CREATE TRIGGER tocar_financiamentos_parcelas AFTER INSERT OR UPDATE OR DELETE ON parcelas_financiamento
+  FOR EACH ROW EXECUTE FUNCTION trg_tocar_pai('financiamentos', 'financiamento_id');